@@ -0,0 +1,302 @@
+"""
+Microbenchmarks of the per item overhead of chunkydl's scheduling code, separate from network throughput.
+
+Every benchmark runs with an in-process transport that answers requests from memory with zero latency, so the measured
+time is the time spent in the library itself.  Each benchmark reports microseconds per item and, from a separate run
+under tracemalloc, the peak bytes allocated and the blocks still allocated per item.
+
+Usage:
+    python -m benchmarks.overhead
+    python -m benchmarks.overhead --output overhead.json
+    python -m benchmarks.overhead --check benchmarks/overhead_thresholds.json
+"""
+
+import io
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable, Dict
+from unittest.mock import patch
+
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
+
+from chunkydl import DownloadConfig, DLGroup, QueueDownloader
+from chunkydl.utils import convert_urls
+from chunkydl.models.multi_part_downloader import MultiPartDownloader
+
+from .run import library_version
+
+
+FILE_SIZE = 1024
+PART_SIZE = 16
+
+
+def memory_send(adapter: HTTPAdapter, request, **kwargs):
+    """
+    Answers a request from memory in place of HTTPAdapter.send.  Every url serves FILE_SIZE bytes unless it ends with
+    '?size=<bytes>', and single byte ranges are honored.
+    """
+    size = int(request.url.rsplit('?size=', 1)[1]) if '?size=' in request.url else FILE_SIZE
+    status = 200
+    body = b'x' * size
+    headers = {'Content-Length': str(size), 'Accept-Ranges': 'bytes', 'ETag': '"memory"'}
+    range_header = request.headers.get('range')
+    if range_header:
+        start, end = (int(value) for value in range_header.split('=')[1].split('-'))
+        body = body[start:end + 1]
+        status = 206
+        headers['Content-Length'] = str(len(body))
+        headers['Content-Range'] = f'bytes {start}-{start + len(body) - 1}/{size}'
+    if request.method == 'HEAD':
+        body = b''
+    raw = HTTPResponse(
+        body=io.BytesIO(body),
+        headers=headers,
+        status=status,
+        preload_content=False,
+        decode_content=False,
+        request_method=request.method,
+    )
+    return adapter.build_response(request, raw)
+
+
+@contextmanager
+def memory_transport():
+    """
+    Replaces the network with memory_send for the duration of the context.
+    """
+    with patch.object(HTTPAdapter, 'send', memory_send):
+        yield
+
+
+def bench_convert_urls(count: int, work_dir: str) -> Callable[[], None]:
+    config = DownloadConfig()
+    urls = [f'http://example.com/file-{index}' for index in range(count)]
+    return lambda: convert_urls(urls, work_dir, config)
+
+
+def bench_queue(count: int, work_dir: str) -> Callable[[], None]:
+    config = DownloadConfig()
+    groups = [DLGroup(f'http://example.com/file-{index}', work_dir, config) for index in range(count)]
+
+    def run():
+        downloader = QueueDownloader(config=config)
+        downloader.add_multiple(groups)
+        for _ in range(count):
+            downloader._queue.get()
+        downloader.executor.shutdown()
+    return run
+
+
+def bench_executor_submit(count: int, work_dir: str) -> Callable[[], None]:
+    def run():
+        executor = ThreadPoolExecutor(4)
+        wait([executor.submit(int) for _ in range(count)])
+        executor.shutdown()
+    return run
+
+
+def bench_handle_future(count: int, work_dir: str) -> Callable[[], None]:
+    downloader = QueueDownloader(config=DownloadConfig())
+    downloader.executor.shutdown()
+    futures = []
+    for _ in range(count):
+        future = Future()
+        future.set_result(None)
+        futures.append(future)
+
+    def run():
+        downloader.results = []
+        for future in futures:
+            downloader.handle_future(future)
+    return run
+
+
+def bench_config_headers(count: int, work_dir: str) -> Callable[[], None]:
+    config = DownloadConfig(additional_headers={'Referer': 'http://example.com/'})
+
+    def run():
+        for _ in range(count):
+            config.headers
+    return run
+
+
+def bench_log_attributes(count: int, work_dir: str) -> Callable[[], None]:
+    config = DownloadConfig()
+
+    def run():
+        for _ in range(count):
+            config.log_attributes('Benchmark')
+    return run
+
+
+def bench_queue_downloader(count: int, work_dir: str) -> Callable[[], None]:
+    config = DownloadConfig(download_threads=4)
+
+    def run():
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        groups = [DLGroup(f'http://example.com/file-{index}', work_dir, config) for index in range(count)]
+        downloader = QueueDownloader(config=config)
+        downloader.add_multiple(groups)
+        downloader.add(None)
+        with memory_transport():
+            downloader.run()
+    return run
+
+
+def bench_multipart(count: int, work_dir: str) -> Callable[[], None]:
+    size = count * PART_SIZE
+    config = DownloadConfig(size_threshold=PART_SIZE, multipart_threads=4)
+
+    def run():
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        url = f'http://example.com/file?size={size}'
+        downloader = MultiPartDownloader(url, os.path.join(work_dir, 'file'), size, config)
+        with memory_transport():
+            downloader.run()
+    return run
+
+
+MICRO_BENCHMARKS = {
+    'convert_urls': bench_convert_urls,
+    'queue_put_get': bench_queue,
+    'executor_submit': bench_executor_submit,
+    'handle_future': bench_handle_future,
+    'config_headers': bench_config_headers,
+    'log_attributes': bench_log_attributes,
+}
+
+END_TO_END_BENCHMARKS = {
+    'queue_downloader': bench_queue_downloader,
+    'multipart': bench_multipart,
+}
+
+
+def measure(factory: Callable[[int, str], Callable[[], None]], count: int, work_dir: str, memory: bool) -> dict:
+    """
+    Runs one benchmark with the supplied number of items.
+
+    Args:
+        factory: A callable that prepares the benchmark and returns the callable that is timed.
+        count (int): The number of items.
+        work_dir (str): A directory the benchmark may write to.
+        memory (bool): Indicates if a second run is made under tracemalloc to measure allocations.
+
+    Returns:
+        dict: The time and allocations per item.
+    """
+    func = factory(count, work_dir)
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    result = {'count': count, 'seconds': elapsed, 'us_per_item': elapsed / count * 1e6}
+    if memory:
+        func = factory(count, work_dir)
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+        result['peak_bytes_per_item'] = peak / count
+        result['retained_blocks_per_item'] = blocks / count
+    return result
+
+
+def run(args: argparse.Namespace) -> dict:
+    """
+    Runs every selected benchmark at every item count.
+
+    Returns:
+        dict: The results, keyed by benchmark name, along with the environment they were gathered in.
+    """
+    selected = args.benchmarks.split(',') if args.benchmarks else None
+    results: Dict[str, list] = {}
+    work_dir = tempfile.mkdtemp(prefix='chunkydl-overhead-')
+    try:
+        for benchmarks, counts in ((MICRO_BENCHMARKS, args.counts), (END_TO_END_BENCHMARKS, args.e2e_counts)):
+            for name, factory in benchmarks.items():
+                if selected is not None and name not in selected:
+                    continue
+                for count in (int(value) for value in counts.split(',')):
+                    memory = count <= args.memory_limit
+                    result = measure(factory, count, work_dir, memory)
+                    results.setdefault(name, []).append(result)
+                    print(format_result(name, result), file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        'chunkydl_version': library_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'results': results,
+    }
+
+
+def format_result(name: str, result: dict) -> str:
+    text = f'{name:<18} n={result["count"]:<9} {result["us_per_item"]:>10.3f} us/item'
+    if 'peak_bytes_per_item' in result:
+        text += (f'  {result["peak_bytes_per_item"]:>10.1f} peak B/item'
+                 f'  {result["retained_blocks_per_item"]:>7.2f} retained blocks/item')
+    return text
+
+
+def check(results: dict, thresholds_path: str) -> int:
+    """
+    Compares the results against the maximum time per item allowed for each benchmark.
+
+    Returns:
+        int: 1 if any benchmark exceeded its threshold, 0 otherwise.
+    """
+    with open(thresholds_path) as file:
+        thresholds = json.load(file)
+    failed = False
+    for name, limits in thresholds.items():
+        for result in results['results'].get(name, []):
+            for metric, limit in limits.items():
+                value = result.get(metric)
+                if value is not None and value > limit:
+                    print(f'REGRESSION {name} n={result["count"]}: {metric} {value:.3f} exceeds {limit}',
+                          file=sys.stderr)
+                    failed = True
+    if not failed:
+        print('All overhead benchmarks are within their thresholds', file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.overhead')
+    parser.add_argument('--benchmarks', default=None, help='Comma separated benchmark names.  Default is all.')
+    parser.add_argument('--counts', default='1000,10000,100000,1000000', help='Item counts for the micro benchmarks.')
+    parser.add_argument('--e2e-counts', default='100,1000', help='Item counts for the end to end benchmarks.')
+    parser.add_argument('--memory-limit', type=int, default=100000,
+                        help='The largest item count that is also measured under tracemalloc.')
+    parser.add_argument('--check', default=None, help='A JSON file of per benchmark thresholds.')
+    parser.add_argument('--output', default=None, help='The path the JSON results are written to.')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.check:
+        return check(results, args.check)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
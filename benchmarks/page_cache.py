@@ -0,0 +1,215 @@
+"""
+Compares the throughput of each I/O mode of chunkydl with the share of the downloaded file left in the page cache, and
+with the share of an unrelated, recently read file that survives the download, which stands in for the working set of
+another service on the same host.
+
+Residency is measured with mincore, so it is only reported on platforms that have it.  The unrelated file is only
+evicted when the download is larger than the memory free for the page cache, so use a size near the host's memory to
+see it.
+
+Usage:
+    python -m benchmarks.page_cache
+    python -m benchmarks.page_cache --size 4gb --modes buffered,fadvise,direct --hot-size 256mb --output cache.json
+"""
+
+import os
+import sys
+import json
+import mmap
+import shutil
+import ctypes
+import ctypes.util
+import argparse
+import platform
+import tempfile
+import statistics
+import time
+from typing import Optional
+
+import chunkydl
+from chunkydl import Size
+
+from .run import library_version, verify
+from .server import BenchmarkServer
+
+
+def resident_bytes(path: str) -> Optional[int]:
+    """
+    Returns:
+        Optional[int]: The number of bytes of the file held in the page cache, or None if it can not be measured on
+            this platform.
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0
+    try:
+        mincore = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).mincore
+    except (OSError, TypeError, AttributeError):
+        return None
+    mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_ubyte)]
+    pages = -(-size // mmap.PAGESIZE)
+    vector = (ctypes.c_ubyte * pages)()
+    with open(path, 'rb') as file:
+        # a private mapping is writable, so that its address can be taken, without the file being opened for writing
+        mapped = mmap.mmap(file.fileno(), size, access=mmap.ACCESS_COPY)
+        try:
+            view = ctypes.c_char.from_buffer(mapped)
+            failed = mincore(ctypes.addressof(view), size, vector)
+            del view
+        finally:
+            mapped.close()
+    if failed:
+        return None
+    return min(sum(page & 1 for page in vector) * mmap.PAGESIZE, size)
+
+
+def residency(path: str) -> Optional[float]:
+    """
+    Returns:
+        Optional[float]: The fraction of the file held in the page cache, or None if it can not be measured.
+    """
+    resident = resident_bytes(path)
+    if resident is None:
+        return None
+    size = os.path.getsize(path)
+    return resident / size if size else 1.0
+
+
+def make_hot_file(path: str, size: int) -> None:
+    """
+    Writes a file and reads it back, so that it is held in the page cache as another service's working set would be.
+    """
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as file:
+        for _ in range(0, size, len(block)):
+            file.write(block)
+    with open(path, 'rb') as file:
+        while file.read(1024 * 1024):
+            pass
+
+
+def measure_mode(server: BenchmarkServer, mode: str, multipart: bool, args: argparse.Namespace, work_dir: str,
+                 hot_path: str) -> dict:
+    """
+    Downloads the benchmark file with an I/O mode several times, measuring the time of each download and the page cache
+    residency of the downloaded file and of the hot file right after it.
+
+    Returns:
+        dict: The summary of the case.
+    """
+    size = Size(args.size)
+    kwargs = {'io_mode': mode, 'io_threshold': 0, 'io_window': Size(args.window)}
+    if multipart:
+        kwargs.update(size_threshold=max(size // args.parts, 1), multipart_threads=args.threads)
+    else:
+        kwargs['size_threshold'] = size + 1
+    timings = []
+    file_residency = []
+    hot_residency = []
+    ok = True
+    errors = []
+    for _ in range(args.repeats):
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        make_hot_file(hot_path, Size(args.hot_size))
+        path = os.path.join(work_dir, 'file.bin')
+        start = time.perf_counter()
+        try:
+            chunkydl.download(server.file_url(size, 'file.bin'), path, **kwargs)
+        except Exception as e:
+            errors.append(repr(e))
+            ok = False
+            continue
+        timings.append(time.perf_counter() - start)
+        # residency is measured before the file is verified, as verifying reads it back into the cache
+        file_residency.append(residency(path))
+        hot_residency.append(residency(hot_path))
+        ok = ok and verify(path, size)
+    if not timings:
+        return {'ok': False, 'errors': errors}
+    median = statistics.median(timings)
+    return {
+        'ok': ok,
+        'bytes': int(size),
+        'runs': timings,
+        'median_seconds': median,
+        'throughput_mb_s': size / median / 1024 ** 2 if median > 0 else None,
+        'file_resident': None if None in file_residency else statistics.median(file_residency),
+        'hot_file_resident': None if None in hot_residency else statistics.median(hot_residency),
+        'errors': errors,
+    }
+
+
+def format_result(result: dict) -> str:
+    if 'runs' not in result:
+        return f'{result["scenario"]:<10} {result["mode"]:<9} FAILED {result.get("errors")}'
+    file_resident = result['file_resident']
+    hot_resident = result['hot_file_resident']
+    return (
+        f'{result["scenario"]:<10} {result["mode"]:<9} {result["median_seconds"]:8.3f}s '
+        f'{result["throughput_mb_s"]:9.1f} MB/s  file cached '
+        f'{"n/a" if file_resident is None else f"{file_resident:6.1%}"}  hot file cached '
+        f'{"n/a" if hot_resident is None else f"{hot_resident:6.1%}"}'
+    )
+
+
+def run(args: argparse.Namespace) -> dict:
+    """
+    Runs every I/O mode for single and multipart downloads.
+
+    Returns:
+        dict: The benchmark results, including the environment they were gathered in.
+    """
+    results = []
+    work_root = tempfile.mkdtemp(prefix='chunkydl-cache-', dir=args.dir)
+    work_dir = os.path.join(work_root, 'downloads')
+    hot_path = os.path.join(work_root, 'hot.bin')
+    try:
+        with BenchmarkServer() as server:
+            for scenario in args.scenarios.split(','):
+                for mode in args.modes.split(','):
+                    result = measure_mode(server, mode, scenario == 'multipart', args, work_dir, hot_path)
+                    result.update({'scenario': scenario, 'mode': mode})
+                    results.append(result)
+                    print(format_result(result), file=sys.stderr)
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+    return {
+        'chunkydl_version': library_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'size': int(Size(args.size)),
+        'hot_size': int(Size(args.hot_size)),
+        'window': int(Size(args.window)),
+        'repeats': args.repeats,
+        'results': results,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.page_cache')
+    parser.add_argument('--size', default='256mb', help='The size of the downloaded file.')
+    parser.add_argument('--modes', default='buffered,fadvise,direct', help='Comma separated I/O modes.')
+    parser.add_argument('--scenarios', default='download,multipart')
+    parser.add_argument('--parts', type=int, default=4, help='The number of parts in each multipart case.')
+    parser.add_argument('--threads', type=int, default=4, help='The number of threads in each multipart case.')
+    parser.add_argument('--window', default='8mb', help='The io_window used by the fadvise and direct modes.')
+    parser.add_argument('--hot-size', default='64mb', help='The size of the file standing in for another service.')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--dir', default=None, help='The directory downloaded into, which sets the file system used.')
+    parser.add_argument('--output', default=None, help='The path the JSON results are written to.')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
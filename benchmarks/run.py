@@ -0,0 +1,264 @@
+"""
+Runs throughput benchmarks of chunkydl against a local BenchmarkServer and writes the results as JSON so that runs made
+with different versions of the library can be compared.
+
+Usage:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --sizes 1mb,64mb --threads 1,4,8 --latency 0.02 --bandwidth 10mb
+    python -m benchmarks.run compare baseline.json results.json
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import time
+from typing import Callable, List
+
+import chunkydl
+from chunkydl import Size
+
+from .server import BenchmarkServer, ServerOptions, iter_content
+
+
+def library_version() -> str:
+    """
+    Returns:
+        str: The installed version of chunkydl, or 'unknown' if it is not installed as a distribution.
+    """
+    try:
+        from importlib.metadata import version
+        return version('chunkydl')
+    except Exception:
+        return 'unknown'
+
+
+def verify(path: str, size: int) -> bool:
+    """
+    Checks that a downloaded file holds exactly the content served by the benchmark server.
+
+    Returns:
+        bool: True if the file is complete and correct.
+    """
+    if not os.path.isfile(path) or os.path.getsize(path) != size:
+        return False
+    with open(path, 'rb') as file:
+        for expected in iter_content(0, size - 1, 1024 * 1024):
+            if file.read(len(expected)) != expected:
+                return False
+    return True
+
+
+def measure(func: Callable[[], List[tuple]], repeats: int, work_dir: str) -> dict:
+    """
+    Runs a benchmark case several times and summarizes the timings.
+
+    Args:
+        func: A callable that runs the case once and returns a list of (path, size) for every file it downloaded.
+        repeats (int): The number of times to run the case.
+        work_dir (str): The directory the case downloads into.  It is emptied before each run.
+
+    Returns:
+        dict: The timing summary of the case.
+    """
+    timings = []
+    ok = True
+    total_bytes = 0
+    errors = []
+    for _ in range(repeats):
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        start = time.perf_counter()
+        try:
+            files = func()
+        except Exception as e:
+            errors.append(repr(e))
+            ok = False
+            continue
+        timings.append(time.perf_counter() - start)
+        total_bytes = sum(size for _, size in files)
+        ok = ok and all(verify(path, size) for path, size in files)
+    if not timings:
+        return {'ok': False, 'errors': errors}
+    median = statistics.median(timings)
+    return {
+        'ok': ok,
+        'bytes': total_bytes,
+        'runs': timings,
+        'median_seconds': median,
+        'min_seconds': min(timings),
+        'throughput_mb_s': total_bytes / median / 1024 ** 2 if median > 0 else None,
+        'errors': errors,
+    }
+
+
+def bench_download(server: BenchmarkServer, size: int, work_dir: str, **kwargs) -> List[tuple]:
+    path = os.path.join(work_dir, 'file.bin')
+    chunkydl.download(server.file_url(size, 'file.bin'), path, **kwargs)
+    return [(path, size)]
+
+
+def bench_download_list(server: BenchmarkServer, size: int, count: int, work_dir: str, **kwargs) -> List[tuple]:
+    urls = [server.file_url(size, f'file-{index}.bin') for index in range(count)]
+    chunkydl.download_list(urls, work_dir, **kwargs)
+    return [(os.path.join(work_dir, f'file-{index}.bin'), size) for index in range(count)]
+
+
+def run(args: argparse.Namespace) -> dict:
+    """
+    Runs the benchmark matrix described by the parsed command line arguments.
+
+    Returns:
+        dict: The benchmark results, including the environment they were gathered in.
+    """
+    options = ServerOptions(
+        latency=args.latency,
+        bandwidth=Size(args.bandwidth) if args.bandwidth else None,
+        ranges=not args.no_ranges,
+        head=not args.no_head,
+        chunked=args.chunked,
+        connect_latency=args.connect_latency,
+    )
+    sizes = [Size(size) for size in args.sizes.split(',')]
+    threads = [int(count) for count in args.threads.split(',')]
+    scenarios = args.scenarios.split(',')
+    results = []
+    work_dir = tempfile.mkdtemp(prefix='chunkydl-bench-')
+    try:
+        with BenchmarkServer(options) as server:
+            for size in sizes:
+                for thread_count in threads:
+                    cases = []
+                    # single downloads do not use the thread count, so they are only run once per size
+                    if 'download' in scenarios and thread_count == threads[0]:
+                        cases.append(('download', lambda: bench_download(
+                            server, size, work_dir, size_threshold=max(size, 1) + 1, transport=args.transport,
+                        )))
+                    if 'download_list' in scenarios:
+                        cases.append(('download_list', lambda: bench_download_list(
+                            server, size, args.files, work_dir, download_threads=thread_count,
+                            size_threshold=max(size, 1) + 1, transport=args.transport, prewarm=args.prewarm,
+                            metadata_threads=args.metadata_threads,
+                        )))
+                    if 'multipart' in scenarios:
+                        part_size = max(size // args.parts, 1)
+                        cases.append(('multipart', lambda: bench_download(
+                            server, size, work_dir, size_threshold=part_size, multipart_threads=thread_count,
+                            transport=args.transport,
+                        )))
+                    for name, func in cases:
+                        result = measure(func, args.repeats, work_dir)
+                        result.update({'scenario': name, 'size': int(size), 'threads': thread_count})
+                        if name == 'download_list':
+                            result['files'] = args.files
+                        if name == 'multipart':
+                            result['parts'] = args.parts
+                        results.append(result)
+                        print(format_result(result), file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        'chunkydl_version': library_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'server': vars(options),
+        'transport': args.transport,
+        'prewarm': args.prewarm,
+        'metadata_threads': args.metadata_threads,
+        'repeats': args.repeats,
+        'results': results,
+    }
+
+
+def format_result(result: dict) -> str:
+    name = f'{result["scenario"]:<14} size={result["size"]:<11} threads={result["threads"]:<3}'
+    if 'median_seconds' not in result:
+        return f'{name} FAILED {result.get("errors")}'
+    status = 'ok' if result['ok'] else 'INVALID OUTPUT'
+    return f'{name} {result["median_seconds"]:.4f}s  {result["throughput_mb_s"] or 0:.1f} MB/s  {status}'
+
+
+def compare(baseline_path: str, current_path: str, tolerance: float) -> int:
+    """
+    Prints the change in median time for every case found in both result files.
+
+    Returns:
+        int: 1 if any case regressed by more than the tolerance or produced invalid output, 0 otherwise.
+    """
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    with open(current_path) as file:
+        current = json.load(file)
+
+    def key(result):
+        return result['scenario'], result['size'], result['threads']
+
+    baseline_results = {key(result): result for result in baseline['results']}
+    failed = False
+    print(f'{baseline["chunkydl_version"]} -> {current["chunkydl_version"]}')
+    for result in current['results']:
+        base = baseline_results.get(key(result))
+        if base is None or 'median_seconds' not in base:
+            continue
+        if 'median_seconds' not in result or not result['ok']:
+            print(f'{format_result(result)}')
+            failed = True
+            continue
+        change = result['median_seconds'] / base['median_seconds'] - 1
+        regressed = change > tolerance
+        failed = failed or regressed
+        marker = '  REGRESSION' if regressed else ''
+        print(f'{result["scenario"]:<14} size={result["size"]:<11} threads={result["threads"]:<3} '
+              f'{base["median_seconds"]:.4f}s -> {result["median_seconds"]:.4f}s ({change:+.1%}){marker}')
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == 'compare':
+        parser = argparse.ArgumentParser(prog='python -m benchmarks.run compare')
+        parser.add_argument('baseline')
+        parser.add_argument('current')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='The allowed slow down as a fraction of the baseline time.  Default is 0.1.')
+        args = parser.parse_args(argv[1:])
+        return compare(args.baseline, args.current, args.tolerance)
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run')
+    parser.add_argument('--scenarios', default='download,download_list,multipart')
+    parser.add_argument('--sizes', default='64kb,1mb,16mb', help='Comma separated file sizes.')
+    parser.add_argument('--threads', default='1,4,8', help='Comma separated thread counts.')
+    parser.add_argument('--files', type=int, default=16, help='The number of files in each download_list case.')
+    parser.add_argument('--parts', type=int, default=8, help='The number of parts in each multipart case.')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of latency added to each request.')
+    parser.add_argument('--bandwidth', default=None, help='Bandwidth cap per connection, such as 10mb.')
+    parser.add_argument('--no-ranges', action='store_true', help='Serve files without Range support.')
+    parser.add_argument('--no-head', action='store_true', help='Answer HEAD requests with 405.')
+    parser.add_argument('--chunked', action='store_true', help='Send bodies with chunked transfer encoding.')
+    parser.add_argument('--transport', default='requests', help='The transport downloads are made with.')
+    parser.add_argument('--connect-latency', type=float, default=0.0,
+                        help='Seconds of latency added to each new connection.')
+    parser.add_argument('--prewarm', action='store_true', help='Warm connections to queued hosts.')
+    parser.add_argument('--metadata-threads', type=int, default=0,
+                        help='Threads that resolve queued downloads ahead of the download threads.')
+    parser.add_argument('--output', default=None, help='The path the JSON results are written to.')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
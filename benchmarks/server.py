@@ -0,0 +1,330 @@
+"""
+A configurable local HTTP server that stands in for a real file host in benchmarks and tests.
+
+Files are generated on the fly: a request for /files/<size> (for example /files/10mb or /files/1024) returns that many
+bytes of deterministic content, so no files need to be prepared on disk.  The server can simulate latency, a bandwidth
+cap per connection, servers without Range or HEAD support, and chunked transfer encoding.
+"""
+
+import re
+import time
+import hashlib
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional
+
+from chunkydl import Size
+
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 64 * 1024
+_BLOCK = hashlib.sha256(b'chunkydl').digest() * (BLOCK_SIZE // 32)
+
+
+def content(start: int, end: int) -> bytes:
+    """
+    Returns the bytes from start to end (inclusive) of the deterministic content served for every file.
+
+    Args:
+        start (int): The first byte.
+        end (int): The last byte.
+
+    Returns:
+        bytes: The requested bytes.
+    """
+    length = end - start + 1
+    if length <= 0:
+        return b''
+    offset = start % BLOCK_SIZE
+    repeats = (offset + length) // BLOCK_SIZE + 1
+    return (_BLOCK * repeats)[offset:offset + length]
+
+
+def iter_content(start: int, end: int, chunk_size: int = BLOCK_SIZE):
+    """
+    Yields the bytes from start to end (inclusive) of the deterministic content in chunks of at most chunk_size bytes.
+    """
+    position = start
+    while position <= end:
+        chunk_end = min(position + chunk_size - 1, end)
+        yield content(position, chunk_end)
+        position = chunk_end + 1
+
+
+class ServerOptions:
+
+    """
+    The behavior of a BenchmarkServer.  The options may be changed while the server is running.
+
+    Attributes:
+        latency (float): Seconds to wait before sending the response headers of every request.
+        bandwidth (Optional[int]): The maximum number of bytes per second sent on each connection, or None for no cap.
+        ranges (bool): Indicates if Range requests are honored.  When False, the full file is always returned.
+        head (bool): Indicates if HEAD requests are supported.  When False, HEAD requests receive a 405 response.
+        chunked (bool): Indicates if bodies are sent with chunked transfer encoding instead of a Content-Length.
+        validators (bool): Indicates if ETag and Last-Modified headers are sent.
+        fail_rate (float): The fraction of GET requests, between 0 and 1, that are answered with a 503 response.
+        multirange (bool): Indicates if requests for several ranges are answered with a multipart/byteranges body.
+            When False, only the first range of such requests is returned.
+        connect_latency (float): Seconds that pass after a connection is accepted before it is read from, standing in
+            for the round trips of the TCP and TLS handshakes to a distant host.
+    """
+
+    def __init__(self, latency: float = 0.0, bandwidth: Optional[int] = None, ranges: bool = True, head: bool = True,
+                 chunked: bool = False, validators: bool = True, fail_rate: float = 0.0, multirange: bool = True,
+                 connect_latency: float = 0.0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.ranges = ranges
+        self.head = head
+        self.chunked = chunked
+        self.validators = validators
+        self.fail_rate = fail_rate
+        self.multirange = multirange
+        self.connect_latency = connect_latency
+
+
+class BenchmarkHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, which would otherwise stall reused connections on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        if self.server.options.connect_latency:
+            time.sleep(self.server.options.connect_latency)
+    server: 'BenchmarkServer'
+
+    def do_HEAD(self):
+        options = self.server.options
+        size = self.get_size()
+        if size is None:
+            return
+        self.wait()
+        if not options.head:
+            self.send_error(405)
+            return
+        self.send_response(200)
+        self.send_file_headers(size, size)
+        self.end_headers()
+
+    def do_GET(self):
+        options = self.server.options
+        size = self.get_size()
+        if size is None:
+            return
+        self.server.count_request()
+        self.wait()
+        if options.fail_rate and self.server.should_fail():
+            self.send_error(503)
+            return
+        start, end = 0, size - 1
+        range_header = self.headers.get('Range')
+        status = 200
+        if options.ranges and range_header:
+            parsed = self.parse_ranges(range_header, size)
+            if not parsed:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if len(parsed) > 1 and options.multirange:
+                self.send_multirange(parsed, size)
+                return
+            start, end = parsed[0]
+            status = 206
+        self.send_response(status)
+        self.send_file_headers(end - start + 1, size)
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        self.send_body(start, end)
+
+    def get_size(self) -> Optional[int]:
+        match = re.fullmatch(r'/files/([0-9.]+[a-zA-Z]*)(/[^?]*)?(\?.*)?', self.path)
+        if match is None:
+            self.send_error(404)
+            return None
+        return int(Size(match.group(1)))
+
+    def wait(self) -> None:
+        latency = self.server.options.latency
+        if latency:
+            time.sleep(latency)
+
+    def send_file_headers(self, length: int, size: int) -> None:
+        options = self.server.options
+        self.send_header('Content-Type', 'application/octet-stream')
+        if options.chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(length))
+        if options.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if options.validators:
+            self.send_header('ETag', f'"{size}"')
+            self.send_header('Last-Modified', 'Mon, 01 Jan 2024 00:00:00 GMT')
+
+    @classmethod
+    def parse_ranges(cls, value: str, size: int) -> list:
+        unit, _, specs = value.strip().partition('=')
+        if unit != 'bytes':
+            return []
+        ranges = [cls.parse_range(spec.strip(), size) for spec in specs.split(',')]
+        return [parsed for parsed in ranges if parsed is not None]
+
+    @staticmethod
+    def parse_range(spec: str, size: int) -> Optional[tuple]:
+        match = re.fullmatch(r'(\d*)-(\d*)', spec)
+        if match is None or (not match.group(1) and not match.group(2)):
+            return None
+        if not match.group(1):
+            start = max(size - int(match.group(2)), 0)
+            end = size - 1
+        else:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        if start >= size or start > end:
+            return None
+        return start, end
+
+    def send_multirange(self, ranges: list, size: int) -> None:
+        boundary = 'chunkydl-byteranges'
+        parts = []
+        for start, end in ranges:
+            parts.append(
+                f'--{boundary}\r\nContent-Type: application/octet-stream\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'.encode('ascii')
+            )
+            parts.append(content(start, end))
+            parts.append(b'\r\n')
+        parts.append(f'--{boundary}--\r\n'.encode('ascii'))
+        body = b''.join(parts)
+        self.send_response(206)
+        self.send_header('Content-Type', f'multipart/byteranges; boundary={boundary}')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug('Client closed connection during transfer')
+
+    def send_body(self, start: int, end: int) -> None:
+        options = self.server.options
+        bandwidth = options.bandwidth
+        slice_size = max(bandwidth // 20, 1) if bandwidth else BLOCK_SIZE
+        began = time.monotonic()
+        sent = 0
+        try:
+            for chunk in iter_content(start, end, slice_size):
+                if options.chunked:
+                    self.wfile.write(f'{len(chunk):x}\r\n'.encode('ascii') + chunk + b'\r\n')
+                else:
+                    self.wfile.write(chunk)
+                sent += len(chunk)
+                if bandwidth:
+                    ahead = sent / bandwidth - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+            if options.chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug('Client closed connection during transfer')
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class BenchmarkServer(ThreadingHTTPServer):
+
+    """
+    A threaded HTTP server that serves generated files according to its ServerOptions.  The server listens on a free
+    local port and may be used as a context manager, which runs it in a background thread.
+
+    Attributes:
+        options (ServerOptions): The behavior of the server.
+        requests (int): The number of GET requests the server has received.
+
+    Args:
+        options (Optional[ServerOptions]): The behavior of the server.  Defaults to a fast server with full support.
+        port (int): The port to listen on.  Default is 0, which picks a free port.
+    """
+
+    daemon_threads = True
+    # the default backlog of 5 drops bursts of new connections, which then wait a second to retry the handshake
+    request_queue_size = 128
+
+    def __init__(self, options: Optional[ServerOptions] = None, port: int = 0):
+        super().__init__(('127.0.0.1', port), BenchmarkHandler)
+        self.options = options or ServerOptions()
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """
+        Returns:
+            str: The base url of the server.
+        """
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def file_url(self, size, name: Optional[str] = None) -> str:
+        """
+        Returns the url of a generated file.
+
+        Args:
+            size: The size of the file, as an int or a size string such as '10mb'.
+            name (Optional[str]): An optional file name appended to the url.
+
+        Returns:
+            str: The url of the file.
+        """
+        url = f'{self.url}/files/{int(size) if isinstance(size, int) else size}'
+        return f'{url}/{name}' if name else url
+
+    def count_request(self) -> None:
+        """
+        Counts a GET request.
+        """
+        with self._lock:
+            self.requests += 1
+
+    def should_fail(self) -> bool:
+        """
+        Returns:
+            bool: True if the latest GET request should fail.  Failures are spread evenly so that the fraction of
+                failed requests matches the fail_rate option.
+        """
+        with self._lock:
+            count = self.requests
+        rate = self.options.fail_rate
+        return int(count * rate) != int((count - 1) * rate)
+
+    def start(self) -> 'BenchmarkServer':
+        """
+        Starts serving in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops serving and closes the server's socket.
+        """
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def __enter__(self) -> 'BenchmarkServer':
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
@@ -14,20 +14,64 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from .api import download, download_list
+from .api import download, download_list, open_remote, download_ranges, update_file, extract
 from .models.queue_downloader import QueueDownloader
+from .models.sharded_downloader import ShardedDownloader
 from .models.download_config import DownloadConfig
-from .models.data_models import DLGroup
-from .exceptions import RequestFailedException
+from .models.data_models import DLGroup, PostResult
+from .exceptions import RequestFailedException, UnsafeArchiveException, CircuitOpenException
 from .models.size import Size
+from .models.metrics import MetricsRegistry, MetricsServer
+from .models.progress import ProgressTracker, ProgressReport
+from .models.hooks import DownloadHooks, SpanRecorder
+from .models.remote_file import RemoteFile
+from .models.range_fetcher import RangeFetcher
+from .models.block_map import BlockMap
+from .models.delta_updater import DeltaUpdater
+from .models.post_processor import PostProcessor
+from .models.persistent_queue import PersistentQueue
+from .models.memory_budget import MemoryBudget
+from .models.segment_sink import SegmentSink, SegmentEntry
+from .models.transport import Transport, RequestsTransport, Urllib3Transport, HttpxTransport
+from .models.dns_cache import DnsCache
+from .models.circuit_breaker import CircuitBreaker
 
 
 __all__ = [
     'download',
     'download_list',
+    'open_remote',
+    'download_ranges',
+    'update_file',
+    'extract',
     'QueueDownloader',
+    'ShardedDownloader',
     'DownloadConfig',
     'RequestFailedException',
+    'UnsafeArchiveException',
+    'CircuitOpenException',
     'DLGroup',
-    'Size'
+    'PostResult',
+    'Size',
+    'MetricsRegistry',
+    'MetricsServer',
+    'ProgressTracker',
+    'ProgressReport',
+    'DownloadHooks',
+    'SpanRecorder',
+    'RemoteFile',
+    'RangeFetcher',
+    'BlockMap',
+    'DeltaUpdater',
+    'PostProcessor',
+    'PersistentQueue',
+    'MemoryBudget',
+    'SegmentSink',
+    'SegmentEntry',
+    'Transport',
+    'RequestsTransport',
+    'Urllib3Transport',
+    'HttpxTransport',
+    'DnsCache',
+    'CircuitBreaker',
 ]
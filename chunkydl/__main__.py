@@ -0,0 +1,39 @@
+"""
+Command line tools for chunkydl.
+
+    python -m chunkydl blockmap path/to/file [--block-size 1mb] [--algorithm sha256] [--output path/to/file.blockmap]
+"""
+
+import argparse
+from typing import Optional, Sequence
+
+from .models.block_map import BlockMap
+from .models.size import Size
+
+
+def make_block_map(args: argparse.Namespace) -> None:
+    """
+    Makes the block map of a file and saves it next to the file, or at the supplied output path.
+    """
+    block_map = BlockMap.from_file(args.path, Size(args.block_size), args.algorithm)
+    output = args.output or f'{args.path}.blockmap'
+    block_map.save(output)
+    print(f'Wrote {block_map.block_count} blocks of {block_map.block_size} bytes to {output}')
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='python -m chunkydl')
+    commands = parser.add_subparsers(dest='command', required=True)
+    block_map = commands.add_parser('blockmap', help='Make the block map of a file, for block level delta updates.')
+    block_map.add_argument('path', help='The file to map.')
+    block_map.add_argument('--block-size', default='1mb', help='The size of each block, such as 64kb or 1mb.')
+    block_map.add_argument('--algorithm', default='sha256', help='The hashlib algorithm used for each block.')
+    block_map.add_argument('--output', help='The path of the block map.  Defaults to the file path with .blockmap '
+                                            'added.')
+    block_map.set_defaults(handler=make_block_map)
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,7 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+from copy import copy
 from typing import Union, Optional
 
 from .models.download_config import DownloadConfig
@@ -21,6 +22,12 @@ from .download import _download
 from .models.data_models import Response
 from .models.data_models import DLGroup
 from .models.queue_downloader import QueueDownloader
+from .models.sharded_downloader import ShardedDownloader
+from .models.remote_file import RemoteFile
+from .models.range_fetcher import RangeFetcher
+from .models.block_map import BlockMap
+from .models.delta_updater import DeltaUpdater
+from .models.size import Size
 from .utils import convert_urls
 
 
@@ -54,10 +61,84 @@ def download(url: str, output_path: str, **kwargs) -> Response:
                 the download queue.  Default is False.
             clean_up_on_fail (bool): Indicates if the multiple parts of a file downloaded with the multipart
                 downloader will be deleted if some part of the multipart download fails.  Default is False.
+            cache_dir (str): The path to a directory used as a shared download cache.  When supplied, files that are
+                already in the cache are placed at their output path instead of being downloaded again.  Default is
+                None (no cache).
+            cache_max_size (int): The size, in bytes, after which the least recently used files are removed from the
+                cache.  Default is 10GB.
+            cache_link_mode (str): How cached files are placed at their output paths.  One of 'auto', 'clone',
+                'reflink', 'hardlink', or 'copy'.  'hardlink' shares the cached file's inode with the output.
+                Default is 'auto' (a reflink where supported, otherwise a copy).
+            cache_digest (bool): Indicates if cached files are also addressed by the digest of their contents.
+                Default is False.
+            metrics (MetricsRegistry): A registry that records metrics for the download.  Default is None.
+            progress (ProgressTracker): A tracker that reports the progress of the download to its subscribers.
+                Default is None.
+            hooks (DownloadHooks): Hooks that are notified at the start and end of each stage of the download.
+                Default is None.
+            decompress (bool): Indicates if compressed files are decompressed while they are downloaded, so that only
+                the decompressed file is written to disk.  The compression is found from the Content-Encoding header
+                or the file extension, which is removed from names taken from the url.  Default is False.
+            atomic_publish (bool): Indicates if the file is written to a hidden temporary file and renamed to its
+                output path once complete, so that readers never see a partial file.  Default is False.
+            durability (str): When the file is flushed to disk.  One of 'none', 'file', or 'batch'.  The file is
+                synced before this function returns with either 'file' or 'batch'.  Default is 'none'.
+            io_mode (str): How a file of at least io_threshold bytes is written.  One of 'buffered', 'fadvise' (the page
+                cache is advised to drop the file behind the write cursor), or 'direct' (written with O_DIRECT where
+                supported), so that large downloads do not evict the page cache of other processes.  Default is
+                'buffered'.
+            io_threshold (Size): The size from which a file is written with the io_mode.  Default is 1gb.
+            transport (Union[str, Transport]): The HTTP client the download is made with.  One of 'requests',
+                'urllib3' (a shared connection pool, with less overhead for each request), or 'httpx' (HTTP/2, which
+                requires httpx[http2]), or a Transport.  Default is 'requests'.
+            dns_ttl (float): The seconds for which the addresses a host resolves to are cached by the 'urllib3'
+                transport.  Default is 0, which resolves each new connection.
+            circuit_breaker (Union[bool, CircuitBreaker]): Indicates if each host has a circuit that opens after
+                circuit_failures failed request attempts in a row, after which downloads from the host fail at once
+                with a CircuitOpenException, and its requests stop retrying.  Default is False.
+            circuit_failures (int): The number of failed request attempts in a row after which a host's circuit opens.
+                Default is 5.
+            circuit_reset (float): The number of seconds a host's circuit stays open before a trial download is let
+                through.  Default is 30.
             config (DownloadConfig): A DownloadConfig object that holds the configuration variables supplied.
     """
     config = kwargs.get('config', DownloadConfig(**kwargs))
-    return _download(url, output_path, config)
+    try:
+        return _download(url, output_path, config)
+    finally:
+        if config.publisher is not None:
+            config.publisher.flush()
+        if config.segment_sink is not None:
+            config.segment_sink.flush()
+
+
+def extract(url: str, destination: str, **kwargs) -> Response:
+    """
+    Extracts the tar archive at the url into the destination directory while it is downloaded, without saving the
+    archive.  Archives compressed with gzip, bz2, xz, or zstd (if the zstandard package is installed) are decompressed
+    on their own stage, found from the Content-Encoding header or the extension of the url, such as .tar.gz or .tgz.
+    Members that would be written outside of the destination are rejected with an UnsafeArchiveException.  Large
+    archives on servers that accept Range requests are downloaded in parts, which are extracted in order.
+
+    Args:
+        url (str): The url of the archive.
+        destination (str): The directory the archive is extracted into.  It is made if it does not exist.
+        **kwargs: Download configuration variables, as for download.
+            extract_buffer (int): The number of bytes of the archive held in memory between the download and the
+                extraction.  Parts of multipart extractions are sized so that the parts held by every thread also fit
+                in this size.  Default is 64MB.
+            size_threshold (int): The size, in bytes, after which the archive is downloaded in parts.  Default is
+                100MB.
+            multipart_threads (int): The number of parts downloaded at the same time.
+            config (DownloadConfig): A DownloadConfig object that holds the configuration variables supplied.  Its
+                extract option is set for the extraction.
+
+    Returns:
+        Response: The response for the archive, with the destination as its output path.
+    """
+    config = copy(kwargs['config']) if 'config' in kwargs else DownloadConfig(**kwargs)
+    config.extract = True
+    return _download(url, destination, config)
 
 
 def download_list(urls: list[Union[str, DLGroup]], output_dir: Optional[str] = None, **kwargs) -> list[Response]:
@@ -95,12 +176,223 @@ def download_list(urls: list[Union[str, DLGroup]], output_dir: Optional[str] = N
                 the download queue.  Default is False.
             clean_up_on_fail (bool): Indicates if the multiple parts of a file downloaded with the multipart
                 downloader will be deleted if some part of the multipart download fails.  Default is False.
+            cache_dir (str): The path to a directory used as a shared download cache.  When supplied, files that are
+                already in the cache are placed at their output path instead of being downloaded again.  Default is
+                None (no cache).
+            cache_max_size (int): The size, in bytes, after which the least recently used files are removed from the
+                cache.  Default is 10GB.
+            cache_link_mode (str): How cached files are placed at their output paths.  One of 'auto', 'clone',
+                'reflink', 'hardlink', or 'copy'.  'hardlink' shares the cached file's inode with the output.
+                Default is 'auto' (a reflink where supported, otherwise a copy).
+            cache_digest (bool): Indicates if cached files are also addressed by the digest of their contents.
+                Default is False.
+            coalesce (bool): Indicates if duplicate urls in the list are only downloaded once at a time.  Each
+                duplicate receives a copy of the downloaded file.  Default is True; set it to False to download every
+                duplicate separately.
+            coalesce_link_mode (str): How coalesced duplicates are placed at their output paths.  Default is 'clone'.
+            metrics (MetricsRegistry): A registry that records metrics for every download.  Default is None.
+            metrics_port (int): A local port on which the metrics registry is served in the Prometheus text format
+                while the downloads run.  Default is None (no server).
+            progress (ProgressTracker): A tracker that reports the progress of the downloads to its subscribers.
+                Default is None.
+            hooks (DownloadHooks): Hooks that are notified at the start and end of each stage of every download.
+                Default is None.
+            decompress (bool): Indicates if compressed files are decompressed while they are downloaded, so that only
+                the decompressed files are written to disk.  The compression is found from the Content-Encoding header
+                or the file extension, which is removed from names taken from the url.  Default is False.
+            extract (bool): Indicates if tar archives are extracted into their output paths, used as directories,
+                while they are downloaded, instead of being saved.  See extract.  Default is False.
+            extract_buffer (int): The number of bytes of each archive held in memory between the download and the
+                extraction.  Default is 64MB.
+            post_process (Sequence[Union[str, Callable]]): Stages run on each downloaded file in a pool of worker
+                processes while the other files download, such as 'sha256', 'decompress', 'validate', 'thumbnail', or
+                picklable callables that take the path of the file.  The outcome is added to each response as
+                response.post.  Default is None.
+            post_process_workers (int): The number of worker processes that run the stages.  Default is the number
+                of CPUs.
+            post_process_pending (int): The number of downloaded files that may wait for a worker before downloads
+                wait for the stages to catch up.  Default is twice the number of workers.
+            atomic_publish (bool): Indicates if files are written to hidden temporary files and renamed to their output
+                paths once complete, so that readers never see a partial file.  Default is False.
+            durability (str): When files are flushed to disk.  One of 'none' (left to the operating system), 'file'
+                (each file is synced before its download finishes), or 'batch' (files are synced in batches on a
+                background thread, and all of them before this function returns).  Default is 'none'.
+            sync_batch_files (int): The number of files after which a batch is synced.  Default is 100.
+            sync_batch_seconds (float): The seconds after which a batch is synced.  Default is 1.
+            io_mode (str): How files of at least io_threshold bytes are written.  One of 'buffered', 'fadvise' (the
+                page cache is advised to drop each file behind the write cursor), or 'direct' (written with O_DIRECT
+                where supported), so that large downloads do not evict the page cache of other processes.  Default is
+                'buffered'.
+            io_threshold (Size): The size from which files are written with the io_mode.  Default is 1gb.
+            segment_dir (str): A directory in which files no larger than the size threshold are appended to rolling
+                segment files instead of being written to their output paths, with an index that maps each url to the
+                segment, offset, and length of its file.  Read them back with DownloadConfig.segment_sink, or from
+                response.segment.  Default is None.
+            segment_size (Size): The size after which a segment file is closed and a new one started.  Default is 1gb.
+            shard_processes (int): The number of processes that the downloads are sharded across by url, each running
+                its own queue downloader, for lists of many small files that are bound by a single process.  Results
+                and metrics are merged back into this process.  A memory limit is divided evenly between the
+                processes.  Default is 1.
+            transport (Union[str, Transport]): The HTTP client the downloads are made with.  One of 'requests',
+                'urllib3' (a single connection pool shared by every download, with less overhead for each request), or
+                'httpx' (HTTP/2, so that many small requests to a host share one connection, which requires
+                httpx[http2]), or a Transport.  Default is 'requests'.
+            dns_ttl (float): The seconds for which the addresses a host resolves to are cached by the 'urllib3'
+                transport, which should be no longer than the TTL of the hosts' DNS records.  Default is 0, which
+                resolves each new connection.
+            prewarm (bool): Indicates if connections to the hosts of the downloads that will start next are opened
+                ahead of them, so that the downloads do not wait on connecting.  Only the 'urllib3' transport keeps the
+                connections.  Default is False.
+            prewarm_lookahead (int): The number of downloads past the last one started whose hosts are warmed.
+                Defaults to the number of download threads.
+            circuit_breaker (Union[bool, CircuitBreaker]): Indicates if each host has a circuit that opens after
+                circuit_failures failed request attempts in a row, after which downloads from the host fail at once
+                with a CircuitOpenException, releasing their workers for the downloads from healthy hosts, and its
+                requests stop retrying.  Default is False.
+            circuit_failures (int): The number of failed request attempts in a row after which a host's circuit opens.
+                Default is 5.
+            circuit_reset (float): The number of seconds a host's circuit stays open before a trial download is let
+                through.  Default is 30.
+            metadata_threads (int): The number of threads that make the HEAD requests of queued downloads ahead of
+                the download threads, which then only move bytes.  The sizes found order the downloads by
+                metadata_order.  Default is 0, with which each download thread makes the HEAD request of its download.
+            metadata_lookahead (int): The number of downloads that may be resolving or waiting for a download thread
+                at once.  Defaults to four times the number of metadata threads.
+            metadata_order (str): The order in which resolved downloads are started.  One of 'queue', 'smallest', or
+                'largest'.  Default is 'queue'.
             config (DownloadConfig): A DownloadConfig object that holds the configuration variables supplied.
     """
     config = kwargs.get('config', DownloadConfig(**kwargs))
     dl_groups = convert_urls(urls, output_dir, config)
-    downloader = QueueDownloader(config=config)
+    if config.shard_processes > 1:
+        downloader = ShardedDownloader(config=config)
+    else:
+        downloader = QueueDownloader(config=config)
     downloader.add_multiple(dl_groups)
     downloader.add(None)  # shutdown downloader after items
     downloader.run()
     return downloader.results
+
+
+def open_remote(url: str, **kwargs) -> RemoteFile:
+    """
+    Opens a remote file for reading without downloading it.  Reads are served by Range requests, so only the parts of
+    the file that are read are downloaded.  The returned file is seekable and may be passed to anything that reads a
+    binary file, such as zipfile.ZipFile.
+
+    Args:
+        url (str): The url of the file.
+        **kwargs:
+            block_size (int): The size, in bytes, of each block read from the server and cached.  Default is 256KB.
+            cache_size (int): The maximum number of bytes of the file kept in memory.  Default is 64MB.
+            readahead (int): The maximum number of blocks read ahead when the file is read sequentially.  Default is
+                16.
+            timout (int): The timout time, in seconds, before a request is abandoned.  Default is 10.
+            retries (int): The number of times a request will be retried.  Default is 3.
+            additional_headers (dict): A dict of headers that will be added to the default headers provided by this
+                class.
+            complete_headers (dict): Overwrites the default headers.  If supplied, these will be the only headers
+                used for each request.
+            metrics (MetricsRegistry): A registry to which the bytes received are added.  Default is None.
+            config (DownloadConfig): A DownloadConfig object that holds the configuration variables supplied.
+
+    Returns:
+        RemoteFile: The opened file.
+    """
+    config = kwargs.get('config', DownloadConfig(**kwargs))
+    return RemoteFile(
+        url,
+        config=config,
+        block_size=Size(kwargs.get('block_size', '256kb')),
+        cache_size=Size(kwargs.get('cache_size', '64mb')),
+        readahead=kwargs.get('readahead', 16),
+    )
+
+
+def download_ranges(url: str, ranges: list[tuple], output_path: Optional[str] = None,
+                    **kwargs) -> Optional[list[bytes]]:
+    """
+    Downloads a set of byte ranges of a file in as few requests as possible.  Ranges that are close together are
+    merged, and the merged ranges are requested together with multi-range requests.  If the server does not support
+    multi-range requests, the ranges are requested one at a time, several at once.
+
+    Args:
+        url (str): The url of the file.
+        ranges (list[tuple]): The first and last byte (inclusive) of each range.
+        output_path (Optional[str]): The path of a file to write the ranges to, at their offsets in the remote file.
+            The bytes that are not downloaded are left as holes in the file.  If not supplied, the bytes of each range
+            are returned.
+        **kwargs:
+            range_gap (int): The largest number of bytes between two ranges for which they are downloaded as one range.
+                Default is 64KB.
+            max_ranges (int): The largest number of ranges requested in a single request.  Default is 64.
+            multipart_threads (int): The number of ranges requested at the same time when the server does not
+                support multi-range requests.
+            timout (int): The timout time, in seconds, before a request is abandoned.  Default is 10.
+            retries (int): The number of times a request will be retried.  Default is 3.
+            additional_headers (dict): A dict of headers that will be added to the default headers provided by this
+                class.
+            complete_headers (dict): Overwrites the default headers.  If supplied, these will be the only headers
+                used for each request.
+            metrics (MetricsRegistry): A registry to which the bytes received are added.  Default is None.
+            config (DownloadConfig): A DownloadConfig object that holds the configuration variables supplied.
+
+    Returns:
+        Optional[list[bytes]]: The bytes of each range, in the order the ranges were supplied, or None if the ranges
+            were written to the output path.
+    """
+    config = kwargs.get('config', DownloadConfig(**kwargs))
+    fetcher = RangeFetcher(
+        url,
+        config=config,
+        gap=Size(kwargs.get('range_gap', '64kb')),
+        max_ranges=kwargs.get('max_ranges', 64),
+    )
+    try:
+        if output_path is not None:
+            fetcher.write(ranges, output_path)
+            return None
+        return fetcher.read(ranges)
+    finally:
+        fetcher.close()
+
+
+def update_file(url: str, output_path: str, block_map: Union[BlockMap, str, None] = None, **kwargs) -> Response:
+    """
+    Updates a local copy of a file to the current version at the url, downloading only the blocks of the file that
+    changed.  The blocks of the local file are compared with the block map of the current version, and the blocks that
+    do not match are downloaded in parts and written into the local file in place.  If the local file does not exist,
+    the whole file is downloaded.
+
+    Args:
+        url (str): The url of the current version of the file.
+        output_path (str): The path of the local file.
+        block_map (Union[BlockMap, str, None]): The block map of the current version of the file, or the url or local
+            path of a block map saved by BlockMap.save.  If not supplied, the block map is downloaded from the url with
+            '.blockmap' added.
+        **kwargs: Download configuration variables.
+            timout (int): The timout time, in seconds, before a request is abandoned.  Default is 10.
+            retries (int): The number of times a request will be retried.  Default is 3.
+            size_threshold (int): The largest range of changed blocks requested at once.  Default is 100MB.
+            multipart_threads (int): The number of ranges downloaded at the same time.
+            additional_headers (dict): A dict of headers that will be added to the default headers provided by this
+                class.
+            complete_headers (dict): Overwrites the default headers.  If supplied, these will be the only headers
+                used for each request.
+            mirrors (Sequence[str]): The urls of the same file on other mirrors, which the changed blocks are spread
+                across.
+            config (DownloadConfig): A DownloadConfig object that holds the configuration variables supplied.
+
+    Returns:
+        Response: The response for the file, with the timing of the downloaded ranges.
+    """
+    config = kwargs.get('config', DownloadConfig(**kwargs))
+    if block_map is None:
+        block_map = f'{url}.blockmap'
+    if isinstance(block_map, str):
+        if block_map.startswith(('http://', 'https://')):
+            block_map = BlockMap.fetch(block_map, config)
+        else:
+            block_map = BlockMap.load(block_map)
+    updater = DeltaUpdater(url, output_path, block_map, config=config, mirrors=kwargs.get('mirrors', ()))
+    return updater.run()
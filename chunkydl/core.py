@@ -1,13 +1,26 @@
+import time
+from contextlib import nullcontext
+from typing import BinaryIO, Callable, Optional
+
 import requests
-from requests.adapters import HTTPAdapter, Retry
 
 from .exceptions import RequestFailedException
-from .utils import make_response
+from .utils import make_response, get_retry_count, parse_byteranges, parse_content_range, get_name_from_url
 from .models.download_config import DownloadConfig
-from .models.data_models import Response
+from .models.data_models import Response, Timing
+from .models.progress import ProgressCounter
+from .models.hooks import DownloadHooks, CONNECT, DISK_WRITE, trace_chunks
+from .models.decompressor import DecompressingWriter, detect_encoding
+from .models.memory_budget import reserve_buffers
+from .models.cache_bypass import open_output
+from .models.transport import Transport, get_request_session, get_retry_strategy
 
 
-def download_actual(url: str, output_path: str, config: DownloadConfig, **kwargs) -> Response:
+def download_actual(url: str, output_path: str, config: DownloadConfig, progress: Optional[ProgressCounter] = None,
+                    hooks: Optional[DownloadHooks] = None,
+                    check_response: Optional[Callable[[requests.Response], None]] = None, decompress: bool = False,
+                    bypass_cache: bool = False, output_file: Optional[BinaryIO] = None, raw: bool = False,
+                    **kwargs) -> Response:
     """
     Download a file from a given URL and save it to the specified output path.
 
@@ -15,47 +28,244 @@ def download_actual(url: str, output_path: str, config: DownloadConfig, **kwargs
         url (str): The URL of the file to download.
         output_path (str): The path where the downloaded file will be saved.
         config (DownloadConfig): The download configuration object that holds the setup variables for this download.
-        **kwargs: Additional keyword arguments to pass to the requests.get function.
+        progress (Optional[ProgressCounter]): A counter to which the number of downloaded bytes is added.
+        hooks (Optional[DownloadHooks]): Hooks that are notified of the request, of each chunk read, and of each disk
+            write.
+        check_response (Optional[Callable[[requests.Response], None]]): A callable that inspects the response before
+            its body is read, and raises an exception to abandon the download.
+        decompress (bool): Indicates if a compressed response is decompressed as it is received, on a separate stage,
+            and only the decompressed bytes are saved.  The compression is found from the Content-Encoding header or
+            the extension of the url.
+        bypass_cache (bool): Indicates if the file is written with the config's cache bypass, so that it does not
+            fill the page cache.
+        output_file (Optional[BinaryIO]): An open file that the body is written to in place of the output path, which
+            is left open.
+        raw (bool): Indicates if the body is saved as it was sent, without decoding its Content-Encoding, such as for
+            a range of a multipart download, which is a range of the encoded body.
+        **kwargs: Additional keyword arguments to pass to the requests.get function, with the requests transport.
 
     Returns:
         Response: A response object containing useful information from the response returned by the get request made in
-        this method.
+        this method, including the timing of the transfer.
     """
-    session = get_request_session(config)
-    response = session.get(url, stream=True, timeout=config.timeout, headers=config.headers, **kwargs)
+    if hooks is None:
+        response = config.transport.get(url, config, headers=config.headers, **kwargs)
+    else:
+        response = get_traced(config.transport, url, config, hooks, **kwargs)
     if response.status_code != 200 and response.status_code != 206:
+        response.close()
         raise RequestFailedException(url, response.status_code, response.reason)
-    with open(output_path, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=config.chunk_size):
-            if chunk:
-                f.write(chunk)
-    return make_response(response)
+    if check_response is not None:
+        try:
+            check_response(response)
+        except Exception:
+            response.close()
+            raise
+    shard = config.metrics.shard() if config.metrics is not None else None
+    clock = time.perf_counter
+    received = 0
+    disk_write = 0.0
+    content_encoding = response.headers.get('content-encoding')
+    encoding = detect_encoding(get_name_from_url(url), content_encoding) if decompress else None
+    budget = config.memory_budget
+    # a decompressing writer holds its pending chunks and the chunk it is decompressing besides the chunk being read
+    pending = 8 if budget is None else 1
+    buffers = 1 if encoding is None else pending + 2
+    transfer_start = clock()
+    cache_bypass = config.cache_bypass if bypass_cache else None
+    output = open_output(output_path, cache_bypass) if output_file is None else nullcontext(output_file)
+    try:
+        with output as file, \
+                reserve_buffers(budget, config.chunk_size, buffers) as chunk_size:
+            if raw or (encoding is not None and content_encoding):
+                # the body is read undecoded so that it is decoded on the decompression stage
+                chunks = response.raw.stream(chunk_size, decode_content=False)
+            else:
+                chunks = response.iter_content(chunk_size=chunk_size)
+            if hooks is not None:
+                chunks = trace_chunks(chunks, hooks, url)
+            writer = DecompressingWriter(file, encoding, pending) if encoding is not None else nullcontext(file)
+            with writer as f:
+                for chunk in chunks:
+                    if chunk:
+                        length = len(chunk)
+                        context = hooks.start(DISK_WRITE, url, bytes=length) if hooks is not None else None
+                        write_start = clock()
+                        f.write(chunk)
+                        disk_write += clock() - write_start
+                        if hooks is not None:
+                            hooks.end(DISK_WRITE, url, context)
+                        received += length
+                        if shard is not None:
+                            shard.bytes_received += length
+                        if progress is not None:
+                            progress.done += length
+    except BaseException:
+        # the connection of a body that was not read to the end is not reused
+        response.close()
+        raise
+    timing = Timing(
+        ttfb=response.elapsed.total_seconds(),
+        transfer=clock() - transfer_start,
+        disk_write=disk_write,
+        bytes_received=received,
+        retries=get_retry_count(response),
+    )
+    return make_response(response, output_path, timing)
 
 
-def get_request_session(config: DownloadConfig) -> requests.Session:
+def get_traced(transport: Transport, url: str, config: DownloadConfig, hooks: DownloadHooks,
+               **kwargs) -> requests.Response:
+    """
+    Makes the streamed download request with the supplied transport, reporting it to the supplied hooks as a connect
+    event.
     """
-    Configures the session that will be used to make requests.
+    headers = config.headers
+    context = hooks.start(CONNECT, url, headers=headers)
+    try:
+        response = transport.get(url, config, headers=headers, **kwargs)
+    except Exception as e:
+        hooks.end(CONNECT, url, context, error=e)
+        raise
+    hooks.end(CONNECT, url, context, status_code=response.status_code)
+    return response
+
+
+def fetch_range(session: requests.Session, url: str, start: int, end: int, config: DownloadConfig,
+                etag: Optional[str] = None, body: Optional[BinaryIO] = None) -> bytes:
+    """
+    Fetches a single byte range of a file into memory.
 
     Args:
-        config (DownloadConfig): The download configuration object that holds the setup variables for this download.:
+        session (requests.Session): The session used to make the request, as returned from get_request_session.
+        url (str): The url of the file.
+        start (int): The first byte of the range.
+        end (int): The last byte of the range.
+        config (DownloadConfig): The download configuration object that holds the setup variables for this download.
+        etag (Optional[str]): The ETag of the file when it was first opened.  When supplied, the range is only served
+            if the file has not changed since.
+        body (Optional[BinaryIO]): A writable file that the whole body is copied into if the server ignores the range
+            and answers with the whole file, so that later reads can be served from it.
+
+    Returns:
+        bytes: The bytes of the range.  Fewer bytes are returned if the range extends past the end of the file.  If the
+            server ignores the range and answers with the whole file, only the body up to the end of the range is read,
+            unless a body file is supplied.
+
+    Raises:
+        RequestFailedException: If the request fails, or if the file has changed since the supplied ETag was read.
     """
-    session = requests.Session()
-    retry_strategy = get_retry_strategy(config)
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session
+    headers = config.get_headers(range=f'bytes={start}-{end}')
+    if etag is not None and not etag.startswith('W/'):
+        headers['If-Range'] = etag
+    response = session.get(url, stream=True, timeout=config.timeout, headers=headers)
+    with response:
+        if response.status_code == 206:
+            if config.metrics is not None:
+                config.metrics.add_bytes(len(response.content))
+            return response.content
+        if response.status_code == 200:
+            if etag is not None and response.headers.get('etag') not in (None, etag):
+                raise RequestFailedException(url, response.status_code, 'The file has changed since it was opened')
+            return read_spans(response, [(start, end)], config, body)[0]
+    raise RequestFailedException(url, response.status_code, response.reason)
 
 
-def get_retry_strategy(config: DownloadConfig) -> Retry:
+def fetch_spans(session: requests.Session, url: str, spans: list, config: DownloadConfig) -> list:
     """
-    Configures the retry strategy used by a request session.
+    Fetches several byte ranges of a file from a server that does not support range requests, in a single request for
+    the whole file whose body is only read up to the end of the last range.
+
     Args:
-        config (DownloadConfig): The download configuration object that holds the setup variables for this download.:
+        session (requests.Session): The session used to make the request, as returned from get_request_session.
+        url (str): The url of the file.
+        spans (list[tuple]): The first and last byte of each range.
+        config (DownloadConfig): The download configuration object that holds the setup variables for this download.
+
+    Returns:
+        list[bytes]: The bytes of each range, in the order the ranges were supplied.  Fewer bytes are returned for a
+            range that extends past the end of the file.
+
+    Raises:
+        RequestFailedException: If the request fails.
     """
-    return Retry(
-        total=config.retries,
-        status_forcelist=config.retry_status_codes,
-        backoff_factor=config.backoff_factor,
-        allowed_methods=['HEAD', 'GET']
-    )
+    response = session.get(url, stream=True, timeout=config.timeout, headers=config.headers)
+    with response:
+        if response.status_code != 200:
+            raise RequestFailedException(url, response.status_code, response.reason)
+        return read_spans(response, spans, config)
+
+
+def read_spans(response: requests.Response, spans: list, config: DownloadConfig,
+               body: Optional[BinaryIO] = None) -> list:
+    """
+    Reads byte ranges from the streamed body of a response that holds the whole file, in a single pass that stops once
+    the last range has been read.
+
+    Args:
+        response (requests.Response): A streamed response whose body is the whole file.
+        spans (list[tuple]): The first and last byte of each range.
+        config (DownloadConfig): The config whose chunk size the body is read in, and whose metrics record the bytes.
+        body (Optional[BinaryIO]): A writable file that the whole body is copied into, in which case the body is read
+            to its end.
+
+    Returns:
+        list[bytes]: The bytes of each range, in the order the ranges were supplied.
+    """
+    parts = [bytearray() for _ in spans]
+    last = max((end for _, end in spans), default=-1)
+    offset = 0
+    for chunk in response.iter_content(config.chunk_size):
+        chunk_end = offset + len(chunk)
+        for part, (start, end) in zip(parts, spans):
+            if start < chunk_end and end >= offset:
+                part += chunk[max(start - offset, 0):end - offset + 1]
+        offset = chunk_end
+        if body is not None:
+            body.write(chunk)
+        elif offset > last:
+            break
+    if config.metrics is not None:
+        config.metrics.add_bytes(offset)
+    return [bytes(part) for part in parts]
+
+
+def fetch_ranges(session: requests.Session, url: str, ranges: list, config: DownloadConfig) -> Optional[list]:
+    """
+    Fetches several byte ranges of a file in a single request.  Servers that support it answer with a
+    multipart/byteranges body, while others may answer with a single range covering all those requested.
+
+    Args:
+        session (requests.Session): The session used to make the request, as returned from get_request_session.
+        url (str): The url of the file.
+        ranges (list[tuple]): The first and last byte of each range.
+        config (DownloadConfig): The download configuration object that holds the setup variables for this download.
+
+    Returns:
+        Optional[list[tuple]]: The first byte, data, and size of the whole file (None if unknown) of each returned part,
+            or None if the server ignored the range request and would have returned the whole file, in which case the
+            body is not read.
+
+    Raises:
+        RequestFailedException: If the request fails.
+    """
+    spec = ','.join(f'{start}-{end}' for start, end in ranges)
+    response = session.get(url, stream=True, timeout=config.timeout, headers=config.get_headers(range=f'bytes={spec}'))
+    with response:
+        if response.status_code == 200:
+            return None
+        if response.status_code != 206:
+            raise RequestFailedException(url, response.status_code, response.reason)
+        content = response.content
+        if config.metrics is not None:
+            config.metrics.add_bytes(len(content))
+        content_type = response.headers.get('content-type', '')
+        if content_type.lower().startswith('multipart/byteranges'):
+            try:
+                return parse_byteranges(content_type, content)
+            except ValueError as e:
+                raise RequestFailedException(url, response.status_code, str(e))
+        content_range = parse_content_range(response.headers.get('content-range'))
+        if content_range is None:
+            raise RequestFailedException(url, response.status_code, 'Partial response has no Content-Range')
+        return [(content_range[0], content, content_range[2])]
@@ -1,22 +1,30 @@
 import os
+import time
 import logging
 import requests
+from typing import Optional, Sequence
 
 from .models.download_config import DownloadConfig
 from .exceptions import RequestFailedException
 from .core import download_actual
-from .utils import get_output, get_name_from_url
-from .models.data_models import Response
+from .utils import get_output, get_name_from_url, get_host, make_response
+from .models.data_models import HeadResult, Response, Timing
 from .models.multi_part_downloader import MultiPartDownloader
+from .models.decompressor import detect_encoding, strip_extension
+from .models.archive_extractor import ArchiveExtractor, archive_encoding
+from .models.hooks import DownloadHooks, DOWNLOAD, HEAD, select_hooks
+from .models.circuit_breaker import get_origin
 
 
 logger = logging.getLogger(__name__)
 
 
-def _download(url: str, output_path: str, config: DownloadConfig) -> Response:
+def _download(url: str, output_path: str, config: DownloadConfig, mirrors: Sequence[str] = (),
+              head: Optional[HeadResult] = None) -> Response:
     """
     Downloads a file from the given URL to the specified output path based on the provided configuration.
-    If the file size exceeds the threshold defined in the configuration, it uses the MultiPartDownloader.
+    If the file size exceeds the threshold defined in the configuration and the server accepts range requests, it uses
+    the MultiPartDownloader.
 
     Args:
         url (str): The URL of the file to download.
@@ -24,26 +32,274 @@ def _download(url: str, output_path: str, config: DownloadConfig) -> Response:
             the file name is taken from the server.  If the server does not provide the file name, the basename  of the
             url is used.
         config (dict): The DownloadConfig object containing download configuration settings.
+        mirrors (Sequence[str]): The urls of the same file on other mirrors, which the parts of a multipart download
+            are spread across.
+        head (Optional[HeadResult]): The HEAD response for the url, if it was already resolved, in which case the HEAD
+            request is not made again.
     """
-    response = requests.head(url, timeout=config.timeout)
+    hooks = select_hooks(config, url) if config.hooks is not None else None
+    if hooks is not None:
+        return _download_traced(url, output_path, config, hooks, mirrors, head)
+    if config.metrics is None:
+        return _download_file(url, output_path, config, mirrors=mirrors, head=head)
+    return _download_measured(url, output_path, config, mirrors=mirrors, head=head)
+
+
+def _download_traced(url: str, output_path: str, config: DownloadConfig, hooks: DownloadHooks,
+                     mirrors: Sequence[str] = (), head: Optional[HeadResult] = None) -> Response:
+    """
+    Downloads a file as _download does, reporting the download to the supplied hooks.
+    """
+    context = hooks.start(DOWNLOAD, url, output_path=output_path)
+    try:
+        if config.metrics is None:
+            response = _download_file(url, output_path, config, hooks, mirrors, head)
+        else:
+            response = _download_measured(url, output_path, config, hooks, mirrors, head)
+    except Exception as e:
+        hooks.end(DOWNLOAD, url, context, error=e)
+        raise
+    hooks.end(DOWNLOAD, url, context)
+    return response
+
+
+def _download_measured(url: str, output_path: str, config: DownloadConfig, hooks: Optional[DownloadHooks] = None,
+                       mirrors: Sequence[str] = (), head: Optional[HeadResult] = None) -> Response:
+    """
+    Downloads a file as _download_file does, recording the outcome and timing of the download in the config's metrics
+    registry.
+    """
+    metrics = config.metrics
+    host = get_host(url)
+    metrics.increment('downloads_started', host)
+    start = time.perf_counter()
+    try:
+        response = _download_file(url, output_path, config, hooks, mirrors, head)
+    except Exception:
+        metrics.increment('downloads_failed', host)
+        raise
+    metrics.increment('downloads_completed', host)
+    metrics.observe('download_seconds', time.perf_counter() - start)
+    timing = response.timing
+    metrics.observe('head_seconds', timing.head)
+    if timing.ttfb:
+        metrics.observe('ttfb_seconds', timing.ttfb)
+    if timing.retries:
+        metrics.increment('retries', host, timing.retries)
+    return response
+
+
+def _download_file(url: str, output_path: str, config: DownloadConfig, hooks: Optional[DownloadHooks] = None,
+                   mirrors: Sequence[str] = (), head: Optional[HeadResult] = None) -> Response:
+    """
+    Makes the HEAD request for the url, then downloads the file in one or multiple parts as described in _download.
+    If the config has a circuit breaker, the download fails at once while the circuit of the url's host is open.
+    """
+    breaker = config.circuit_breaker
+    if breaker is None:
+        return _download_checked(url, output_path, config, hooks, mirrors, head)
+    origin = get_origin(url)
+    # a resolved HEAD response was checked with the breaker when it was resolved
+    if head is None:
+        breaker.check(url, origin)
+    response = _download_checked(url, output_path, config, hooks, mirrors, head)
+    breaker.record_success(origin)
+    return response
+
+
+def _resolve_head(url: str, config: DownloadConfig, hooks: Optional[DownloadHooks] = None) -> HeadResult:
+    """
+    Makes the HEAD request for the url, recording its outcome with the config's circuit breaker.
+
+    Args:
+        url (str): The url of the file.
+        config (DownloadConfig): The config whose transport makes the request.
+        hooks (Optional[DownloadHooks]): The hooks the request is reported to, if the download is sampled.
+
+    Returns:
+        HeadResult: The HEAD response and the time it took.
+
+    Raises:
+        RequestFailedException: If the response status is not 200.
+    """
+    breaker = config.circuit_breaker
+    head_start = time.perf_counter()
+    try:
+        if hooks is None:
+            response = config.transport.head(url, config)
+        else:
+            response = _head_traced(url, config, hooks)
+    except Exception:
+        if breaker is not None:
+            breaker.record_failure(get_origin(url))
+        raise
+    head_time = time.perf_counter() - head_start
     if response.status_code != 200:
+        if breaker is not None:
+            breaker.record_status(get_origin(url), response.status_code, config.retry_status_codes)
         raise RequestFailedException(url=url, status_code=response.status_code, message=response.reason)
     logger.debug(f'Request to {url} successful')
+    return HeadResult(response, head_time)
+
+
+def _download_checked(url: str, output_path: str, config: DownloadConfig, hooks: Optional[DownloadHooks] = None,
+                      mirrors: Sequence[str] = (), head: Optional[HeadResult] = None) -> Response:
+    """
+    Makes the HEAD request for the url, unless its response is supplied, then downloads the file in one or multiple
+    parts as described in _download.  The outcome of the HEAD request is recorded with the config's circuit breaker,
+    while failed attempts of the download requests are recorded by their retry strategy.
+    """
+    if head is None:
+        head = _resolve_head(url, config, hooks)
+    response, head_time = head
+    if config.extract:
+        result = _extract_file(url, output_path, config, response)
+        return result._replace(timing=result.timing._replace(head=head_time))
     dir_path, name = get_output(output_path)
     if not name:
         name = get_name_from_url(url)
+        if config.decompress and detect_encoding(name, response.headers.get('content-encoding')) is not None:
+            name = strip_extension(name)
         logger.debug(f'Name taken from url: {name}')
     output = str(os.path.join(dir_path, name))
     size = int(response.headers.get('content-length', 0))
     logger.debug(f'{url} file size: {size} bytes')
-    if size > config.size_threshold:
-        logger.debug(f'File size exceeds threshold of {config.size_threshold}, multi-part downloader is being used')
-        multi_part_downloader = MultiPartDownloader(url, output, file_size=size, config=config)
-        multi_part_downloader.run()
-    else:
-        logger.debug(f'File size under threshold of {config.size_threshold}, downloading file in one part')
-        return download_actual(
-            url=url,
-            output_path=output,
-            config=config
-        )
+    accept_ranges = response.headers.get('accept-ranges', '').lower() == 'bytes'
+    if config.segment_sink is not None and size <= config.size_threshold:
+        result = _store_in_segment(url, output, size, config, hooks)
+        return result._replace(timing=result.timing._replace(head=head_time))
+    progress = config.progress.start_file(url, output, size) if config.progress is not None else None
+    publisher = config.publisher
+    # with a publisher, the file is written to a temporary path and published at the output path once complete
+    target = publisher.temp_path(output) if publisher is not None else output
+    cache_key = None
+    # decompressed files are not cached, as the cache holds files as they are served
+    if config.cache is not None and not config.decompress:
+        cache_key = config.cache.make_key(url, response.headers)
+        if cache_key is not None and config.cache.materialize(cache_key, target):
+            logger.debug(f'{url} served from download cache')
+            if publisher is not None:
+                publisher.publish(target, output)
+            if progress is not None:
+                progress.done = size
+                progress.finish()
+            return make_response(response, output, Timing(head=head_time))
+    try:
+        if size > config.size_threshold and accept_ranges:
+            logger.debug(f'File size exceeds threshold of {config.size_threshold}, multi-part downloader is being used')
+            multi_part_downloader = MultiPartDownloader(
+                url,
+                target,
+                file_size=size,
+                config=config,
+                progress=progress,
+                hooks=hooks,
+                mirrors=mirrors,
+                etag=response.headers.get('etag'),
+                content_encoding=response.headers.get('content-encoding'),
+            )
+            multi_part_downloader.run()
+            joined_size = os.path.getsize(target)
+            # a decoded file is not the size served
+            if multi_part_downloader.join_encoding is None and joined_size != size:
+                raise RequestFailedException(
+                    url, response.status_code, f'Joined file is {joined_size} bytes, expected {size} bytes'
+                )
+            result = make_response(response, target, multi_part_downloader.timing)
+        else:
+            if size > config.size_threshold:
+                logger.debug(f'{url} does not accept range requests, downloading file in one part')
+            else:
+                logger.debug(f'File size under threshold of {config.size_threshold}, downloading file in one part')
+            result = download_actual(
+                url=url,
+                output_path=target,
+                config=config,
+                progress=progress,
+                hooks=hooks,
+                decompress=config.decompress,
+                bypass_cache=config.cache_bypass is not None and config.cache_bypass.applies(size),
+            )
+        if publisher is not None:
+            publisher.publish(target, output)
+            result = result._replace(output_path=output)
+    except Exception:
+        if publisher is not None:
+            publisher.discard(target, output)
+        if progress is not None:
+            progress.finish(failed=True)
+        raise
+    if progress is not None:
+        progress.finish()
+    if cache_key is not None and (size == 0 or os.path.getsize(output) == size):
+        config.cache.store(cache_key, output)
+    return result._replace(timing=result.timing._replace(head=head_time))
+
+
+def _store_in_segment(url: str, output_path: str, size: int, config: DownloadConfig,
+                      hooks: Optional[DownloadHooks] = None) -> Response:
+    """
+    Streams the file at the url onto the end of a segment file of the config's segment sink, in place of writing it to
+    the output path, which is only used to report progress.
+    """
+    progress = config.progress.start_file(url, output_path, size) if config.progress is not None else None
+    try:
+        with config.segment_sink.store(url) as item:
+            result = download_actual(
+                url=url,
+                output_path=item.path,
+                config=config,
+                progress=progress,
+                hooks=hooks,
+                decompress=config.decompress,
+                output_file=item,
+            )
+    except Exception:
+        if progress is not None:
+            progress.finish(failed=True)
+        raise
+    if progress is not None:
+        progress.finish()
+    return result._replace(segment=item.entry)
+
+
+def _extract_file(url: str, output_path: str, config: DownloadConfig, response: requests.Response) -> Response:
+    """
+    Extracts the archive at the url into the output path, used as a directory, as it is downloaded.
+    """
+    size = int(response.headers.get('content-length', 0))
+    progress = config.progress.start_file(url, output_path, size) if config.progress is not None else None
+    extractor = ArchiveExtractor(
+        url,
+        output_path,
+        config,
+        file_size=size,
+        accept_ranges=response.headers.get('accept-ranges', '').lower() == 'bytes',
+        encoding=archive_encoding(get_name_from_url(url), response.headers.get('content-encoding')),
+        etag=response.headers.get('etag'),
+        progress=progress,
+    )
+    try:
+        timing = extractor.run()
+    except Exception:
+        if progress is not None:
+            progress.finish(failed=True)
+        raise
+    if progress is not None:
+        progress.finish()
+    logger.debug(f'Extracted {len(extractor.members)} members of {url} into {output_path}')
+    return make_response(response, output_path, timing)
+
+
+def _head_traced(url: str, config: DownloadConfig, hooks: DownloadHooks) -> requests.Response:
+    """
+    Makes the HEAD request for the url, reporting it to the supplied hooks.
+    """
+    context = hooks.start(HEAD, url)
+    try:
+        response = config.transport.head(url, config)
+    except Exception as e:
+        hooks.end(HEAD, url, context, error=e)
+        raise
+    hooks.end(HEAD, url, context, status_code=response.status_code)
+    return response
@@ -36,3 +36,71 @@ class OutputPathRequiredException(Exception):
     def __init__(self, *args):
         super().__init__(f'No output path supplied for download.  All downloads need at least a directory path in '
                          f'which to save downloaded files.', *args)
+
+
+class InconsistentMirrorException(Exception):
+
+    """
+    An exception raised when a mirror serves content that does not match the file being downloaded.
+
+    Attributes:
+        url (str): The url of the file on the mirror.
+        message (str): A description of the inconsistency.
+
+    Args:
+        url (str): The url of the file on the mirror.
+        message (str): A description of the inconsistency.
+        *args: Any additional arguments that should be shown to the user regarding the exception.
+    """
+
+    def __init__(self, url: str, message: str, *args):
+        self.url = url
+        self.message = message
+        super().__init__(f'Mirror {url} is inconsistent: {message}', *args)
+
+
+class UnsafeArchiveException(Exception):
+
+    """
+    An exception raised when an archive that is being extracted holds a member that would be written outside of the
+    destination directory, or that is not a regular file, directory, or link.
+
+    Attributes:
+        name (str): The name of the member in the archive.
+        message (str): The reason the member is unsafe.
+
+    Args:
+        name (str): The name of the member in the archive.
+        message (str): The reason the member is unsafe.
+        *args: Any additional arguments that should be shown to the user regarding the exception.
+    """
+
+    def __init__(self, name: str, message: str, *args):
+        self.name = name
+        self.message = message
+        super().__init__(f'Unsafe archive member {name}: {message}', *args)
+
+
+class CircuitOpenException(Exception):
+
+    """
+    An exception raised when a download is not started, or a request is not retried, because the circuit of its host
+    is open after the host failed too many times in a row.
+
+    Attributes:
+        url (str): The url that was not requested.
+        host (str): The host and port whose circuit is open.
+        retry_after (float): The number of seconds until trial downloads from the host are let through.
+
+    Args:
+        url (str): The url that was not requested.
+        host (str): The host and port whose circuit is open.
+        retry_after (float): The number of seconds until trial downloads from the host are let through.
+        *args: Any additional arguments that should be shown to the user regarding the exception.
+    """
+
+    def __init__(self, url: str, host: str, retry_after: float, *args):
+        self.url = url
+        self.host = host
+        self.retry_after = retry_after
+        super().__init__(f'Circuit for {host} is open, not requesting {url} for {retry_after:.1f}s', *args)
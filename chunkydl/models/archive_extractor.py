@@ -0,0 +1,428 @@
+import os
+import time
+import tarfile
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Thread
+from typing import Optional
+
+from .download_config import DownloadConfig
+from .data_models import Timing
+from .progress import FileCounter
+from .decompressor import DecompressingWriter, detect_encoding
+from .memory_budget import reserve_buffers
+from chunkydl.core import fetch_range, get_request_session
+from chunkydl.utils import get_retry_count
+from chunkydl.exceptions import RequestFailedException, UnsafeArchiveException
+
+
+logger = logging.getLogger(__name__)
+
+
+ARCHIVE_EXTENSIONS = {
+    '.tgz': 'gzip',
+    '.tbz2': 'bz2',
+    '.txz': 'xz',
+    '.tzst': 'zstd',
+}
+
+
+def archive_encoding(name: str, content_encoding: Optional[str] = None) -> Optional[str]:
+    """
+    Returns:
+        Optional[str]: The compression of a tar archive, found from the Content-Encoding header or the extension of the
+            archive's name, or None if it is not compressed.
+    """
+    encoding = ARCHIVE_EXTENSIONS.get(os.path.splitext(name)[1].lower())
+    if encoding is not None and not content_encoding:
+        return encoding
+    return detect_encoding(name, content_encoding)
+
+
+class StreamBuffer:
+
+    """
+    A bounded, in memory pipe of bytes between a thread that writes and a thread that reads.  Writes block while the
+    buffer is full and reads block while it is empty, until the writer closes the buffer.
+
+    Attributes:
+        max_size (int): The number of bytes that may be buffered before writes block.
+
+    Args:
+        max_size (int): The number of bytes that may be buffered before writes block.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max(int(max_size), 1)
+        self._chunks = deque()
+        self._offset = 0
+        self._size = 0
+        self._closed = False
+        self._aborted = False
+        self._condition = Condition()
+
+    def write(self, data: bytes) -> int:
+        """
+        Adds bytes to the buffer, waiting while it is full.
+
+        Raises:
+            BrokenPipeError: If the buffer was aborted.
+        """
+        with self._condition:
+            while self._size >= self.max_size and not self._aborted:
+                self._condition.wait()
+            if self._aborted:
+                raise BrokenPipeError('The stream buffer was aborted')
+            if data:
+                self._chunks.append(bytes(data))
+                self._size += len(data)
+                self._condition.notify_all()
+        return len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Returns:
+            bytes: Up to size bytes, waiting until some are available.  An empty result means the buffer was closed
+                and every byte has been read.
+
+        Raises:
+            BrokenPipeError: If the buffer was aborted.
+        """
+        with self._condition:
+            while not self._chunks and not self._closed and not self._aborted:
+                self._condition.wait()
+            if self._aborted:
+                raise BrokenPipeError('The stream buffer was aborted')
+            if not self._chunks:
+                return b''
+            head = self._chunks[0]
+            end = len(head) if size < 0 else min(len(head), self._offset + size)
+            chunk = head[self._offset:end]
+            # the rest of a partly read chunk is kept in place, as slicing it would copy it on every read
+            if end == len(head):
+                self._chunks.popleft()
+                self._offset = 0
+            else:
+                self._offset = end
+            self._size -= len(chunk)
+            self._condition.notify_all()
+            return chunk
+
+    def close(self) -> None:
+        """
+        Marks the end of the stream.  Buffered bytes may still be read.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def abort(self) -> None:
+        """
+        Discards the buffer and wakes both sides, which raise BrokenPipeError.
+        """
+        with self._condition:
+            self._aborted = True
+            self._chunks.clear()
+            self._offset = 0
+            self._size = 0
+            self._condition.notify_all()
+
+
+def check_member(member: tarfile.TarInfo, destination: str) -> None:
+    """
+    Checks that a member of an archive stays within the destination directory when extracted.
+
+    Raises:
+        UnsafeArchiveException: If the member has an absolute path, a path or link target outside of the destination,
+            or is a device or FIFO.
+    """
+    root = os.path.realpath(destination)
+    if os.path.isabs(member.name) or member.name.startswith(('/', '\\')):
+        raise UnsafeArchiveException(member.name, 'absolute path')
+    path = os.path.realpath(os.path.join(root, member.name))
+    if os.path.commonpath([root, path]) != root:
+        raise UnsafeArchiveException(member.name, 'path is outside of the destination')
+    if member.isdev():
+        raise UnsafeArchiveException(member.name, 'device or FIFO')
+    if member.issym() or member.islnk():
+        if os.path.isabs(member.linkname):
+            raise UnsafeArchiveException(member.name, 'link to an absolute path')
+        base = os.path.dirname(path) if member.issym() else root
+        target = os.path.realpath(os.path.join(base, member.linkname))
+        if os.path.commonpath([root, target]) != root:
+            raise UnsafeArchiveException(member.name, 'link target is outside of the destination')
+
+
+class ArchiveSink:
+
+    """
+    A writable sink that extracts a tar archive, optionally compressed, into a directory as its bytes are written.
+    The bytes pass through a bounded StreamBuffer to an extraction thread, after being decompressed on their own stage
+    if the archive is compressed, so the archive is never written to disk.  Every member is checked with check_member
+    before it is extracted, and is also extracted with the tarfile 'data' filter where it is available.
+
+    Attributes:
+        destination (str): The directory the archive is extracted into.
+        encoding (Optional[str]): The compression of the archive.
+        members (list[str]): The names of the members that have been extracted.
+        buffer (StreamBuffer): The buffer between the writer and the extraction thread.
+
+    Args:
+        destination (str): The directory the archive is extracted into.  It is made if it does not exist.
+        encoding (Optional[str]): The compression of the archive, or None if it is not compressed.
+        max_buffer (int): The number of decompressed bytes that may wait to be extracted before writes block.
+        max_pending (int): The number of writes that may wait to be decompressed before writes block.  Default is 8.
+    """
+
+    def __init__(self, destination: str, encoding: Optional[str] = None, max_buffer: int = 64 * 1024 * 1024,
+                 max_pending: int = 8):
+        self.destination = destination
+        self.encoding = encoding
+        self.members = []
+        self.buffer = StreamBuffer(max_buffer)
+        self._error = None
+        os.makedirs(destination, exist_ok=True)
+        self._writer = DecompressingWriter(self.buffer, encoding, max_pending) if encoding is not None \
+            else self.buffer
+        self._thread = Thread(target=self._extract, name='chunkydl-extract', daemon=True)
+        self._thread.start()
+
+    def write(self, data: bytes) -> int:
+        try:
+            return self._writer.write(data)
+        except Exception:
+            self.raise_error()
+            raise
+
+    def close(self) -> None:
+        """
+        Marks the end of the archive and waits for every member to be extracted.
+
+        Raises:
+            Exception: The error raised while decompressing or extracting the archive, if any.
+        """
+        try:
+            if self._writer is not self.buffer:
+                self._writer.close()
+            self.buffer.close()
+        except Exception:
+            self.raise_error()
+            raise
+        self._thread.join()
+        self.raise_error()
+
+    def abort(self) -> None:
+        """
+        Stops the extraction, leaving any members that were already extracted.
+        """
+        self.buffer.abort()
+        if self._writer is not self.buffer:
+            try:
+                self._writer.close()
+            except Exception:
+                pass
+        self._thread.join()
+
+    def raise_error(self) -> None:
+        """
+        Raises the error that stopped the extraction, if any, once the extraction thread has finished.
+        """
+        if self._error is not None:
+            self._thread.join()
+            raise self._error
+
+    def _extract(self) -> None:
+        try:
+            with tarfile.open(fileobj=self.buffer, mode='r|') as archive:
+                for member in archive:
+                    check_member(member, self.destination)
+                    if hasattr(tarfile, 'data_filter'):
+                        archive.extract(member, self.destination, filter='data')
+                    else:
+                        archive.extract(member, self.destination)
+                    self.members.append(member.name)
+            # the padding after the end of the archive is read so that the writer is never left blocked
+            while self.buffer.read(1024 * 1024):
+                pass
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            logger.error(f'Failed to extract archive into {self.destination}', exc_info=True)
+            self._error = e
+            self.buffer.abort()
+
+
+class ArchiveExtractor:
+
+    """
+    Downloads a tar archive and extracts it into a directory as it streams, without saving the archive.  Archives
+    larger than the config's size threshold, on servers that accept Range requests, are downloaded in parts on the
+    config's multipart threads.  Parts are kept in memory and handed to the extractor in order, so at most one part per
+    thread, sized to fit the config's extract buffer between them, is held while waiting for an earlier part.
+
+    If the config has a memory budget, two extract buffers are reserved from it for the whole extraction: one for the
+    buffer between the download and the extraction, and one for the parts or chunks in flight, including those waiting
+    to be decompressed.  Both are smaller than the extract buffer while the budget is nearly exhausted.
+
+    Attributes:
+        url (str): The url of the archive.
+        destination (str): The directory the archive is extracted into.
+        config (DownloadConfig): The download configuration object that holds the setup variables for this download.
+        file_size (int): The size of the archive, or 0 if it is unknown.
+        accept_ranges (bool): Indicates if the server accepts Range requests for the archive.
+        encoding (Optional[str]): The compression of the archive.
+        etag (Optional[str]): The ETag of the archive, which every part must match.
+        progress (Optional[FileCounter]): The counter to which the progress of the download is added.
+        members (list[str]): The names of the extracted members.
+        buffer_size (int): The number of bytes of the archive held in memory between the download and the extraction,
+            which is the config's extract buffer unless less could be reserved from its memory budget.
+
+    Args:
+        url (str): The url of the archive.
+        destination (str): The directory the archive is extracted into.
+        config (DownloadConfig): The download configuration object that holds the setup variables for this download.
+        file_size (int): The size of the archive, or 0 if it is unknown.
+        accept_ranges (bool): Indicates if the server accepts Range requests for the archive.
+        encoding (Optional[str]): The compression of the archive, or None if it is not compressed.
+        etag (Optional[str]): The ETag of the archive, as returned by the HEAD request.
+        progress (Optional[FileCounter]): The counter to which the progress of the download is added.
+    """
+
+    def __init__(self, url: str, destination: str, config: DownloadConfig, file_size: int = 0,
+                 accept_ranges: bool = False, encoding: Optional[str] = None, etag: Optional[str] = None,
+                 progress: Optional[FileCounter] = None):
+        self.url = url
+        self.destination = destination
+        self.config = config
+        self.file_size = file_size
+        self.accept_ranges = accept_ranges
+        self.encoding = encoding
+        self.etag = etag
+        self.progress = progress
+        self.members = []
+        self.buffer_size = int(config.extract_buffer)
+
+    @property
+    def part_size(self) -> int:
+        """
+        Returns:
+            int: The size of each part of a multipart extraction, so that the parts held by every thread fit in the
+                extract buffer.
+        """
+        in_flight = self.config.multipart_threads
+        if self.config.memory_budget is not None:
+            # a part waiting to be decompressed and the part being decompressed are also held
+            in_flight += 2
+        part_size = self.buffer_size // in_flight
+        return max(min(int(self.config.size_threshold), part_size), 1)
+
+    def run(self) -> Timing:
+        """
+        Downloads and extracts the archive.
+
+        Returns:
+            Timing: The timing of the download.
+
+        Raises:
+            UnsafeArchiveException: If a member of the archive would be extracted outside of the destination.
+            RequestFailedException: If a request for the archive fails.
+        """
+        budget = self.config.memory_budget
+        if budget is None:
+            return self.extract(ArchiveSink(self.destination, self.encoding, self.buffer_size))
+        with reserve_buffers(budget, self.config.extract_buffer, 2) as buffer_size:
+            self.buffer_size = buffer_size
+            return self.extract(ArchiveSink(self.destination, self.encoding, buffer_size, max_pending=1))
+
+    def extract(self, sink: ArchiveSink) -> Timing:
+        """
+        Downloads the archive into the supplied sink, in parts or in a single request.
+
+        Returns:
+            Timing: The timing of the download.
+        """
+        transfer_start = time.perf_counter()
+        try:
+            if self.accept_ranges and self.file_size > self.config.size_threshold:
+                timing = self.download_parts(sink)
+            else:
+                timing = self.download_stream(sink)
+        except Exception:
+            sink.abort()
+            sink.raise_error()
+            raise
+        sink.close()
+        self.members = sink.members
+        return timing._replace(transfer=time.perf_counter() - transfer_start)
+
+    def download_stream(self, sink: ArchiveSink) -> Timing:
+        """
+        Downloads the archive in a single request, writing each chunk to the sink as it arrives.
+        """
+        received = 0
+        # with a memory budget, the chunk being read, the chunk waiting to be decompressed, and the chunk being
+        # decompressed share the buffer reserved for the data in flight
+        chunk_size = self.config.chunk_size if self.config.memory_budget is None else \
+            max(min(int(self.config.chunk_size), self.buffer_size // 3), 1)
+        with get_request_session(self.config) as session:
+            response = session.get(self.url, stream=True, timeout=self.config.timeout, headers=self.config.headers)
+            with response:
+                if response.status_code != 200:
+                    raise RequestFailedException(self.url, response.status_code, response.reason)
+                if self.encoding is not None and response.headers.get('content-encoding'):
+                    chunks = response.raw.stream(chunk_size, decode_content=False)
+                else:
+                    chunks = response.iter_content(chunk_size=chunk_size)
+                for chunk in chunks:
+                    if chunk:
+                        sink.write(chunk)
+                        received += len(chunk)
+                        self._add_progress(len(chunk))
+                if self.config.metrics is not None:
+                    self.config.metrics.add_bytes(received)
+                return Timing(ttfb=response.elapsed.total_seconds(), bytes_received=received,
+                              retries=get_retry_count(response))
+
+    def download_parts(self, sink: ArchiveSink) -> Timing:
+        """
+        Downloads the archive in parts on the config's multipart threads, writing each part to the sink in order.  The
+        next part is only started once the part before it has been written, so that no more parts are held than there
+        are threads, as part_size assumes.
+        """
+        part_size = self.part_size
+        starts = iter(range(0, self.file_size, part_size))
+        received = 0
+        pending = deque()
+        with get_request_session(self.config) as session, \
+                ThreadPoolExecutor(self.config.multipart_threads) as executor:
+            try:
+                for start in starts:
+                    pending.append(executor.submit(self._fetch_part, session, start, part_size))
+                    if len(pending) >= self.config.multipart_threads:
+                        break
+                while pending:
+                    data = pending.popleft().result()
+                    sink.write(data)
+                    received += len(data)
+                    self._add_progress(len(data))
+                    # the written part is released before the next part is fetched in its place
+                    data = None
+                    start = next(starts, None)
+                    if start is not None:
+                        pending.append(executor.submit(self._fetch_part, session, start, part_size))
+            finally:
+                for future in pending:
+                    future.cancel()
+        return Timing(bytes_received=received)
+
+    def _fetch_part(self, session, start: int, part_size: int) -> bytes:
+        end = min(start + part_size, self.file_size) - 1
+        data = fetch_range(session, self.url, start, end, self.config, self.etag)
+        if len(data) != end - start + 1:
+            raise RequestFailedException(self.url, 206, f'Expected {end - start + 1} bytes but received {len(data)}')
+        return data
+
+    def _add_progress(self, length: int) -> None:
+        if self.progress is not None:
+            self.progress.done += length
@@ -0,0 +1,146 @@
+import os
+import json
+import hashlib
+from typing import BinaryIO, Iterator, Optional, Sequence, Union
+
+from .download_config import DownloadConfig
+from .size import Size
+from chunkydl.core import get_request_session
+from chunkydl.exceptions import RequestFailedException
+
+
+class BlockMap:
+
+    """
+    A map of the checksum of each fixed size block of a file, which is used to find the blocks of an older copy of the
+    file that still match, so that only the blocks that changed need to be downloaded.  Block maps are published next
+    to the file they describe, and are stored as JSON.  A block map can be made for a file by running:
+
+        python -m chunkydl blockmap path/to/file [--block-size 1mb] [--output path/to/file.blockmap]
+
+    Attributes:
+        size (int): The size of the file, in bytes.
+        block_size (int): The size of each block, in bytes.  The last block may be shorter.
+        hashes (list[str]): The hex digest of each block, in order.
+        algorithm (str): The name of the hashlib algorithm used for each digest.
+
+    Args:
+        size (int): The size of the file, in bytes.
+        block_size (int): The size of each block, in bytes.
+        hashes (Sequence[str]): The hex digest of each block, in order.
+        algorithm (str): The name of the hashlib algorithm used for each digest.  Default is sha256.
+    """
+
+    VERSION = 1
+
+    def __init__(self, size: int, block_size: int, hashes: Sequence[str], algorithm: str = 'sha256'):
+        self.size = int(size)
+        self.block_size = int(block_size)
+        self.hashes = list(hashes)
+        self.algorithm = algorithm
+        expected = -(-self.size // self.block_size) if self.block_size > 0 else -1
+        if len(self.hashes) != expected:
+            raise ValueError(f'A block map of {self.size} bytes in blocks of {self.block_size} bytes has {expected} '
+                             f'blocks, not {len(self.hashes)}')
+
+    @property
+    def block_count(self) -> int:
+        return len(self.hashes)
+
+    def block_range(self, index: int) -> tuple:
+        """
+        Returns:
+            tuple: The first and last byte of the block at the supplied index.
+        """
+        start = index * self.block_size
+        return start, min(start + self.block_size, self.size) - 1
+
+    @classmethod
+    def from_file(cls, path: str, block_size: int = Size('1mb'), algorithm: str = 'sha256') -> 'BlockMap':
+        """
+        Makes the block map of a local file.
+
+        Args:
+            path (str): The path of the file.
+            block_size (int): The size of each block.  Default is 1MB.
+            algorithm (str): The name of the hashlib algorithm used for each digest.  Default is sha256.
+
+        Returns:
+            BlockMap: The block map of the file.
+        """
+        block_size = int(Size(block_size))
+        with open(path, 'rb') as file:
+            hashes = list(hash_blocks(file, block_size, algorithm))
+        return cls(os.path.getsize(path), block_size, hashes, algorithm)
+
+    @classmethod
+    def loads(cls, data: Union[str, bytes]) -> 'BlockMap':
+        """
+        Reads a block map from its JSON form.
+
+        Raises:
+            ValueError: If the data is not a block map of a supported version.
+        """
+        document = json.loads(data)
+        if not isinstance(document, dict) or document.get('version') != cls.VERSION:
+            raise ValueError('Unsupported block map')
+        return cls(document['size'], document['block_size'], document['hashes'], document['algorithm'])
+
+    @classmethod
+    def load(cls, path: str) -> 'BlockMap':
+        """
+        Reads a block map from a file.
+        """
+        with open(path, 'rb') as file:
+            return cls.loads(file.read())
+
+    @classmethod
+    def fetch(cls, url: str, config: Optional[DownloadConfig] = None) -> 'BlockMap':
+        """
+        Downloads a published block map.
+
+        Raises:
+            RequestFailedException: If the block map could not be downloaded.
+        """
+        config = config or DownloadConfig()
+        with get_request_session(config) as session:
+            response = session.get(url, timeout=config.timeout, headers=config.headers)
+        if response.status_code != 200:
+            raise RequestFailedException(url, response.status_code, response.reason)
+        return cls.loads(response.content)
+
+    def dumps(self) -> str:
+        return json.dumps({
+            'version': self.VERSION,
+            'size': self.size,
+            'block_size': self.block_size,
+            'algorithm': self.algorithm,
+            'hashes': self.hashes,
+        })
+
+    def save(self, path: str) -> None:
+        with open(path, 'w') as file:
+            file.write(self.dumps())
+
+    def __repr__(self) -> str:
+        return f'<BlockMap size={self.size} block_size={self.block_size} blocks={self.block_count}>'
+
+
+def hash_blocks(file: BinaryIO, block_size: int, algorithm: str = 'sha256') -> Iterator[str]:
+    """
+    Reads an open file from its current position to its end, yielding the hex digest of each block.
+
+    Args:
+        file (BinaryIO): A file open for reading in binary mode.
+        block_size (int): The size of each block.
+        algorithm (str): The name of the hashlib algorithm used for each digest.
+
+    Yields:
+        str: The hex digest of each block, in order.
+    """
+    while True:
+        data = file.read(block_size)
+        if not data:
+            return
+        yield hashlib.new(algorithm, data).hexdigest()
+
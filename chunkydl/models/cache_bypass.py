@@ -0,0 +1,298 @@
+import os
+import io
+import mmap
+import errno
+import logging
+from typing import BinaryIO, Optional, Union
+
+
+logger = logging.getLogger(__name__)
+
+IO_MODES = ('buffered', 'fadvise', 'direct')
+DIRECT_ALIGNMENT = 4096
+
+
+def drop_cache(fd: int, offset: int = 0, length: int = 0) -> bool:
+    """
+    Advises the operating system that a range of a file will not be read again, so that its clean pages are dropped
+    from the page cache and writeback of its dirty pages is started.  A length of 0 extends the range to the end of the
+    file.
+
+    Returns:
+        bool: True if the advice was given, or False on platforms without posix_fadvise.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    try:
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        return False
+    return True
+
+
+class CacheBypassWriter:
+
+    """
+    A file opened for writing that keeps large downloads from evicting the page cache used by other processes.  It is
+    written as any binary file, in one of two modes:
+        - 'fadvise': Writes are buffered as usual, but after every window of bytes written the file is flushed and
+            advised as not needed, so that writeback of the new window starts and the earlier windows, once written
+            back, are dropped from the page cache.  When the file is closed, it is synced and advised again, so that
+            none of it is left in the cache.
+        - 'direct': Writes are gathered in an aligned buffer of one window and written with O_DIRECT, so that they
+            never enter the page cache.  The final partial block is padded and the file truncated to its length.  If the
+            file system does not support O_DIRECT, the writer falls back to the 'fadvise' mode.
+
+    Seeking is supported in the 'fadvise' mode only.
+
+    Attributes:
+        path (str): The path of the file.
+        mode (str): The mode in use, which is 'fadvise' once a 'direct' writer has fallen back.
+        window (int): The number of bytes written between each advice, or the size of the aligned buffer.
+
+    Args:
+        path (str): The path of the file.
+        mode (str): Either 'fadvise' or 'direct'.
+        window (int): The number of bytes written between each advice, or the size of the aligned buffer, which is
+            rounded up to a multiple of DIRECT_ALIGNMENT.
+        file_mode (str): The mode the file is opened with, either 'wb' or 'r+b'.  Files opened with 'r+b' are written
+            in the 'fadvise' mode.
+    """
+
+    def __init__(self, path: str, mode: str = 'fadvise', window: int = 8 * 1024 * 1024, file_mode: str = 'wb'):
+        if mode not in ('fadvise', 'direct'):
+            raise ValueError(f'Unknown cache bypass mode: {mode}')
+        self.path = path
+        self.window = -(-int(window) // DIRECT_ALIGNMENT) * DIRECT_ALIGNMENT
+        self.mode = mode if file_mode == 'wb' else 'fadvise'
+        self._file = None
+        self._fd = None
+        self._buffer = None
+        self._filled = 0
+        self._position = 0
+        self._window_start = 0
+        if self.mode == 'direct':
+            self._open_direct()
+        if self.mode == 'fadvise':
+            self._file = open(path, file_mode)
+
+    def _open_direct(self) -> None:
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_DIRECT', 0)
+        if flags & getattr(os, 'O_DIRECT', 0) == 0:
+            logger.debug('O_DIRECT is not supported on this platform, falling back to fadvise')
+            self.mode = 'fadvise'
+            return
+        try:
+            self._fd = os.open(self.path, flags, 0o666)
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+            logger.debug(f'O_DIRECT is not supported for {self.path}, falling back to fadvise')
+            self.mode = 'fadvise'
+            return
+        # anonymous maps are page aligned, as O_DIRECT requires of its buffers
+        self._buffer = mmap.mmap(-1, self.window)
+
+    def _fall_back(self) -> None:
+        """
+        Reopens a file that rejected an O_DIRECT write without O_DIRECT, at the position written so far.
+        """
+        logger.debug(f'O_DIRECT write to {self.path} failed, falling back to fadvise')
+        os.close(self._fd)
+        self._fd = None
+        self.mode = 'fadvise'
+        self._file = open(self.path, 'r+b')
+        self._file.seek(self._position)
+        self._file.truncate()
+        buffer, self._buffer = self._buffer, None
+        self._window_start = self._position
+        filled, self._filled = self._filled, 0
+        self.write(buffer[:filled])
+        buffer.close()
+
+    def _write_direct(self, length: int) -> bool:
+        """
+        Writes the first length bytes of the aligned buffer with O_DIRECT.
+
+        Returns:
+            bool: False if the file system rejected the write, before any of it was written.
+        """
+        written = 0
+        with memoryview(self._buffer) as view:
+            try:
+                while written < length:
+                    written += os.write(self._fd, view[written:length])
+            except OSError as e:
+                if e.errno != errno.EINVAL or written:
+                    raise
+                return False
+            finally:
+                self._position += written
+        return True
+
+    def write(self, data: Union[bytes, bytearray, memoryview]) -> int:
+        """
+        Writes the supplied bytes to the file.
+
+        Returns:
+            int: The number of bytes written.
+        """
+        length = len(data)
+        if self.mode == 'fadvise':
+            self._file.write(data)
+            self._position += length
+            if self._position - self._window_start >= self.window:
+                self._advise()
+            return length
+        view = memoryview(data).cast('B')
+        while view:
+            count = min(len(view), self.window - self._filled)
+            self._buffer[self._filled:self._filled + count] = view[:count]
+            self._filled += count
+            view = view[count:]
+            if self._filled == self.window:
+                if not self._write_direct(self.window):
+                    self._fall_back()
+                    self.write(view)
+                    return length
+                self._filled = 0
+        return length
+
+    def _advise(self) -> None:
+        """
+        Flushes the file and advises all of it as not needed.  Pages that are still being written back are left in the
+        cache by each advice, so the whole file is advised each time rather than only the last window, which costs
+        little as pages that are not cached are skipped.
+        """
+        self._file.flush()
+        drop_cache(self._file.fileno())
+        self._window_start = self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """
+        Moves the write cursor, in the 'fadvise' mode.
+
+        Returns:
+            int: The new position of the cursor.
+        """
+        if self.mode != 'fadvise':
+            raise io.UnsupportedOperation('seek is not supported with O_DIRECT writes')
+        self._advise()
+        self._position = self._file.seek(offset, whence)
+        self._window_start = self._position
+        return self._position
+
+    def tell(self) -> int:
+        return self._position + self._filled
+
+    def truncate(self, size: Optional[int] = None) -> int:
+        """
+        Truncates the file, in the 'fadvise' mode.
+        """
+        if self.mode != 'fadvise':
+            raise io.UnsupportedOperation('truncate is not supported with O_DIRECT writes')
+        return self._file.truncate(size)
+
+    def flush(self) -> None:
+        """
+        Flushes buffered bytes to the operating system in the 'fadvise' mode.  Bytes held in the aligned buffer of the
+        'direct' mode are only written once a block is full, or when the file is closed.
+        """
+        if self._file is not None:
+            self._file.flush()
+
+    @property
+    def closed(self) -> bool:
+        return self._file is None and self._fd is None
+
+    def close(self) -> None:
+        """
+        Writes any remaining bytes, advises the whole file as not needed, and closes the file.
+        """
+        if self._file is not None:
+            try:
+                self._file.flush()
+                if hasattr(os, 'fdatasync'):
+                    # pages are only dropped once they are clean, and the last windows may not be written back yet
+                    os.fdatasync(self._file.fileno())
+                drop_cache(self._file.fileno())
+            finally:
+                self._file.close()
+                self._file = None
+        if self._fd is not None:
+            try:
+                self._close_direct()
+            finally:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                if self._buffer is not None:
+                    self._buffer.close()
+                    self._buffer = None
+
+    def _close_direct(self) -> None:
+        if self._filled:
+            length = self._position + self._filled
+            padded = -(-self._filled // DIRECT_ALIGNMENT) * DIRECT_ALIGNMENT
+            self._buffer[self._filled:padded] = bytes(padded - self._filled)
+            if not self._write_direct(padded):
+                self._fall_back()
+                self.close()
+                return
+            os.ftruncate(self._fd, length)
+            self._position = length
+            self._filled = 0
+
+    def __enter__(self) -> 'CacheBypassWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+class CacheBypass:
+
+    """
+    Chooses how downloaded files are written so that large downloads do not evict the page cache used by other
+    processes on the same host.  Files at least as large as the threshold are written with a CacheBypassWriter, while
+    smaller files are written as usual.
+
+    Attributes:
+        mode (str): Either 'fadvise' or 'direct', as described by CacheBypassWriter.
+        threshold (int): The size in bytes from which files are written without filling the page cache.
+        window (int): The number of bytes written between each advice, or the size of the aligned buffer.
+
+    Args:
+        mode (str): Either 'fadvise' or 'direct'.
+        threshold (int): The size in bytes from which files are written without filling the page cache.
+        window (int): The number of bytes written between each advice, or the size of the aligned buffer.
+    """
+
+    def __init__(self, mode: str = 'fadvise', threshold: int = 1024 ** 3, window: int = 8 * 1024 * 1024):
+        if mode not in IO_MODES[1:]:
+            raise ValueError(f'Unknown I/O mode: {mode}')
+        self.mode = mode
+        self.threshold = int(threshold)
+        self.window = int(window)
+
+    def applies(self, size: int) -> bool:
+        """
+        Returns:
+            bool: True if a file of the supplied size is written without filling the page cache.
+        """
+        return size >= self.threshold
+
+    def open(self, path: str, file_mode: str = 'wb') -> CacheBypassWriter:
+        """
+        Opens a file for writing without filling the page cache.
+        """
+        return CacheBypassWriter(path, self.mode, self.window, file_mode)
+
+
+def open_output(path: str, cache_bypass: Optional[CacheBypass], file_mode: str = 'wb') -> BinaryIO:
+    """
+    Opens a file for writing, without filling the page cache if a cache bypass is supplied.
+    """
+    if cache_bypass is None:
+        return open(path, file_mode)
+    return cache_bypass.open(path, file_mode)
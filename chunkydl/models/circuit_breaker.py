@@ -0,0 +1,235 @@
+import time
+import logging
+from threading import Lock
+from typing import Collection, Optional
+from urllib.parse import urlsplit
+
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
+
+from chunkydl.exceptions import CircuitOpenException
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def get_origin(url: str) -> str:
+    """
+    Returns:
+        str: The host and port of the url, which identify the circuit of its origin.
+    """
+    parts = urlsplit(url)
+    return f'{parts.hostname or ""}:{parts.port or DEFAULT_PORTS.get(parts.scheme, 80)}'
+
+
+class HostCircuit:
+
+    """
+    The state of the circuit of one host.
+
+    Attributes:
+        state (str): One of 'closed', 'open', or 'half_open'.
+        failures (int): The number of failures in a row while the circuit is closed.
+        opened_at (float): The time.monotonic value at which the circuit last opened.
+        trials (int): The number of trial downloads let through since the circuit became half open.
+        trial_started (float): The time.monotonic value at which the last trial download was let through.
+    """
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trials = 0
+        self.trial_started = 0.0
+
+
+class CircuitBreaker:
+
+    """
+    Stops downloads from waiting on hosts that are failing.  Each host, identified by its name and port as get_origin
+    returns, has a circuit that is closed while the host is healthy.  Every failed attempt of a request to the host
+    counts against it: a connection error, a timeout, or an error status that is retried, which includes each retry of
+    a request.  Once failure_threshold attempts in a row have failed, the circuit opens.
+
+    While a host's circuit is open, its downloads fail at once with a CircuitOpenException, and requests already being
+    retried stop retrying, so that workers are not held by backoff sleeps.  After reset_timeout seconds the circuit is
+    half open, and half_open_requests trial downloads are let through.  If a trial reaches the host, the circuit closes,
+    and if it fails, the circuit opens again.  A trial that ends without an outcome frees its place after another
+    reset_timeout.
+
+    The circuits are kept in memory, so each process that downloads with the config keeps its own.
+
+    Attributes:
+        failure_threshold (int): The number of failures in a row after which a host's circuit opens.
+        reset_timeout (float): The number of seconds a circuit stays open before trial downloads are let through.
+        half_open_requests (int): The number of trial downloads let through at once while a circuit is half open.
+
+    Args:
+        failure_threshold (int): The number of failures in a row after which a host's circuit opens.  Default is 5.
+        reset_timeout (float): The number of seconds a circuit stays open before trial downloads are let through.
+            Default is 30.
+        half_open_requests (int): The number of trial downloads let through at once while a circuit is half open.
+            Default is 1.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30, half_open_requests: int = 1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_requests = half_open_requests
+        self._lock = Lock()
+        self._circuits = {}
+
+    def __getstate__(self) -> dict:
+        return {
+            'failure_threshold': self.failure_threshold,
+            'reset_timeout': self.reset_timeout,
+            'half_open_requests': self.half_open_requests,
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def _get_circuit(self, host: str) -> HostCircuit:
+        """
+        Returns the circuit of a host, after moving it from open to half open if it has been open for the reset
+        timeout.  Must be called while holding the lock.
+        """
+        circuit = self._circuits.get(host)
+        if circuit is None:
+            circuit = self._circuits[host] = HostCircuit()
+        if circuit.state == OPEN and time.monotonic() - circuit.opened_at >= self.reset_timeout:
+            circuit.state = HALF_OPEN
+            circuit.trials = 0
+            logger.info(f'Circuit for {host} is half open')
+        return circuit
+
+    def state(self, host: str) -> str:
+        """
+        Returns:
+            str: The state of the host's circuit, one of 'closed', 'open', or 'half_open'.
+        """
+        with self._lock:
+            return self._get_circuit(host).state
+
+    def is_open(self, host: str) -> bool:
+        """
+        Returns:
+            bool: True if the host's circuit is open, and requests to it should not be made or retried.
+        """
+        return self.state(host) == OPEN
+
+    def retry_after(self, host: str) -> float:
+        """
+        Returns:
+            float: The number of seconds until the host's circuit is half open, or 0 if it is not open.
+        """
+        with self._lock:
+            circuit = self._get_circuit(host)
+            if circuit.state != OPEN:
+                return 0.0
+            return max(circuit.opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def allow(self, host: str) -> bool:
+        """
+        Checks if a download from the host may start, which takes a trial place if the circuit is half open.
+
+        Returns:
+            bool: True if the download may start.
+        """
+        with self._lock:
+            circuit = self._get_circuit(host)
+            if circuit.state == CLOSED:
+                return True
+            if circuit.state == OPEN:
+                return False
+            now = time.monotonic()
+            if circuit.trials < self.half_open_requests or now - circuit.trial_started >= self.reset_timeout:
+                circuit.trials += 1
+                circuit.trial_started = now
+                return True
+            return False
+
+    def check(self, url: str, host: str) -> None:
+        """
+        Checks if a download of the url may start, as allow does.
+
+        Raises:
+            CircuitOpenException: If the host's circuit does not let the download through.
+        """
+        if not self.allow(host):
+            raise CircuitOpenException(url, host, self.retry_after(host))
+
+    def record_success(self, host: str) -> None:
+        """
+        Records that a request reached the host, which closes its circuit.
+        """
+        with self._lock:
+            circuit = self._get_circuit(host)
+            if circuit.state != CLOSED:
+                logger.info(f'Circuit for {host} is closed')
+            circuit.state = CLOSED
+            circuit.failures = 0
+
+    def record_failure(self, host: str) -> None:
+        """
+        Records a failed attempt of a request to the host, which opens its circuit once failure_threshold attempts in a
+        row have failed, or at once if the circuit is half open.
+        """
+        with self._lock:
+            circuit = self._get_circuit(host)
+            if circuit.state == OPEN:
+                return
+            circuit.failures += 1
+            if circuit.state == HALF_OPEN or circuit.failures >= self.failure_threshold:
+                circuit.state = OPEN
+                circuit.opened_at = time.monotonic()
+                logger.warning(f'Circuit for {host} opened after {circuit.failures} failures in a row')
+
+    def record_status(self, host: str, status_code: int, retry_status_codes: Collection[int] = ()) -> None:
+        """
+        Records a response from the host, which is a failure if its status is a server error or one that is retried,
+        and otherwise shows that the host is up.
+        """
+        if status_code >= 500 or status_code in retry_status_codes:
+            self.record_failure(host)
+        else:
+            self.record_success(host)
+
+
+class CircuitBreakerRetry(Retry):
+
+    """
+    A urllib3 Retry that records each failed attempt with a CircuitBreaker, and stops retrying once the circuit of the
+    host is open.
+
+    Attributes:
+        circuit_breaker (CircuitBreaker): The breaker that failures are recorded with.
+        host (str): The origin requested, as get_origin returns, or an empty string to take it from the connection pool.
+    """
+
+    def __init__(self, *args, circuit_breaker: Optional[CircuitBreaker] = None, host: str = '', **kwargs):
+        super().__init__(*args, **kwargs)
+        self.circuit_breaker = circuit_breaker
+        self.host = host
+
+    def new(self, **kwargs) -> 'CircuitBreakerRetry':
+        retry = super().new(**kwargs)
+        retry.circuit_breaker = self.circuit_breaker
+        retry.host = self.host
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None) -> Retry:
+        redirect = response is not None and response.get_redirect_location()
+        host = self.host or (f'{_pool.host}:{_pool.port}' if _pool is not None else '')
+        if not redirect and host:
+            self.circuit_breaker.record_failure(host)
+            if self.circuit_breaker.is_open(host):
+                raise MaxRetryError(
+                    _pool, url, CircuitOpenException(url, host, self.circuit_breaker.retry_after(host))
+                ) from error
+        return super().increment(method, url, response, error, _pool, _stacktrace)
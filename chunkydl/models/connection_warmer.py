@@ -0,0 +1,100 @@
+import logging
+from collections import Counter, deque
+from threading import Condition
+from typing import Optional
+from urllib.parse import urlsplit
+
+from chunkydl.runner import Runner
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionWarmer(Runner):
+
+    """
+    Opens connections to the hosts of queued downloads shortly before the downloads start, so that resolving the host
+    and the TCP and TLS handshakes are not waited on by each download.  Downloads are hinted in the order they will be
+    started, and once a hinted download is within lookahead downloads of the last one started, its host is warmed until
+    the transport holds an idle connection for each download of that host in the window that has not started, up to
+    the number of connections the transport keeps for a host.
+
+    Only transports that keep connections between requests, such as the 'urllib3' transport, are warmed.  Connections
+    that can not be opened are left to the downloads that follow, which report the error.
+
+    Attributes:
+        config (DownloadConfig): The config whose transport is warmed.
+        lookahead (int): The number of downloads past the last one started whose hosts are warmed.
+
+    Args:
+        config (DownloadConfig): The config whose transport is warmed.
+        lookahead (Optional[int]): The number of downloads past the last one started whose hosts are warmed.  Defaults
+            to the config's download threads.
+    """
+
+    def __init__(self, config, lookahead: Optional[int] = None):
+        super().__init__()
+        self.daemon = True
+        self.config = config
+        self.lookahead = lookahead or config.download_threads
+        self._condition = Condition()
+        self._hints = deque()
+        self._hint_count = 0
+        self._start_count = 0
+        self._window = Counter()
+
+    @staticmethod
+    def get_host(url: str) -> tuple:
+        parts = urlsplit(url)
+        return parts.scheme, parts.netloc
+
+    def hint(self, url: str) -> None:
+        """
+        Adds a download that will be started after every download hinted before it.
+        """
+        with self._condition:
+            self._hints.append((self._hint_count, url))
+            self._hint_count += 1
+            self._condition.notify()
+
+    def started(self, url: str) -> None:
+        """
+        Records that the next hinted download has started, which moves the window forward by one download.
+        """
+        host = self.get_host(url)
+        with self._condition:
+            self._start_count += 1
+            if self._window[host] > 0:
+                self._window[host] -= 1
+            self._condition.notify()
+
+    def _ready(self) -> bool:
+        return bool(self._hints) and self._hints[0][0] < self._start_count + self.lookahead
+
+    def run(self) -> None:
+        """
+        Warms the host of each hinted download as it enters the window, until the warmer is stopped.
+        """
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: not self.continue_run or self._ready())
+                if not self.continue_run:
+                    return
+                index, url = self._hints.popleft()
+                if index < self._start_count:
+                    continue
+                host = self.get_host(url)
+                self._window[host] += 1
+                connections = self._window[host]
+            try:
+                self.config.transport.warm(url, self.config, connections)
+            except Exception as e:
+                logger.debug(f'Failed to warm a connection to {url}: {e}')
+
+    def stop(self) -> None:
+        """
+        Stops warming connections.  Connections already opened are kept by the transport.
+        """
+        super().stop()
+        with self._condition:
+            self._condition.notify_all()
@@ -1,7 +1,8 @@
 from datetime import timedelta
-from typing import NamedTuple, Dict
+from typing import Any, NamedTuple, Dict, Optional, Tuple
 
 from .download_config import DownloadConfig
+from .segment_sink import SegmentEntry
 
 
 class DLGroup(NamedTuple):
@@ -14,10 +15,108 @@ class DLGroup(NamedTuple):
         output_path (str): The path where the file will be downloaded.
         config (DownloadConfig): A DownloadConfig object that specifies the download configuration for this particular
             file.
+        mirrors (tuple[str, ...]): The urls of the same file on other mirrors.  Files large enough to be downloaded in
+            multiple parts have their parts spread across the url and its mirrors.
     """
     url: str
     output_path: str
     config: DownloadConfig
+    mirrors: Tuple[str, ...] = ()
+
+
+class RangeTiming(NamedTuple):
+
+    """
+    A NamedTuple that holds the timing of a single byte range downloaded by the multipart downloader.
+
+    Attributes:
+        start (int): The first byte of the range.
+        end (int): The last byte of the range.
+        bytes_received (int): The number of bytes received for the range.
+        ttfb (float): The seconds between sending the request and receiving the response headers.
+        transfer (float): The seconds spent receiving and writing the response body.
+        disk_write (float): The seconds spent writing the response body to disk.
+        retries (int): The number of times the request was retried.
+        mirror (Optional[str]): The url the range was downloaded from.
+    """
+
+    start: int
+    end: int
+    bytes_received: int = 0
+    ttfb: float = 0.0
+    transfer: float = 0.0
+    disk_write: float = 0.0
+    retries: int = 0
+    mirror: Optional[str] = None
+
+
+class Timing(NamedTuple):
+
+    """
+    A NamedTuple that holds a breakdown of where the time of a download was spent.  All times are in seconds.
+
+    Attributes:
+        queue_wait (float): The time the download waited in a queue downloader's queue before a worker started it.
+        head (float): The time taken by the HEAD request made before downloading.
+        ttfb (float): The time between sending the download request and receiving the response headers, which includes
+            connecting to the server.  For multipart downloads, this is the fastest of the ranges.
+        transfer (float): The time spent receiving and writing the response body.  For multipart downloads, this is the
+            wall time from the first range starting to the last range finishing.
+        disk_write (float): The time spent writing to disk while receiving the body.  For multipart downloads, this is
+            the sum over all ranges.
+        join (float): The time spent joining the parts of a multipart download.
+        bytes_received (int): The number of bytes received.
+        retries (int): The number of times requests were retried.
+        ranges (tuple[RangeTiming, ...]): The timing of each range of a multipart download, ordered by start byte.
+    """
+
+    queue_wait: float = 0.0
+    head: float = 0.0
+    ttfb: float = 0.0
+    transfer: float = 0.0
+    disk_write: float = 0.0
+    join: float = 0.0
+    bytes_received: int = 0
+    retries: int = 0
+    ranges: Tuple[RangeTiming, ...] = ()
+
+    @property
+    def throughput(self) -> float:
+        """
+        Returns:
+            float: The transfer rate in bytes per second, or 0 if no time was spent transferring.
+        """
+        return self.bytes_received / self.transfer if self.transfer > 0 else 0.0
+
+
+class PostResult(NamedTuple):
+
+    """
+    The outcome of the post-processing stages run on a downloaded file.
+
+    Attributes:
+        values (Dict[str, Any]): The value returned by each stage that finished, keyed by the stage name.
+        path (Optional[str]): The path of the file after the stages, which differs from the download's output path if
+            a stage, such as decompress, made a new file.
+        error (Optional[BaseException]): The exception raised by the stage that failed, or None if every stage
+            finished.  The stages after a failed stage are not run.
+        wait (float): The seconds the file waited for a free worker process.
+        duration (float): The seconds spent running the stages.
+    """
+
+    values: Dict[str, Any] = {}
+    path: Optional[str] = None
+    error: Optional[BaseException] = None
+    wait: float = 0.0
+    duration: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """
+        Returns:
+            bool: True if every stage finished without raising.
+        """
+        return self.error is None
 
 
 class Response(NamedTuple):
@@ -31,9 +130,40 @@ class Response(NamedTuple):
         headers (Dict[str, str]): The headers returned by the original response.
         status_code (int): The HTTP status code of the original response.
         elapsed (timedelta): The elapsed time between sending the request and receiving the original response.
+        output_path (Optional[str]): The path where the downloaded file was saved.
+        timing (Optional[Timing]): A breakdown of where the time of the download was spent.
+        post (Optional[PostResult]): The results of the post-processing stages run on the downloaded file, if any.
+        segment (Optional[SegmentEntry]): The location of the downloaded object, if it was stored in a segment file
+            rather than at its own path.
     """
 
     url: str
     headers: Dict[str, str]
     status_code: int
     elapsed: timedelta
+    output_path: Optional[str] = None
+    timing: Optional[Timing] = None
+    post: Optional[PostResult] = None
+    segment: Optional[SegmentEntry] = None
+
+
+class HeadResult(NamedTuple):
+
+    """
+    The successful HEAD response for a url, resolved before its download starts.
+
+    Attributes:
+        response (Any): The HEAD response, as returned by the config's transport.
+        seconds (float): The time taken by the HEAD request.
+    """
+
+    response: Any
+    seconds: float
+
+    @property
+    def size(self) -> int:
+        """
+        Returns:
+            int: The size of the file as given by the Content-Length header, or 0 if it is not given.
+        """
+        return int(self.response.headers.get('content-length', 0))
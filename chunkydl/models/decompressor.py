@@ -0,0 +1,217 @@
+import os
+import bz2
+import zlib
+import lzma
+import logging
+from queue import Queue
+from threading import Thread
+from typing import BinaryIO, Callable, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+
+
+EXTENSIONS = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+    '.lzma': 'xz',
+    '.zst': 'zstd',
+}
+
+
+def _zstd_decoder():
+    if zstandard is None:
+        raise ValueError('zstd decompression requires the zstandard package')
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+DECODERS = {
+    'gzip': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    'x-gzip': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    # a wbits offset of 32 accepts a zlib or gzip header, as servers send either for deflate
+    'deflate': lambda: zlib.decompressobj(32 + zlib.MAX_WBITS),
+    'bz2': bz2.BZ2Decompressor,
+    'xz': lzma.LZMADecompressor,
+    'zstd': _zstd_decoder,
+}
+
+
+def is_supported(encoding: Optional[str]) -> bool:
+    """
+    Returns:
+        bool: True if streams in the supplied encoding can be decompressed.
+    """
+    if encoding == 'zstd':
+        return zstandard is not None
+    return encoding in DECODERS
+
+
+def detect_encoding(name: str, content_encoding: Optional[str] = None) -> Optional[str]:
+    """
+    Finds the compression of a file from the Content-Encoding of its response or, if it has none, from the extension
+    of its name.
+
+    Args:
+        name (str): The name of the file.
+        content_encoding (Optional[str]): The Content-Encoding header of the response for the file.
+
+    Returns:
+        Optional[str]: The encoding of the file, or None if it is not compressed in a supported encoding.
+    """
+    if content_encoding and content_encoding.strip().lower() != 'identity':
+        encoding = content_encoding.strip().lower()
+        return encoding if is_supported(encoding) else None
+    encoding = EXTENSIONS.get(os.path.splitext(name)[1].lower())
+    return encoding if is_supported(encoding) else None
+
+
+def strip_extension(name: str) -> str:
+    """
+    Returns:
+        str: The supplied file name without its compression extension, if it has one.
+    """
+    root, extension = os.path.splitext(name)
+    return root if extension.lower() in EXTENSIONS and root else name
+
+
+class StreamDecoder:
+
+    """
+    Decompresses a stream that arrives in chunks.  Streams made of several concatenated members, such as those written
+    by parallel gzip or xz tools, are decompressed member by member.
+
+    Args:
+        encoding (str): The encoding of the stream, one of the keys of DECODERS.
+
+    Raises:
+        ValueError: If the encoding is not supported.
+    """
+
+    def __init__(self, encoding: str):
+        if encoding not in DECODERS:
+            raise ValueError(f'Unsupported compression: {encoding}')
+        self.encoding = encoding
+        self._factory: Callable = DECODERS[encoding]
+        self._decoder = self._factory()
+        self._started = False
+
+    def decompress(self, data: bytes) -> bytes:
+        """
+        Returns:
+            bytes: The decompressed bytes that are available after adding the supplied data to the stream.
+        """
+        output = []
+        while data:
+            self._started = True
+            output.append(self._decoder.decompress(data))
+            if not getattr(self._decoder, 'eof', False):
+                break
+            data = self._decoder.unused_data
+            self._decoder = self._factory()
+            self._started = False
+        return b''.join(output)
+
+    def finish(self) -> bytes:
+        """
+        Returns:
+            bytes: The remaining decompressed bytes at the end of the stream.
+
+        Raises:
+            ValueError: If the stream ended before its last member was complete.
+        """
+        flush = getattr(self._decoder, 'flush', None)
+        remaining = flush() if flush is not None else b''
+        if self._started and not getattr(self._decoder, 'eof', True):
+            raise ValueError(f'The {self.encoding} stream is truncated')
+        return remaining
+
+
+class DecompressingWriter:
+
+    """
+    A writable stage that decompresses the chunks written to it and writes the decompressed bytes to a file.  The
+    decompression and the file writes run on the stage's own thread, so that the thread receiving the download is only
+    held up when the stage falls a bounded number of chunks behind.  The zlib, bz2, and lzma decoders release the GIL,
+    so decompression overlaps the network transfer.
+
+    Attributes:
+        file (BinaryIO): The file to which the decompressed bytes are written.
+        decoder (StreamDecoder): The decoder for the stream.
+        bytes_written (int): The number of decompressed bytes written to the file.
+
+    Args:
+        file (BinaryIO): A file open for writing in binary mode.
+        encoding (str): The encoding of the stream.
+        max_pending (int): The number of chunks that may wait to be decompressed before write blocks.  Default is 8.
+    """
+
+    def __init__(self, file: BinaryIO, encoding: str, max_pending: int = 8):
+        self.file = file
+        self.decoder = StreamDecoder(encoding)
+        self.bytes_written = 0
+        self._queue = Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = Thread(target=self._run, name='chunkydl-decompress', daemon=True)
+        self._thread.start()
+
+    def write(self, data: bytes) -> int:
+        """
+        Queues a chunk of compressed data for the stage.
+
+        Raises:
+            Exception: The error raised by the stage, if it has failed.
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put(data)
+        return len(data)
+
+    def close(self) -> None:
+        """
+        Waits for the stage to decompress and write every queued chunk.
+
+        Raises:
+            Exception: The error raised by the stage, if it failed.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self) -> None:
+        data = b''
+        try:
+            while True:
+                data = self._queue.get()
+                if data is None:
+                    self._write(self.decoder.finish())
+                    return
+                self._write(self.decoder.decompress(data))
+        except Exception as e:
+            logger.error(f'Failed to decompress {self.decoder.encoding} stream', exc_info=True)
+            self._error = e
+            # the queue is drained so that a writer blocked on a full queue can see the error
+            while data is not None:
+                data = self._queue.get()
+
+    def _write(self, data: bytes) -> None:
+        if data:
+            self.file.write(data)
+            self.bytes_written += len(data)
+
+    def __enter__(self) -> 'DecompressingWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        elif self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
@@ -0,0 +1,216 @@
+import os
+import time
+import logging
+import hashlib
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+import requests
+
+from .download_config import DownloadConfig
+from .data_models import Response, Timing
+from .block_map import BlockMap, hash_blocks
+from .multi_part_downloader import MultiPartDownloader
+from chunkydl.utils import make_response
+from chunkydl.exceptions import RequestFailedException
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeltaPlan(NamedTuple):
+
+    """
+    The work needed to turn a local file into the file described by a block map.
+
+    Attributes:
+        reused (int): The number of blocks that already match in place.
+        copies (tuple[tuple]): The index of each block that is copied from elsewhere in the local file, and the offset
+            it is copied from.
+        fetches (tuple[int]): The index of each block that must be downloaded.
+    """
+
+    reused: int = 0
+    copies: Tuple[Tuple[int, int], ...] = ()
+    fetches: Tuple[int, ...] = ()
+
+
+class DeltaUpdater:
+
+    """
+    Updates a local copy of a large file to the current version at a url by downloading only the blocks that changed.
+    The local file is hashed in blocks and compared with the block map of the current version.  Blocks that match in
+    place are kept, blocks that match a block elsewhere in the local file are copied, and the remaining blocks are
+    downloaded as ranges with the MultiPartDownloader and written into the file in place.  Every block that was written
+    is hashed again afterwards, so a failed range can not leave the file silently corrupted.
+
+    Blocks are compared at block boundaries, so content that is shifted by an amount that is not a multiple of the
+    block size is downloaded again.
+
+    Attributes:
+        url (str): The url of the current version of the file.
+        output_path (str): The path of the local file that is updated.  If it does not exist, it is downloaded in full.
+        block_map (BlockMap): The block map of the current version of the file.
+        config (DownloadConfig): The download configuration object that holds the setup variables for this download.
+        mirrors (Sequence[str]): The urls of the same file on other mirrors.
+        plan (Optional[DeltaPlan]): The plan of the last update, once it has been made.
+
+    Args:
+        url (str): The url of the current version of the file.
+        output_path (str): The path of the local file that is updated.
+        block_map (BlockMap): The block map of the current version of the file.
+        config (Optional[DownloadConfig]): The download configuration.  Defaults to a new DownloadConfig.
+        mirrors (Sequence[str]): The urls of the same file on other mirrors, which the changed blocks are spread across.
+    """
+
+    def __init__(self, url: str, output_path: str, block_map: BlockMap, config: Optional[DownloadConfig] = None,
+                 mirrors: Sequence[str] = ()):
+        self.url = url
+        self.output_path = output_path
+        self.block_map = block_map
+        self.config = config or DownloadConfig()
+        self.mirrors = mirrors
+        self.plan = None
+
+    def make_plan(self) -> DeltaPlan:
+        """
+        Hashes the local file and compares its blocks with the block map.
+
+        A block is only copied from a local offset whose block is kept in place or lies past the end of the new file,
+        so that no copy reads a block that has already been overwritten.
+
+        Returns:
+            DeltaPlan: The blocks that are kept, copied, and downloaded.
+        """
+        block_map = self.block_map
+        local_hashes = []
+        last = block_map.block_count - 1
+        last_start, last_end = block_map.block_range(last) if last >= 0 else (0, -1)
+        last_digest = None
+        if os.path.exists(self.output_path):
+            with open(self.output_path, 'rb') as file:
+                local_hashes = list(hash_blocks(file, block_map.block_size, block_map.algorithm))
+                # a shorter last block of the new file may match the start of a full block of a longer local file
+                if len(local_hashes) > last >= 0 and last_end - last_start + 1 < block_map.block_size:
+                    file.seek(last_start)
+                    last_digest = hashlib.new(block_map.algorithm, file.read(last_end - last_start + 1)).hexdigest()
+        kept = {index for index, digest in enumerate(local_hashes[:block_map.block_count])
+                if digest == block_map.hashes[index]}
+        if last_digest is not None and last_digest == block_map.hashes[last]:
+            kept.add(last)
+        sources = {}
+        for index, digest in enumerate(local_hashes):
+            if index in kept or index >= block_map.block_count:
+                sources.setdefault(digest, index * block_map.block_size)
+        copies = []
+        fetches = []
+        for index, digest in enumerate(block_map.hashes):
+            if index in kept:
+                continue
+            if digest in sources:
+                copies.append((index, sources[digest]))
+            else:
+                fetches.append(index)
+        return DeltaPlan(reused=len(kept), copies=tuple(copies), fetches=tuple(fetches))
+
+    def run(self) -> Response:
+        """
+        Updates the local file to the current version.
+
+        Returns:
+            Response: The response for the file, with the timing of the downloaded ranges.
+
+        Raises:
+            RequestFailedException: If the file at the url does not have the size given by the block map, or if any
+                updated block does not match the block map afterwards.
+        """
+        head_start = time.perf_counter()
+        response = requests.head(self.url, timeout=self.config.timeout, headers=self.config.headers,
+                                 allow_redirects=True)
+        head_time = time.perf_counter() - head_start
+        if response.status_code != 200:
+            raise RequestFailedException(self.url, response.status_code, response.reason)
+        size = response.headers.get('content-length')
+        if size is not None and int(size) != self.block_map.size:
+            raise RequestFailedException(self.url, response.status_code,
+                                         f'File size {size} does not match the block map size {self.block_map.size}')
+        self.plan = plan = self.make_plan()
+        logger.info(f'Updating {self.output_path}: {plan.reused} blocks kept, {len(plan.copies)} copied, '
+                    f'{len(plan.fetches)} downloaded')
+        if not os.path.exists(self.output_path):
+            open(self.output_path, 'wb').close()
+        self.copy_blocks(plan.copies)
+        timing = Timing(head=head_time)
+        if plan.fetches:
+            downloader = MultiPartDownloader(
+                self.url,
+                self.output_path,
+                file_size=self.block_map.size,
+                config=self.config,
+                mirrors=self.mirrors,
+                etag=response.headers.get('etag'),
+                ranges=self.get_ranges(plan.fetches),
+            )
+            downloader.run()
+            timing = downloader.timing._replace(head=head_time)
+        else:
+            with open(self.output_path, 'r+b') as file:
+                file.truncate(self.block_map.size)
+        self.verify([index for index, _ in plan.copies] + list(plan.fetches))
+        return make_response(response, self.output_path, timing)
+
+    def copy_blocks(self, copies: Sequence[tuple]) -> None:
+        """
+        Copies blocks from their offsets in the local file to their index in the new file.
+        """
+        if not copies:
+            return
+        with open(self.output_path, 'r+b') as file:
+            for index, offset in copies:
+                start, end = self.block_map.block_range(index)
+                file.seek(offset)
+                data = file.read(end - start + 1)
+                file.seek(start)
+                file.write(data)
+
+    def get_ranges(self, indexes: Sequence[int]) -> list:
+        """
+        Joins runs of adjacent blocks into ranges no larger than the config's size threshold, or a single block if
+        blocks are larger than the threshold.
+
+        Returns:
+            list[tuple]: The first and last byte of each range.
+        """
+        max_blocks = max(self.config.size_threshold // self.block_map.block_size, 1)
+        ranges = []
+        run_start = previous = None
+        for index in indexes:
+            if run_start is not None and index == previous + 1 and index - run_start < max_blocks:
+                previous = index
+                continue
+            if run_start is not None:
+                ranges.append((self.block_map.block_range(run_start)[0], self.block_map.block_range(previous)[1]))
+            run_start = previous = index
+        if run_start is not None:
+            ranges.append((self.block_map.block_range(run_start)[0], self.block_map.block_range(previous)[1]))
+        return ranges
+
+    def verify(self, indexes: Sequence[int]) -> None:
+        """
+        Checks the supplied blocks of the updated file against the block map.
+
+        Raises:
+            RequestFailedException: If the file has the wrong size, or any of the blocks does not match.
+        """
+        if os.path.getsize(self.output_path) != self.block_map.size:
+            raise RequestFailedException(self.url, 206, f'Updated file {self.output_path} has the wrong size')
+        mismatched = []
+        with open(self.output_path, 'rb') as file:
+            for index in sorted(indexes):
+                start, end = self.block_map.block_range(index)
+                file.seek(start)
+                digest = hashlib.new(self.block_map.algorithm, file.read(end - start + 1)).hexdigest()
+                if digest != self.block_map.hashes[index]:
+                    mismatched.append(index)
+        if mismatched:
+            raise RequestFailedException(self.url, 206, f'{len(mismatched)} blocks of {self.output_path} do not '
+                                                        f'match the block map')
@@ -0,0 +1,111 @@
+import time
+import socket
+import logging
+from threading import Lock
+
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NameResolutionError, NewConnectionError
+
+
+logger = logging.getLogger(__name__)
+
+
+class DnsCache:
+
+    """
+    Caches the addresses that host names resolve to, so that each new connection to a host does not wait on the
+    resolver.  The standard resolver does not report the TTL of the records it returns, so entries are kept for the
+    supplied ttl, which should be no longer than the TTL of the hosts' records.  Failed lookups are not cached, and a
+    host is resolved again once a connection to every one of its cached addresses has failed.
+
+    Attributes:
+        ttl (float): The number of seconds an entry is kept.
+
+    Args:
+        ttl (float): The number of seconds an entry is kept.  Default is 60.
+    """
+
+    def __init__(self, ttl: float = 60):
+        self.ttl = float(ttl)
+        self._lock = Lock()
+        self._entries = {}
+
+    def __getstate__(self) -> dict:
+        return {'ttl': self.ttl}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def resolve(self, host: str, port: int) -> list[str]:
+        """
+        Returns:
+            list[str]: The addresses of the host, in the order the resolver returned them, from the cache if they have
+                not expired.
+
+        Raises:
+            socket.gaierror: If the host can not be resolved.
+        """
+        key = (host, port)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+        results = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(result[4][0] for result in results))
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, addresses)
+        logger.debug(f'Resolved {host} to {", ".join(addresses)}')
+        return addresses
+
+    def invalidate(self, host: str, port: int) -> None:
+        """
+        Removes the cached addresses of a host, so that it is resolved again by the next connection.
+        """
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DnsCachedConnection:
+
+    """
+    Resolves the host of a urllib3 connection through the DnsCache of its class, trying each cached address in turn.
+    TLS is negotiated with the host name, so certificates are still verified against it.
+    """
+
+    dns_cache: DnsCache = None
+
+    def _new_conn(self) -> socket.socket:
+        host = self._dns_host
+        try:
+            addresses = self.dns_cache.resolve(host, self.port)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        error = None
+        for address in addresses:
+            self._dns_host = address
+            try:
+                return super()._new_conn()
+            except NewConnectionError as e:
+                error = e
+            finally:
+                self._dns_host = host
+        self.dns_cache.invalidate(host, self.port)
+        raise error
+
+
+def make_pool_classes(dns_cache: DnsCache) -> dict:
+    """
+    Returns:
+        dict: The connection pool classes, by scheme, for a urllib3.PoolManager whose connections are resolved through
+            the supplied cache.
+    """
+    http = type('DnsCachedHTTPConnection', (DnsCachedConnection, HTTPConnection), {'dns_cache': dns_cache})
+    https = type('DnsCachedHTTPSConnection', (DnsCachedConnection, HTTPSConnection), {'dns_cache': dns_cache})
+    return {
+        'http': type('DnsCachedHTTPConnectionPool', (HTTPConnectionPool,), {'ConnectionCls': http}),
+        'https': type('DnsCachedHTTPSConnectionPool', (HTTPSConnectionPool,), {'ConnectionCls': https}),
+    }
@@ -0,0 +1,337 @@
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+from typing import Optional, Mapping
+
+
+logger = logging.getLogger(__name__)
+
+LINK_MODES = ('auto', 'clone', 'reflink', 'hardlink', 'copy')
+
+
+class DownloadCache:
+
+    """
+    A shared, on disk cache of downloaded files that may be used by multiple downloaders and multiple processes at the
+    same time.  Files are stored by a key made from the url and the validators (ETag, Last-Modified) returned by the
+    server, so a cached file is only reused while the server reports the same version of the file.  When digest mode is
+    used, the stored files are additionally addressed by the sha256 digest of their contents so that identical files
+    served from different urls are only stored once.
+
+    Cached files are placed at their output paths with a reflink or copy (or a hard link, when requested; see link_file)
+    instead of being downloaded again.  Downloaded files are always stored with a reflink or copy, never a hard link, so
+    that writing to an output file in place never changes the cached copy.  The total size of the cache is kept under
+    max_size by removing the least recently used files.
+
+    All writes to the cache are made to a temporary file which is then atomically moved into place, so readers in other
+    processes never see a partially written file.  Eviction is guarded by a lock file so that only one process evicts
+    at a time.
+
+    Attributes:
+        path (str): The directory in which the cache is stored.
+        max_size (Optional[int]): The maximum size of the cache in bytes.  None means the cache is never evicted.
+        digest (bool): Indicates if stored files are addressed by the digest of their contents.
+        link_mode (str): The method used to place cached files at their output paths.
+        lock_timeout (float): The number of seconds after which an abandoned eviction lock is considered stale.
+
+    Args:
+        path (str): The directory in which the cache is stored.  It will be created if it does not exist.
+        max_size (Optional[int]): The maximum size of the cache in bytes.
+        digest (bool): Indicates if stored files are addressed by the digest of their contents.
+        link_mode (str): One of 'auto', 'clone', 'reflink', 'hardlink', or 'copy'.  See link_file.
+        lock_timeout (float): The number of seconds after which an abandoned eviction lock is considered stale.
+    """
+
+    def __init__(self, path: str, max_size: Optional[int] = None, digest: bool = False, link_mode: str = 'auto',
+                 lock_timeout: float = 30):
+        if link_mode not in LINK_MODES:
+            raise ValueError(f'Unknown link mode: {link_mode}')
+        self.path = path
+        self.max_size = max_size
+        self.digest = digest
+        self.link_mode = link_mode
+        self.lock_timeout = lock_timeout
+        self.objects_path = os.path.join(path, 'objects')
+        self.keys_path = os.path.join(path, 'keys')
+        self.tmp_path = os.path.join(path, 'tmp')
+        self.lock_path = os.path.join(path, '.lock')
+        for directory in (self.objects_path, self.keys_path, self.tmp_path):
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(url: str, headers: Mapping[str, str]) -> Optional[str]:
+        """
+        Makes a cache key from a url and the validators found in the headers returned by the server for that url.
+
+        Args:
+            url (str): The url of the file.
+            headers (Mapping[str, str]): The headers returned by a request to the url.  The mapping must be case
+                insensitive, as the headers of a requests.Response are.
+
+        Returns:
+            Optional[str]: The cache key, or None if the server did not return any validators.  Files without
+                validators are never cached because there is no way to tell if the cached version is still current.
+        """
+        etag = headers.get('etag')
+        last_modified = headers.get('last-modified')
+        if etag is None and last_modified is None:
+            return None
+        length = headers.get('content-length', '')
+        value = f'{url}\n{etag}\n{last_modified}\n{length}'
+        return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the path of the cached file for the supplied key and marks the file as recently used.
+
+        Args:
+            key (str): The cache key as returned from make_key.
+
+        Returns:
+            Optional[str]: The path to the cached file, or None if the key is not in the cache.
+        """
+        path = self._object_path(key)
+        if path is None:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def materialize(self, key: str, output_path: str) -> bool:
+        """
+        Places the cached file for the supplied key at the output path.
+
+        Args:
+            key (str): The cache key as returned from make_key.
+            output_path (str): The path where the file will be placed.
+
+        Returns:
+            bool: True if the file was in the cache and has been placed at the output path, False otherwise.
+        """
+        path = self.get(key)
+        if path is None:
+            return False
+        try:
+            method = link_file(path, output_path, self.link_mode)
+        except FileNotFoundError:
+            # the file was evicted by another process between the lookup and the link
+            return False
+        logger.debug(f'Cached file {path} placed at {output_path} by {method}')
+        return True
+
+    def store(self, key: str, source_path: str) -> Optional[str]:
+        """
+        Adds a downloaded file to the cache, then evicts the least recently used files if the cache has grown past its
+        maximum size.
+
+        Args:
+            key (str): The cache key as returned from make_key.
+            source_path (str): The path of the downloaded file.
+
+        Returns:
+            Optional[str]: The path of the cached file, or None if the file could not be stored.
+        """
+        if self.max_size is not None and os.path.getsize(source_path) > self.max_size:
+            logger.debug(f'{source_path} is larger than the cache and will not be stored')
+            return None
+        fd, tmp = tempfile.mkstemp(dir=self.tmp_path)
+        os.close(fd)
+        try:
+            # the caller keeps using its file, so it must never share an inode with the cached copy
+            link_file(source_path, tmp, 'clone')
+            name = file_digest(tmp) if self.digest else key
+            path = os.path.join(self.objects_path, name)
+            os.replace(tmp, path)
+            if self.digest:
+                self._write_key(key, name)
+        except OSError:
+            logger.error(f'Failed to store {source_path} in download cache', exc_info=True)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return None
+        logger.debug(f'Stored {source_path} in download cache as {name}')
+        self.evict()
+        return path
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used files from the cache until the total size of the cache is under max_size.  If
+        another process is currently evicting, this method returns without doing anything.
+        """
+        if self.max_size is None or not self._acquire_lock():
+            return
+        try:
+            entries = []
+            total = 0
+            with os.scandir(self.objects_path) as it:
+                for entry in it:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    logger.debug(f'Evicted {path} from download cache')
+                except FileNotFoundError:
+                    total -= size
+        finally:
+            self._release_lock()
+
+    @property
+    def size(self) -> int:
+        """
+        Returns:
+            int: The current total size of the files stored in the cache, in bytes.
+        """
+        total = 0
+        with os.scandir(self.objects_path) as it:
+            for entry in it:
+                try:
+                    total += entry.stat().st_size
+                except FileNotFoundError:
+                    continue
+        return total
+
+    def clear(self) -> None:
+        """
+        Removes every file from the cache.
+        """
+        for directory in (self.objects_path, self.keys_path):
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(directory, exist_ok=True)
+
+    def _object_path(self, key: str) -> Optional[str]:
+        if not self.digest:
+            return os.path.join(self.objects_path, key)
+        try:
+            with open(os.path.join(self.keys_path, key), 'r') as file:
+                name = file.read().strip()
+        except FileNotFoundError:
+            return None
+        return os.path.join(self.objects_path, name) if name else None
+
+    def _write_key(self, key: str, name: str) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.tmp_path)
+        with os.fdopen(fd, 'w') as file:
+            file.write(name)
+        os.replace(tmp, os.path.join(self.keys_path, key))
+
+    def _acquire_lock(self) -> bool:
+        if self._try_lock():
+            return True
+        try:
+            if time.time() - os.path.getmtime(self.lock_path) < self.lock_timeout:
+                return False
+            logger.debug(f'Removing stale download cache lock {self.lock_path}')
+            os.remove(self.lock_path)
+        except FileNotFoundError:
+            pass
+        return self._try_lock()
+
+    def _try_lock(self) -> bool:
+        try:
+            fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        os.close(fd)
+        return True
+
+    def _release_lock(self) -> None:
+        try:
+            os.remove(self.lock_path)
+        except FileNotFoundError:
+            pass
+
+
+def link_file(source: str, dest: str, mode: str = 'auto') -> str:
+    """
+    Places a copy of the source file at the destination path.  Depending on the mode, the file is reflinked (a
+    copy-on-write clone that shares the source's data blocks), hard linked, or fully copied.  Any file that already
+    exists at the destination path is replaced.
+
+    Args:
+        source (str): The path of the existing file.
+        dest (str): The path where the file will be placed.
+        mode (str): One of 'reflink', 'hardlink', 'copy', 'clone', or 'auto'.  'clone' and 'auto' try a reflink and
+            fall back to a full copy, so the two files are always independent.  'hardlink' must be requested
+            explicitly: a hard linked file shares its inode with the source, so modifying one in place modifies the
+            other.
+
+    Returns:
+        str: The method that was actually used to place the file.
+
+    Raises:
+        ValueError: If the supplied mode is not recognized.
+        OSError: If the requested method is not supported for the supplied paths.
+    """
+    if mode not in LINK_MODES:
+        raise ValueError(f'Unknown link mode: {mode}')
+    if os.path.lexists(dest):
+        os.remove(dest)
+    if mode in ('auto', 'clone', 'reflink'):
+        try:
+            _reflink(source, dest)
+            return 'reflink'
+        except FileNotFoundError:
+            raise
+        except OSError:
+            if mode == 'reflink':
+                raise
+    if mode == 'hardlink':
+        os.link(source, dest)
+        return 'hardlink'
+    shutil.copyfile(source, dest)
+    return 'copy'
+
+
+def _reflink(source: str, dest: str) -> None:
+    """
+    Clones the source file to the destination path using the Linux FICLONE ioctl.  This only succeeds on file systems
+    that support copy-on-write clones (btrfs, xfs, etc.) and when both paths are on the same file system.
+
+    Raises:
+        OSError: If cloning is not supported on this platform or file system.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError('Reflinks are not supported on this platform')
+    ficlone = 0x40049409
+    with open(source, 'rb') as src:
+        try:
+            with open(dest, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), ficlone, src.fileno())
+        except OSError:
+            if os.path.exists(dest):
+                os.remove(dest)
+            raise
+
+
+def file_digest(path: str, block_size: int = 1024 * 1024) -> str:
+    """
+    Calculates the sha256 digest of a file's contents.
+
+    Args:
+        path (str): The path of the file.
+        block_size (int): The number of bytes read from the file at a time.
+
+    Returns:
+        str: The hex digest of the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
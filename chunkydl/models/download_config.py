@@ -1,6 +1,15 @@
 import logging
+from typing import Optional
 
 from .size import Size
+from .download_cache import DownloadCache
+from .memory_budget import MemoryBudget
+from .file_publisher import FilePublisher
+from .cache_bypass import CacheBypass
+from .segment_sink import SegmentSink
+from .transport import Transport, make_transport
+from .dns_cache import DnsCache
+from .circuit_breaker import CircuitBreaker
 
 
 logger = logging.getLogger(__name__)
@@ -55,6 +64,128 @@ class DownloadConfig:
                     the download queue.  Default is False.
                 clean_up_on_fail (bool): Indicates if the multiple parts of a file downloaded with the multipart
                     downloader will be deleted if some part of the multipart download fails.  Default is False.
+                cache_dir (str): The path to a directory used as a shared download cache.  When supplied, files that
+                    are already in the cache are placed at their output path instead of being downloaded again.  The
+                    cache may be shared between multiple processes.  Default is None (no cache).
+                cache_max_size (int): The size, in bytes, after which the least recently used files are removed from
+                    the cache.  Default is 10GB.
+                cache_link_mode (str): How cached files are placed at their output paths.  One of 'auto', 'clone',
+                    'reflink', 'hardlink', or 'copy'.  'auto' and 'clone' try a reflink, then a copy.  'hardlink' shares
+                    the cached file's inode with the output, so writing to the output in place also changes the cached
+                    file.  Default is 'auto'.
+                cache_digest (bool): Indicates if cached files are also addressed by the sha256 digest of their
+                    contents so identical files from different urls are only stored once.  Default is False.
+                coalesce (bool): Indicates if a queue downloader makes only one request at a time for duplicate
+                    downloads of the same url with the same config object.  Duplicates that are added while the first
+                    is downloading receive a copy of the downloaded file instead of downloading it again.  Default is
+                    True; set it to False to download every duplicate separately.
+                coalesce_link_mode (str): How coalesced duplicates are placed at their output paths.  See
+                    cache_link_mode for the available modes.  Default is 'clone' (a reflink where supported,
+                    otherwise a full copy).
+                metrics (MetricsRegistry): A registry that records metrics for every download made with this config.
+                    The same registry may be shared between configs.  Default is None (no metrics are recorded).
+                metrics_port (int): When supplied along with a metrics registry, a queue downloader serves the
+                    registry's metrics in the Prometheus text format on this local port while it runs.  Default is
+                    None (no server).
+                progress (ProgressTracker): A tracker that reports the progress of every download made with this
+                    config to its subscribers.  The same tracker may be shared between configs.  Default is None (no
+                    progress is tracked).
+                hooks (DownloadHooks): Hooks that are notified at the start and end of each stage of every download
+                    made with this config, such as the HEAD request, each chunk read, and each disk write, for
+                    attaching tracers and profilers.  Default is None (no hooks are called).
+                decompress (bool): Indicates if compressed files are decompressed while they are downloaded, so that
+                    only the decompressed file is written to disk.  gzip, deflate, bz2, xz, and zstd (if the zstandard
+                    package is installed) are found from the Content-Encoding header or the file extension, which is
+                    removed from names taken from the url.  Multipart downloads are decompressed as their parts are
+                    joined.  Default is False.
+                extract (bool): Indicates if tar archives, which may be compressed as for decompress, are extracted
+                    into the output path, which is used as a directory, while they are downloaded, instead of being
+                    saved.  Default is False.
+                extract_buffer (int): The number of bytes of an archive held in memory between the download and the
+                    extraction.  Parts of multipart extractions are sized so that the parts held by every thread also
+                    fit in this size.  Default is 64MB.
+                post_process (Sequence[Union[str, Callable]]): Stages that a queue downloader runs on each downloaded
+                    file, in order, in a pool of worker processes while other files download.  Each stage is the name of
+                    a built-in stage ('sha256', 'md5', 'decompress', 'validate', or 'thumbnail') or a picklable callable
+                    that takes the path of the file.  The value of each stage is added to the file's response.  Default
+                    is None (no post-processing).
+                post_process_workers (int): The number of worker processes that run the post-processing stages.
+                    Default is the number of CPUs.
+                post_process_pending (int): The number of downloaded files that may wait for post-processing before
+                    the download threads wait for it to catch up.  Default is twice the number of workers.
+                queue_path (str): The path to a SQLite database used as a durable download queue by a queue
+                    downloader, so that pending and unfinished downloads survive a restart.  Several processes may
+                    consume the same queue.  Only the url, output path, and mirrors of each item are stored, and they
+                    are downloaded with the queue downloader's config.  Default is None (an in-memory queue).
+                queue_lease_timeout (float): The seconds after which an item taken from the durable queue by a
+                    process that has stopped renewing its leases, such as one that crashed, is taken by another
+                    process.  Default is 300.
+                queue_max_attempts (int): The number of times an item of the durable queue is attempted before it is
+                    marked as failed.  Default is 3.
+                shard_processes (int): The number of processes that download_list shards its downloads across, each
+                    running its own queue downloader, for workloads of many small files that are bound by a single
+                    process.  Default is 1 (downloads are made in the calling process).
+                memory_limit (Union[int, str, MemoryBudget]): A ceiling on the bytes held in download buffers at once by
+                    every download made with this config, including the chunk buffer of each stream, the buffers
+                    between downloads and their decompression or extraction, and the copy buffer of multipart joins.
+                    Chunk sizes shrink while the limit is nearly reached, and downloads wait for buffers once it is
+                    reached.  A MemoryBudget may be supplied to share one limit between configs.  The limit applies to
+                    each process, except that a ShardedDownloader divides it evenly between its worker processes.
+                    Default is None (no limit).
+                atomic_publish (bool): Indicates if downloaded files are written to a hidden temporary file in their
+                    output directory and renamed to their output path once complete, so that readers never see a
+                    partial file.  Default is False.
+                durability (str): When downloaded files are flushed to disk.  One of 'none' (left to the operating
+                    system), 'file' (each file and its directory are synced before its download finishes), or 'batch'
+                    (files are synced in batches on a background thread, after they are published).  Default is
+                    'none'.
+                sync_batch_files (int): The number of files after which a batch is synced with the 'batch'
+                    durability.  Default is 100.
+                sync_batch_seconds (float): The seconds after which a batch is synced with the 'batch' durability,
+                    however few files it holds.  Default is 1.
+                io_mode (str): How files of at least io_threshold bytes are written.  One of 'buffered' (through the
+                    page cache as usual), 'fadvise' (the page cache is advised to drop each window of the file behind
+                    the write cursor), or 'direct' (written with O_DIRECT, falling back to 'fadvise' where it is not
+                    supported).  Default is 'buffered'.
+                io_threshold (Size): The size from which files are written with the io_mode.  The parts of multipart
+                    downloads of such files, and the joins of their parts, are written with it too.  Default is 1gb.
+                io_window (Size): The number of bytes written between each advice in the 'fadvise' mode, or the size
+                    of the aligned write buffer in the 'direct' mode.  Default is 8mb.
+                segment_dir (Union[str, SegmentSink]): A directory in which downloads no larger than the size
+                    threshold are appended to rolling segment files, indexed by url, instead of being written to their
+                    output paths.  A SegmentSink may be supplied to share one between configs.  Objects stored in
+                    segments are not cached, published, or post-processed.  Default is None.
+                segment_size (Size): The size after which a segment file is closed and a new one started.  Default is
+                    1gb.
+                transport (Union[str, Transport]): The HTTP client that downloads are made with.  One of 'requests' (a
+                    new requests session for each request), 'urllib3' (a single urllib3 pool manager shared by every
+                    download, with less overhead for each request), or 'httpx' (a single httpx client that multiplexes
+                    requests to a host over HTTP/2, which requires httpx[http2]), or a Transport.  Only downloads, their
+                    HEAD requests, and multipart parts use the transport.  Default is 'requests'.
+                dns_ttl (float): The seconds for which the addresses a host resolves to are cached by the 'urllib3'
+                    transport, which should be no longer than the TTL of the hosts' DNS records.  Default is 0, which
+                    resolves each new connection.
+                prewarm (bool): Indicates if the queue downloader opens connections to the hosts of the downloads that
+                    will start next, ahead of them, so that the downloads do not wait on connecting.  Only the 'urllib3'
+                    transport keeps the connections.  Default is False.
+                prewarm_lookahead (int): The number of downloads past the last one started whose hosts are warmed.
+                    Defaults to the number of download threads.
+                circuit_breaker (Union[bool, CircuitBreaker]): Indicates if each host has a circuit that opens after
+                    circuit_failures failed request attempts in a row, after which downloads from the host fail at once
+                    with a CircuitOpenException, and its requests stop retrying, until circuit_reset seconds have passed
+                    and a trial download reaches the host.  A CircuitBreaker may be supplied to share one between
+                    configs.  Default is False.
+                circuit_failures (int): The number of failed request attempts in a row after which a host's circuit
+                    opens.  Default is 5.
+                circuit_reset (float): The number of seconds a host's circuit stays open before a trial download is let
+                    through.  Default is 30.
+                metadata_threads (int): The number of threads with which the queue downloader makes the HEAD requests of
+                    queued downloads ahead of the download threads, so that the download threads only move bytes.
+                    Default is 0, with which each download thread makes the HEAD request of its download.
+                metadata_lookahead (int): The number of downloads that may be resolving or waiting for a download
+                    thread at once.  Defaults to four times the number of metadata threads.
+                metadata_order (str): The order in which resolved downloads are started.  One of 'queue', 'smallest'
+                    (the smallest file first), or 'largest' (the largest file first).  Default is 'queue'.
         """
         self.timeout = kwargs.get('timeout', 10)
         self.retries = kwargs.get('retries', 3)
@@ -68,6 +199,151 @@ class DownloadConfig:
         self.multipart_threads = kwargs.get('multipart_threads', 4)
         self.run_perpetual = kwargs.get('run_perpetual', False)
         self.clean_up_on_fail = kwargs.get('clean_up_on_fail', False)
+        self.cache = self._make_cache(**kwargs)
+        self.coalesce = kwargs.get('coalesce', True)
+        self.coalesce_link_mode = kwargs.get('coalesce_link_mode', 'clone')
+        self.metrics = kwargs.get('metrics', None)
+        self.metrics_port = kwargs.get('metrics_port', None)
+        self.progress = kwargs.get('progress', None)
+        self.hooks = kwargs.get('hooks', None)
+        self.decompress = kwargs.get('decompress', False)
+        self.extract = kwargs.get('extract', False)
+        self.extract_buffer = Size(kwargs.get('extract_buffer', '64mb'))
+        self.post_process = kwargs.get('post_process', None)
+        self.post_process_workers = kwargs.get('post_process_workers', None)
+        self.post_process_pending = kwargs.get('post_process_pending', None)
+        self.queue_path = kwargs.get('queue_path', None)
+        self.queue_lease_timeout = kwargs.get('queue_lease_timeout', 300)
+        self.queue_max_attempts = kwargs.get('queue_max_attempts', 3)
+        self.shard_processes = kwargs.get('shard_processes', 1)
+        self.memory_budget = self._make_memory_budget(kwargs.get('memory_limit', None))
+        self.publisher = self._make_publisher(**kwargs)
+        self.cache_bypass = self._make_cache_bypass(**kwargs)
+        self.segment_sink = self._make_segment_sink(**kwargs)
+        self.transport = self._make_transport(**kwargs)
+        self.prewarm = kwargs.get('prewarm', False)
+        self.prewarm_lookahead = kwargs.get('prewarm_lookahead', None)
+        self.circuit_breaker = self._make_circuit_breaker(**kwargs)
+        self.metadata_threads = kwargs.get('metadata_threads', 0)
+        self.metadata_lookahead = kwargs.get('metadata_lookahead', None)
+        self.metadata_order = kwargs.get('metadata_order', 'queue')
+
+    @staticmethod
+    def _make_transport(**kwargs) -> Transport:
+        """
+        Makes the transport as configured by the kwargs supplied to the class initializer.  A supplied Transport is
+        used as it is.
+        """
+        transport = kwargs.get('transport', 'requests')
+        if isinstance(transport, Transport):
+            return transport
+        dns_ttl = kwargs.get('dns_ttl', 0)
+        return make_transport(transport, dns_cache=DnsCache(dns_ttl) if dns_ttl else None)
+
+    @staticmethod
+    def _make_circuit_breaker(**kwargs) -> Optional[CircuitBreaker]:
+        """
+        Makes the circuit breaker as configured by the kwargs supplied to the class initializer.  A supplied
+        CircuitBreaker is used as it is.
+        """
+        circuit_breaker = kwargs.get('circuit_breaker', False)
+        if isinstance(circuit_breaker, CircuitBreaker):
+            return circuit_breaker
+        if not circuit_breaker:
+            return None
+        return CircuitBreaker(
+            failure_threshold=kwargs.get('circuit_failures', 5),
+            reset_timeout=kwargs.get('circuit_reset', 30),
+        )
+
+    @staticmethod
+    def _make_cache(**kwargs) -> Optional[DownloadCache]:
+        """
+        Makes the download cache as configured by the kwargs supplied to the class initializer.
+
+        Returns:
+            Optional[DownloadCache]: The download cache, or None if no cache directory was supplied.
+        """
+        cache_dir = kwargs.get('cache_dir', None)
+        if cache_dir is None:
+            return None
+        return DownloadCache(
+            path=cache_dir,
+            max_size=Size(kwargs.get('cache_max_size', '10gb')),
+            digest=kwargs.get('cache_digest', False),
+            link_mode=kwargs.get('cache_link_mode', 'auto'),
+        )
+
+    @staticmethod
+    def _make_memory_budget(memory_limit) -> Optional[MemoryBudget]:
+        """
+        Makes the memory budget for the supplied memory limit.
+
+        Returns:
+            Optional[MemoryBudget]: The supplied budget, a new budget of the supplied size, or None if no limit was
+                supplied.
+        """
+        if memory_limit is None or isinstance(memory_limit, MemoryBudget):
+            return memory_limit
+        return MemoryBudget(Size(memory_limit))
+
+    @staticmethod
+    def _make_publisher(**kwargs) -> Optional[FilePublisher]:
+        """
+        Makes the file publisher as configured by the kwargs supplied to the class initializer.
+
+        Returns:
+            Optional[FilePublisher]: The file publisher, or None if files are neither published atomically nor synced.
+        """
+        atomic = kwargs.get('atomic_publish', False)
+        durability = kwargs.get('durability', 'none')
+        if not atomic and durability == 'none':
+            return None
+        return FilePublisher(
+            atomic=atomic,
+            durability=durability,
+            batch_files=kwargs.get('sync_batch_files', 100),
+            batch_seconds=kwargs.get('sync_batch_seconds', 1.0),
+            metrics=kwargs.get('metrics', None),
+        )
+
+    @staticmethod
+    def _make_cache_bypass(**kwargs) -> Optional[CacheBypass]:
+        """
+        Makes the cache bypass as configured by the kwargs supplied to the class initializer.
+
+        Returns:
+            Optional[CacheBypass]: The cache bypass, or None if files are written through the page cache.
+        """
+        io_mode = kwargs.get('io_mode', 'buffered')
+        if io_mode == 'buffered':
+            return None
+        return CacheBypass(
+            mode=io_mode,
+            threshold=Size(kwargs.get('io_threshold', '1gb')),
+            window=Size(kwargs.get('io_window', '8mb')),
+        )
+
+    @staticmethod
+    def _make_segment_sink(**kwargs) -> Optional[SegmentSink]:
+        """
+        Makes the segment sink as configured by the kwargs supplied to the class initializer.
+
+        Returns:
+            Optional[SegmentSink]: The supplied sink, a new sink in the supplied directory, or None if downloads are
+                written to their output paths.
+
+        Raises:
+            ValueError: If post-processing stages are also configured, as they run on files of their own.
+        """
+        segment_dir = kwargs.get('segment_dir', None)
+        if segment_dir is None:
+            return None
+        if kwargs.get('post_process', None):
+            raise ValueError('Post-processing stages can not be run on objects stored in segment files')
+        if isinstance(segment_dir, SegmentSink):
+            return segment_dir
+        return SegmentSink(segment_dir, segment_size=Size(kwargs.get('segment_size', '1gb')))
 
     @property
     def headers(self) -> dict:
@@ -105,6 +381,8 @@ class DownloadConfig:
         return headers
 
     def log_attributes(self, message):
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         logger.debug(
             f'{message}: '
             f'timeout: {self.timeout}, '
@@ -115,5 +393,6 @@ class DownloadConfig:
             f'download_threads: {self.download_threads}, '
             f'multipart_threads: {self.multipart_threads}, '
             f'run_perpetual: {self.run_perpetual}, '
-            f'clean_up_on_fail: {self.clean_up_on_fail}'
+            f'clean_up_on_fail: {self.clean_up_on_fail}, '
+            f'cache_dir: {self.cache.path if self.cache is not None else None}'
         )
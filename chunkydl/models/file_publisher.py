@@ -0,0 +1,251 @@
+import os
+import time
+import uuid
+import logging
+from threading import Condition, Thread
+from typing import Optional
+
+from .metrics import MetricsRegistry
+
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_MODES = ('none', 'file', 'batch')
+
+
+def sync_directory(path: str) -> None:
+    """
+    Flushes a directory's entries to disk, so that files renamed into it survive a crash.  Does nothing on platforms
+    where directories can not be opened.
+    """
+    if os.name == 'nt':
+        return
+    fd = os.open(path or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sync_file(path: str) -> None:
+    """
+    Flushes the contents of a file to disk.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FileSyncer:
+
+    """
+    Flushes published files to disk in batches on a background thread, so that downloads do not wait for each file to
+    be synced.  A batch is synced once it holds batch_files files, or batch_seconds after its first file was added,
+    whichever comes first.  The directory of every file in a batch is synced once after its files.
+
+    Attributes:
+        batch_files (int): The number of files after which a batch is synced.
+        batch_seconds (float): The seconds after which a batch is synced, however few files it holds.
+        metrics (Optional[MetricsRegistry]): The registry the time spent syncing is recorded in.
+
+    Args:
+        batch_files (int): The number of files after which a batch is synced.
+        batch_seconds (float): The seconds after which a batch is synced, however few files it holds.
+        metrics (Optional[MetricsRegistry]): The registry the time spent syncing is recorded in.
+    """
+
+    def __init__(self, batch_files: int = 100, batch_seconds: float = 1.0, metrics: Optional[MetricsRegistry] = None):
+        self.batch_files = batch_files
+        self.batch_seconds = batch_seconds
+        self.metrics = metrics
+        self._pending = []
+        self._first_added = None
+        self._added = 0
+        self._synced = 0
+        self._flushing = False
+        self._condition = Condition()
+        self._thread = None
+
+    def __getstate__(self) -> dict:
+        # the metrics registry belongs to this process, so a copy records nothing until it is given one
+        return {'batch_files': self.batch_files, 'batch_seconds': self.batch_seconds}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def add(self, path: str) -> None:
+        """
+        Adds a file to the current batch.
+        """
+        with self._condition:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='chunkydl-syncer', daemon=True)
+                self._thread.start()
+            if not self._pending:
+                self._first_added = time.monotonic()
+            self._pending.append(path)
+            self._added += 1
+            if len(self._pending) >= self.batch_files:
+                self._condition.notify_all()
+
+    def flush(self) -> None:
+        """
+        Syncs the current batch immediately and waits until every file added so far has been synced.
+        """
+        with self._condition:
+            target = self._added
+            self._flushing = True
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: self._synced >= target)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    if self._pending and (self._flushing or len(self._pending) >= self.batch_files):
+                        break
+                    if self._pending:
+                        remaining = self._first_added + self.batch_seconds - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    else:
+                        self._flushing = False
+                        self._condition.wait()
+                batch, self._pending = self._pending, []
+            self._sync(batch)
+            with self._condition:
+                self._synced += len(batch)
+                if not self._pending:
+                    self._flushing = False
+                self._condition.notify_all()
+
+    def _sync(self, batch: list) -> None:
+        start = time.perf_counter()
+        directories = set()
+        for path in batch:
+            try:
+                sync_file(path)
+                directories.add(os.path.dirname(path))
+            except FileNotFoundError:
+                continue
+            except OSError:
+                logger.error(f'Failed to sync {path}', exc_info=True)
+        for directory in directories:
+            try:
+                sync_directory(directory)
+            except OSError:
+                logger.error(f'Failed to sync directory {directory}', exc_info=True)
+        if self.metrics is not None:
+            self.metrics.observe('sync_seconds', time.perf_counter() - start)
+            self.metrics.increment('files_synced', value=len(batch))
+            self.metrics.increment('sync_batches')
+
+
+class FilePublisher:
+
+    """
+    Publishes downloaded files at their output paths.  With atomic publishing, files are written to a temporary path in
+    the same directory and renamed to their output path once they are complete, so that readers never see a partial
+    file.  The durability mode sets when published files are flushed to disk:
+        - 'none': Files are left for the operating system to flush.
+        - 'file': Each file, and then its directory, is synced before the download finishes.
+        - 'batch': Files are synced in batches by a background FileSyncer, so that many small files share the cost of
+            syncing.  Files are published before they are synced.  flush waits for every published file to be synced.
+
+    Attributes:
+        atomic (bool): Indicates if files are written to a temporary path and renamed to their output path.
+        durability (str): The durability mode.
+        metrics (Optional[MetricsRegistry]): The registry the time spent syncing is recorded in.
+        syncer (Optional[FileSyncer]): The background syncer, in the 'batch' durability mode.
+
+    Args:
+        atomic (bool): Indicates if files are written to a temporary path and renamed to their output path.
+        durability (str): One of 'none', 'file', or 'batch'.
+        batch_files (int): The number of files after which a batch is synced, in the 'batch' durability mode.
+        batch_seconds (float): The seconds after which a batch is synced, in the 'batch' durability mode.
+        metrics (Optional[MetricsRegistry]): The registry the time spent syncing is recorded in.
+    """
+
+    def __init__(self, atomic: bool = True, durability: str = 'none', batch_files: int = 100,
+                 batch_seconds: float = 1.0, metrics: Optional[MetricsRegistry] = None):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f'Unknown durability mode: {durability}')
+        self.atomic = atomic
+        self.durability = durability
+        self.metrics = metrics
+        self.syncer = FileSyncer(batch_files, batch_seconds, metrics) if durability == 'batch' else None
+
+    def __getstate__(self) -> dict:
+        state = {'atomic': self.atomic, 'durability': self.durability}
+        if self.syncer is not None:
+            state.update(batch_files=self.syncer.batch_files, batch_seconds=self.syncer.batch_seconds)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def set_metrics(self, metrics: Optional[MetricsRegistry]) -> None:
+        """
+        Sets the registry the time spent syncing is recorded in, such as after the publisher is copied to another
+        process, which does not receive the registry.
+        """
+        self.metrics = metrics
+        if self.syncer is not None:
+            self.syncer.metrics = metrics
+
+    def temp_path(self, path: str) -> str:
+        """
+        Returns:
+            str: The path that a file is written to before it is published at the supplied path.  This is a hidden
+                file in the same directory, so that it is renamed within a single file system, or the path itself if
+                publishing is not atomic.
+        """
+        if not self.atomic:
+            return path
+        directory, name = os.path.split(path)
+        return os.path.join(directory, f'.{name}.{uuid.uuid4().hex[:12]}.partial')
+
+    def publish(self, temp_path: str, path: str) -> None:
+        """
+        Publishes a complete file, written at the supplied temporary path, at its output path, syncing it as the
+        durability mode requires.
+
+        Args:
+            temp_path (str): The path the file was written to, as returned from temp_path.
+            path (str): The output path of the file.
+        """
+        if self.durability == 'file':
+            start = time.perf_counter()
+            sync_file(temp_path)
+            if temp_path != path:
+                os.replace(temp_path, path)
+            sync_directory(os.path.dirname(path))
+            if self.metrics is not None:
+                self.metrics.observe('sync_seconds', time.perf_counter() - start)
+                self.metrics.increment('files_synced')
+            return
+        if temp_path != path:
+            os.replace(temp_path, path)
+        if self.syncer is not None:
+            self.syncer.add(path)
+
+    def discard(self, temp_path: str, path: str) -> None:
+        """
+        Removes the temporary file of a download that failed.  Nothing is removed if publishing is not atomic.
+        """
+        if temp_path == path:
+            return
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+
+    def flush(self) -> None:
+        """
+        Waits until every published file has been synced, in the 'batch' durability mode.
+        """
+        if self.syncer is not None:
+            self.syncer.flush()
@@ -0,0 +1,177 @@
+import time
+import zlib
+from typing import Any, Iterator, NamedTuple, Optional
+
+
+DISPATCH = 'dispatch'
+DOWNLOAD = 'download'
+HEAD = 'head'
+CONNECT = 'connect'
+CHUNK_BATCH = 'chunk_batch'
+DISK_WRITE = 'disk_write'
+RANGE = 'range'
+JOIN = 'join'
+
+EVENTS = (DISPATCH, DOWNLOAD, HEAD, CONNECT, CHUNK_BATCH, DISK_WRITE, RANGE, JOIN)
+
+
+class DownloadHooks:
+
+    """
+    The base class for hooks that are notified at the start and end of each stage of a download, for attaching tracers
+    and profilers.  Hooks may be supplied to a DownloadConfig with the 'hooks' option.  Subclasses override 'start' and
+    'end'; whatever 'start' returns is passed back to the matching 'end' call, so a span or timer can be carried between
+    the two without any shared state.  When no hooks are configured, no hook code runs at all.
+
+    The events, along with the attributes supplied to 'start' and 'end', are:
+        - dispatch: A QueueDownloader worker handling a queued download.  start: queue_wait.
+        - download: A whole download, including the HEAD request.  start: output_path.
+        - head: The HEAD request.  end: status_code.
+        - connect: A download request, from sending it until the response headers are received, which includes
+            connecting to the host.  start: headers.  end: status_code.
+        - chunk_batch: Reading one chunk of up to chunk_size bytes from a response.  end: bytes.
+        - disk_write: Writing one chunk to disk.  start: bytes.
+        - range: Downloading one part of a multipart download.  start: start, end.  end: bytes_received.
+        - join: Joining the parts of a multipart download into a single file.  start: parts.
+
+    Every 'end' call also receives the exception that ended the stage, if any, as 'error'.  Hooks are called on the
+    download threads, so they must be thread safe, and they should return quickly and not raise.
+
+    Attributes:
+        sample_rate (float): The fraction of downloads, between 0 and 1, for which the hooks are called.
+
+    Args:
+        sample_rate (float): The fraction of downloads, between 0 and 1, for which the hooks are called.  Default is 1.
+    """
+
+    def __init__(self, sample_rate: float = 1.0):
+        self.sample_rate = sample_rate
+
+    def sample(self, url: str) -> bool:
+        """
+        Decides if the hooks are called for the download of a url.  The decision must be the same each time it is made
+        for the same url, as it is made separately by each stage of a download.  The default decision is based on a
+        hash of the url, so the same urls are always sampled.
+
+        Args:
+            url (str): The url being downloaded.
+
+        Returns:
+            bool: True if the hooks are called for the download.
+        """
+        if self.sample_rate >= 1:
+            return True
+        return zlib.crc32(url.encode('utf-8')) < self.sample_rate * 0x100000000
+
+    def start(self, event: str, url: str, **attributes) -> Any:
+        """
+        Called when a stage of a download starts.
+
+        Args:
+            event (str): The name of the stage.
+            url (str): The url being downloaded.
+            **attributes: Details of the stage, as listed in the class description.
+
+        Returns:
+            Any: A value that is passed to the matching 'end' call.
+        """
+        return None
+
+    def end(self, event: str, url: str, context: Any, error: Optional[BaseException] = None, **attributes) -> None:
+        """
+        Called when a stage of a download ends.
+
+        Args:
+            event (str): The name of the stage.
+            url (str): The url being downloaded.
+            context (Any): The value returned from the matching 'start' call.
+            error (Optional[BaseException]): The exception that ended the stage, if it failed.
+            **attributes: Details of the stage, as listed in the class description.
+        """
+
+
+class Span(NamedTuple):
+
+    """
+    A NamedTuple that holds a single stage of a download recorded by a SpanRecorder.
+
+    Attributes:
+        event (str): The name of the stage.
+        url (str): The url being downloaded.
+        start (float): The time.perf_counter value at which the stage started.
+        end (float): The time.perf_counter value at which the stage ended.
+        attributes (dict): The attributes supplied to both the start and end hooks.
+        error (Optional[BaseException]): The exception that ended the stage, if it failed.
+    """
+
+    event: str
+    url: str
+    start: float
+    end: float
+    attributes: dict
+    error: Optional[BaseException] = None
+
+    @property
+    def duration(self) -> float:
+        """
+        Returns:
+            float: The number of seconds the stage took.
+        """
+        return self.end - self.start
+
+
+class SpanRecorder(DownloadHooks):
+
+    """
+    Hooks that record every stage of the sampled downloads as a Span.  Useful for finding where time is spent, and as
+    an example of adapting the hooks to a tracing library.
+
+    Attributes:
+        spans (list[Span]): The recorded spans, in the order they ended.
+    """
+
+    def __init__(self, sample_rate: float = 1.0):
+        super().__init__(sample_rate)
+        self.spans = []
+
+    def start(self, event: str, url: str, **attributes) -> Any:
+        return time.perf_counter(), attributes
+
+    def end(self, event: str, url: str, context: Any, error: Optional[BaseException] = None, **attributes) -> None:
+        start, start_attributes = context
+        self.spans.append(Span(event, url, start, time.perf_counter(), {**start_attributes, **attributes}, error))
+
+
+def select_hooks(config, url: str) -> Optional[DownloadHooks]:
+    """
+    Returns the hooks configured for a download if the download is sampled.
+
+    Args:
+        config (DownloadConfig): The download configuration object.
+        url (str): The url being downloaded.
+
+    Returns:
+        Optional[DownloadHooks]: The hooks to call for the download, or None if there are none to call.
+    """
+    hooks = config.hooks
+    if hooks is None or not hooks.sample(url):
+        return None
+    return hooks
+
+
+def trace_chunks(chunks: Iterator[bytes], hooks: DownloadHooks, url: str) -> Iterator[bytes]:
+    """
+    Wraps an iterator of response chunks so that reading each chunk is reported to the hooks as a chunk_batch event.
+    """
+    while True:
+        context = hooks.start(CHUNK_BATCH, url)
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            hooks.end(CHUNK_BATCH, url, context, bytes=0)
+            return
+        except Exception as e:
+            hooks.end(CHUNK_BATCH, url, context, error=e)
+            raise
+        hooks.end(CHUNK_BATCH, url, context, bytes=len(chunk))
+        yield chunk
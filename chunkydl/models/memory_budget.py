@@ -0,0 +1,126 @@
+from contextlib import contextmanager, nullcontext
+from threading import Condition
+from typing import ContextManager, Optional
+
+
+MIN_BUFFER_SIZE = 64 * 1024
+
+
+class MemoryBudget:
+
+    """
+    A ceiling on the bytes held in download buffers at once, shared by every download made with the configs that hold
+    it.  Streams reserve their chunk buffers, along with any write-behind buffers such as those of decompression and
+    extraction, and multipart joins reserve their copy buffer, before they allocate them.
+
+    A reservation is granted as much of the requested size as is free, down to a minimum, so that chunk sizes shrink
+    while the budget is nearly exhausted.  When less than the minimum is free, the reservation waits for other
+    reservations to be released.  Every stream makes a single reservation for all of its buffers, so a reservation is
+    never held while waiting for another.
+
+    A budget only counts the reservations made in its own process.  A budget copied to another process, such as by
+    pickling, starts with nothing reserved.
+
+    Attributes:
+        limit (int): The maximum number of bytes reserved at once.
+        used (int): The number of bytes currently reserved.
+        peak (int): The largest number of bytes reserved at once.
+        waiting (int): The number of reservations currently waiting for bytes to be released.
+
+    Args:
+        limit (int): The maximum number of bytes reserved at once.
+    """
+
+    def __init__(self, limit: int):
+        if limit <= 0:
+            raise ValueError('The memory limit must be greater than 0')
+        self.limit = int(limit)
+        self.used = 0
+        self.peak = 0
+        self.waiting = 0
+        self._condition = Condition()
+
+    def __getstate__(self) -> dict:
+        return {'limit': self.limit}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def acquire(self, size: int, minimum: Optional[int] = None) -> int:
+        """
+        Reserves up to size bytes, waiting until at least minimum bytes are free.  Sizes larger than the limit are
+        reduced to the limit, so that no reservation waits forever.
+
+        Args:
+            size (int): The number of bytes wanted.
+            minimum (Optional[int]): The smallest number of bytes that may be granted.  Defaults to size.
+
+        Returns:
+            int: The number of bytes reserved, which must be passed to release.
+        """
+        size = min(int(size), self.limit)
+        minimum = size if minimum is None else min(int(minimum), size)
+        with self._condition:
+            if self.limit - self.used < minimum:
+                self.waiting += 1
+                try:
+                    self._condition.wait_for(lambda: self.limit - self.used >= minimum)
+                finally:
+                    self.waiting -= 1
+            granted = min(size, self.limit - self.used)
+            self.used += granted
+            self.peak = max(self.peak, self.used)
+        return granted
+
+    def release(self, size: int) -> None:
+        """
+        Releases bytes reserved with acquire.
+        """
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, size: int, minimum: Optional[int] = None):
+        """
+        Reserves bytes as acquire does for the duration of a with block, which receives the number of bytes reserved.
+        """
+        granted = self.acquire(size, minimum)
+        try:
+            yield granted
+        finally:
+            self.release(granted)
+
+    def usage(self) -> dict:
+        """
+        Returns:
+            dict: The limit, used, peak, and waiting values of the budget.
+        """
+        with self._condition:
+            return {'limit': self.limit, 'used': self.used, 'peak': self.peak, 'waiting': self.waiting}
+
+
+def reserve_buffers(budget: Optional[MemoryBudget], buffer_size: int, count: int = 1) -> ContextManager[int]:
+    """
+    Reserves count buffers of up to buffer_size bytes each from a budget, for the duration of a with block, which
+    receives the size that each buffer may use.  Buffers shrink down to MIN_BUFFER_SIZE while the budget is nearly
+    exhausted.  Without a budget, the with block receives buffer_size.
+
+    Args:
+        budget (Optional[MemoryBudget]): The budget the buffers are reserved from, if any.
+        buffer_size (int): The size wanted for each buffer.
+        count (int): The number of buffers.
+
+    Returns:
+        ContextManager[int]: A context manager that gives the size of each buffer.
+    """
+    buffer_size = int(buffer_size)
+    if budget is None:
+        return nullcontext(buffer_size)
+    return _reserve_buffers(budget, buffer_size, count)
+
+
+@contextmanager
+def _reserve_buffers(budget: MemoryBudget, buffer_size: int, count: int):
+    with budget.reserve(buffer_size * count, min(buffer_size, MIN_BUFFER_SIZE) * count) as granted:
+        yield max(granted // count, 1)
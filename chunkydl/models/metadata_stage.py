@@ -0,0 +1,143 @@
+import heapq
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import count
+from threading import Condition, RLock
+from typing import Callable, Optional
+
+from .data_models import DLGroup, HeadResult
+from .hooks import select_hooks
+from .circuit_breaker import get_origin
+from chunkydl.download import _resolve_head
+
+
+logger = logging.getLogger(__name__)
+
+METADATA_ORDERS = ('queue', 'smallest', 'largest')
+
+
+class MetadataStage:
+
+    """
+    Resolves the HEAD responses of queued downloads in its own pool of threads, ahead of the workers that download
+    them, so that the workers only move bytes.  The HEAD requests are cheap, so the pool may be much larger than the
+    number of download threads.
+
+    Each resolved download waits until a download thread is free and is then dispatched with its HEAD response, which
+    the download uses to choose between a single or multipart download, name its file, and check the download cache.
+    Waiting downloads are dispatched in the chosen order:
+        - 'queue': The order in which they were queued.
+        - 'smallest': The smallest file first, so that the most files are complete soonest.
+        - 'largest': The largest file first, so that a large file is not left running alone at the end.
+    Downloads whose HEAD request failed are dispatched first, with the error, so that they fail through the usual
+    path.
+
+    Attributes:
+        order (str): The order in which resolved downloads are dispatched.
+        lookahead (int): The number of downloads that may be resolving or waiting to be dispatched at once.
+        slots (int): The number of dispatched downloads that may be running at once.
+        executor (ThreadPoolExecutor): The pool that makes the HEAD requests.
+
+    Args:
+        dispatch (Callable): Starts a resolved download, as dispatch(dl_group, queued_at, head, error), returning the
+            future of the download.
+        threads (int): The number of threads that make HEAD requests.
+        slots (int): The number of dispatched downloads that may be running at once.
+        lookahead (Optional[int]): The number of downloads that may be resolving or waiting to be dispatched at once.
+            Defaults to four times the number of threads.
+        order (str): One of 'queue', 'smallest', or 'largest'.  Default is 'queue'.
+
+    Raises:
+        ValueError: If the order is not one of METADATA_ORDERS.
+    """
+
+    def __init__(self, dispatch: Callable[..., Future], threads: int, slots: int, lookahead: Optional[int] = None,
+                 order: str = 'queue'):
+        if order not in METADATA_ORDERS:
+            raise ValueError(f'Unknown metadata order: {order}')
+        self.order = order
+        self.lookahead = lookahead or threads * 4
+        self.slots = slots
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='chunkydl-metadata')
+        self._dispatch = dispatch
+        self._lock = RLock()
+        self._changed = Condition(self._lock)
+        self._sequence = count()
+        self._ready = []
+        self._resolving = 0
+        self._running = 0
+        self._pumping = False
+
+    def submit(self, dl_group: DLGroup, queued_at: Optional[float] = None) -> None:
+        """
+        Adds a download to be resolved, waiting while the lookahead is full.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._resolving + len(self._ready) < self.lookahead)
+            self._resolving += 1
+        self.executor.submit(self._resolve, dl_group, queued_at)
+
+    def _resolve(self, dl_group: DLGroup, queued_at: Optional[float]) -> None:
+        url, _, config = dl_group[:3]
+        head = error = None
+        try:
+            if config.circuit_breaker is not None:
+                config.circuit_breaker.check(url, get_origin(url))
+            hooks = select_hooks(config, url) if config.hooks is not None else None
+            head = _resolve_head(url, config, hooks)
+        except Exception as e:
+            error = e
+        if error is not None:
+            key = float('-inf')
+        elif self.order == 'smallest':
+            key = head.size
+        elif self.order == 'largest':
+            key = -head.size
+        else:
+            key = 0
+        with self._changed:
+            heapq.heappush(self._ready, (key, next(self._sequence), dl_group, queued_at, head, error))
+            self._resolving -= 1
+            self._pump()
+
+    def _pump(self) -> None:
+        """
+        Dispatches waiting downloads while there are free slots.  Must be called while holding the lock.
+        """
+        # a download that ends at once calls back into _pump through _finished, which this loop covers
+        if self._pumping:
+            return
+        self._pumping = True
+        try:
+            while self._ready and self._running < self.slots:
+                _, _, dl_group, queued_at, head, error = heapq.heappop(self._ready)
+                self._running += 1
+                try:
+                    future = self._dispatch(dl_group, queued_at, head, error)
+                except Exception:
+                    self._running -= 1
+                    logger.error(f'Failed to dispatch download of {dl_group[0]}', exc_info=True)
+                    continue
+                future.add_done_callback(self._finished)
+        finally:
+            self._pumping = False
+            self._changed.notify_all()
+
+    def _finished(self, future: Future) -> None:
+        with self._changed:
+            self._running -= 1
+            self._pump()
+
+    def join(self) -> None:
+        """
+        Waits until every submitted download has been resolved, dispatched, and has finished.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: not self._resolving and not self._ready and not self._running)
+
+    def shutdown(self) -> None:
+        """
+        Waits for every submitted download as join does, then stops the pool.
+        """
+        self.join()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,407 @@
+import time
+import weakref
+import logging
+from bisect import bisect_left
+from collections import deque
+from threading import local, RLock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Optional, Sequence
+
+from chunkydl.runner import Runner
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+COUNTERS = {
+    'downloads_started': 'Downloads that have been started.',
+    'downloads_completed': 'Downloads that have completed successfully.',
+    'downloads_failed': 'Downloads that have failed.',
+    'retries': 'Requests that have been retried.',
+    'ranges_started': 'Multipart ranges that have been started.',
+    'ranges_finished': 'Multipart ranges that have finished, successfully or not.',
+    'files_synced': 'Published files that have been flushed to disk.',
+    'sync_batches': 'Batches of published files that have been flushed to disk together.',
+}
+
+HISTOGRAMS = {
+    'head_seconds': 'Latency of the HEAD request made before each download.',
+    'ttfb_seconds': 'Time between sending a download request and receiving the response headers.',
+    'download_seconds': 'Total time taken by each download.',
+    'sync_seconds': 'Time taken to flush each published file, or each batch of files, to disk.',
+}
+
+
+class MetricsShard:
+
+    """
+    The metrics recorded by a single thread.  Each thread only ever writes to its own shard, so recording a metric never
+    needs a lock.  The registry merges all shards when the metrics are read.
+
+    Attributes:
+        bytes_received (int): The number of bytes received by this thread.
+        counters (dict): A mapping of (name, host) to the count recorded for that name and host.
+        histograms (dict): A mapping of name to a list holding the count in each bucket, the sum of all observed
+            values, and the number of observations.
+    """
+
+    __slots__ = ('bytes_received', 'counters', 'histograms')
+
+    def __init__(self):
+        self.bytes_received = 0
+        self.counters = {}
+        self.histograms = {}
+
+
+class _ShardOwner:
+
+    """
+    Holds a thread's shard in the registry's thread local storage.  The owner is released when its thread exits, which
+    retires the shard.
+    """
+
+    __slots__ = ('shard', '__weakref__')
+
+    def __init__(self, shard: MetricsShard):
+        self.shard = shard
+
+
+class MetricsRegistry:
+
+    """
+    A registry of metrics describing the current state of downloads.  The registry may be supplied to a DownloadConfig
+    with the 'metrics' option, and is then updated by every download made with that config.
+
+    Updates are lock free: each thread records its metrics in its own MetricsShard, and the shards are only merged when
+    the metrics are read through snapshot or render.  When a thread exits, its shard is merged into the totals of the
+    retired threads, so that the short lived threads of multipart downloads do not leave a shard each behind.  Gauges,
+    such as the depth of a queue, are registered as callables and are only evaluated when the metrics are read.
+
+    Attributes:
+        buckets (Sequence[float]): The upper bounds, in seconds, of the latency histogram buckets.
+        rate_window (float): The number of seconds over which the bytes per second rate is calculated.
+
+    Args:
+        buckets (Sequence[float]): The upper bounds, in seconds, of the latency histogram buckets.
+        rate_window (float): The number of seconds over which the bytes per second rate is calculated.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS, rate_window: float = 10):
+        self.buckets = tuple(sorted(buckets))
+        self.rate_window = rate_window
+        self._local = local()
+        self._shards = []
+        self._retired = MetricsShard()
+        self._lock = RLock()
+        self._gauges = {}
+        self._rate_samples = deque([(time.monotonic(), 0)])
+
+    def shard(self) -> MetricsShard:
+        """
+        Returns the shard of the calling thread, creating it the first time a thread records a metric.  Hot loops may
+        hold on to the returned shard and update its bytes_received directly.
+
+        Returns:
+            MetricsShard: The calling thread's shard.
+        """
+        try:
+            return self._local.owner.shard
+        except AttributeError:
+            shard = MetricsShard()
+            with self._lock:
+                self._shards.append(shard)
+            owner = self._local.owner = _ShardOwner(shard)
+            weakref.finalize(owner, self._retire, weakref.ref(self), shard)
+            return shard
+
+    @staticmethod
+    def _retire(registry_ref: weakref.ref, shard: MetricsShard) -> None:
+        """
+        Merges the shard of a thread that has exited into the retired totals, and stops reading it separately.
+        """
+        registry = registry_ref()
+        if registry is None:
+            return
+        with registry._lock:
+            registry._merge(registry._retired, shard)
+            registry._shards.remove(shard)
+
+    def add_bytes(self, count: int) -> None:
+        """
+        Records the supplied number of bytes as received.
+        """
+        self.shard().bytes_received += count
+
+    def increment(self, name: str, host: Optional[str] = None, value: int = 1) -> None:
+        """
+        Increments a counter.
+
+        Args:
+            name (str): The name of the counter.
+            host (Optional[str]): The host that the counter applies to, if any.
+            value (int): The amount by which the counter is incremented.
+        """
+        counters = self.shard().counters
+        key = (name, host)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        """
+        Records a value in a histogram.
+
+        Args:
+            name (str): The name of the histogram.
+            value (float): The observed value, in seconds.
+        """
+        histograms = self.shard().histograms
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        histogram[0][bisect_left(self.buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    def register_gauge(self, name: str, func: Callable[[], float]) -> None:
+        """
+        Registers a gauge whose value is read from the supplied callable each time the metrics are read.
+
+        Args:
+            name (str): The name of the gauge.
+            func (Callable[[], float]): A callable that returns the current value of the gauge.
+        """
+        with self._lock:
+            self._gauges[name] = func
+
+    def unregister_gauge(self, name: str) -> None:
+        """
+        Removes a previously registered gauge.
+        """
+        with self._lock:
+            self._gauges.pop(name, None)
+
+    def snapshot(self) -> dict:
+        """
+        Merges the metrics recorded by every thread and returns them.
+
+        Returns:
+            dict: A dict holding:
+                - bytes_received (int): The total bytes received.
+                - bytes_per_second (float): The rate at which bytes were received over the rate window.
+                - in_flight_downloads (int): The number of downloads currently in progress.
+                - in_flight_ranges (int): The number of multipart ranges currently in progress.
+                - counters (dict): A mapping of counter name to a mapping of host to count.
+                - histograms (dict): A mapping of histogram name to a dict of cumulative 'buckets', 'sum', and 'count'.
+                - gauges (dict): A mapping of gauge name to its current value.
+        """
+        with self._lock:
+            gauges = dict(self._gauges)
+        totals = self.totals()
+        received = totals.bytes_received
+        counters = {}
+        for (name, host), value in totals.counters.items():
+            counters.setdefault(name, {})[host] = value
+        histograms = totals.histograms
+        return {
+            'bytes_received': received,
+            'bytes_per_second': self._rate(received),
+            'in_flight_downloads': self._total(counters, 'downloads_started') -
+                                   self._total(counters, 'downloads_completed') -
+                                   self._total(counters, 'downloads_failed'),
+            'in_flight_ranges': self._total(counters, 'ranges_started') - self._total(counters, 'ranges_finished'),
+            'counters': counters,
+            'histograms': {name: self._cumulative(*values) for name, values in histograms.items()},
+            'gauges': {name: self._read_gauge(name, func) for name, func in gauges.items()},
+        }
+
+    def totals(self) -> MetricsShard:
+        """
+        Merges the metrics recorded by every thread into a single shard, such as for sending the metrics of a process to
+        the registry of another process.
+
+        Returns:
+            MetricsShard: A new shard holding the totals of every shard.
+        """
+        totals = MetricsShard()
+        with self._lock:
+            shards = list(self._shards)
+            self._merge(totals, self._retired)
+        for shard in shards:
+            self._merge(totals, shard)
+        return totals
+
+    def _merge(self, totals: MetricsShard, shard: MetricsShard) -> None:
+        """
+        Adds the values of a shard to the supplied totals.
+        """
+        totals.bytes_received += shard.bytes_received
+        for key, value in shard.counters.copy().items():
+            totals.counters[key] = totals.counters.get(key, 0) + value
+        for name, (counts, total, count) in shard.histograms.copy().items():
+            merged = totals.histograms.setdefault(name, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            for index, bucket_count in enumerate(list(counts)):
+                merged[0][index] += bucket_count
+            merged[1] += total
+            merged[2] += count
+
+    def add_shard(self, shard: MetricsShard) -> MetricsShard:
+        """
+        Adds a shard that is not owned by any thread of this process, such as one holding the totals of another
+        process, which is merged with the other shards when the metrics are read.  The shard's values may be replaced
+        at any time.
+
+        Args:
+            shard (MetricsShard): The shard to add.
+
+        Returns:
+            MetricsShard: The added shard.
+        """
+        with self._lock:
+            self._shards.append(shard)
+        return shard
+
+    def render(self) -> str:
+        """
+        Renders the current metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The rendered metrics.
+        """
+        snapshot = self.snapshot()
+        lines = [
+            '# HELP chunkydl_bytes_received_total Bytes received by all downloads.',
+            '# TYPE chunkydl_bytes_received_total counter',
+            f'chunkydl_bytes_received_total {snapshot["bytes_received"]}',
+            '# HELP chunkydl_bytes_per_second Rate at which bytes are being received.',
+            '# TYPE chunkydl_bytes_per_second gauge',
+            f'chunkydl_bytes_per_second {snapshot["bytes_per_second"]}',
+            '# HELP chunkydl_in_flight_downloads Downloads currently in progress.',
+            '# TYPE chunkydl_in_flight_downloads gauge',
+            f'chunkydl_in_flight_downloads {snapshot["in_flight_downloads"]}',
+            '# HELP chunkydl_in_flight_ranges Multipart ranges currently in progress.',
+            '# TYPE chunkydl_in_flight_ranges gauge',
+            f'chunkydl_in_flight_ranges {snapshot["in_flight_ranges"]}',
+        ]
+        for name, hosts in sorted(snapshot['counters'].items()):
+            metric = f'chunkydl_{name}_total'
+            lines.append(f'# HELP {metric} {COUNTERS.get(name, name)}')
+            lines.append(f'# TYPE {metric} counter')
+            for host, value in sorted(hosts.items(), key=lambda item: item[0] or ''):
+                labels = f'{{host="{self._escape(host)}"}}' if host is not None else ''
+                lines.append(f'{metric}{labels} {value}')
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            metric = f'chunkydl_{name}'
+            lines.append(f'# HELP {metric} {HISTOGRAMS.get(name, name)}')
+            lines.append(f'# TYPE {metric} histogram')
+            for bound, count in histogram['buckets']:
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+            lines.append(f'{metric}_sum {histogram["sum"]}')
+            lines.append(f'{metric}_count {histogram["count"]}')
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append(f'# TYPE chunkydl_{name} gauge')
+            lines.append(f'chunkydl_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def _rate(self, received: int) -> float:
+        now = time.monotonic()
+        with self._lock:
+            self._rate_samples.append((now, received))
+            while len(self._rate_samples) > 2 and now - self._rate_samples[1][0] >= self.rate_window:
+                self._rate_samples.popleft()
+            start_time, start_received = self._rate_samples[0]
+        elapsed = now - start_time
+        return (received - start_received) / elapsed if elapsed > 0 else 0.0
+
+    def _cumulative(self, counts: list, total: float, count: int) -> dict:
+        buckets = []
+        running = 0
+        for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+            running += bucket_count
+            buckets.append((bound, running))
+        return {'buckets': buckets, 'sum': total, 'count': count}
+
+    @staticmethod
+    def _total(counters: dict, name: str) -> int:
+        return sum(counters.get(name, {}).values())
+
+    @staticmethod
+    def _read_gauge(name: str, func: Callable[[], float]) -> Optional[float]:
+        try:
+            return func()
+        except Exception:
+            logger.error(f'Failed to read metrics gauge {name}', exc_info=True)
+            return None
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsServer(Runner):
+
+    """
+    A small HTTP server, run in its own thread, that serves the metrics of a MetricsRegistry in the Prometheus text
+    exposition format at /metrics.  The server is bound when it is instantiated, so the port is available before the
+    thread is started.
+
+    Attributes:
+        registry (MetricsRegistry): The registry whose metrics are served.
+        server (ThreadingHTTPServer): The underlying HTTP server.
+
+    Args:
+        registry (MetricsRegistry): The registry whose metrics are served.
+        port (int): The port to listen on.  Supplying 0 binds to a free port, see the 'port' property.
+        host (str): The address to listen on.  Default is the local loopback address.
+    """
+
+    def __init__(self, registry: MetricsRegistry, port: int = 0, host: str = '127.0.0.1'):
+        super().__init__()
+        self.daemon = True
+        self.registry = registry
+        self.server = ThreadingHTTPServer((host, port), self._make_handler(registry))
+        self.server.daemon_threads = True
+
+    @property
+    def port(self) -> int:
+        """
+        Returns:
+            int: The port the server is listening on.
+        """
+        return self.server.server_address[1]
+
+    def run(self) -> None:
+        """
+        Serves requests until the server is stopped.
+        """
+        logger.info(f'Serving metrics on port {self.port}')
+        self.server.serve_forever()
+
+    def stop(self) -> None:
+        """
+        Stops serving requests and closes the server's socket.
+        """
+        super().stop()
+        if self.is_alive():
+            self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def _make_handler(registry: MetricsRegistry) -> type:
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f'Metrics request: {format % args}')
+
+        return MetricsHandler
@@ -0,0 +1,128 @@
+import logging
+from threading import Lock
+from typing import Optional, Sequence
+
+
+logger = logging.getLogger(__name__)
+
+
+class Mirror:
+
+    """
+    The observed state of a single mirror of a file.
+
+    Attributes:
+        url (str): The url of the file on the mirror.
+        rate (Optional[float]): The smoothed transfer rate of a single range from the mirror, in bytes per second, or
+            None if no range has been downloaded from it yet.
+        in_flight (int): The number of ranges currently being downloaded from the mirror.
+        completed (int): The number of ranges downloaded from the mirror.
+        dropped (Optional[str]): The reason the mirror was dropped, or None if it is still in use.
+    """
+
+    __slots__ = ('url', 'rate', 'in_flight', 'completed', 'dropped')
+
+    def __init__(self, url: str):
+        self.url = url
+        self.rate = None
+        self.in_flight = 0
+        self.completed = 0
+        self.dropped = None
+
+
+class MirrorPool:
+
+    """
+    Chooses which mirror each range of a multipart download is requested from.  Every mirror is tried once, then ranges
+    are weighted toward the mirrors with the highest observed transfer rate, shared out by the number of ranges each
+    mirror is already serving.  As rates are re-measured after every range, the weighting follows mirrors that speed up
+    or slow down during the download.  Mirrors that fail or serve inconsistent content are dropped, except for the last
+    remaining mirror, whose failures are left to the caller.
+
+    Attributes:
+        mirrors (list[Mirror]): The state of each mirror, the primary url first.
+        smoothing (float): The weight given to the most recent rate sample of a mirror, between 0 and 1.
+
+    Args:
+        urls (Sequence[str]): The urls of the file on every mirror.  Duplicates are ignored.
+        smoothing (float): The weight given to the most recent rate sample of a mirror, between 0 and 1.
+    """
+
+    def __init__(self, urls: Sequence[str], smoothing: float = 0.5):
+        self.mirrors = [Mirror(url) for url in dict.fromkeys(urls)]
+        self.smoothing = smoothing
+        self._lock = Lock()
+
+    @property
+    def available(self) -> list:
+        """
+        Returns:
+            list[Mirror]: The mirrors that have not been dropped.
+        """
+        return [mirror for mirror in self.mirrors if mirror.dropped is None]
+
+    def choose(self) -> Mirror:
+        """
+        Chooses the mirror for the next range and counts the range as in flight on it.
+
+        Returns:
+            Mirror: The chosen mirror.
+        """
+        with self._lock:
+            mirror = max(self.available, key=self._score)
+            mirror.in_flight += 1
+            return mirror
+
+    def record(self, mirror: Mirror, bytes_received: int, seconds: float) -> None:
+        """
+        Records a range that was downloaded from a mirror.
+
+        Args:
+            mirror (Mirror): The mirror the range was downloaded from.
+            bytes_received (int): The size of the range.
+            seconds (float): The time taken to transfer the range.
+        """
+        with self._lock:
+            mirror.in_flight -= 1
+            mirror.completed += 1
+            if seconds <= 0:
+                return
+            rate = bytes_received / seconds
+            mirror.rate = rate if mirror.rate is None else self.smoothing * rate + (1 - self.smoothing) * mirror.rate
+
+    def fail(self, mirror: Mirror, reason: str) -> bool:
+        """
+        Records a range that could not be downloaded from a mirror, dropping the mirror if any other mirror remains.
+
+        Args:
+            mirror (Mirror): The mirror the range was requested from.
+            reason (str): A description of the failure.
+
+        Returns:
+            bool: True if the mirror was dropped and the range may be requested from another mirror, False if the
+                mirror was the last one remaining.
+        """
+        with self._lock:
+            mirror.in_flight -= 1
+            if mirror.dropped is not None:
+                return True
+            if len(self.available) <= 1:
+                return False
+            mirror.dropped = reason
+        logger.warning(f'Dropped mirror {mirror.url}: {reason}')
+        return True
+
+    @staticmethod
+    def _score(mirror: Mirror) -> tuple:
+        rate = float('inf') if mirror.rate is None else mirror.rate
+        return rate / (mirror.in_flight + 1), -mirror.in_flight
+
+
+def strip_etag(etag: Optional[str]) -> Optional[str]:
+    """
+    Returns:
+        Optional[str]: The supplied ETag without a weak validator prefix, for comparing ETags from different mirrors.
+    """
+    if etag is None:
+        return None
+    return etag[2:] if etag.startswith('W/') else etag
@@ -1,16 +1,28 @@
 import os
+import time
 import shutil
 import tempfile
 import logging
-from copy import deepcopy
+import requests
+from copy import copy
+from functools import partial
 from concurrent.futures import ThreadPoolExecutor
 from queue import Queue
-from typing import BinaryIO
+from typing import BinaryIO, Optional, Sequence, Tuple
 
 from .download_config import DownloadConfig
+from .data_models import RangeTiming, Timing
+from .progress import FileCounter, ProgressCounter
+from .hooks import DownloadHooks, RANGE, JOIN
+from .mirror_pool import Mirror, MirrorPool, strip_etag
+from .decompressor import DecompressingWriter, detect_encoding
+from .memory_budget import reserve_buffers
+from .cache_bypass import CacheBypass, drop_cache, open_output
+from .data_models import Response
 from chunkydl.runner import Runner
 from chunkydl.core import download_actual
-from chunkydl.utils import get_output
+from chunkydl.utils import get_output, get_name_from_url
+from chunkydl.exceptions import InconsistentMirrorException
 
 
 logger = logging.getLogger(__name__)
@@ -35,10 +47,26 @@ class MultiPartDownloader(Runner):
             instantiating this class.
         config (DownloadConfig): The download configuration object that holds the setup variables for this download.
         part_count (int): The number of parts to download.
-        failed_parts (list): A list of failed download parts.
+        failed_parts (int): The number of parts that failed to download.
         executor (ThreadPoolExecutor): A thread pool executor to use for downloading file chunks.
         part_queue (Queue): A queue that holds download parts awaiting download.
         temp_path (str): The directory to save the downloaded file parts until they can be joined together.
+        range_timings (list[RangeTiming]): The timing of each downloaded part.
+        transfer_time (float): The seconds from the first part starting to the last part finishing.
+        join_time (float): The seconds spent joining the parts into a single file.
+        progress (Optional[FileCounter]): The counter to which the progress of each part is added.
+        hooks (Optional[DownloadHooks]): Hooks that are notified of each part and of the join.
+        mirror_pool (MirrorPool): Chooses the url each part is requested from when the file is available from
+            multiple mirrors.
+        etag (Optional[str]): The ETag of the file, which the response for every part must match if the part's
+            response has an ETag.
+        ranges (Optional[list[tuple]]): The first and last byte of each part to download, or None to download the
+            whole file in parts of the config's size threshold.  When supplied, the output file must already exist,
+            and each part is written into it at its offset, leaving the rest of the file as it is.
+        cache_bypass (Optional[CacheBypass]): The config's cache bypass, if the file is large enough to be written
+            with it.  The parts, and the joined file, are then written without filling the page cache.
+        content_encoding (Optional[str]): The Content-Encoding of the file.  The parts are ranges of the encoded file,
+            so they are saved undecoded, and decoded as they are joined (see join_encoding).
 
     Args:
         url (str): The url of the large file that is to be downloaded.
@@ -48,9 +76,21 @@ class MultiPartDownloader(Runner):
         file_size (int): The size of the file, in bytes.  This value should be retrieved from the host server prior to
             instantiating this class.
         config (DownloadConfig): The download configuration object that holds the setup variables for this download.
+        progress (Optional[FileCounter]): The counter to which the progress of each part is added.
+        hooks (Optional[DownloadHooks]): Hooks that are notified of each part and of the join.
+        mirrors (Sequence[str]): The urls of the same file on other mirrors.  Parts are spread across the url and all
+            of its mirrors, weighted toward the fastest, and mirrors that fail or serve a file with a different size
+            or ETag are dropped.
+        etag (Optional[str]): The ETag of the file, as returned by the HEAD request.
+        ranges (Optional[Sequence[tuple]]): The first and last byte of each part to download into the existing output
+            file.  If not supplied, the whole file is downloaded.
+        content_encoding (Optional[str]): The Content-Encoding of the file, as returned by the HEAD request.
     """
 
-    def __init__(self, url: str, output_path: str, file_size: int, config: DownloadConfig):
+    def __init__(self, url: str, output_path: str, file_size: int, config: DownloadConfig,
+                 progress: Optional[FileCounter] = None, hooks: Optional[DownloadHooks] = None,
+                 mirrors: Sequence[str] = (), etag: Optional[str] = None, ranges: Optional[Sequence[tuple]] = None,
+                 content_encoding: Optional[str] = None):
         super().__init__()
         self.url = url
         self.output_path = output_path
@@ -62,6 +102,19 @@ class MultiPartDownloader(Runner):
         self.executor = ThreadPoolExecutor(self.config.multipart_threads)
         self.part_queue = Queue()
         self.temp_path = None
+        self.range_timings = []
+        self.transfer_time = 0.0
+        self.join_time = 0.0
+        self.progress = progress
+        self.hooks = hooks
+        self.mirror_pool = MirrorPool([url, *mirrors])
+        self.etag = etag
+        self.ranges = list(ranges) if ranges is not None else None
+        if content_encoding is not None and content_encoding.strip().lower() == 'identity':
+            content_encoding = None
+        self.content_encoding = content_encoding or None
+        bypass = config.cache_bypass
+        self.cache_bypass: Optional[CacheBypass] = bypass if bypass is not None and bypass.applies(file_size) else None
         self.config.log_attributes('Multi-part downloader configured with following options')
 
     def run(self) -> None:
@@ -69,22 +122,40 @@ class MultiPartDownloader(Runner):
         Determines the number of chunks along with the start and end byte range of the file, then queues the download
         parts and starts the extractor which will download the parts.  After the extractor completes the downloads and
         shuts down, the join file method is called.
+
+        Raises:
+            Exception: The error of the first part that failed to download, in which case the parts are not joined.
         """
-        chunks = range(0, self.file_size, self.config.size_threshold)
+        if self.ranges is not None:
+            chunks = self.ranges
+        else:
+            chunks = [(start, start + self.config.size_threshold - 1)
+                      for start in range(0, self.file_size, self.config.size_threshold)]
         self.part_count = len(chunks)
-        for part, start in enumerate(chunks):
-            self.part_queue.put((part, start))
+        for part, (start, end) in enumerate(chunks):
+            self.part_queue.put((part, start, end))
         self.part_queue.put(None)
+        transfer_start = time.perf_counter()
+        futures = []
         while self.continue_run:
             item = self.part_queue.get()
             if item is not None:
-                part, start = item
-                end = start + self.config.size_threshold - 1
+                part, start, end = item
                 out_path = self.get_output_path(part)
-                self.executor.submit(self.download_part, start=start, end=end, output_path=out_path)
+                futures.append(self.executor.submit(self.download_part, start=start, end=end, output_path=out_path))
             else:
                 break
         self.executor.shutdown(wait=True)
+        self.transfer_time = time.perf_counter() - transfer_start
+        try:
+            for future in futures:
+                future.result()
+        except Exception:
+            self.failed_parts = sum(1 for future in futures if future.exception() is not None)
+            logger.error(f'{self.failed_parts} of {self.part_count} parts of {self.url} failed to download')
+            if self.clean_up_on_fail:
+                self.remove_temp_path()
+            raise
         self.join_file()
 
     def download_part(self, start: int, end: int, output_path: str) -> None:
@@ -97,43 +168,193 @@ class MultiPartDownloader(Runner):
             output_path: The path that the file part will be saved to.
         """
         logger.debug(f'Downloading part to {output_path}: start: {start} - end: {end}')
-        config = deepcopy(self.config)
-        headers = self.config.get_headers(range=f'bytes={start}-{end}')
-        config.headers = headers
-        download_actual(
-            url=self.url,
-            output_path=output_path,
-            config=self.config,
-        )
+        config = copy(self.config)
+        config.headers = self.config.get_headers(range=f'bytes={start}-{end}')
+        end = min(end, self.file_size - 1)
+        progress = self.progress.start_range(start, end) if self.progress is not None else None
+        if config.metrics is not None:
+            config.metrics.increment('ranges_started')
+        hooks = self.hooks
+        context = hooks.start(RANGE, self.url, start=start, end=end) if hooks is not None else None
+        try:
+            response, mirror = self.download_range(start, end, output_path, config, progress)
+        except Exception as e:
+            if hooks is not None:
+                hooks.end(RANGE, self.url, context, error=e)
+            raise
+        finally:
+            if config.metrics is not None:
+                config.metrics.increment('ranges_finished')
+        timing = response.timing
+        if hooks is not None:
+            hooks.end(RANGE, self.url, context, bytes_received=timing.bytes_received)
+        self.range_timings.append(RangeTiming(
+            start=start,
+            end=end,
+            bytes_received=timing.bytes_received,
+            ttfb=timing.ttfb,
+            transfer=timing.transfer,
+            disk_write=timing.disk_write,
+            retries=timing.retries,
+            mirror=mirror.url,
+        ))
+
+    def download_range(self, start: int, end: int, output_path: str, config: DownloadConfig,
+                       progress: Optional[ProgressCounter]) -> Tuple[Response, Mirror]:
+        """
+        Downloads a part from the mirror chosen by the mirror pool.  If the mirror fails or serves inconsistent content,
+        it is dropped and the part is requested from another mirror, until only one mirror remains.
+
+        Args:
+            start (int): The first byte of the part.
+            end (int): The last byte of the part.
+            output_path (str): The path that the part will be saved to.
+            config (DownloadConfig): The config, with the range header, used for the request.
+            progress (Optional[ProgressCounter]): The counter to which the progress of the part is added.
+
+        Returns:
+            tuple[Response, Mirror]: The response for the part, and the mirror it was downloaded from.
+        """
+        while True:
+            mirror = self.mirror_pool.choose()
+            if progress is not None:
+                progress.done = 0
+            try:
+                response = download_actual(
+                    url=mirror.url,
+                    output_path=output_path,
+                    config=config,
+                    progress=progress,
+                    hooks=self.hooks,
+                    check_response=partial(self.verify_range, start=start, end=end),
+                    bypass_cache=self.cache_bypass is not None,
+                    raw=self.content_encoding is not None,
+                )
+            except Exception as e:
+                if not self.mirror_pool.fail(mirror, str(e)):
+                    raise
+                continue
+            self.mirror_pool.record(mirror, response.timing.bytes_received, response.timing.transfer)
+            return response, mirror
+
+    def verify_range(self, response: requests.Response, start: int, end: int) -> None:
+        """
+        Checks that the response for a part holds the requested range of the expected file, before its body is read.
+
+        Raises:
+            InconsistentMirrorException: If the server ignored the range, or reported a different file size or ETag.
+        """
+        if response.status_code == 200 and (start != 0 or end != self.file_size - 1):
+            raise InconsistentMirrorException(response.url, 'range request was answered with the whole file')
+        content_range = response.headers.get('content-range')
+        if content_range is not None:
+            total = content_range.rsplit('/', 1)[-1]
+            if total != '*' and int(total) != self.file_size:
+                raise InconsistentMirrorException(response.url, f'file size {total} does not match {self.file_size}')
+        etag = strip_etag(response.headers.get('etag'))
+        if etag is not None and self.etag is not None and etag != strip_etag(self.etag):
+            raise InconsistentMirrorException(response.url, f'ETag {etag} does not match {self.etag}')
 
     def join_file(self) -> None:
         """
         Joins all the downloaded parts of the file into a single file, then deletes the temporary directory where
-        the parts were stored during download.
+        the parts were stored during download.  If only some ranges of the file were downloaded, the parts are written
+        into the existing file at their offsets.  The parts are decoded from their join_encoding, if they have one, as
+        they are joined.
+
+        Raises:
+            Exception: The error raised while joining or decompressing the parts, after the hooks are notified.
         """
-        with open(self.output_path, 'wb') as file:
+        join_start = time.perf_counter()
+        context = self.hooks.start(JOIN, self.url, parts=self.part_count) if self.hooks is not None else None
+        error = None
+        encoding = self.join_encoding
+        budget = self.config.memory_budget
+        pending = 8 if budget is None else 1
+        buffers = 1 if encoding is None else pending + 2
+        with open_output(self.output_path, self.cache_bypass, 'wb' if self.ranges is None else 'r+b') as file, \
+                reserve_buffers(budget, self.config.chunk_size, buffers) as buffer_size:
             logger.info(f'Joining file {self.output_path}')
             try:
-                self.write_parts_to_file(file)
+                if encoding is None:
+                    self.write_parts_to_file(file, buffer_size)
+                else:
+                    with DecompressingWriter(file, encoding, pending) as writer:
+                        self.write_parts_to_file(writer, buffer_size)
                 self.remove_temp_path()
-            except:
-                if self.config.clean_up_on_fail:
+            except BaseException as e:
+                error = e
+                if self.clean_up_on_fail:
                     self.remove_temp_path()
                 logger.error(f'Failed to join multi-part file: {self.output_path}', exc_info=True)
+        self.join_time = time.perf_counter() - join_start
+        if self.hooks is not None:
+            self.hooks.end(JOIN, self.url, context, error=error)
+        if error is not None:
+            raise error
+
+    @property
+    def join_encoding(self) -> Optional[str]:
+        """
+        Returns:
+            Optional[str]: The encoding that the parts are decoded from as they are joined, or None if they are joined
+                as they are.  The parts are ranges of the encoded body, so a Content-Encoding is always decoded, as it
+                is from the body of a single request, while a file compressed by its extension is only decompressed
+                if the config's decompress option is set.  The ranges of a partial download are written in place, so
+                they are never decoded.
+        """
+        if self.ranges is not None:
+            return None
+        if self.config.decompress:
+            return detect_encoding(get_name_from_url(self.url), self.content_encoding)
+        return detect_encoding('', self.content_encoding)
+
+    @property
+    def clean_up_on_fail(self) -> bool:
+        """
+        Returns:
+            bool: True if the parts are removed when the download fails, as the config's clean_up_on_fail option asks,
+                or always when files are published atomically, so that no partial files are left behind.
+        """
+        publisher = self.config.publisher
+        return bool(self.config.clean_up_on_fail or (publisher is not None and publisher.atomic))
+
+    @property
+    def timing(self) -> Timing:
+        """
+        Returns:
+            Timing: The combined timing of all downloaded parts and of joining them into a single file.
+        """
+        ranges = tuple(sorted(self.range_timings))
+        return Timing(
+            ttfb=min((r.ttfb for r in ranges), default=0.0),
+            transfer=self.transfer_time,
+            disk_write=sum(r.disk_write for r in ranges),
+            join=self.join_time,
+            bytes_received=sum(r.bytes_received for r in ranges),
+            retries=sum(r.retries for r in ranges),
+            ranges=ranges,
+        )
 
-    def write_parts_to_file(self, file: BinaryIO) -> None:
+    def write_parts_to_file(self, file: BinaryIO, buffer_size: int = 1024 * 1024) -> None:
         """
-        Iterates through the saved temporary files reading the data from each one and writing it into the supplied open
-        file to combine the parts into the single file.
+        Iterates through the saved temporary files copying the data from each one into the supplied open file to
+        combine the parts into the single file.
 
         Args:
             file: An open writable file to which the file parts will be written.
+            buffer_size: The number of bytes copied at a time, so that parts are never read into memory whole.
         """
         for part in range(self.part_count):
             path = self.get_output_path(part)
+            if self.ranges is not None:
+                file.seek(self.ranges[part][0])
             with open(path, 'rb') as part_file:
-                data = part_file.read()
-                file.write(data)
+                shutil.copyfileobj(part_file, file, buffer_size)
+                if self.cache_bypass is not None:
+                    drop_cache(part_file.fileno())
+        if self.ranges is not None:
+            file.truncate(self.file_size)
 
     def get_output_path(self, part: int) -> str:
         """
@@ -159,6 +380,8 @@ class MultiPartDownloader(Runner):
         Remove the temporary directory and its contents after we are done with it and handle the error if there was an
         error making the directory, and it does not exist.
         """
+        if self.temp_path is None:
+            return
         try:
             shutil.rmtree(self.temp_path)
             logger.info(f'Removed temporary directory {self.temp_path}')
@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+from threading import Condition, Event, Lock, Thread
+from typing import Iterable, Optional
+
+from .data_models import DLGroup
+from .download_config import DownloadConfig
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    mirrors TEXT NOT NULL DEFAULT '[]',
+    added REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS items_ready ON items (failed, lease_expires, id);
+"""
+
+
+class PersistentQueue:
+
+    """
+    A download queue stored in a SQLite database in WAL mode, so that pending downloads survive a restart of the
+    process, and so that several processes on the same host can consume the same queue.
+
+    Items are leased to the process that takes them until they are finished.  A leased item is not handed to any
+    other consumer.  Leases are renewed in the background while the item is downloading.  If the process dies, its
+    leases stop being renewed and expire after the lease timeout, and the items are taken by the next consumer.  Items
+    whose download fails are returned to the queue until they have been attempted max_attempts times, after which they
+    are marked as failed and kept in the database.
+
+    Only the url, output path, and mirrors of each item are stored.  Items are returned with the config supplied to
+    this queue.
+
+    Attributes:
+        path (str): The path of the database file.
+        config (DownloadConfig): The config that is given to each item taken from the queue.
+        lease_timeout (float): The seconds after which the lease of an item that has not been renewed expires.
+        max_attempts (int): The number of times an item is attempted before it is marked as failed.
+        max_leases (int): The maximum number of items that this queue holds leases for at once.
+        poll_interval (float): The seconds between checks of the database for new items while the queue is empty.
+        owner (str): The name under which this queue's leases are held.
+
+    Args:
+        path (str): The path of the database file, which is created if it does not exist.
+        config (DownloadConfig): The config that is given to each item taken from the queue.
+        lease_timeout (float): The seconds after which the lease of an item that has not been renewed expires.
+            Default is 300.
+        max_attempts (int): The number of times an item is attempted before it is marked as failed.  Default is 3.
+        max_leases (int): The maximum number of items that this queue holds leases for at once.  get waits while it is
+            reached, which leaves the remaining items to other consumers.  Default is 8.
+        poll_interval (float): The seconds between checks of the database for new items while the queue is empty.
+            Default is 1.
+    """
+
+    def __init__(self, path: str, config: DownloadConfig, lease_timeout: float = 300, max_attempts: int = 3,
+                 max_leases: int = 8, poll_interval: float = 1.0):
+        self.path = path
+        self.config = config
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.max_leases = max_leases
+        self.poll_interval = poll_interval
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = Lock()
+        self._condition = Condition()
+        self._leases = {}
+        self._draining = False
+        self._interrupted = False
+        self._closed = Event()
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.executescript(SCHEMA)
+        recovered = self.recover()
+        if recovered:
+            logger.info(f'Recovered {recovered} items with expired leases from {path}')
+        self._renewer = Thread(target=self._renew_leases, daemon=True)
+        self._renewer.start()
+
+    def put(self, item: Optional[DLGroup]) -> None:
+        """
+        Adds an item to the queue.  None marks the end of the items for this consumer: once no more items can be
+        taken, get returns None instead of waiting for more.
+
+        Args:
+            item (Optional[DLGroup]): The item that will be downloaded.
+        """
+        self.put_many([item])
+
+    def put_many(self, items: Iterable[Optional[DLGroup]]) -> None:
+        """
+        Adds several items to the queue in a single transaction.  See put.
+
+        Args:
+            items (Iterable[Optional[DLGroup]]): The items that will be downloaded.
+        """
+        now = time.time()
+        rows = []
+        for item in items:
+            if item is None:
+                self._draining = True
+            else:
+                rows.append((item[0], item[1], json.dumps(list(getattr(item, 'mirrors', ()))), now))
+        if rows:
+            with self._lock:
+                self._connection.execute('BEGIN IMMEDIATE')
+                try:
+                    self._connection.executemany(
+                        'INSERT INTO items (url, output_path, mirrors, added) VALUES (?, ?, ?, ?)', rows
+                    )
+                except BaseException:
+                    self._connection.execute('ROLLBACK')
+                    raise
+                self._connection.execute('COMMIT')
+        with self._condition:
+            self._condition.notify_all()
+
+    def get(self) -> tuple:
+        """
+        Takes the oldest item that is not leased, or whose lease has expired, and leases it to this queue.  Waits while
+        this queue holds max_leases leases, and while no item can be taken.
+
+        Returns:
+            tuple: The time.perf_counter value at which the item was added (adjusted for the time it spent in the
+                database), and the item.  The item is None if the queue was interrupted, or if the end of the items was
+                put and no more items can be taken.
+        """
+        while True:
+            with self._condition:
+                while len(self._leases) >= self.max_leases and not self._interrupted:
+                    self._condition.wait()
+                if self._interrupted:
+                    return time.perf_counter(), None
+            leased = self._lease()
+            if leased is not None:
+                return leased
+            with self._condition:
+                if self._interrupted or self._draining:
+                    return time.perf_counter(), None
+                self._condition.wait(self.poll_interval)
+
+    def _lease(self) -> Optional[tuple]:
+        """
+        Leases the oldest item that can be taken, marking items whose expired lease has used up their attempts as
+        failed.
+
+        Returns:
+            Optional[tuple]: As get returns, or None if no item can be taken.
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                self._connection.execute(
+                    'UPDATE items SET failed = 1, lease_owner = NULL, lease_expires = NULL '
+                    'WHERE failed = 0 AND lease_expires < ? AND attempts >= ?',
+                    (now, self.max_attempts),
+                )
+                row = self._connection.execute(
+                    'SELECT id, url, output_path, mirrors, added, attempts FROM items '
+                    'WHERE failed = 0 AND (lease_expires IS NULL OR lease_expires < ?) ORDER BY id LIMIT 1',
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    self._connection.execute(
+                        'UPDATE items SET lease_owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?',
+                        (self.owner, now + self.lease_timeout, row[0]),
+                    )
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+        if row is None:
+            return None
+        row_id, url, output_path, mirrors, added, attempts = row
+        item = DLGroup(url, output_path, self.config, tuple(json.loads(mirrors)))
+        with self._condition:
+            self._leases[id(item)] = (row_id, attempts + 1, item)
+        return time.perf_counter() - max(now - added, 0.0), item
+
+    def done(self, item: DLGroup, failed: bool = False) -> None:
+        """
+        Ends the lease of an item taken from this queue.  Items that were downloaded are removed from the queue.  Items
+        that failed are returned to the queue, or marked as failed if they have been attempted max_attempts times.
+        Items that were not taken from this queue, or whose lease expired and was taken over by another consumer, are
+        left as they are.
+
+        Args:
+            item (DLGroup): The item, as returned from get.
+            failed (bool): Indicates if the download of the item failed.
+        """
+        with self._condition:
+            lease = self._leases.pop(id(item), None)
+            self._condition.notify_all()
+        if lease is None:
+            return
+        row_id, attempts, _ = lease
+        with self._lock:
+            if not failed:
+                cursor = self._connection.execute(
+                    'DELETE FROM items WHERE id = ? AND lease_owner = ?', (row_id, self.owner)
+                )
+            else:
+                cursor = self._connection.execute(
+                    'UPDATE items SET lease_owner = NULL, lease_expires = NULL, failed = ? '
+                    'WHERE id = ? AND lease_owner = ?',
+                    (int(attempts >= self.max_attempts), row_id, self.owner),
+                )
+        if not cursor.rowcount:
+            logger.warning(f'Lease of {item[0]} expired and was taken over by another consumer')
+            return
+        if failed and attempts >= self.max_attempts:
+            logger.error(f'Download of {item[0]} failed {attempts} times and was marked as failed')
+
+    def recover(self) -> int:
+        """
+        Returns every item whose lease has expired, such as the items of a consumer that crashed, to the queue.  Expired
+        leases are also taken over by get, so this only needs to be called to return them immediately.
+
+        Returns:
+            int: The number of items returned to the queue.
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                'UPDATE items SET lease_owner = NULL, lease_expires = NULL WHERE failed = 0 AND lease_expires < ?',
+                (time.time(),),
+            )
+        return cursor.rowcount
+
+    def _renew_leases(self) -> None:
+        """
+        Extends the leases held by this queue until the queue is closed.
+        """
+        while not self._closed.wait(self.lease_timeout / 3):
+            with self._condition:
+                if not self._leases:
+                    continue
+            try:
+                with self._lock:
+                    self._connection.execute(
+                        'UPDATE items SET lease_expires = ? WHERE lease_owner = ? AND lease_expires IS NOT NULL',
+                        (time.time() + self.lease_timeout, self.owner),
+                    )
+            except sqlite3.Error:
+                logger.error(f'Failed to renew leases in {self.path}', exc_info=True)
+
+    def qsize(self) -> int:
+        """
+        Returns:
+            int: The number of items in the queue that have not been downloaded or marked as failed, including leased
+                items.
+        """
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM items WHERE failed = 0').fetchone()[0]
+
+    def failed(self) -> list[DLGroup]:
+        """
+        Returns:
+            list[DLGroup]: The items that were marked as failed.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT url, output_path, mirrors FROM items WHERE failed = 1 ORDER BY id'
+            ).fetchall()
+        return [
+            DLGroup(url, output_path, self.config, tuple(json.loads(mirrors))) for url, output_path, mirrors in rows
+        ]
+
+    def interrupt(self) -> None:
+        """
+        Makes get return None immediately, including any call that is waiting, without waiting for the queue to drain.
+        """
+        with self._condition:
+            self._interrupted = True
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        """
+        Returns the items still leased by this queue, which were taken but not finished, to the queue, and closes the
+        database.
+        """
+        self.interrupt()
+        self._closed.set()
+        self._renewer.join()
+        with self._condition:
+            row_ids = [(row_id,) for row_id, _, _ in self._leases.values()]
+            self._leases.clear()
+        with self._lock:
+            if row_ids:
+                self._connection.executemany(
+                    'UPDATE items SET lease_owner = NULL, lease_expires = NULL, attempts = attempts - 1 WHERE id = ?',
+                    row_ids,
+                )
+                logger.info(f'Returned {len(row_ids)} unfinished items to {self.path}')
+            self._connection.close()
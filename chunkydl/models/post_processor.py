@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import hashlib
+import tarfile
+import zipfile
+import logging
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from threading import BoundedSemaphore
+from typing import Any, Callable, NamedTuple, Optional, Sequence, Union
+
+from .data_models import PostResult, Response
+from .decompressor import StreamDecoder, detect_encoding, strip_extension
+
+
+logger = logging.getLogger(__name__)
+
+
+class StageOutput(NamedTuple):
+
+    """
+    A value returned by a post-processing stage that made a new file, such as a decompressed copy.  The stages after it
+    are run on the new file.
+
+    Attributes:
+        path (str): The path of the new file.
+        value (Any): The value recorded for the stage.
+    """
+
+    path: str
+    value: Any = None
+
+
+def hash_file(path: str, algorithm: str = 'sha256', block_size: int = 1024 * 1024) -> str:
+    """
+    A post-processing stage that calculates the digest of a file.
+
+    Returns:
+        str: The hex digest of the file's contents.
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as file:
+        for block in iter(partial(file.read, block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def decompress_file(path: str, remove: bool = False, block_size: int = 1024 * 1024) -> Union[StageOutput, str]:
+    """
+    A post-processing stage that decompresses a file compressed with gzip, bz2, xz, or zstd, found from its extension,
+    into the same directory without the extension.  Files that are not compressed are left as they are.
+
+    Args:
+        path (str): The path of the file.
+        remove (bool): Indicates if the compressed file is removed after it is decompressed.  Default is False.
+        block_size (int): The number of compressed bytes read at a time.
+
+    Returns:
+        Union[StageOutput, str]: The path of the decompressed file, which the following stages are run on.
+    """
+    encoding = detect_encoding(os.path.basename(path))
+    if encoding is None:
+        return path
+    output_path = strip_extension(path)
+    decoder = StreamDecoder(encoding)
+    with open(path, 'rb') as source, open(output_path, 'wb') as output:
+        for block in iter(partial(source.read, block_size), b''):
+            output.write(decoder.decompress(block))
+        output.write(decoder.finish())
+    if remove:
+        os.remove(path)
+    return StageOutput(output_path, output_path)
+
+
+def validate_file(path: str) -> str:
+    """
+    A post-processing stage that checks that a file is a complete, readable example of the format given by its
+    extension: zip, tar (plain or compressed), gzip, bz2, xz, zstd, or JSON.  Files of other formats are only checked
+    to exist.
+
+    Returns:
+        str: The format that was checked.
+
+    Raises:
+        ValueError: If the file is not valid.
+    """
+    name = os.path.basename(path).lower()
+    try:
+        if name.endswith('.zip'):
+            with zipfile.ZipFile(path) as archive:
+                bad = archive.testzip()
+            if bad is not None:
+                raise ValueError(f'{bad} is corrupt')
+            return 'zip'
+        if '.tar' in name or name.endswith(('.tgz', '.tbz2', '.txz')):
+            with tarfile.open(path) as archive:
+                for member in archive:
+                    if member.isfile():
+                        archive.extractfile(member).read()
+            return 'tar'
+        encoding = detect_encoding(name)
+        if encoding is not None:
+            decoder = StreamDecoder(encoding)
+            with open(path, 'rb') as file:
+                for block in iter(partial(file.read, 1024 * 1024), b''):
+                    decoder.decompress(block)
+            decoder.finish()
+            return encoding
+        if name.endswith('.json'):
+            with open(path, 'rb') as file:
+                json.load(file)
+            return 'json'
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f'{path} is not a valid file: {e}') from e
+    if not os.path.isfile(path):
+        raise ValueError(f'{path} does not exist')
+    return 'file'
+
+
+def make_thumbnail(path: str, size: int = 256) -> str:
+    """
+    A post-processing stage that saves a thumbnail of an image next to it, with .thumbnail.png added to its name.
+    Requires the Pillow package.
+
+    Returns:
+        str: The path of the thumbnail.
+    """
+    from PIL import Image
+    output_path = f'{path}.thumbnail.png'
+    with Image.open(path) as image:
+        image.thumbnail((size, size))
+        image.save(output_path, 'PNG')
+    return output_path
+
+
+BUILT_IN_STAGES = {
+    'sha256': partial(hash_file, algorithm='sha256'),
+    'md5': partial(hash_file, algorithm='md5'),
+    'decompress': decompress_file,
+    'validate': validate_file,
+    'thumbnail': make_thumbnail,
+}
+
+
+def stage_name(stage: Union[str, Callable]) -> str:
+    """
+    Returns:
+        str: The name under which the value of a stage is recorded: the name of a built-in stage, or the name of a
+            function (or of the function wrapped by a partial).
+    """
+    if isinstance(stage, str):
+        return stage
+    return getattr(stage, '__name__', None) or getattr(getattr(stage, 'func', None), '__name__', repr(stage))
+
+
+def run_stages(stages: Sequence[tuple], path: str) -> tuple:
+    """
+    Runs post-processing stages on a file, in a worker process.  Stops at the first stage that raises.
+
+    Args:
+        stages (Sequence[tuple]): The name and callable of each stage.
+        path (str): The path of the downloaded file.
+
+    Returns:
+        tuple: The value of each stage that finished, the path of the file after the stages, the exception raised by
+            the stage that failed (or None), and the seconds spent.
+    """
+    start = time.perf_counter()
+    values = {}
+    try:
+        for name, stage in stages:
+            value = stage(path)
+            if isinstance(value, StageOutput):
+                path, value = value
+            values[name] = value
+    except Exception as e:
+        return values, path, e, time.perf_counter() - start
+    return values, path, None, time.perf_counter() - start
+
+
+class PostProcessor:
+
+    """
+    Runs post-processing stages, such as hashing, decompression, format validation, or thumbnailing, on downloaded files
+    in a pool of worker processes, so that CPU heavy work neither holds the GIL from the download threads nor waits
+    behind them.  Stages run one after another on each file, and several files are processed at once.
+
+    The number of files waiting for a worker is bounded.  When it is reached, submit blocks, which holds the download
+    thread that finished the file until a worker is free, so that downloads never run unboundedly ahead of processing.
+
+    Stages are built-in stage names (see BUILT_IN_STAGES) or callables that take the path of a file and return a value.
+    Callables must be picklable, which means module level functions or partials of them.  A stage may return a
+    StageOutput to hand a new file to the stages after it.
+
+    Attributes:
+        stages (list[tuple]): The name and callable of each stage.
+        max_workers (int): The number of worker processes.
+        max_pending (int): The number of files that may be submitted and not yet finished before submit blocks.
+
+    Args:
+        stages (Sequence[Union[str, Callable]]): The stages to run on each file, in order.
+        max_workers (Optional[int]): The number of worker processes.  Defaults to the number of CPUs.
+        max_pending (Optional[int]): The number of files that may be submitted and not yet finished before submit
+            blocks.  Defaults to twice the number of workers.
+    """
+
+    def __init__(self, stages: Sequence[Union[str, Callable]], max_workers: Optional[int] = None,
+                 max_pending: Optional[int] = None):
+        self.stages = []
+        for stage in stages:
+            function = BUILT_IN_STAGES.get(stage) if isinstance(stage, str) else stage
+            if function is None:
+                raise ValueError(f'Unknown post-processing stage: {stage}')
+            self.stages.append((stage_name(stage), function))
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 2
+        self._slots = BoundedSemaphore(self.max_pending)
+        self._executor = None
+
+    def submit(self, response: Response, callback: Callable[[Response], None]) -> Future:
+        """
+        Queues the file of a download for processing, waiting while the number of pending files is at its limit.
+
+        Args:
+            response (Response): The response of the download, whose output path is processed.
+            callback (Callable[[Response], None]): Called with the response, with its post result added, once the
+                stages have run.
+
+        Returns:
+            Future: The future of the stages.
+        """
+        self._slots.acquire()
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.max_workers)
+        submitted = time.perf_counter()
+        try:
+            future = self._executor.submit(run_stages, self.stages, response.output_path)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(partial(self._finish, response, callback, submitted))
+        return future
+
+    def _finish(self, response: Response, callback: Callable[[Response], None], submitted: float,
+                future: Future) -> None:
+        self._slots.release()
+        elapsed = time.perf_counter() - submitted
+        try:
+            values, path, error, duration = future.result()
+        except Exception as e:
+            # the worker process died, or the stages or their results could not be pickled
+            values, path, error, duration = {}, response.output_path, e, 0.0
+        if error is not None:
+            logger.error(f'Post-processing of {response.output_path} failed: {error!r}')
+        result = PostResult(values=values, path=path, error=error, wait=max(elapsed - duration, 0.0),
+                            duration=duration)
+        callback(response._replace(post=result))
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Shuts down the worker processes, by default waiting for every submitted file to be processed.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -0,0 +1,363 @@
+import time
+import logging
+from threading import Lock
+from typing import Callable, NamedTuple, Optional, Tuple
+
+from chunkydl.runner import Runner
+
+
+logger = logging.getLogger(__name__)
+
+
+class RangeProgress(NamedTuple):
+
+    """
+    A NamedTuple that holds the progress of a single range of a multipart download.
+
+    Attributes:
+        start (int): The first byte of the range.
+        end (int): The last byte of the range.
+        done (int): The number of bytes of the range that have been downloaded.
+        total (int): The size of the range in bytes.
+    """
+
+    start: int
+    end: int
+    done: int
+    total: int
+
+
+class FileProgress(NamedTuple):
+
+    """
+    A NamedTuple that holds the progress of a single file.
+
+    Attributes:
+        url (str): The url of the file.
+        output_path (str): The path the file is being saved to.
+        done (int): The number of bytes that have been downloaded.
+        total (Optional[int]): The size of the file in bytes, or None if the server did not report a size.
+        rate (float): The smoothed download rate in bytes per second.
+        eta (Optional[float]): The estimated number of seconds until the download completes, or None if it can not be
+            estimated.
+        idle (float): The number of seconds since the last byte of this file was received.  Useful for detecting
+            stalled downloads.
+        ranges (tuple[RangeProgress, ...]): The progress of each range of a multipart download.
+        finished (bool): Indicates if the download has finished.
+        failed (bool): Indicates if the download finished with an error.
+    """
+
+    url: str
+    output_path: str
+    done: int
+    total: Optional[int]
+    rate: float
+    eta: Optional[float]
+    idle: float
+    ranges: Tuple[RangeProgress, ...] = ()
+    finished: bool = False
+    failed: bool = False
+
+
+class ProgressReport(NamedTuple):
+
+    """
+    A NamedTuple that holds the progress of every file tracked by a ProgressTracker.  A report is emitted to subscribers
+    at most once per interval.
+
+    Attributes:
+        files (tuple[FileProgress, ...]): The progress of each active file, along with any that finished since the last
+            report.
+        done (int): The total number of bytes downloaded by all tracked files, including finished ones.
+        total (int): The total size of all tracked files whose size is known.
+        rate (float): The smoothed combined download rate in bytes per second.
+        eta (Optional[float]): The estimated number of seconds until all active files with a known size complete.
+        active (int): The number of files currently downloading.
+        completed (int): The number of files that have completed successfully.
+        failed (int): The number of files that have failed.
+    """
+
+    files: Tuple[FileProgress, ...]
+    done: int
+    total: int
+    rate: float
+    eta: Optional[float]
+    active: int
+    completed: int
+    failed: int
+
+
+class ProgressCounter:
+
+    """
+    Counts the bytes downloaded for a file or for a range of a file.  The download loop only ever adds to the 'done'
+    attribute of its counter, and all other work is done by the ProgressTracker when a report is emitted, so tracking
+    progress costs a single integer addition per chunk.
+
+    Attributes:
+        done (int): The number of bytes downloaded.
+        total (Optional[int]): The number of bytes expected, if known.
+        start (int): The first byte of the range, for range counters.
+        end (int): The last byte of the range, for range counters.
+    """
+
+    __slots__ = ('done', 'total', 'start', 'end')
+
+    def __init__(self, total: Optional[int] = None, start: int = 0, end: int = 0):
+        self.done = 0
+        self.total = total
+        self.start = start
+        self.end = end
+
+
+class FileCounter(ProgressCounter):
+
+    """
+    A ProgressCounter for a whole file, which also holds the counters of the file's ranges when the file is downloaded
+    in multiple parts.
+
+    Attributes:
+        url (str): The url of the file.
+        output_path (str): The path the file is being saved to.
+        ranges (list[ProgressCounter]): The counters of the ranges of a multipart download.
+        finished (bool): Indicates if the download has finished.
+        failed (bool): Indicates if the download finished with an error.
+    """
+
+    __slots__ = ('url', 'output_path', 'ranges', 'finished', 'failed', 'rate', 'sample', 'last_change')
+
+    def __init__(self, url: str, output_path: str, total: Optional[int]):
+        super().__init__(total)
+        self.url = url
+        self.output_path = output_path
+        self.ranges = []
+        self.finished = False
+        self.failed = False
+        self.rate = 0.0
+        self.sample = (time.monotonic(), 0)
+        self.last_change = self.sample[0]
+
+    def start_range(self, start: int, end: int) -> ProgressCounter:
+        """
+        Adds a counter for a range of the file.
+
+        Args:
+            start (int): The first byte of the range.
+            end (int): The last byte of the range.
+
+        Returns:
+            ProgressCounter: The counter for the range.
+        """
+        counter = ProgressCounter(end - start + 1, start, end)
+        self.ranges.append(counter)
+        return counter
+
+    def downloaded(self) -> int:
+        """
+        Returns:
+            int: The number of bytes downloaded for the file, including all of its ranges.
+        """
+        return self.done + sum(counter.done for counter in list(self.ranges))
+
+    def finish(self, failed: bool = False) -> None:
+        """
+        Marks the file as finished.  The file is included in the next report one last time, then no longer tracked.
+
+        Args:
+            failed (bool): Indicates if the download finished with an error.
+        """
+        self.failed = failed
+        self.finished = True
+
+
+class ProgressTracker(Runner):
+
+    """
+    Tracks the progress of downloads and periodically emits a ProgressReport to subscribers from its own thread.  The
+    tracker may be supplied to a DownloadConfig with the 'progress' option, and then tracks every download made with
+    that config, including each range of multipart downloads.  When shared by the downloads of a QueueDownloader, each
+    report holds the aggregate progress of the queue.
+
+    Reports are coalesced: subscribers receive at most one report per interval, no matter how many chunks were
+    downloaded in that time.  A report is emitted every interval while downloads are active, even if no bytes were
+    received, so that stalled downloads can be detected by their 'idle' time.  Rates are smoothed with an exponential
+    moving average and used to estimate the time remaining.
+
+    Attributes:
+        interval (float): The minimum number of seconds between reports.
+        smoothing (float): The weight given to the most recent rate sample when smoothing rates, between 0 and 1.
+
+    Args:
+        interval (float): The minimum number of seconds between reports.
+        smoothing (float): The weight given to the most recent rate sample when smoothing rates, between 0 and 1.
+    """
+
+    def __init__(self, interval: float = 0.5, smoothing: float = 0.3):
+        super().__init__()
+        self.daemon = True
+        self.interval = interval
+        self.smoothing = smoothing
+        self._subscribers = []
+        self._files = []
+        self._lock = Lock()
+        self._report_lock = Lock()
+        self._running = False
+        self._finished_bytes = 0
+        self._finished_total = 0
+        self._completed = 0
+        self._failed = 0
+        self._rate = 0.0
+        self._sample = (time.monotonic(), 0)
+
+    def subscribe(self, callback: Callable[[ProgressReport], None]) -> None:
+        """
+        Adds a callback that receives each ProgressReport.  Callbacks are run on the tracker's thread and should return
+        quickly.
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[ProgressReport], None]) -> None:
+        """
+        Removes a previously added callback.
+        """
+        with self._lock:
+            self._subscribers.remove(callback)
+
+    def start_file(self, url: str, output_path: str, total: Optional[int] = None) -> FileCounter:
+        """
+        Starts tracking a file, starting the tracker's thread if it is not yet running.
+
+        Args:
+            url (str): The url of the file.
+            output_path (str): The path the file is being saved to.
+            total (Optional[int]): The size of the file in bytes, if known.
+
+        Returns:
+            FileCounter: The counter that the download adds its progress to.
+        """
+        counter = FileCounter(url, output_path, total or None)
+        with self._lock:
+            if not self._files:
+                self._sample = (time.monotonic(), self._finished_bytes)
+            self._files.append(counter)
+            if not self._running:
+                self._running = True
+                self.start()
+        return counter
+
+    def run(self) -> None:
+        """
+        Emits a report every interval until the tracker is stopped.
+        """
+        while self.continue_run:
+            self._stop_run.wait(self.interval)
+            self.emit()
+
+    def stop(self) -> None:
+        """
+        Stops the tracker's thread after emitting a final report.
+        """
+        super().stop()
+        self.emit()
+
+    def emit(self) -> Optional[ProgressReport]:
+        """
+        Builds a report and sends it to every subscriber, if there is anything to report.
+
+        Returns:
+            Optional[ProgressReport]: The report that was emitted, or None if there was nothing to report.
+        """
+        with self._report_lock:
+            report = self.report()
+        if report is None:
+            return None
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(report)
+            except Exception:
+                logger.error('Progress subscriber failed', exc_info=True)
+        return report
+
+    def report(self) -> Optional[ProgressReport]:
+        """
+        Builds a report of the current progress and forgets any files that have finished.
+
+        Returns:
+            Optional[ProgressReport]: The current progress, or None if no files are being tracked.
+        """
+        now = time.monotonic()
+        with self._lock:
+            files = list(self._files)
+        if not files:
+            return None
+        progress = []
+        active_done = 0
+        remaining = 0
+        total = 0
+        finished = []
+        for counter in files:
+            done = counter.downloaded()
+            if done != counter.sample[1]:
+                counter.last_change = now
+            counter.rate = self._smooth(counter.rate, counter.sample, now, done)
+            counter.sample = (now, done)
+            if counter.total is not None:
+                total += counter.total
+                if not counter.finished:
+                    remaining += max(counter.total - done, 0)
+            ranges = tuple(RangeProgress(r.start, r.end, r.done, r.total) for r in list(counter.ranges))
+            progress.append(FileProgress(
+                url=counter.url,
+                output_path=counter.output_path,
+                done=done,
+                total=counter.total,
+                rate=counter.rate,
+                eta=self._eta(counter.total - done, counter.rate) if counter.total is not None else None,
+                idle=now - counter.last_change,
+                ranges=ranges,
+                finished=counter.finished,
+                failed=counter.failed,
+            ))
+            if counter.finished:
+                finished.append(counter)
+            else:
+                active_done += done
+        with self._lock:
+            total += self._finished_total
+            for counter in finished:
+                self._files.remove(counter)
+                self._finished_bytes += counter.downloaded()
+                self._finished_total += counter.total or 0
+                if counter.failed:
+                    self._failed += 1
+                else:
+                    self._completed += 1
+            done = self._finished_bytes + active_done
+            self._rate = self._smooth(self._rate, self._sample, now, done)
+            self._sample = (now, done)
+            return ProgressReport(
+                files=tuple(progress),
+                done=done,
+                total=total,
+                rate=self._rate,
+                eta=self._eta(remaining, self._rate),
+                active=len(files) - len(finished),
+                completed=self._completed,
+                failed=self._failed,
+            )
+
+    def _smooth(self, rate: float, sample: tuple, now: float, done: int) -> float:
+        elapsed = now - sample[0]
+        if elapsed <= 0:
+            return rate
+        current = (done - sample[1]) / elapsed
+        return current if rate == 0 else self.smoothing * current + (1 - self.smoothing) * rate
+
+    @staticmethod
+    def _eta(remaining: int, rate: float) -> Optional[float]:
+        if remaining <= 0:
+            return 0.0
+        return remaining / rate if rate > 0 else None
@@ -1,12 +1,21 @@
+import time
 import logging
 from queue import Queue
+from threading import Lock
 from concurrent.futures import ThreadPoolExecutor, Future
-from typing import Optional
+from typing import Optional, Union
 
 from .download_config import DownloadConfig
-from .data_models import DLGroup, Response
+from .data_models import DLGroup, HeadResult, Response
 from chunkydl.runner import Runner, verify_run
 from chunkydl.download import _download
+from chunkydl.utils import share_download
+from .metrics import MetricsServer
+from .hooks import DISPATCH, select_hooks
+from .post_processor import PostProcessor
+from .persistent_queue import PersistentQueue
+from .connection_warmer import ConnectionWarmer
+from .metadata_stage import MetadataStage
 
 logger = logging.getLogger(__name__)
 
@@ -20,8 +29,23 @@ class QueueDownloader(Runner):
 
     Attributes:
         config (DownloadConfig): The configuration object that will be used to determine the download parameters.
-        _queue (Queue): The queue that stores pending downloads.
+        _queue (Union[Queue, PersistentQueue]): The queue that stores pending downloads along with the time they were
+            added.
+        persistent_queue (Optional[PersistentQueue]): The durable queue used in place of an in-memory queue, if the
+            config specifies a queue path.
         executor (ThreadPoolExecutor): The executor that will be used to download files simultaneously.
+        results (list[Response]): The responses of the completed downloads.
+        _flights (dict): A mapping of the downloads that are currently in flight to the duplicate downloads waiting on
+            them.  Only used when the config's coalesce option is set.
+        _flight_lock (Lock): A lock that guards the _flights mapping.
+        metrics_server (Optional[MetricsServer]): The server that serves the config's metrics registry while the
+            downloader runs, if the config specifies a metrics port.
+        post_processor (Optional[PostProcessor]): The process pool that runs the config's post-processing stages on
+            each downloaded file before its response is added to the results, if the config specifies any.
+        connection_warmer (Optional[ConnectionWarmer]): The thread that opens connections to the hosts of the
+            downloads that will start next, if the config's prewarm option is set.
+        metadata_stage (Optional[MetadataStage]): The pool that makes the HEAD requests of queued downloads ahead of
+            the download threads, if the config specifies metadata threads.
 
     Args:
         config (DownloadConfig): The configuration object that will be used to determine the download parameters.
@@ -30,9 +54,42 @@ class QueueDownloader(Runner):
     def __init__(self, config: DownloadConfig):
         super().__init__()
         self.config = config
-        self._queue = Queue(maxsize=-1)
+        self.persistent_queue = None
+        if config.queue_path is not None:
+            self.persistent_queue = PersistentQueue(
+                config.queue_path,
+                config,
+                lease_timeout=config.queue_lease_timeout,
+                max_attempts=config.queue_max_attempts,
+                max_leases=config.download_threads * 2,
+            )
+            self._queue = self.persistent_queue
+        else:
+            self._queue = Queue(maxsize=-1)
         self.executor = ThreadPoolExecutor(config.download_threads)
         self.results = []
+        self._flights = {}
+        self._flight_lock = Lock()
+        self.metrics_server = None
+        self.post_processor = None
+        if config.post_process:
+            self.post_processor = PostProcessor(
+                config.post_process,
+                max_workers=config.post_process_workers,
+                max_pending=config.post_process_pending,
+            )
+        self.connection_warmer = None
+        if config.prewarm:
+            self.connection_warmer = ConnectionWarmer(config, lookahead=config.prewarm_lookahead)
+        self.metadata_stage = None
+        if config.metadata_threads:
+            self.metadata_stage = MetadataStage(
+                self.dispatch,
+                threads=config.metadata_threads,
+                slots=config.download_threads,
+                lookahead=config.metadata_lookahead,
+                order=config.metadata_order,
+            )
         self.config.log_attributes('Queue downloader configured with following options')
 
     def add(self, item: Optional[DLGroup]) -> None:
@@ -42,8 +99,12 @@ class QueueDownloader(Runner):
         Args:
             item (Optional[DLGroup]): The item that will be downloaded.
         """
-        self._queue.put(item)
-        logger.debug(f'Item added to download queue: {item}')
+        if self.persistent_queue is not None:
+            self.persistent_queue.put(item)
+        else:
+            self._queue.put((time.perf_counter(), item))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'Item added to download queue: {item}')
 
     def add_multiple(self, items: list[Optional[DLGroup]]) -> None:
         """
@@ -52,6 +113,9 @@ class QueueDownloader(Runner):
         Args:
             items (list[Optional[DLGroup]]): A list of items to be added.
         """
+        if self.persistent_queue is not None:
+            self.persistent_queue.put_many(items)
+            return
         for item in items:
             self.add(item)
 
@@ -67,20 +131,106 @@ class QueueDownloader(Runner):
         If an item is retrieved from the queue, the method calls 'download_group' to handle the download.
         If the queue is empty, the method stops the execution and shuts down the executor.
         """
+        self.start_metrics()
+        if self.connection_warmer is not None:
+            self.connection_warmer.start()
+        debug = logger.isEnabledFor(logging.DEBUG)
         while self.continue_run:
-            dl_group = self._queue.get()
+            queued_at, dl_group = self._queue.get()
             if dl_group is not None:
-                future = self.executor.submit(self.download_group, dl_group=dl_group)
-                future.add_done_callback(self.handle_future)
-                logger.debug(f'Item submitted to executor: {dl_group}')
+                if self.config.coalesce and self.join_flight(dl_group):
+                    if debug:
+                        logger.debug(f'Item coalesced with download already in flight: {dl_group}')
+                    continue
+                if self.metadata_stage is not None:
+                    self.metadata_stage.submit(dl_group, queued_at)
+                else:
+                    self.dispatch(dl_group, queued_at)
+                if debug:
+                    logger.debug(f'Item submitted to executor: {dl_group}')
             else:
                 logger.debug('Breaking out of download cycle')
                 break
+        if self.metadata_stage is not None:
+            self.metadata_stage.shutdown()
         self.executor.shutdown(wait=True)
+        if self.connection_warmer is not None:
+            self.connection_warmer.stop()
+        if self.config.publisher is not None:
+            self.config.publisher.flush()
+        if self.config.segment_sink is not None:
+            self.config.segment_sink.flush()
+        if self.post_processor is not None:
+            self.post_processor.shutdown(wait=True)
+        self.stop_metrics()
+        if self.persistent_queue is not None:
+            self.persistent_queue.close()
+        if self.config.progress is not None:
+            self.config.progress.emit()
         logger.info('Queue downloader shutdown')
 
+    def dispatch(self, dl_group: DLGroup, queued_at: Optional[float] = None, head: Optional[HeadResult] = None,
+                 head_error: Optional[Exception] = None) -> Future:
+        """
+        Submits a download to the executor.
+
+        Args:
+            dl_group (DLGroup): The group to download.
+            queued_at (Optional[float]): The time.perf_counter value at which the dl_group was added to the queue.
+            head (Optional[HeadResult]): The HEAD response for the url, if it was already resolved.
+            head_error (Optional[Exception]): The error raised while resolving the HEAD response, if any.
+
+        Returns:
+            Future: The future of the download.
+        """
+        if self.connection_warmer is not None:
+            self.connection_warmer.hint(dl_group[0])
+        future = self.executor.submit(
+            self.download_group, dl_group=dl_group, queued_at=queued_at, head=head, head_error=head_error
+        )
+        future.add_done_callback(self.handle_future)
+        return future
+
+    def stop(self) -> None:
+        """
+        Sets the stop_run flag to true, and wakes the run loop if it is waiting on a durable queue.  Items of a durable
+        queue that were taken but not downloaded are returned to the queue when the run loop ends.
+        """
+        super().stop()
+        if self.persistent_queue is not None:
+            self.persistent_queue.interrupt()
+
+    def start_metrics(self) -> None:
+        """
+        Registers the queue depth, and the bytes reserved from the memory budget if there is one, with the config's
+        metrics registry and starts the metrics server if a metrics port is configured.
+        """
+        metrics = self.config.metrics
+        if metrics is None:
+            return
+        metrics.register_gauge('queue_depth', self._queue.qsize)
+        budget = self.config.memory_budget
+        if budget is not None:
+            metrics.register_gauge('memory_used_bytes', lambda: budget.used)
+        if self.config.metrics_port is not None and self.metrics_server is None:
+            self.metrics_server = MetricsServer(metrics, port=self.config.metrics_port)
+            self.metrics_server.start()
+
+    def stop_metrics(self) -> None:
+        """
+        Removes the queue depth and memory gauges and stops the metrics server if it is running.
+        """
+        if self.config.metrics is None:
+            return
+        self.config.metrics.unregister_gauge('queue_depth')
+        self.config.metrics.unregister_gauge('memory_used_bytes')
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
     @verify_run
-    def download_group(self, dl_group: DLGroup) -> Response:
+    def download_group(self, dl_group: DLGroup, queued_at: Optional[float] = None, head: Optional[HeadResult] = None,
+                       head_error: Optional[Exception] = None) -> Response:
         """
         Calls the actual download method with the values supplied in the dl_group.
 
@@ -90,9 +240,105 @@ class QueueDownloader(Runner):
                 - output_path (str): The path that the file will be saved to.
                 - config (DownloadConfig): The configuration object that will be used to determine the download
                     parameters.
+                - mirrors (tuple[str, ...]): The urls of the same file on other mirrors.
+            queued_at (Optional[float]): The time.perf_counter value at which the dl_group was added to the queue.
+                Used to record how long the download waited in the queue.
+            head (Optional[HeadResult]): The HEAD response for the url, if it was resolved by the metadata stage.
+            head_error (Optional[Exception]): The error raised while the metadata stage resolved the HEAD response,
+                which is raised as the error of the download.
+        """
+        queue_wait = time.perf_counter() - queued_at if queued_at is not None else 0.0
+        url, output_path, config = dl_group[:3]
+        if self.connection_warmer is not None:
+            self.connection_warmer.started(url)
+        hooks = select_hooks(config, url) if config.hooks is not None else None
+        context = hooks.start(DISPATCH, url, queue_wait=queue_wait) if hooks is not None else None
+        try:
+            if head_error is not None:
+                raise head_error
+            response = _download(url, output_path, config, mirrors=getattr(dl_group, 'mirrors', ()), head=head)
+        except Exception as e:
+            self.land_flight(dl_group, None)
+            if hooks is not None:
+                hooks.end(DISPATCH, url, context, error=e)
+            raise
+        if response.timing is not None:
+            response = response._replace(timing=response.timing._replace(queue_wait=queue_wait))
+        self.land_flight(dl_group, response)
+        if hooks is not None:
+            hooks.end(DISPATCH, url, context)
+        return response
+
+    def join_flight(self, dl_group: DLGroup) -> bool:
         """
-        url, output_path, config = dl_group
-        return _download(url, output_path, config)
+        Checks if a download of the same url with the same config is already in flight.  If so, the supplied dl_group
+        is added to the waiting duplicates of that download.  If not, a new flight is started for the dl_group.
+
+        Args:
+            dl_group (DLGroup): The group that is about to be downloaded.
+
+        Returns:
+            bool: True if the dl_group is waiting on a download that is already in flight, False if the dl_group should
+                be downloaded.
+        """
+        key = self.get_flight_key(dl_group)
+        with self._flight_lock:
+            duplicates = self._flights.get(key)
+            if duplicates is not None:
+                duplicates.append(dl_group)
+                return True
+            self._flights[key] = []
+            return False
+
+    def land_flight(self, dl_group: DLGroup, response: Optional[Response]) -> None:
+        """
+        Ends the flight for the supplied dl_group and shares the downloaded file with every duplicate that was waiting
+        on it.  The response for each duplicate is added to the results.  Items taken from a durable queue are marked
+        as done.
+
+        Args:
+            dl_group (DLGroup): The group that was downloaded.
+            response (Optional[Response]): The response returned from the download, or None if the download failed.
+        """
+        key = self.get_flight_key(dl_group)
+        with self._flight_lock:
+            duplicates = self._flights.pop(key, [])
+        if self.persistent_queue is not None:
+            self.persistent_queue.done(dl_group, failed=response is None)
+        for duplicate in duplicates:
+            url, output_path, config = duplicate[:3]
+            failed = True
+            if response is None or response.output_path is None:
+                logger.error(f'Download of {url} to {output_path} failed with coalesced download')
+            elif response.segment is not None:
+                # objects in segments are indexed by url, so the duplicate is the same object
+                self.add_result(response)
+                failed = False
+            else:
+                try:
+                    self.add_result(
+                        share_download(response, output_path, config.coalesce_link_mode, config.publisher)
+                    )
+                    failed = False
+                except OSError:
+                    logger.error(f'Failed to share coalesced download with {output_path}', exc_info=True)
+            if self.persistent_queue is not None:
+                self.persistent_queue.done(duplicate, failed=failed)
+
+    @staticmethod
+    def get_flight_key(dl_group: DLGroup) -> tuple:
+        """
+        Returns:
+            tuple: A key that identifies downloads that would result in the same request and the same file.  Only
+                groups that share the same config object are coalesced, since the config decides the headers sent and
+                how the file is written (decompressed, cached, published, or appended to a segment).  Extracted
+                archives are directories, which can not be shared, so they are only coalesced with duplicates extracted
+                to the same path.
+        """
+        url, output_path, config = dl_group[:3]
+        if config.extract:
+            return url, id(config), output_path
+        return url, id(config)
 
     def handle_future(self, future: Future) -> None:
         """
@@ -101,4 +347,18 @@ class QueueDownloader(Runner):
         Args:
             future (Future): The future as returned from submitting work to the thread pool executor.
         """
-        self.results.append(future.result())
+        self.add_result(future.result())
+
+    def add_result(self, response: Response) -> None:
+        """
+        Adds the response of a completed download to the results list.  If post-processing stages are configured, the
+        downloaded file is first submitted to the post processor, and the response, with the outcome of the stages, is
+        added once they have run.  Submitting waits while too many files are waiting to be processed.
+
+        Args:
+            response (Response): The response of the completed download.
+        """
+        if self.post_processor is None or response.output_path is None:
+            self.results.append(response)
+            return
+        self.post_processor.submit(response, self.results.append)
@@ -0,0 +1,221 @@
+import logging
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Optional, Sequence
+
+from .download_config import DownloadConfig
+from .size import Size
+from chunkydl.core import fetch_range, fetch_ranges, fetch_spans, get_request_session
+from chunkydl.exceptions import RequestFailedException
+
+
+logger = logging.getLogger(__name__)
+
+
+class RangeFetcher:
+
+    """
+    Fetches an arbitrary set of byte ranges of a single file in as few requests as possible.  Ranges that overlap or
+    are separated by no more than the gap are merged, and the merged ranges are requested in batches with multi-range
+    requests, which servers answer with a multipart/byteranges body.  When a server does not support multi-range
+    requests, the ranges that it did not return are fetched with single range requests in parallel, using the config's
+    multipart thread count.  When a server ignores range requests and answers with the whole file, every range is read
+    from the body of a single request for the file, which is read no further than the end of the last range.
+
+    Attributes:
+        url (str): The url of the file.
+        config (DownloadConfig): The configuration used for each request.
+        gap (int): The largest number of bytes between two ranges for which they are fetched as one range.
+        max_ranges (int): The largest number of ranges requested in a single multi-range request.
+        requests (int): The number of requests made.
+        multirange (Optional[bool]): Indicates if the server answered a multi-range request with every range, or None
+            if no multi-range request has been made.
+        size (Optional[int]): The size of the file, once it has been reported by a response.
+        ranges_supported (Optional[bool]): Indicates if the server answered a range request with part of the file, or
+            None if no range request has been made.
+
+    Args:
+        url (str): The url of the file.
+        config (Optional[DownloadConfig]): The configuration used for each request.  Defaults to a new DownloadConfig.
+        gap (int): The largest number of bytes between two ranges for which they are fetched as one range.  Default is
+            64KB.
+        max_ranges (int): The largest number of ranges requested in a single multi-range request.  Default is 64.
+    """
+
+    def __init__(self, url: str, config: Optional[DownloadConfig] = None, gap: int = Size('64kb'),
+                 max_ranges: int = 64):
+        self.url = url
+        self.config = config or DownloadConfig()
+        self.gap = int(Size(gap))
+        self.max_ranges = max(max_ranges, 1)
+        self.requests = 0
+        self.multirange = None
+        self.size = None
+        self.ranges_supported = None
+        self._session = get_request_session(self.config)
+        # batches and spans are fetched from executor threads, which all update the counts and what the server supports
+        self._lock = Lock()
+
+    @staticmethod
+    def merge(ranges: Sequence[tuple], gap: int = 0) -> list:
+        """
+        Sorts ranges and merges those that overlap or are separated by no more than the gap.
+
+        Args:
+            ranges (Sequence[tuple]): The first and last byte of each range.
+            gap (int): The largest number of bytes between two ranges for which they are merged.
+
+        Returns:
+            list[tuple]: The merged ranges, in order.
+        """
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + 1 + gap:
+                if end > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        return merged
+
+    def fetch(self, ranges: Sequence[tuple]) -> list:
+        """
+        Fetches the supplied ranges.
+
+        Args:
+            ranges (Sequence[tuple]): The first and last byte of each range.
+
+        Returns:
+            list[tuple]: The first byte and data of each fetched part, sorted by first byte.  Together the parts cover
+                every supplied range, and may hold more bytes than were requested.
+        """
+        for start, end in ranges:
+            if start < 0 or end < start:
+                raise ValueError(f'Invalid byte range {start}-{end}')
+        spans = self.merge(ranges, self.gap)
+        if not spans:
+            return []
+        batches = [spans[index:index + self.max_ranges] for index in range(0, len(spans), self.max_ranges)]
+        pieces = self._fetch_batch(batches[0])
+        self.multirange = len(batches[0]) > 1 and not self._missing(pieces, self._clamp(batches[0]))
+        with ThreadPoolExecutor(self.config.multipart_threads) as executor:
+            if self.multirange:
+                for batch_pieces in executor.map(self._fetch_batch, batches[1:]):
+                    pieces.extend(batch_pieces)
+            else:
+                logger.debug(f'{self.url} does not support multi-range requests, fetching ranges one at a time')
+            missing = self._missing(pieces, self._clamp(spans))
+            if self.ranges_supported:
+                datas = executor.map(self._fetch_span, missing)
+            else:
+                logger.debug(f'{self.url} does not support range requests, reading ranges from the whole file')
+                datas = self._fetch_spans(missing) if missing else []
+            for start, data in zip((start for start, _ in missing), datas):
+                pieces.append((start, data))
+        return sorted(pieces, key=lambda piece: piece[0])
+
+    def read(self, ranges: Sequence[tuple]) -> list:
+        """
+        Fetches the supplied ranges and returns the bytes of each.
+
+        Args:
+            ranges (Sequence[tuple]): The first and last byte of each range.
+
+        Returns:
+            list[bytes]: The bytes of each range, in the order the ranges were supplied.  Fewer bytes are returned for
+                a range that extends past the end of the file.
+        """
+        pieces = self.fetch(ranges)
+        return [self.find(pieces, start, end) for start, end in ranges]
+
+    def write(self, ranges: Sequence[tuple], output_path: str) -> None:
+        """
+        Fetches the supplied ranges and writes them at their offsets in a sparse file.  Bytes of the file that were not
+        fetched are left as holes, which read as zeros.
+
+        Args:
+            ranges (Sequence[tuple]): The first and last byte of each range.
+            output_path (str): The path of the file that is written.
+        """
+        pieces = self.fetch(ranges)
+        with open(output_path, 'wb') as file:
+            for start, data in pieces:
+                file.seek(start)
+                file.write(data)
+
+    @staticmethod
+    def find(pieces: list, start: int, end: int) -> bytes:
+        """
+        Returns:
+            bytes: The bytes from start to end taken from the sorted parts that cover them.
+        """
+        index = bisect_right([piece[0] for piece in pieces], start) - 1
+        piece_start, data = pieces[index]
+        return bytes(data[start - piece_start:end - piece_start + 1])
+
+    def _fetch_batch(self, batch: list) -> list:
+        self._count_request()
+        pieces = fetch_ranges(self._session, self.url, batch, self.config)
+        with self._lock:
+            if pieces is None:
+                self.ranges_supported = False
+                return []
+            self.ranges_supported = True
+            for _, _, size in pieces:
+                if size is not None:
+                    self.size = size
+        return [(start, data) for start, data, _ in pieces]
+
+    def _clamp(self, spans: list) -> list:
+        """
+        Returns:
+            list[tuple]: The supplied spans cut to the end of the file, if its size is known.
+        """
+        if self.size is None:
+            return spans
+        return [(start, min(end, self.size - 1)) for start, end in spans if start < self.size]
+
+    def _count_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def _fetch_span(self, span: tuple) -> bytes:
+        self._count_request()
+        try:
+            return fetch_range(self._session, self.url, span[0], span[1], self.config)
+        except RequestFailedException as e:
+            # the part of a range past the end of the file is not satisfiable
+            if e.status_code == 416:
+                return b''
+            raise
+
+    def _fetch_spans(self, spans: list) -> list:
+        self._count_request()
+        return fetch_spans(self._session, self.url, spans, self.config)
+
+    @staticmethod
+    def _missing(pieces: list, spans: list) -> list:
+        """
+        Returns:
+            list[tuple]: The parts of the supplied spans that are not covered by the supplied pieces.
+        """
+        covered = sorted((start, start + len(data) - 1) for start, data in pieces)
+        missing = []
+        for start, end in spans:
+            for covered_start, covered_end in covered:
+                if covered_end < start or covered_start > end:
+                    continue
+                if covered_start > start:
+                    missing.append((start, covered_start - 1))
+                start = max(start, covered_end + 1)
+                if start > end:
+                    break
+            if start <= end:
+                missing.append((start, end))
+        return missing
+
+    def close(self) -> None:
+        """
+        Closes the connections used to fetch ranges.
+        """
+        self._session.close()
@@ -0,0 +1,249 @@
+import io
+import logging
+import tempfile
+from collections import OrderedDict
+from threading import RLock
+from typing import Optional
+
+from .download_config import DownloadConfig
+from .size import Size
+from chunkydl.core import fetch_range, get_request_session
+from chunkydl.exceptions import RequestFailedException
+
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteFile(io.RawIOBase):
+
+    """
+    A read-only, seekable, file-like object whose reads are served by Range requests to a url, so that only the parts
+    of a file that are read are downloaded.  Instances are usually made with chunkydl.open_remote, and may be passed to
+    anything that reads a binary file, such as zipfile.ZipFile.
+
+    The file is read in blocks of block_size bytes, which are kept in an LRU cache of at most cache_size bytes.  When
+    reads are sequential, further blocks are read ahead, doubling with each sequential read up to the readahead limit.
+    Adjacent blocks that are missing from the cache are fetched together in a single request.  Requests use the same
+    session, retry, and header configuration as downloads.
+
+    If the server ignores a range request and answers with the whole file, the file is streamed once into a spooled
+    temporary file, held in memory up to cache_size bytes, and every later read is served from it.
+
+    Attributes:
+        url (str): The url of the file.
+        config (DownloadConfig): The configuration used for each request.
+        block_size (int): The size, in bytes, of each cached block.
+        cache_size (int): The maximum number of bytes held in the block cache.
+        readahead (int): The maximum number of blocks read ahead of a sequential read.
+        size (int): The size of the file in bytes.
+        etag (Optional[str]): The ETag of the file when it was opened.  Reads fail if the file changes afterwards.
+        requests (int): The number of range requests made.
+        bytes_fetched (int): The number of bytes received from the server.
+        ranges_supported (bool): Indicates if the server answers range requests with part of the file.  False once a
+            range request was answered with the whole file.
+
+    Args:
+        url (str): The url of the file.
+        config (Optional[DownloadConfig]): The configuration used for each request.  Defaults to a new DownloadConfig.
+        block_size (int): The size, in bytes, of each cached block.  Default is 256KB.
+        cache_size (int): The maximum number of bytes held in the block cache.  Default is 64MB.
+        readahead (int): The maximum number of blocks read ahead of a sequential read.  Default is 16.
+    """
+
+    def __init__(self, url: str, config: Optional[DownloadConfig] = None, block_size: int = Size('256kb'),
+                 cache_size: int = Size('64mb'), readahead: int = 16):
+        super().__init__()
+        self.url = url
+        self.config = config or DownloadConfig()
+        self.block_size = max(int(Size(block_size)), 1)
+        self.cache_size = int(Size(cache_size))
+        self.readahead = readahead
+        self.requests = 0
+        self.bytes_fetched = 0
+        self.ranges_supported = True
+        self._body = None
+        self._session = get_request_session(self.config)
+        self._blocks = OrderedDict()
+        self._lock = RLock()
+        self._position = 0
+        self._sequential_end = None
+        self._window = 1
+        self.size, self.etag = self._stat()
+
+    def _stat(self) -> tuple:
+        """
+        Reads the size and ETag of the file, from a HEAD request or, if the server does not report a size for HEAD
+        requests, from the Content-Range of a request for the first byte.
+
+        Returns:
+            tuple: The size of the file and its ETag, if any.
+        """
+        response = self._session.head(url=self.url, timeout=self.config.timeout, headers=self.config.headers,
+                                      allow_redirects=True)
+        etag = response.headers.get('etag')
+        if response.status_code == 200 and 'content-length' in response.headers:
+            return int(response.headers['content-length']), etag
+        response = self._session.get(self.url, timeout=self.config.timeout,
+                                     headers=self.config.get_headers(range='bytes=0-0'))
+        content_range = response.headers.get('content-range', '')
+        if response.status_code != 206 or not content_range.rpartition('/')[2].isdigit():
+            raise RequestFailedException(self.url, response.status_code, 'The size of the file could not be read')
+        return int(content_range.rpartition('/')[2]), response.headers.get('etag', etag)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        self._check_open()
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """
+        Moves the read position.
+
+        Args:
+            offset (int): The offset, in bytes, from the point given by whence.
+            whence (int): io.SEEK_SET, io.SEEK_CUR, or io.SEEK_END.
+
+        Returns:
+            int: The new read position.
+        """
+        self._check_open()
+        with self._lock:
+            if whence == io.SEEK_SET:
+                position = offset
+            elif whence == io.SEEK_CUR:
+                position = self._position + offset
+            elif whence == io.SEEK_END:
+                position = self.size + offset
+            else:
+                raise ValueError(f'Invalid whence value: {whence}')
+            if position < 0:
+                raise ValueError(f'Negative seek position {position}')
+            self._position = position
+            return position
+
+    def readinto(self, buffer) -> int:
+        """
+        Reads up to len(buffer) bytes from the current position into the supplied buffer.
+
+        Returns:
+            int: The number of bytes read, which is 0 at the end of the file.
+        """
+        self._check_open()
+        with self._lock:
+            start = self._position
+            end = min(start + len(buffer), self.size)
+            if start >= end:
+                return 0
+            view = memoryview(buffer).cast('B')
+            first = start // self.block_size
+            last = (end - 1) // self.block_size
+            ahead = self._readahead(start, last)
+            # the read ahead blocks are topped up once less than half of them remain, so they are fetched in batches
+            if ahead and last + 1 + ahead // 2 not in self._blocks:
+                self._load(first, last + ahead)
+            else:
+                self._load(first, last)
+            written = 0
+            for index in range(first, last + 1):
+                block = self._blocks[index]
+                self._blocks.move_to_end(index)
+                block_start = index * self.block_size
+                chunk = block[max(start - block_start, 0):end - block_start]
+                view[written:written + len(chunk)] = chunk
+                written += len(chunk)
+            # blocks read ahead are about to be used, so they are kept in preference to the blocks just read
+            for index in range(last + 1, last + ahead + 1):
+                if index in self._blocks:
+                    self._blocks.move_to_end(index)
+            self._position = end
+            self._sequential_end = end
+            self._evict()
+            return written
+
+    def _readahead(self, start: int, last: int) -> int:
+        """
+        Returns:
+            int: The number of blocks to read ahead of the supplied read.  The window doubles with every sequential
+                read, and resets when a read is not sequential.
+        """
+        if self.readahead <= 0 or self._sequential_end != start:
+            self._window = 1
+            return 0
+        window = self._window
+        self._window = min(self._window * 2, self.readahead)
+        max_blocks = max(self.cache_size // self.block_size - (last - start // self.block_size + 1), 0)
+        return min(window, max_blocks)
+
+    def _load(self, first: int, last: int) -> None:
+        """
+        Fetches the blocks from first to last that are not cached, fetching each run of adjacent missing blocks in a
+        single request.
+        """
+        last = min(last, (self.size - 1) // self.block_size)
+        run_start = None
+        for index in range(first, last + 2):
+            missing = index <= last and index not in self._blocks
+            if missing and run_start is None:
+                run_start = index
+            elif not missing and run_start is not None:
+                self._fetch(run_start, index - 1)
+                run_start = None
+
+    def _fetch(self, first: int, last: int) -> None:
+        """
+        Fetches a run of adjacent blocks in a single request and adds them to the cache.
+        """
+        start = first * self.block_size
+        end = min((last + 1) * self.block_size, self.size) - 1
+        if self._body is not None:
+            self._body.seek(start)
+            data = self._body.read(end - start + 1)
+        else:
+            logger.debug(f'Fetching bytes {start}-{end} of {self.url}')
+            body = tempfile.SpooledTemporaryFile(max_size=self.cache_size)
+            data = fetch_range(self._session, self.url, start, end, self.config, self.etag, body)
+            self.requests += 1
+            if body.tell():
+                logger.info(f'{self.url} does not support range requests, reading it from a local copy')
+                self.ranges_supported = False
+                self._body = body
+                self.bytes_fetched += body.tell()
+            else:
+                body.close()
+                self.bytes_fetched += len(data)
+        if len(data) != end - start + 1:
+            raise RequestFailedException(self.url, 206, f'Expected {end - start + 1} bytes but received {len(data)}')
+        for index in range(first, last + 1):
+            offset = (index - first) * self.block_size
+            self._blocks[index] = data[offset:offset + self.block_size]
+            self._blocks.move_to_end(index)
+
+    def _evict(self) -> None:
+        """
+        Removes the least recently used blocks until the cache is within its size limit.
+        """
+        while self._blocks and len(self._blocks) * self.block_size > self.cache_size:
+            self._blocks.popitem(last=False)
+
+    def close(self) -> None:
+        """
+        Closes the file, releasing its cached blocks and its connections.
+        """
+        if not self.closed:
+            self._blocks.clear()
+            if self._body is not None:
+                self._body.close()
+            self._session.close()
+        super().close()
+
+    def _check_open(self) -> None:
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+
+    def __repr__(self) -> str:
+        return f'<RemoteFile url={self.url!r} size={self.size}>'
@@ -0,0 +1,299 @@
+import os
+import sqlite3
+import logging
+from contextlib import contextmanager
+from threading import Lock
+from typing import BinaryIO, Iterator, NamedTuple, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = 'index.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    size INTEGER NOT NULL DEFAULT 0,
+    closed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS objects (
+    url TEXT PRIMARY KEY,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+"""
+
+
+class SegmentEntry(NamedTuple):
+
+    """
+    The location of an object stored in a segment file by a SegmentSink.
+
+    Attributes:
+        path (str): The path of the segment file.
+        offset (int): The offset of the first byte of the object in the segment file.
+        length (int): The number of bytes of the object.
+    """
+
+    path: str
+    offset: int
+    length: int
+
+
+class Segment:
+
+    """
+    A segment file open for appending, which is written by one object at a time.
+
+    Attributes:
+        id (int): The id of the segment in the index.
+        path (str): The path of the segment file.
+        file (BinaryIO): The open segment file.
+        size (int): The number of bytes of complete objects in the segment.
+    """
+
+    def __init__(self, segment_id: int, path: str):
+        self.id = segment_id
+        self.path = path
+        self.file: BinaryIO = open(path, 'wb')
+        self.size = 0
+
+
+class SegmentObject:
+
+    """
+    An object being streamed onto the end of a segment.  It is written as a file, and its entry is set once it is
+    complete.
+
+    Attributes:
+        path (str): The path of the segment file.
+        offset (int): The offset of the object in the segment file.
+        length (int): The number of bytes written so far.
+        entry (Optional[SegmentEntry]): The location of the object, once it is complete.
+    """
+
+    def __init__(self, segment: Segment):
+        self.path = segment.path
+        self.offset = segment.size
+        self.length = 0
+        self.entry: Optional[SegmentEntry] = None
+        self._file = segment.file
+
+    def write(self, data: bytes) -> int:
+        self._file.write(data)
+        self.length += len(data)
+        return len(data)
+
+
+class SegmentSink:
+
+    """
+    Stores many small downloads by appending them to rolling segment files in a directory, rather than writing each to
+    its own file, along with a SQLite index that maps each url to the segment, offset, and length of its object.
+
+    Each object is streamed straight from the response onto the end of a segment that is held by its download alone,
+    so concurrent downloads write to separate segments, and at most as many segments are open as objects are being
+    written at once.  A segment is closed once it reaches segment_size, and a new one is started.  An object that fails
+    part way is truncated from its segment, and is never indexed.
+
+    Objects are flushed to the segment before they are indexed, and index entries are committed in batches of
+    index_batch, or when flush is called, so a crash loses at most the index entries of the last batch, leaving their
+    bytes unreferenced.  Segments are allocated in the index, so several processes can share a directory.  Storing a
+    url again replaces its index entry, and the old object's bytes are left unreferenced.
+
+    Attributes:
+        path (str): The directory that holds the segment files and the index.
+        segment_size (int): The size in bytes after which a segment is closed.
+        index_batch (int): The number of objects whose index entries are committed together.
+
+    Args:
+        path (str): The directory that holds the segment files and the index, which is created if it does not exist.
+        segment_size (int): The size in bytes after which a segment is closed.  Default is 1gb.
+        index_batch (int): The number of objects whose index entries are committed together.  Default is 1000.
+    """
+
+    def __init__(self, path: str, segment_size: int = 1024 ** 3, index_batch: int = 1000):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.segment_size = int(segment_size)
+        self.index_batch = index_batch
+        self._lock = Lock()
+        self._connection = None
+        self._pid = None
+        self._idle = []
+        self._pending = {}
+
+    def __getstate__(self) -> dict:
+        return {'path': self.path, 'segment_size': self.segment_size, 'index_batch': self.index_batch}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Returns the connection to the index, opening it if this process has not.  Segments and pending entries
+        inherited from a parent process are left to the parent.  Must be called while holding the lock.
+        """
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(
+                os.path.join(self.path, INDEX_NAME), timeout=30, isolation_level=None, check_same_thread=False
+            )
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.executescript(SCHEMA)
+            self._pid = os.getpid()
+            self._idle = []
+            self._pending = {}
+        return self._connection
+
+    def segment_path(self, segment_id: int) -> str:
+        """
+        Returns:
+            str: The path of the segment file with the supplied id.
+        """
+        return os.path.join(self.path, f'segment-{segment_id:08d}.seg')
+
+    def _acquire(self) -> Segment:
+        with self._lock:
+            connection = self._connect()
+            if self._idle:
+                return self._idle.pop()
+            segment_id = connection.execute('INSERT INTO segments DEFAULT VALUES').lastrowid
+        logger.debug(f'Starting segment {segment_id} in {self.path}')
+        return Segment(segment_id, self.segment_path(segment_id))
+
+    def _release(self, segment: Segment) -> None:
+        if segment.size < self.segment_size:
+            with self._lock:
+                self._idle.append(segment)
+            return
+        self._close_segment(segment)
+
+    def _close_segment(self, segment: Segment) -> None:
+        segment.file.close()
+        with self._lock:
+            self._connect().execute('UPDATE segments SET size = ?, closed = 1 WHERE id = ?', (segment.size, segment.id))
+        logger.debug(f'Closed segment {segment.id} at {segment.size} bytes')
+
+    @contextmanager
+    def store(self, url: str) -> Iterator[SegmentObject]:
+        """
+        Stores the object for a url, written to the SegmentObject given to the with block.  The object is indexed when
+        the block exits, or removed from its segment if the block raises.
+
+        Args:
+            url (str): The url the object is indexed under.
+
+        Returns:
+            Iterator[SegmentObject]: The object, which receives its entry once it is complete.
+        """
+        segment = self._acquire()
+        item = SegmentObject(segment)
+        try:
+            yield item
+            segment.file.flush()
+        except BaseException:
+            try:
+                segment.file.flush()
+                segment.file.truncate(item.offset)
+                segment.file.seek(item.offset)
+            except OSError:
+                logger.error(f'Failed to remove incomplete object from segment {segment.id}', exc_info=True)
+                segment.size = self.segment_size
+            self._release(segment)
+            raise
+        segment.size += item.length
+        item.entry = SegmentEntry(segment.path, item.offset, item.length)
+        self._index(url, segment.id, item.offset, item.length)
+        self._release(segment)
+
+    def _index(self, url: str, segment_id: int, offset: int, length: int) -> None:
+        with self._lock:
+            self._connect()
+            self._pending[url] = (segment_id, offset, length)
+            if len(self._pending) >= self.index_batch:
+                self._commit()
+
+    def _commit(self) -> None:
+        """
+        Commits the pending index entries.  Must be called while holding the lock.
+        """
+        if not self._pending:
+            return
+        rows = [(url, *location) for url, location in self._pending.items()]
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(
+                'INSERT OR REPLACE INTO objects (url, segment, offset, length) VALUES (?, ?, ?, ?)', rows
+            )
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        self._pending = {}
+
+    def flush(self) -> None:
+        """
+        Commits the index entries of every object stored so far.
+        """
+        with self._lock:
+            self._connect()
+            self._commit()
+
+    def close(self) -> None:
+        """
+        Commits the pending index entries and closes every open segment.  Objects may still be stored afterward, in new
+        segments.
+        """
+        self.flush()
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for segment in idle:
+            self._close_segment(segment)
+
+    def lookup(self, url: str) -> Optional[SegmentEntry]:
+        """
+        Returns:
+            Optional[SegmentEntry]: The location of the object stored for the url, or None if there is none.
+        """
+        with self._lock:
+            connection = self._connect()
+            location = self._pending.get(url)
+            if location is None:
+                location = connection.execute(
+                    'SELECT segment, offset, length FROM objects WHERE url = ?', (url,)
+                ).fetchone()
+        if location is None:
+            return None
+        segment_id, offset, length = location
+        return SegmentEntry(self.segment_path(segment_id), offset, length)
+
+    def read(self, url: str) -> bytes:
+        """
+        Returns:
+            bytes: The object stored for the url.
+
+        Raises:
+            KeyError: If no object is stored for the url.
+        """
+        entry = self.lookup(url)
+        if entry is None:
+            raise KeyError(url)
+        with open(entry.path, 'rb') as file:
+            file.seek(entry.offset)
+            return file.read(entry.length)
+
+    def entries(self) -> Iterator[Tuple[str, SegmentEntry]]:
+        """
+        Returns:
+            Iterator[Tuple[str, SegmentEntry]]: The url and location of every committed object, ordered by segment and
+                offset.
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT url, segment, offset, length FROM objects ORDER BY segment, offset'
+            ).fetchall()
+        for url, segment_id, offset, length in rows:
+            yield url, SegmentEntry(self.segment_path(segment_id), offset, length)
@@ -0,0 +1,269 @@
+import os
+import copy
+import zlib
+import queue
+import logging
+import multiprocessing
+from typing import Callable, Optional
+
+from .download_config import DownloadConfig
+from .data_models import DLGroup, Response
+from .memory_budget import MemoryBudget
+from .metrics import MetricsRegistry, MetricsServer, MetricsShard
+from .queue_downloader import QueueDownloader
+from chunkydl.runner import Runner
+
+
+logger = logging.getLogger(__name__)
+
+STOP = 'stop'
+RESULT = 'result'
+METRICS = 'metrics'
+DONE = 'done'
+
+
+class ResultChannel:
+
+    """
+    Takes the place of the results list of the queue downloader in a worker process, sending each result to the parent
+    process as it is added.
+
+    Args:
+        index (int): The index of the worker process.
+        channel (multiprocessing.Queue): The queue on which messages are sent to the parent process.
+    """
+
+    def __init__(self, index: int, channel):
+        self.index = index
+        self.channel = channel
+
+    def append(self, response: Response) -> None:
+        self.channel.put((RESULT, self.index, response))
+
+
+def run_shard(index: int, config: DownloadConfig, items, channel, record_metrics: bool,
+              metrics_interval: float) -> None:
+    """
+    Runs a queue downloader in a worker process, downloading the items received from the parent process and sending
+    the results, and the totals of the metrics, back to it.
+
+    Args:
+        index (int): The index of the worker process.
+        config (DownloadConfig): The config used by the queue downloader, without the parent's metrics registry.
+        items (multiprocessing.Queue): The queue on which the items to download are received.
+        channel (multiprocessing.Queue): The queue on which messages are sent to the parent process.
+        record_metrics (bool): Indicates if metrics are recorded and sent to the parent process.
+        metrics_interval (float): The seconds between sends of the metrics to the parent process.
+    """
+    if record_metrics:
+        config.metrics = MetricsRegistry()
+        if config.publisher is not None:
+            config.publisher.set_metrics(config.metrics)
+    downloader = QueueDownloader(config)
+    downloader.results = ResultChannel(index, channel)
+    downloader.start()
+    try:
+        while True:
+            try:
+                item = items.get(timeout=metrics_interval)
+            except queue.Empty:
+                if record_metrics:
+                    channel.put((METRICS, index, config.metrics.totals()))
+                continue
+            if item is None:
+                downloader.add(None)
+                break
+            if item == STOP:
+                downloader.stop()
+                downloader.add(None)
+                break
+            url, output_path, item_config, mirrors = item
+            downloader.add(DLGroup(url, output_path, item_config or config, mirrors))
+        downloader.join()
+    finally:
+        if record_metrics:
+            channel.put((METRICS, index, config.metrics.totals()))
+        channel.put((DONE, index, None))
+
+
+class ShardedDownloader(Runner):
+
+    """
+    A front end that shards the downloads added to it across several worker processes, each of which runs its own
+    QueueDownloader, so that workloads of many small files, which are bound by the parsing done by a single process
+    while holding the GIL, can use every core.  The results of each process are sent back as they complete, and the
+    metrics recorded by each process are merged into the config's metrics registry.
+
+    Downloads are assigned to a process by a hash of a key taken from their url, which by default is the url itself, so
+    that duplicate urls land in the same process and are still coalesced.  Supply chunkydl.utils.get_host as the shard
+    key to keep each host's downloads in a single process.
+
+    Items are sent to the worker processes with their config replaced by the downloader's config when it is the same
+    object.  Items with other configs, and the downloader's config on platforms that spawn processes, must be
+    picklable.  Progress trackers and hooks are called within the worker processes.  The memory limit of the
+    downloader's config is divided evenly between the processes, each of which reserves from its own share, so that
+    their buffers together stay under the limit.  Items with other configs reserve from a copy of their config's budget
+    in each process, so their limits are not divided.
+
+    Attributes:
+        config (DownloadConfig): The configuration object that will be used to determine the download parameters.
+        processes (int): The number of worker processes.
+        shard_key (Callable[[str], str]): Returns the key that is hashed to choose the process of a url.
+        results (list[Response]): The responses of the completed downloads.
+        metrics_interval (float): The seconds between sends of each process's metrics to this process.
+        metrics_server (Optional[MetricsServer]): The server that serves the config's metrics registry while the
+            downloader runs, if the config specifies a metrics port.
+
+    Args:
+        config (DownloadConfig): The configuration object that will be used to determine the download parameters.
+        processes (Optional[int]): The number of worker processes.  Defaults to the config's shard_processes, or the
+            number of CPUs if that is not greater than 1.
+        shard_key (Optional[Callable[[str], str]]): Returns the key that is hashed to choose the process of a url.
+            Defaults to the url itself.
+        metrics_interval (float): The seconds between sends of each process's metrics to this process.  Default is 1.
+    """
+
+    def __init__(self, config: DownloadConfig, processes: Optional[int] = None,
+                 shard_key: Optional[Callable[[str], str]] = None, metrics_interval: float = 1.0):
+        super().__init__()
+        if config.queue_path is not None:
+            raise ValueError('A durable queue is shared by running several processes on it, not by sharding')
+        self.config = config
+        if processes is None:
+            processes = config.shard_processes if config.shard_processes > 1 else os.cpu_count() or 1
+        self.processes = processes
+        self.shard_key = shard_key
+        self.metrics_interval = metrics_interval
+        self.results = []
+        self.metrics_server = None
+        context = multiprocessing.get_context()
+        self._channel = context.Queue()
+        self._queues = [context.Queue() for _ in range(processes)]
+        worker_config = copy.copy(config)
+        worker_config.metrics = None
+        worker_config.metrics_port = None
+        if config.memory_budget is not None:
+            # each process reserves from its own budget, so the limit is divided to keep the total under it
+            limit = config.memory_budget.limit // processes
+            if limit <= 0:
+                raise ValueError(f'A memory limit of {config.memory_budget.limit} bytes can not be divided between '
+                                 f'{processes} processes')
+            worker_config.memory_budget = MemoryBudget(limit)
+        self._workers = [
+            context.Process(
+                target=run_shard,
+                args=(index, worker_config, self._queues[index], self._channel, config.metrics is not None,
+                      metrics_interval),
+                name=f'chunkydl-shard-{index}',
+            )
+            for index in range(processes)
+        ]
+        self._metric_shards = {}
+
+    def get_shard(self, url: str) -> int:
+        """
+        Returns:
+            int: The index of the process that downloads the url.
+        """
+        key = self.shard_key(url) if self.shard_key is not None else url
+        return zlib.crc32(key.encode()) % self.processes
+
+    def add(self, item: Optional[DLGroup]) -> None:
+        """
+        Adds a new item to the download queue of its process.  None is sent to every process, which stops once its
+        queue is empty.
+
+        Args:
+            item (Optional[DLGroup]): The item that will be downloaded.
+        """
+        if item is None:
+            for items in self._queues:
+                items.put(None)
+            return
+        url, output_path, config = item[:3]
+        self._queues[self.get_shard(url)].put(
+            (url, output_path, None if config is self.config else config, tuple(getattr(item, 'mirrors', ())))
+        )
+
+    def add_multiple(self, items: list[Optional[DLGroup]]) -> None:
+        """
+        Adds multiple items to the download queues.
+
+        Args:
+            items (list[Optional[DLGroup]]): A list of items to be added.
+        """
+        for item in items:
+            self.add(item)
+
+    def download_all(self) -> None:
+        """
+        Calls the run method in a more concise and user-friendly way.
+        """
+        self.run()
+
+    def stop(self) -> None:
+        """
+        Stops every worker process without waiting for their queues to empty.
+        """
+        super().stop()
+        for items in self._queues:
+            items.put(STOP)
+
+    def run(self) -> None:
+        """
+        Starts the worker processes and collects their results and metrics until every process has stopped.
+        """
+        for worker in self._workers:
+            worker.start()
+        self.start_metrics()
+        running = set(range(self.processes))
+        while running:
+            try:
+                kind, index, value = self._channel.get(timeout=self.metrics_interval)
+            except queue.Empty:
+                for index in list(running):
+                    if not self._workers[index].is_alive():
+                        logger.error(f'Shard process {index} exited with code {self._workers[index].exitcode}')
+                        running.discard(index)
+                continue
+            if kind == RESULT:
+                self.results.append(value)
+            elif kind == METRICS:
+                self.merge_metrics(index, value)
+            elif kind == DONE:
+                running.discard(index)
+        for worker in self._workers:
+            worker.join()
+        self.stop_metrics()
+        logger.info('Sharded downloader shutdown')
+
+    def merge_metrics(self, index: int, totals: MetricsShard) -> None:
+        """
+        Replaces the metrics of a worker process in the config's metrics registry with the totals it sent.
+
+        Args:
+            index (int): The index of the worker process.
+            totals (MetricsShard): The totals of the metrics recorded by the process.
+        """
+        shard = self._metric_shards.get(index)
+        if shard is None:
+            shard = self._metric_shards[index] = self.config.metrics.add_shard(MetricsShard())
+        shard.counters = totals.counters
+        shard.histograms = totals.histograms
+        shard.bytes_received = totals.bytes_received
+
+    def start_metrics(self) -> None:
+        """
+        Starts the metrics server if the config specifies a metrics registry and a metrics port.
+        """
+        if self.config.metrics is not None and self.config.metrics_port is not None:
+            self.metrics_server = MetricsServer(self.config.metrics, port=self.config.metrics_port)
+            self.metrics_server.start()
+
+    def stop_metrics(self) -> None:
+        """
+        Stops the metrics server if it is running.
+        """
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
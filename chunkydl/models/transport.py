@@ -0,0 +1,475 @@
+import os
+import time
+import queue
+import logging
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from threading import Lock
+from typing import Iterator, Optional
+from urllib.parse import urljoin
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter, Retry
+
+from .dns_cache import DnsCache, make_pool_classes
+from .circuit_breaker import CircuitBreakerRetry, get_origin
+
+
+logger = logging.getLogger(__name__)
+
+TRANSPORTS = ('requests', 'urllib3', 'httpx')
+
+
+def get_request_session(config) -> requests.Session:
+    """
+    Configures the session that will be used to make requests.
+
+    Args:
+        config (DownloadConfig): The download configuration object that holds the setup variables for this download.:
+    """
+    session = requests.Session()
+    retry_strategy = get_retry_strategy(config)
+    adapter = HTTPAdapter(max_retries=retry_strategy)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_retry_strategy(config, host: str = '') -> Retry:
+    """
+    Configures the retry strategy used by a request session.  If the config has a circuit breaker, each failed attempt
+    is recorded with it.
+    Args:
+        config (DownloadConfig): The download configuration object that holds the setup variables for this download.:
+        host (str): The origin requested, as get_origin returns, which is otherwise taken from the connection pool of
+            each attempt.
+    """
+    if config.circuit_breaker is not None:
+        return CircuitBreakerRetry(
+            total=config.retries,
+            status_forcelist=config.retry_status_codes,
+            backoff_factor=config.backoff_factor,
+            allowed_methods=['HEAD', 'GET'],
+            circuit_breaker=config.circuit_breaker,
+            host=host,
+        )
+    return Retry(
+        total=config.retries,
+        status_forcelist=config.retry_status_codes,
+        backoff_factor=config.backoff_factor,
+        allowed_methods=['HEAD', 'GET']
+    )
+
+
+class Transport(ABC):
+
+    """
+    The HTTP client that downloads make their requests with.  Every transport returns responses with the parts of the
+    requests.Response interface that downloads use:
+        - status_code, reason, url, headers (case insensitive), and elapsed (the time until the headers were read)
+        - iter_content(chunk_size), which yields the body decoded as its Content-Encoding requires
+        - raw.stream(chunk_size, decode_content=False), which yields the body as it was sent
+        - raw.retries, the urllib3 Retry whose history holds the retries made, or None
+        - content, the whole body, and close(), which releases the connection
+
+    Requests are retried as the config's retries, retry_status_codes, and backoff_factor describe.  HEAD requests are
+    made without the config's headers, without retries, and without following redirects.
+
+    Attributes:
+        name (str): The name that selects the transport in a DownloadConfig.
+    """
+
+    name = None
+
+    @abstractmethod
+    def head(self, url: str, config):
+        """
+        Makes a HEAD request for the url.
+        """
+
+    @abstractmethod
+    def get(self, url: str, config, headers: Optional[dict] = None, stream: bool = True, **kwargs):
+        """
+        Makes a GET request for the url, with its body left unread when stream is True.
+
+        Args:
+            url (str): The url requested.
+            config (DownloadConfig): The config whose timeout and retry settings are used.
+            headers (Optional[dict]): The headers sent with the request.
+            stream (bool): Indicates if the body is read as it is iterated, rather than before returning.
+            **kwargs: Additional keyword arguments, which only the requests transport accepts.
+        """
+
+    def warm(self, url: str, config, connections: int = 1) -> int:
+        """
+        Opens connections to the host of the url ahead of the requests that will use them, until the transport holds
+        the supplied number of idle connections to the host, or as many as it keeps for a host.  Transports that do not
+        keep connections between requests open none.
+
+        Returns:
+            int: The number of connections opened.
+        """
+        return 0
+
+    def close(self) -> None:
+        """
+        Closes the connections held by the transport.
+        """
+
+
+class RequestsTransport(Transport):
+
+    """
+    Makes requests with a new requests.Session for every request, as chunkydl always has.
+    """
+
+    name = 'requests'
+
+    def head(self, url: str, config) -> requests.Response:
+        return requests.head(url, timeout=config.timeout)
+
+    def get(self, url: str, config, headers: Optional[dict] = None, stream: bool = True,
+            **kwargs) -> requests.Response:
+        session = get_request_session(config)
+        return session.get(url, stream=stream, timeout=config.timeout, headers=headers, **kwargs)
+
+
+class Urllib3Response:
+
+    """
+    A urllib3 response, presented with the parts of the requests.Response interface that downloads use.
+
+    Attributes:
+        raw (urllib3.BaseHTTPResponse): The urllib3 response.
+        url (str): The url of the response, after any redirects.
+        status_code (int): The HTTP status code.
+        reason (str): The HTTP reason phrase.
+        headers (urllib3.HTTPHeaderDict): The response headers.
+        elapsed (timedelta): The time from sending the request until the headers were read.
+    """
+
+    def __init__(self, raw: urllib3.BaseHTTPResponse, url: str, elapsed: timedelta):
+        self.raw = raw
+        self.url = self.get_url(raw, url)
+        self.status_code = raw.status
+        self.reason = raw.reason
+        self.headers = raw.headers
+        self.elapsed = elapsed
+
+    @staticmethod
+    def get_url(raw: urllib3.BaseHTTPResponse, url: str) -> str:
+        """
+        Returns:
+            str: The url of the last redirect followed, or the requested url, as a pool manager only gives the path.
+        """
+        history = raw.retries.history if raw.retries is not None else ()
+        for retry in reversed(history):
+            if retry.redirect_location:
+                return urljoin(url, retry.redirect_location)
+        return url
+
+    def iter_content(self, chunk_size: int = 1) -> Iterator[bytes]:
+        return self.raw.stream(chunk_size, decode_content=True)
+
+    @property
+    def content(self) -> bytes:
+        return self.raw.data
+
+    def close(self) -> None:
+        # a connection whose body was not read to the end can not be reused
+        if not self.raw.isclosed():
+            self.raw.close()
+        self.raw.release_conn()
+
+
+class Urllib3Transport(Transport):
+
+    """
+    Makes requests with a single urllib3.PoolManager shared by every download made with the config, so that
+    connections are reused between downloads and each request skips the setup of a requests.Session.  Bodies are not
+    requested compressed unless the config's headers ask for it.
+
+    The pool is made for the process that first uses it, so the transport may be shared with worker processes.
+
+    Attributes:
+        maxsize (Optional[int]): The number of connections kept for each host.  Defaults to the config's download
+            threads multiplied by its multipart threads.
+        dns_cache (Optional[DnsCache]): The cache that new connections resolve their hosts through, if any.
+
+    Args:
+        maxsize (Optional[int]): The number of connections kept for each host.
+        dns_cache (Optional[DnsCache]): The cache that new connections resolve their hosts through.
+    """
+
+    name = 'urllib3'
+
+    def __init__(self, maxsize: Optional[int] = None, dns_cache: Optional[DnsCache] = None):
+        self.maxsize = maxsize
+        self.dns_cache = dns_cache
+        self._pool = None
+        self._pid = None
+        self._lock = Lock()
+
+    def __getstate__(self) -> dict:
+        return {'maxsize': self.maxsize, 'dns_cache': self.dns_cache}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def pool(self, config) -> urllib3.PoolManager:
+        """
+        Returns:
+            urllib3.PoolManager: The pool used by this process, made with the supplied config if there is none yet.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                maxsize = self.maxsize or max(config.download_threads * config.multipart_threads, 1)
+                # pools are evicted least recently used first, so there is room for the hosts of running downloads,
+                # the hosts warmed ahead of them, and as many hosts of downloads that finished since they were warmed
+                lookahead = config.prewarm_lookahead or config.download_threads
+                num_pools = max(10, config.download_threads + 2 * lookahead)
+                self._pool = urllib3.PoolManager(num_pools=num_pools, maxsize=maxsize)
+                if self.dns_cache is not None:
+                    self._pool.pool_classes_by_scheme = make_pool_classes(self.dns_cache)
+                self._pid = os.getpid()
+            return self._pool
+
+    @staticmethod
+    def get_timeout(config) -> urllib3.Timeout:
+        timeout = config.timeout
+        if isinstance(timeout, tuple):
+            return urllib3.Timeout(connect=timeout[0], read=timeout[1])
+        return urllib3.Timeout(connect=timeout, read=timeout)
+
+    def head(self, url: str, config) -> Urllib3Response:
+        start = time.perf_counter()
+        raw = self.pool(config).request('HEAD', url, timeout=self.get_timeout(config), retries=False)
+        return Urllib3Response(raw, url, timedelta(seconds=time.perf_counter() - start))
+
+    def get(self, url: str, config, headers: Optional[dict] = None, stream: bool = True,
+            **kwargs) -> Urllib3Response:
+        if kwargs:
+            raise TypeError(f'The urllib3 transport does not accept arguments: {", ".join(kwargs)}')
+        start = time.perf_counter()
+        raw = self.pool(config).request(
+            'GET',
+            url,
+            headers=headers,
+            timeout=self.get_timeout(config),
+            retries=get_retry_strategy(config),
+            preload_content=not stream,
+            decode_content=True,
+        )
+        return Urllib3Response(raw, url, timedelta(seconds=time.perf_counter() - start))
+
+    def warm(self, url: str, config, connections: int = 1) -> int:
+        pool = self.pool(config).connection_from_url(url)
+        idle = sum(1 for conn in list(pool.pool.queue) if conn is not None and conn.is_connected)
+        needed = min(connections, pool.pool.maxsize) - idle
+        held = []
+        opened = 0
+        try:
+            # the free slots of the pool are held as None, which are taken along with any idle connections above them
+            while opened < needed:
+                try:
+                    conn = pool.pool.get(block=False)
+                except queue.Empty:
+                    break
+                if conn is None:
+                    conn = pool._new_conn()
+                held.append(conn)
+                if not conn.is_connected:
+                    conn.timeout = self.get_timeout(config).connect_timeout
+                    conn.connect()
+                    opened += 1
+        finally:
+            for conn in reversed(held):
+                pool._put_conn(conn)
+        if opened:
+            logger.debug(f'Opened {opened} connections to {pool.host}')
+        return opened
+
+    def close(self) -> None:
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.clear()
+        self._pool = None
+        self._pid = None
+
+
+class HttpxRaw:
+
+    """
+    Gives the body of an httpx response through the raw.stream interface of a urllib3 response.
+
+    Attributes:
+        retries (Retry): The retry strategy, whose history holds the retries made.
+    """
+
+    def __init__(self, response, retries: Retry):
+        self._response = response
+        self.retries = retries
+
+    def stream(self, amt: int = 2 ** 16, decode_content: bool = True) -> Iterator[bytes]:
+        if decode_content:
+            return self._response.iter_bytes(amt)
+        return self._response.iter_raw(amt)
+
+
+class HttpxResponse:
+
+    """
+    An httpx response, presented with the parts of the requests.Response interface that downloads use.
+
+    Attributes:
+        raw (HttpxRaw): The body of the response as a raw stream.
+        url (str): The url of the response, after any redirects.
+        status_code (int): The HTTP status code.
+        reason (str): The HTTP reason phrase.
+        headers (httpx.Headers): The response headers.
+        elapsed (timedelta): The time from sending the request until the headers were read.
+    """
+
+    def __init__(self, response, elapsed: timedelta, retries: Optional[Retry] = None):
+        self._response = response
+        self.raw = HttpxRaw(response, retries)
+        self.url = str(response.url)
+        self.status_code = response.status_code
+        self.reason = response.reason_phrase
+        self.headers = response.headers
+        self.elapsed = elapsed
+
+    def iter_content(self, chunk_size: int = 1) -> Iterator[bytes]:
+        return self._response.iter_bytes(chunk_size)
+
+    @property
+    def content(self) -> bytes:
+        return self._response.read()
+
+    def close(self) -> None:
+        self._response.close()
+
+
+class HttpxTransport(Transport):
+
+    """
+    Makes requests with a single httpx.Client, which by default speaks HTTP/2 to hosts that support it, so that many
+    small requests to a host are multiplexed over one connection.  Requires httpx, with the h2 package for HTTP/2,
+    which are installed with: pip install httpx[http2]
+
+    The client is made for the process that first uses it, so the transport may be shared with worker processes.
+
+    Attributes:
+        http2 (bool): Indicates if HTTP/2 is offered to hosts.
+        max_connections (Optional[int]): The maximum number of connections the client opens.  Defaults to the
+            config's download threads multiplied by its multipart threads.
+
+    Args:
+        http2 (bool): Indicates if HTTP/2 is offered to hosts.  Default is True.
+        max_connections (Optional[int]): The maximum number of connections the client opens.
+
+    Raises:
+        ImportError: If httpx, or h2 when http2 is True, is not installed.
+    """
+
+    name = 'httpx'
+
+    def __init__(self, http2: bool = True, max_connections: Optional[int] = None):
+        try:
+            import httpx  # noqa: F401
+            if http2:
+                import h2  # noqa: F401
+        except ImportError as e:
+            raise ImportError('The httpx transport requires httpx, installed with: pip install httpx[http2]') from e
+        self.http2 = http2
+        self.max_connections = max_connections
+        self._client = None
+        self._pid = None
+        self._lock = Lock()
+
+    def __getstate__(self) -> dict:
+        return {'http2': self.http2, 'max_connections': self.max_connections}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def client(self, config):
+        """
+        Returns:
+            httpx.Client: The client used by this process, made with the supplied config if there is none yet.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                import httpx
+                max_connections = self.max_connections or max(config.download_threads * config.multipart_threads, 1)
+                self._client = httpx.Client(
+                    http2=self.http2,
+                    follow_redirects=True,
+                    limits=httpx.Limits(max_connections=max_connections),
+                )
+                self._pid = os.getpid()
+            return self._client
+
+    @staticmethod
+    def get_timeout(config):
+        import httpx
+        timeout = config.timeout
+        if isinstance(timeout, tuple):
+            return httpx.Timeout(timeout[1], connect=timeout[0])
+        return httpx.Timeout(timeout)
+
+    def head(self, url: str, config) -> HttpxResponse:
+        start = time.perf_counter()
+        response = self.client(config).head(url, timeout=self.get_timeout(config), follow_redirects=False)
+        return HttpxResponse(response, timedelta(seconds=time.perf_counter() - start))
+
+    def get(self, url: str, config, headers: Optional[dict] = None, stream: bool = True,
+            **kwargs) -> HttpxResponse:
+        if kwargs:
+            raise TypeError(f'The httpx transport does not accept arguments: {", ".join(kwargs)}')
+        client = self.client(config)
+        retries = get_retry_strategy(config, get_origin(url))
+        start = time.perf_counter()
+        while True:
+            request = client.build_request('GET', url, headers=headers, timeout=self.get_timeout(config))
+            response = client.send(request, stream=True)
+            if not retries.is_retry('GET', response.status_code):
+                break
+            try:
+                retries = retries.increment('GET', url)
+            except urllib3.exceptions.MaxRetryError:
+                break
+            response.close()
+            logger.debug(f'Retrying {url} after status {response.status_code}')
+            retries.sleep()
+        if not stream:
+            response.read()
+        return HttpxResponse(response, timedelta(seconds=time.perf_counter() - start), retries)
+
+    def close(self) -> None:
+        if self._client is not None and self._pid == os.getpid():
+            self._client.close()
+        self._client = None
+        self._pid = None
+
+
+def make_transport(name: str, dns_cache: Optional[DnsCache] = None) -> Transport:
+    """
+    Args:
+        name (str): The kind of transport, one of 'requests', 'urllib3', or 'httpx'.
+        dns_cache (Optional[DnsCache]): The cache that a 'urllib3' transport resolves hosts through.  The other
+            transports resolve each connection with their own resolvers.
+
+    Returns:
+        Transport: A new transport of the named kind.
+
+    Raises:
+        ValueError: If the name is not that of a transport.
+    """
+    if name == 'requests':
+        return RequestsTransport()
+    if name == 'urllib3':
+        return Urllib3Transport(dns_cache=dns_cache)
+    if name == 'httpx':
+        return HttpxTransport()
+    raise ValueError(f'Unknown transport: {name}')
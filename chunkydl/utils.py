@@ -1,9 +1,11 @@
 import os
-from typing import Union
+from typing import Union, Optional
 from urllib.parse import urlparse
 import requests
 
-from .models.data_models import DLGroup, Response
+from .models.data_models import DLGroup, Response, Timing
+from .models.download_cache import link_file
+from .models.file_publisher import FilePublisher
 
 
 def get_output(output_path: str) -> tuple:
@@ -40,12 +42,26 @@ def get_name_from_url(url: str) -> str:
     return os.path.basename(o.path)
 
 
-def make_response(response: requests.Response) -> Response:
+def get_host(url: str) -> str:
+    """
+    Args:
+        url (str): The url for which the host is to be extracted.
+
+    Returns:
+        str: The host name of the url, or an empty string if the url has no host.
+    """
+    return urlparse(url).hostname or ''
+
+
+def make_response(response: requests.Response, output_path: Optional[str] = None,
+                  timing: Optional[Timing] = None) -> Response:
     """
     Takes a requests.Response object and extracts the pertinent information from it, returning it as a Response object.
 
     Args:
         response (requests.Response): A requests.Response object as returned from a request.
+        output_path (Optional[str]): The path where the downloaded file was saved.
+        timing (Optional[Timing]): The timing of the download.
 
     Returns:
         Response: A Response object containing pertinent information from the supplied requests.Response.
@@ -56,9 +72,116 @@ def make_response(response: requests.Response) -> Response:
         headers=headers,
         status_code=response.status_code,
         elapsed=response.elapsed,
+        output_path=output_path,
+        timing=timing,
     )
 
 
+def get_retry_count(response: requests.Response) -> int:
+    """
+    Returns:
+        int: The number of times the request that produced the supplied response was retried.
+    """
+    retries = getattr(response.raw, 'retries', None)
+    return len(retries.history) if retries is not None else 0
+
+
+def parse_content_range(value: Optional[str]) -> Optional[tuple]:
+    """
+    Parses the value of a Content-Range header.
+
+    Args:
+        value (Optional[str]): The header value, such as 'bytes 0-99/1000'.
+
+    Returns:
+        Optional[tuple]: The first byte, last byte, and total size (None if the size is unknown) of the range, or None
+            if the value is missing or is not a satisfied byte range.
+    """
+    if not value:
+        return None
+    unit, _, spec = value.strip().partition(' ')
+    span, _, total = spec.partition('/')
+    start, _, end = span.partition('-')
+    if unit.lower() != 'bytes' or not start.isdigit() or not end.isdigit():
+        return None
+    return int(start), int(end), int(total) if total.isdigit() else None
+
+
+def parse_byteranges(content_type: str, body: bytes) -> list[tuple]:
+    """
+    Splits a multipart/byteranges response body into its parts.
+
+    Args:
+        content_type (str): The Content-Type header of the response, which holds the multipart boundary.
+        body (bytes): The response body.
+
+    Returns:
+        list[tuple]: The first byte, data, and size of the whole file (None if unknown) of each part, in the order they
+            appear in the body.
+
+    Raises:
+        ValueError: If the content type has no boundary, or a part has no valid Content-Range.
+    """
+    boundary = None
+    for parameter in content_type.split(';')[1:]:
+        key, _, value = parameter.strip().partition('=')
+        if key.lower() == 'boundary':
+            boundary = value.strip('"')
+    if not boundary:
+        raise ValueError(f'No boundary in content type {content_type}')
+    delimiter = b'--' + boundary.encode('ascii')
+    parts = []
+    for part in body.split(delimiter)[1:]:
+        if part.startswith(b'--'):
+            break
+        head, _, data = part.partition(b'\r\n\r\n')
+        if data.endswith(b'\r\n'):
+            data = data[:-2]
+        content_range = None
+        for line in head.decode('latin-1').split('\r\n'):
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'content-range':
+                content_range = parse_content_range(value)
+        if content_range is None or content_range[1] - content_range[0] + 1 != len(data):
+            raise ValueError('A part of a multipart/byteranges response has an invalid Content-Range')
+        parts.append((content_range[0], data, content_range[2]))
+    return parts
+
+
+def share_download(response: Response, output_path: str, link_mode: str = 'clone',
+                   publisher: Optional[FilePublisher] = None) -> Response:
+    """
+    Places a file that has already been downloaded at another output path, for a duplicate download of the same url.
+
+    Args:
+        response (Response): The Response returned from the completed download.
+        output_path (str): The output path of the duplicate download.  If the path is a directory, the file is given
+            the same name as the downloaded file.
+        link_mode (str): How the file is placed at the output path.  See link_file for the available modes.
+        publisher (Optional[FilePublisher]): The publisher that places the file at the output path once it is
+            complete, if any.
+
+    Returns:
+        Response: A copy of the supplied Response pointing at the new output path.
+    """
+    dir_path, name = get_output(output_path)
+    if not name:
+        name = os.path.basename(response.output_path)
+    output = str(os.path.join(dir_path, name))
+    if not (os.path.exists(output) and os.path.samefile(output, response.output_path)):
+        if publisher is None:
+            link_file(response.output_path, output, link_mode)
+        else:
+            target = publisher.temp_path(output)
+            try:
+                link_file(response.output_path, target, link_mode)
+                publisher.publish(target, output)
+            except OSError:
+                publisher.discard(target, output)
+                raise
+    return response._replace(output_path=output)
+
+
 def convert_urls(urls: list[Union[str, DLGroup]], output_dir, config) -> list[DLGroup]:
     """
     Verifies that the supplied urls are DLGroup objects and if not, converts them.
@@ -9,7 +9,7 @@ setup(
     long_description=open('README.md').read(),
     long_description_content_type="text/markdown",
     url='https://github.com/MalloyDelacroix/chunkydl',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     classifiers=[
         'Programming Language :: Python :: 3',
         'License :: OSI Approved :: Apache Software License',
@@ -21,5 +21,6 @@ setup(
     python_requires='>=3.5',
     install_requires=[
         'requests',
+        'urllib3>=2',
     ],
 )
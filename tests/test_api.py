@@ -60,3 +60,12 @@ class TestDownloadList(unittest.TestCase):
         )
 
         mock_downloader.assert_called_with(config=config)
+
+    @patch('chunkydl.api.ShardedDownloader')
+    @patch('chunkydl.api.QueueDownloader')
+    def test_download_list_shards_across_processes_when_configured(self, mock_downloader, mock_sharded):
+        config = DownloadConfig(shard_processes=4)
+        download_list(['http://example.com/path/to/file_one.mp4'], '/path/to/file/', config=config)
+
+        mock_sharded.assert_called_with(config=config)
+        mock_downloader.assert_not_called()
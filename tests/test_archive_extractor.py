@@ -0,0 +1,198 @@
+import io
+import os
+import time
+import threading
+import gzip
+import shutil
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from chunkydl import DownloadConfig, UnsafeArchiveException
+from chunkydl.models.archive_extractor import (ArchiveExtractor, ArchiveSink, StreamBuffer, archive_encoding,
+                                               check_member)
+
+
+def make_tar(members: dict) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+MEMBERS = {'first.txt': b'first', 'directory/second.bin': bytes(range(256)) * 400}
+TAR = make_tar(MEMBERS)
+
+
+def chunks(data, size=1000):
+    return [data[index:index + size] for index in range(0, len(data), size)]
+
+
+class TestArchiveEncoding(unittest.TestCase):
+
+    def test_encoding_is_found_from_extension(self):
+        self.assertEqual('gzip', archive_encoding('data.tar.gz'))
+        self.assertEqual('gzip', archive_encoding('data.tgz'))
+        self.assertEqual('xz', archive_encoding('data.txz'))
+        self.assertIsNone(archive_encoding('data.tar'))
+
+
+class TestStreamBuffer(unittest.TestCase):
+
+    def test_reads_return_written_bytes_in_order(self):
+        buffer = StreamBuffer(100)
+        buffer.write(b'abcdef')
+        buffer.write(b'gh')
+        buffer.close()
+        self.assertEqual(b'abcd', buffer.read(4))
+        self.assertEqual(b'ef', buffer.read(4))
+        self.assertEqual(b'gh', buffer.read())
+        self.assertEqual(b'', buffer.read())
+
+    def test_aborted_buffer_raises(self):
+        buffer = StreamBuffer(100)
+        buffer.abort()
+        with self.assertRaises(BrokenPipeError):
+            buffer.write(b'data')
+        with self.assertRaises(BrokenPipeError):
+            buffer.read()
+
+
+class TestCheckMember(unittest.TestCase):
+
+    def check(self, name, kind=tarfile.REGTYPE, linkname=''):
+        member = tarfile.TarInfo(name)
+        member.type = kind
+        member.linkname = linkname
+        check_member(member, '/destination')
+
+    def test_safe_members_pass(self):
+        self.check('directory/file.txt')
+        self.check('directory/link', tarfile.SYMTYPE, '../file.txt')
+
+    def test_unsafe_members_raise(self):
+        for name, kind, linkname in (('/etc/passwd', tarfile.REGTYPE, ''),
+                                     ('../outside', tarfile.REGTYPE, ''),
+                                     ('link', tarfile.SYMTYPE, '../../etc/passwd'),
+                                     ('link', tarfile.SYMTYPE, '/etc/passwd'),
+                                     ('device', tarfile.CHRTYPE, '')):
+            with self.subTest(name=name, linkname=linkname), self.assertRaises(UnsafeArchiveException):
+                self.check(name, kind, linkname)
+
+
+class TestArchiveSink(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def assert_extracted(self):
+        for name, data in MEMBERS.items():
+            with open(os.path.join(self.temp_dir, name), 'rb') as file:
+                self.assertEqual(data, file.read())
+
+    def test_archive_is_extracted_as_it_is_written(self):
+        sink = ArchiveSink(self.temp_dir, max_buffer=4096)
+        for chunk in chunks(TAR):
+            sink.write(chunk)
+        sink.close()
+        self.assert_extracted()
+        self.assertEqual(list(MEMBERS), sink.members)
+
+    def test_compressed_archive_is_extracted(self):
+        sink = ArchiveSink(self.temp_dir, encoding='gzip', max_buffer=4096)
+        for chunk in chunks(gzip.compress(TAR)):
+            sink.write(chunk)
+        sink.close()
+        self.assert_extracted()
+
+    def test_unsafe_archive_raises(self):
+        sink = ArchiveSink(self.temp_dir, max_buffer=1024)
+        with self.assertRaises(UnsafeArchiveException):
+            for chunk in chunks(make_tar({'../outside': b'data'}) + TAR):
+                sink.write(chunk)
+            sink.close()
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, '..', 'outside')))
+
+
+class TestArchiveExtractor(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    @patch('chunkydl.models.archive_extractor.get_request_session', return_value=MagicMock())
+    @patch('chunkydl.models.archive_extractor.fetch_range')
+    def test_parts_are_extracted_in_order(self, mock_fetch, mock_session):
+        def fetch(session, url, start, end, config, etag=None):
+            # earlier parts finish last, so they must be reordered before they are extracted
+            time.sleep(0.02 if start == 0 else 0)
+            return TAR[start:end + 1]
+        mock_fetch.side_effect = fetch
+        config = DownloadConfig(size_threshold=1000, multipart_threads=4, extract_buffer=40000)
+        extractor = ArchiveExtractor('http://example.com/data.tar', self.temp_dir, config, file_size=len(TAR),
+                                     accept_ranges=True)
+        timing = extractor.run()
+        self.assertEqual(len(TAR), timing.bytes_received)
+        self.assertEqual(list(MEMBERS), extractor.members)
+        self.assertEqual(-(-len(TAR) // 1000), mock_fetch.call_count)
+        with open(os.path.join(self.temp_dir, 'directory/second.bin'), 'rb') as file:
+            self.assertEqual(MEMBERS['directory/second.bin'], file.read())
+
+    @patch('chunkydl.models.archive_extractor.get_request_session', return_value=MagicMock())
+    @patch('chunkydl.models.archive_extractor.fetch_range')
+    def test_parts_held_never_exceed_the_threads(self, mock_fetch, mock_session):
+        lock = threading.Lock()
+        held = [0]
+        most = []
+
+        def fetch(session, url, start, end, config, etag=None):
+            with lock:
+                held[0] += 1
+                most.append(held[0])
+            return TAR[start:end + 1]
+
+        def release(data):
+            with lock:
+                held[0] -= 1
+        mock_fetch.side_effect = fetch
+        config = DownloadConfig(size_threshold=1000, multipart_threads=3, extract_buffer=40000)
+        extractor = ArchiveExtractor('http://example.com/data.tar', self.temp_dir, config, file_size=len(TAR),
+                                     accept_ranges=True)
+        sink = MagicMock()
+        sink.write.side_effect = release
+        extractor.download_parts(sink)
+        self.assertEqual(-(-len(TAR) // extractor.part_size), sink.write.call_count)
+        self.assertLessEqual(max(most), 3)
+
+    def test_part_size_fits_the_extract_buffer(self):
+        config = DownloadConfig(size_threshold='100mb', multipart_threads=4, extract_buffer='64mb')
+        extractor = ArchiveExtractor('http://example.com/data.tar', self.temp_dir, config)
+        self.assertEqual(16 * 1024 * 1024, extractor.part_size)
+
+    @patch('chunkydl.models.archive_extractor.get_request_session', return_value=MagicMock())
+    @patch('chunkydl.models.archive_extractor.fetch_range')
+    def test_extraction_is_reserved_from_memory_budget(self, mock_fetch, mock_session):
+        config = DownloadConfig(size_threshold=1000, multipart_threads=2, extract_buffer=40000, memory_limit=60000)
+        used = []
+
+        def fetch(session, url, start, end, config, etag=None):
+            used.append(config.memory_budget.used)
+            return TAR[start:end + 1]
+        mock_fetch.side_effect = fetch
+        extractor = ArchiveExtractor('http://example.com/data.tar', self.temp_dir, config, file_size=len(TAR),
+                                     accept_ranges=True)
+        extractor.run()
+        self.assertEqual(list(MEMBERS), extractor.members)
+        self.assertEqual({60000}, set(used))
+        self.assertEqual(30000, extractor.buffer_size)
+        self.assertEqual(1000, extractor.part_size)
+        self.assertEqual(0, config.memory_budget.used)
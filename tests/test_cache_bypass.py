@@ -0,0 +1,119 @@
+import os
+import errno
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+from unittest.mock import patch, MagicMock
+
+from chunkydl import DownloadConfig
+from chunkydl.core import download_actual
+from chunkydl.models.cache_bypass import CacheBypass, CacheBypassWriter, DIRECT_ALIGNMENT
+
+
+WINDOW = 4 * DIRECT_ALIGNMENT
+
+
+class CacheBypassTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'file.bin')
+        self.data = os.urandom(3 * WINDOW + 1234)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, mode, step=1000):
+        with CacheBypassWriter(self.path, mode, window=WINDOW) as writer:
+            for index in range(0, len(self.data), step):
+                writer.write(self.data[index:index + step])
+        return writer
+
+    def read(self):
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+
+class TestCacheBypassWriter(CacheBypassTestCase):
+
+    @patch('chunkydl.models.cache_bypass.drop_cache')
+    def test_fadvise_drops_the_file_after_each_window(self, mock_drop):
+        self.write('fadvise')
+        self.assertEqual(self.data, self.read())
+        # once for each full window, and once more on close
+        self.assertEqual(4, mock_drop.call_count)
+
+    @unittest.skipUnless(hasattr(os, 'O_DIRECT'), 'O_DIRECT is not supported on this platform')
+    def test_direct_writes_unaligned_lengths(self):
+        self.write('direct', step=777)
+        self.assertEqual(self.data, self.read())
+
+    def test_direct_falls_back_when_the_file_system_rejects_it(self):
+        real_open = os.open
+
+        def reject_direct(path, flags, *args):
+            if flags & getattr(os, 'O_DIRECT', 0):
+                raise OSError(errno.EINVAL, 'Invalid argument')
+            return real_open(path, flags, *args)
+
+        with patch('chunkydl.models.cache_bypass.os.open', side_effect=reject_direct):
+            writer = self.write('direct')
+        self.assertEqual('fadvise', writer.mode)
+        self.assertEqual(self.data, self.read())
+
+    @unittest.skipUnless(hasattr(os, 'O_DIRECT'), 'O_DIRECT is not supported on this platform')
+    def test_direct_falls_back_when_a_write_is_rejected(self):
+        real_write = os.write
+        calls = []
+
+        def reject_second_write(fd, data):
+            calls.append(len(data))
+            if len(calls) == 2:
+                raise OSError(errno.EINVAL, 'Invalid argument')
+            return real_write(fd, data)
+
+        with patch('chunkydl.models.cache_bypass.os.write', new=reject_second_write):
+            writer = self.write('direct')
+        self.assertEqual('fadvise', writer.mode)
+        self.assertEqual(self.data, self.read())
+
+    def test_existing_files_are_written_in_place(self):
+        with open(self.path, 'wb') as file:
+            file.write(b'a' * 100)
+        with CacheBypassWriter(self.path, 'direct', window=WINDOW, file_mode='r+b') as writer:
+            writer.seek(10)
+            writer.write(b'bbb')
+        self.assertEqual('fadvise', writer.mode)
+        self.assertEqual(b'a' * 10 + b'bbb' + b'a' * 87, self.read())
+
+    def test_unknown_mode_raises(self):
+        with self.assertRaises(ValueError):
+            CacheBypassWriter(self.path, 'buffered')
+
+
+class TestCacheBypassConfig(CacheBypassTestCase):
+
+    def test_buffered_mode_has_no_cache_bypass(self):
+        self.assertIsNone(DownloadConfig().cache_bypass)
+
+    def test_cache_bypass_applies_from_the_threshold(self):
+        config = DownloadConfig(io_mode='direct', io_threshold='1mb', io_window='1mb')
+        self.assertEqual('direct', config.cache_bypass.mode)
+        self.assertTrue(config.cache_bypass.applies(1024 ** 2))
+        self.assertFalse(config.cache_bypass.applies(1024 ** 2 - 1))
+
+    def test_unknown_io_mode_raises(self):
+        with self.assertRaises(ValueError):
+            CacheBypass('nocache')
+
+    def test_download_actual_writes_with_the_cache_bypass(self):
+        response = MagicMock(status_code=200, url='http://example.com/file', headers={})
+        response.iter_content.return_value = [self.data[index:index + 5000] for index in range(0, len(self.data), 5000)]
+        response.elapsed = timedelta(seconds=0)
+        config = DownloadConfig(io_mode='fadvise', io_threshold=0, io_window=WINDOW)
+        with patch('requests.Session.get', return_value=response), \
+                patch('chunkydl.models.cache_bypass.drop_cache') as mock_drop:
+            download_actual('http://example.com/file', self.path, config=config, bypass_cache=True)
+        self.assertEqual(self.data, self.read())
+        mock_drop.assert_called()
@@ -0,0 +1,159 @@
+import time
+import pickle
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from urllib3.exceptions import MaxRetryError
+
+from benchmarks.server import BenchmarkServer, ServerOptions
+from chunkydl import DownloadConfig
+from chunkydl.download import _download
+from chunkydl.exceptions import CircuitOpenException, RequestFailedException
+from chunkydl.models.circuit_breaker import CircuitBreaker, CircuitBreakerRetry, get_origin
+from chunkydl.models.transport import get_retry_strategy
+
+
+HOST = 'example.com:80'
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = patch('chunkydl.models.circuit_breaker.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10)
+
+    def fail(self, count):
+        for _ in range(count):
+            self.breaker.record_failure(HOST)
+
+    def test_circuit_opens_after_failures_in_a_row(self):
+        self.fail(2)
+        self.breaker.record_success(HOST)
+        self.fail(2)
+        self.assertEqual('closed', self.breaker.state(HOST))
+        self.fail(1)
+        self.assertEqual('open', self.breaker.state(HOST))
+        self.assertEqual('closed', self.breaker.state('other.com:80'))
+        with self.assertRaises(CircuitOpenException) as context:
+            self.breaker.check('http://example.com/file', HOST)
+        self.assertEqual(10, context.exception.retry_after)
+
+    def test_half_open_circuit_lets_a_trial_through(self):
+        self.fail(3)
+        self.now += 10
+        self.assertEqual('half_open', self.breaker.state(HOST))
+        self.assertTrue(self.breaker.allow(HOST))
+        self.assertFalse(self.breaker.allow(HOST))
+        self.breaker.record_success(HOST)
+        self.assertEqual('closed', self.breaker.state(HOST))
+        self.assertTrue(self.breaker.allow(HOST))
+
+    def test_failed_trial_opens_the_circuit_again(self):
+        self.fail(3)
+        self.now += 10
+        self.assertTrue(self.breaker.allow(HOST))
+        self.fail(1)
+        self.assertEqual('open', self.breaker.state(HOST))
+        self.assertEqual(10, self.breaker.retry_after(HOST))
+
+    def test_abandoned_trial_frees_its_place(self):
+        self.fail(3)
+        self.now += 10
+        self.assertTrue(self.breaker.allow(HOST))
+        self.now += 10
+        self.assertTrue(self.breaker.allow(HOST))
+
+    def test_statuses_are_recorded_by_kind(self):
+        self.breaker.record_status(HOST, 503)
+        self.breaker.record_status(HOST, 429, [429])
+        self.breaker.record_status(HOST, 404)
+        self.fail(2)
+        self.assertEqual('closed', self.breaker.state(HOST))
+
+    def test_breaker_is_picklable(self):
+        self.fail(3)
+        copy = pickle.loads(pickle.dumps(self.breaker))
+        self.assertEqual((3, 10), (copy.failure_threshold, copy.reset_timeout))
+        self.assertEqual('closed', copy.state(HOST))
+
+    def test_origin(self):
+        self.assertEqual('example.com:443', get_origin('https://example.com/file'))
+        self.assertEqual('example.com:8080', get_origin('http://example.com:8080/file'))
+
+
+class TestCircuitBreakerRetry(unittest.TestCase):
+
+    def setUp(self):
+        self.config = DownloadConfig(circuit_breaker=True, circuit_failures=2, retries=5)
+        self.pool = MagicMock(host='example.com', port=80)
+
+    def test_config_makes_breaker_and_retry(self):
+        self.assertIsNone(DownloadConfig().circuit_breaker)
+        self.assertNotIsInstance(get_retry_strategy(DownloadConfig()), CircuitBreakerRetry)
+        self.assertEqual(2, self.config.circuit_breaker.failure_threshold)
+        breaker = CircuitBreaker()
+        self.assertIs(breaker, DownloadConfig(circuit_breaker=breaker).circuit_breaker)
+
+    def test_retries_stop_once_the_circuit_opens(self):
+        retry = get_retry_strategy(self.config)
+        retry = retry.increment('GET', '/file', error=ConnectionError(), _pool=self.pool)
+        self.assertIsInstance(retry, CircuitBreakerRetry)
+        self.assertIs(self.config.circuit_breaker, retry.circuit_breaker)
+        with self.assertRaises(MaxRetryError) as context:
+            retry.increment('GET', '/file', error=ConnectionError(), _pool=self.pool)
+        self.assertIsInstance(context.exception.reason, CircuitOpenException)
+        self.assertEqual('open', self.config.circuit_breaker.state('example.com:80'))
+
+    def test_redirects_are_not_failures(self):
+        retry = get_retry_strategy(self.config, HOST)
+        response = MagicMock()
+        response.get_redirect_location.return_value = '/other'
+        for _ in range(3):
+            retry = retry.increment('GET', '/file', response=response)
+        self.assertEqual('closed', self.config.circuit_breaker.state(HOST))
+
+
+class TestCircuitBreakerDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BenchmarkServer(ServerOptions(fail_rate=1.0)).start()
+        self.url = self.server.file_url(1024, 'file.bin')
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def assert_fails_fast(self, transport):
+        config = DownloadConfig(transport=transport, circuit_breaker=True, circuit_failures=3, backoff_factor=0.5)
+        with self.assertRaises(Exception):
+            _download(self.url, self.temp_dir, config)
+        # the circuit opened on the third attempt, so the backoff sleeps of the later retries were skipped
+        self.assertEqual(3, self.server.requests)
+        start = time.perf_counter()
+        with self.assertRaises(CircuitOpenException):
+            _download(self.url, self.temp_dir, config)
+        self.assertLess(time.perf_counter() - start, 0.1)
+        self.assertEqual(3, self.server.requests)
+        config.transport.close()
+
+    def test_requests_transport_fails_fast(self):
+        self.assert_fails_fast('requests')
+
+    def test_urllib3_transport_fails_fast(self):
+        self.assert_fails_fast('urllib3')
+
+    def test_head_errors_open_the_circuit(self):
+        config = DownloadConfig(circuit_breaker=True, circuit_failures=2)
+        head = MagicMock(status_code=503, reason='Service Unavailable')
+        with patch('requests.head', return_value=head):
+            for _ in range(2):
+                with self.assertRaises(RequestFailedException):
+                    _download(self.url, self.temp_dir, config)
+            with self.assertRaises(CircuitOpenException):
+                _download(self.url, self.temp_dir, config)
@@ -0,0 +1,173 @@
+import os
+import time
+import pickle
+import shutil
+import socket
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+import chunkydl
+from benchmarks.server import BenchmarkServer, content
+from chunkydl import DownloadConfig
+from chunkydl.models.connection_warmer import ConnectionWarmer
+from chunkydl.models.dns_cache import DnsCache
+from chunkydl.models.transport import RequestsTransport, Urllib3Transport
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('Timed out waiting for condition')
+        time.sleep(0.01)
+
+
+class TestDnsCache(unittest.TestCase):
+
+    ADDRESSES = [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('10.0.0.1', 80)),
+                 (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('10.0.0.2', 80)),
+                 (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('10.0.0.1', 80))]
+
+    @patch('socket.getaddrinfo')
+    def test_addresses_are_cached_until_they_expire(self, mock_resolve):
+        mock_resolve.return_value = self.ADDRESSES
+        cache = DnsCache(ttl=30)
+        self.assertEqual(['10.0.0.1', '10.0.0.2'], cache.resolve('example.com', 80))
+        self.assertEqual(['10.0.0.1', '10.0.0.2'], cache.resolve('example.com', 80))
+        self.assertEqual(1, mock_resolve.call_count)
+        with patch('time.monotonic', return_value=time.monotonic() + 31):
+            cache.resolve('example.com', 80)
+        self.assertEqual(2, mock_resolve.call_count)
+
+    @patch('socket.getaddrinfo')
+    def test_invalidated_hosts_are_resolved_again(self, mock_resolve):
+        mock_resolve.return_value = self.ADDRESSES
+        cache = DnsCache()
+        cache.resolve('example.com', 80)
+        cache.invalidate('example.com', 80)
+        cache.resolve('example.com', 80)
+        self.assertEqual(2, mock_resolve.call_count)
+
+    @patch('socket.getaddrinfo', side_effect=socket.gaierror('Name or service not known'))
+    def test_failed_lookups_are_not_cached(self, mock_resolve):
+        cache = DnsCache()
+        for _ in range(2):
+            with self.assertRaises(socket.gaierror):
+                cache.resolve('missing.example.com', 80)
+        self.assertEqual(0, len(cache))
+
+    def test_cache_is_picklable(self):
+        cache = DnsCache(ttl=5)
+        cache.resolve('127.0.0.1', 80)
+        copy = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(5, copy.ttl)
+        self.assertEqual(0, len(copy))
+
+
+class TransportServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BenchmarkServer().start()
+        self.url = self.server.file_url(1024, 'file.bin')
+
+    def tearDown(self):
+        self.server.stop()
+
+
+class TestDnsCachedTransport(TransportServerTestCase):
+
+    def test_new_connections_resolve_through_the_cache(self):
+        config = DownloadConfig(transport='urllib3', dns_ttl=60)
+        self.assertIsNotNone(config.transport.dns_cache)
+        url = self.url.replace('127.0.0.1', 'localhost')
+        real_resolve = socket.getaddrinfo
+        with patch('socket.getaddrinfo', side_effect=real_resolve) as mock_resolve:
+            self.assertEqual(2, config.transport.warm(url, config, connections=2))
+            response = config.transport.get(url, config)
+            self.assertEqual(content(0, 1023), b''.join(response.iter_content(1024)))
+            response.close()
+        self.assertEqual(1, len([call for call in mock_resolve.call_args_list if call.args[0] == 'localhost']))
+        config.transport.close()
+
+    def test_no_cache_by_default(self):
+        self.assertIsNone(DownloadConfig(transport='urllib3').transport.dns_cache)
+
+
+class TestWarm(TransportServerTestCase):
+
+    def test_warm_opens_idle_connections_up_to_the_pool_size(self):
+        config = DownloadConfig(transport=Urllib3Transport(maxsize=3))
+        self.assertEqual(2, config.transport.warm(self.url, config, connections=2))
+        self.assertEqual(0, config.transport.warm(self.url, config, connections=2))
+        self.assertEqual(1, config.transport.warm(self.url, config, connections=10))
+        pool = config.transport.pool(config).connection_from_url(self.url)
+        response = config.transport.get(self.url, config)
+        response.content
+        response.close()
+        # the request is made on a warm connection rather than a new one
+        self.assertEqual(3, pool.num_connections)
+        config.transport.close()
+
+    def test_requests_transport_does_not_warm(self):
+        self.assertEqual(0, RequestsTransport().warm(self.url, DownloadConfig(), connections=2))
+
+
+class TestConnectionWarmer(unittest.TestCase):
+
+    def setUp(self):
+        self.config = DownloadConfig()
+        self.config.transport = MagicMock()
+        self.warmer = ConnectionWarmer(self.config, lookahead=2)
+        self.warmer.start()
+
+    def tearDown(self):
+        self.warmer.stop()
+        self.warmer.join(5)
+
+    def warmed(self):
+        return [call.args[0] for call in self.config.transport.warm.call_args_list]
+
+    def test_hosts_are_warmed_within_the_lookahead(self):
+        urls = ['http://a.example.com/1', 'http://b.example.com/1', 'http://c.example.com/1']
+        for url in urls:
+            self.warmer.hint(url)
+        wait_until(lambda: len(self.warmed()) == 2)
+        time.sleep(0.05)
+        self.assertEqual(urls[:2], self.warmed())
+        self.warmer.started(urls[0])
+        wait_until(lambda: len(self.warmed()) == 3)
+        self.assertEqual(urls, self.warmed())
+
+    def test_a_connection_is_warmed_for_each_download_of_a_host_in_the_window(self):
+        for index in range(3):
+            self.warmer.hint(f'http://a.example.com/{index}')
+        wait_until(lambda: len(self.warmed()) == 2)
+        self.warmer.started('http://a.example.com/0')
+        wait_until(lambda: len(self.warmed()) == 3)
+        self.assertEqual([1, 2, 2], [call.args[2] for call in self.config.transport.warm.call_args_list])
+
+    def test_failed_warming_does_not_stop_the_warmer(self):
+        self.config.transport.warm.side_effect = OSError('connection refused')
+        self.warmer.hint('http://a.example.com/1')
+        self.warmer.hint('http://b.example.com/1')
+        wait_until(lambda: len(self.warmed()) == 2)
+
+
+class TestPrewarmDownload(TransportServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.temp_dir)
+
+    def test_download_list_with_prewarm(self):
+        urls = [self.server.file_url(1024, f'file-{index}.bin') for index in range(20)]
+        responses = chunkydl.download_list(urls, self.temp_dir, transport='urllib3', prewarm=True, dns_ttl=60)
+        self.assertEqual(20, len(responses))
+        for index in range(20):
+            with open(os.path.join(self.temp_dir, f'file-{index}.bin'), 'rb') as file:
+                self.assertEqual(content(0, 1023), file.read())
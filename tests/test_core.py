@@ -1,4 +1,7 @@
+import io
+import gzip
 import unittest
+from datetime import timedelta
 from unittest.mock import patch, mock_open, MagicMock
 
 from chunkydl import DownloadConfig
@@ -47,6 +50,28 @@ class TestDownloadActual(unittest.TestCase):
         self.assertEqual(context.exception.status_code, 404)
         self.assertEqual(context.exception.url, url)
 
+    @patch('requests.Session.get')
+    @patch('builtins.open', new_callable=mock_open)
+    def test_transfer_timing_is_recorded(self, mock_file, mock_get):
+        """
+        Tests that the bytes received and the time to first byte are recorded in the returned response's timing.
+        """
+        url = "http://example.com/file"
+        config = DownloadConfig()
+        mock_response = MagicMock(status_code=200, url=url)
+        mock_response.iter_content.return_value = [b'12345', b'', b'678']
+        mock_response.elapsed = timedelta(milliseconds=250)
+        mock_response.raw.retries.history = ('first', 'second')
+        mock_get.return_value = mock_response
+
+        result = download_actual(url, "output.txt", config=config)
+
+        self.assertEqual(8, result.timing.bytes_received)
+        self.assertEqual(0.25, result.timing.ttfb)
+        self.assertEqual(2, result.timing.retries)
+        self.assertGreaterEqual(result.timing.transfer, result.timing.disk_write)
+        self.assertEqual("output.txt", result.output_path)
+
     def test_empty_url(self, ):
         output_path = "output.txt"
         config = DownloadConfig()
@@ -58,3 +83,32 @@ class TestDownloadActual(unittest.TestCase):
             download_actual(None, output_path, config)
 
     # TODO: test that additional kwargs supplied to download_actual are used in the request header
+
+
+class TestDecompress(unittest.TestCase):
+
+    def download(self, url, headers, body, raw=False):
+        mock_response = MagicMock(status_code=200, url=url, headers=headers)
+        parts = [body[index:index + 100] for index in range(0, len(body), 100)]
+        mock_response.iter_content.return_value = [] if raw else parts
+        mock_response.raw.stream.return_value = parts if raw else []
+        mock_response.elapsed = timedelta(seconds=0)
+        output = io.BytesIO()
+        output.close = lambda: None
+        with patch('requests.Session.get', return_value=mock_response), patch('builtins.open', return_value=output):
+            download_actual(url, 'output', config=DownloadConfig(), decompress=True)
+        return output.getvalue(), mock_response
+
+    def test_file_is_decompressed_by_extension(self):
+        data, _ = self.download('http://example.com/dump.gz', {}, gzip.compress(b'data' * 1000))
+        self.assertEqual(b'data' * 1000, data)
+
+    def test_content_encoding_is_decoded_on_the_stage(self):
+        data, response = self.download('http://example.com/dump', {'content-encoding': 'gzip'},
+                                       gzip.compress(b'data' * 1000), raw=True)
+        self.assertEqual(b'data' * 1000, data)
+        self.assertFalse(response.raw.stream.call_args.kwargs['decode_content'])
+
+    def test_uncompressed_file_is_written_as_is(self):
+        data, _ = self.download('http://example.com/dump.sql', {}, b'data' * 1000)
+        self.assertEqual(b'data' * 1000, data)
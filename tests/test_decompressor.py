@@ -0,0 +1,77 @@
+import io
+import bz2
+import gzip
+import lzma
+import zlib
+import unittest
+
+from chunkydl.models.decompressor import DecompressingWriter, StreamDecoder, detect_encoding, strip_extension
+
+
+DATA = b'chunkydl decompression ' * 5000
+
+
+def chunks(data, size=1000):
+    return [data[index:index + size] for index in range(0, len(data), size)]
+
+
+class TestDetectEncoding(unittest.TestCase):
+
+    def test_encoding_is_found_from_extension(self):
+        self.assertEqual('gzip', detect_encoding('dump.sql.gz'))
+        self.assertEqual('bz2', detect_encoding('dump.BZ2'))
+        self.assertEqual('xz', detect_encoding('dump.xz'))
+        self.assertIsNone(detect_encoding('dump.sql'))
+
+    def test_content_encoding_takes_precedence(self):
+        self.assertEqual('deflate', detect_encoding('dump.xz', 'deflate'))
+        self.assertIsNone(detect_encoding('dump.gz', 'br'))
+        self.assertEqual('gzip', detect_encoding('dump.gz', 'identity'))
+
+    def test_extension_is_stripped(self):
+        self.assertEqual('dump.sql', strip_extension('dump.sql.gz'))
+        self.assertEqual('dump.sql', strip_extension('dump.sql'))
+        self.assertEqual('.gz', strip_extension('.gz'))
+
+
+class TestStreamDecoder(unittest.TestCase):
+
+    def decode(self, encoding, data):
+        decoder = StreamDecoder(encoding)
+        return b''.join(decoder.decompress(chunk) for chunk in chunks(data)) + decoder.finish()
+
+    def test_each_encoding_is_decoded(self):
+        self.assertEqual(DATA, self.decode('gzip', gzip.compress(DATA)))
+        self.assertEqual(DATA, self.decode('deflate', zlib.compress(DATA)))
+        self.assertEqual(DATA, self.decode('bz2', bz2.compress(DATA)))
+        self.assertEqual(DATA, self.decode('xz', lzma.compress(DATA)))
+
+    def test_concatenated_members_are_decoded(self):
+        self.assertEqual(DATA * 2, self.decode('gzip', gzip.compress(DATA) + gzip.compress(DATA)))
+        self.assertEqual(DATA * 2, self.decode('bz2', bz2.compress(DATA) + bz2.compress(DATA)))
+
+    def test_truncated_stream_raises(self):
+        with self.assertRaises(ValueError):
+            self.decode('xz', lzma.compress(DATA)[:-20])
+
+    def test_unsupported_encoding_raises(self):
+        with self.assertRaises(ValueError):
+            StreamDecoder('br')
+
+
+class TestDecompressingWriter(unittest.TestCase):
+
+    def test_decompressed_bytes_are_written(self):
+        output = io.BytesIO()
+        with DecompressingWriter(output, 'gzip', max_pending=2) as writer:
+            for chunk in chunks(gzip.compress(DATA)):
+                writer.write(chunk)
+        self.assertEqual(DATA, output.getvalue())
+        self.assertEqual(len(DATA), writer.bytes_written)
+
+    def test_invalid_stream_raises(self):
+        output = io.BytesIO()
+        with self.assertRaises(zlib.error):
+            with DecompressingWriter(output, 'gzip', max_pending=1) as writer:
+                for chunk in chunks(b'not compressed' * 1000, 10):
+                    writer.write(chunk)
@@ -0,0 +1,133 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+from unittest.mock import patch, MagicMock
+
+from chunkydl import DownloadConfig, RequestFailedException
+from chunkydl.models.block_map import BlockMap
+from chunkydl.models.delta_updater import DeltaUpdater
+from chunkydl.models.data_models import Response, Timing
+
+
+BLOCK = 100
+DATA = random.Random(7).randbytes(BLOCK * 20 + 50)
+
+
+def fake_download(data):
+    """
+    Returns a stand-in for download_actual that writes the requested range of data to the output path.
+    """
+    def download(url, output_path, config, **kwargs):
+        start, end = (int(value) for value in config.headers['range'].split('=')[1].split('-'))
+        part = data[start:end + 1]
+        with open(output_path, 'wb') as file:
+            file.write(part)
+        return Response(url, {}, 206, timedelta(), output_path, Timing(bytes_received=len(part)))
+    return download
+
+
+class TestBlockMap(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'file')
+        with open(self.path, 'wb') as file:
+            file.write(DATA)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_blocks_cover_the_file(self):
+        block_map = BlockMap.from_file(self.path, BLOCK)
+        self.assertEqual(21, block_map.block_count)
+        self.assertEqual((2000, 2049), block_map.block_range(20))
+
+    def test_block_map_round_trips(self):
+        block_map = BlockMap.from_file(self.path, BLOCK)
+        block_map.save(self.path + '.blockmap')
+        loaded = BlockMap.load(self.path + '.blockmap')
+        self.assertEqual((block_map.size, block_map.block_size, block_map.hashes),
+                         (loaded.size, loaded.block_size, loaded.hashes))
+
+    def test_wrong_number_of_hashes_raises(self):
+        with self.assertRaises(ValueError):
+            BlockMap(250, 100, ['a', 'b'])
+
+    def test_unknown_version_raises(self):
+        with self.assertRaises(ValueError):
+            BlockMap.loads('{"version": 99}')
+
+
+@patch('chunkydl.models.delta_updater.requests.head',
+       return_value=MagicMock(status_code=200, headers={'content-length': str(len(DATA))}))
+class TestDeltaUpdater(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'file')
+        source = os.path.join(self.temp_dir, 'source')
+        with open(source, 'wb') as file:
+            file.write(DATA)
+        self.block_map = BlockMap.from_file(source, BLOCK)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_local(self, data):
+        with open(self.path, 'wb') as file:
+            file.write(data)
+
+    def update(self, data=DATA):
+        updater = DeltaUpdater('http://example.com/file', self.path, self.block_map, DownloadConfig(size_threshold=300))
+        with patch('chunkydl.models.multi_part_downloader.download_actual', side_effect=fake_download(data)):
+            response = updater.run()
+        return updater, response
+
+    def read_local(self):
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+    def test_only_changed_blocks_are_downloaded(self, mock_head):
+        local = bytearray(DATA)
+        local[350] ^= 0xff
+        local[1799] ^= 0xff
+        self.write_local(bytes(local))
+        updater, response = self.update()
+        self.assertEqual(DATA, self.read_local())
+        self.assertEqual((3, 17), updater.plan.fetches)
+        self.assertEqual(200, response.timing.bytes_received)
+
+    def test_moved_blocks_are_copied(self, mock_head):
+        self.write_local(b'\0' * 100 + DATA[100:] + b'\0' * 50 + DATA[:100])
+        updater, response = self.update()
+        self.assertEqual(DATA, self.read_local())
+        self.assertEqual(((0, 2100),), updater.plan.copies)
+        self.assertEqual(0, response.timing.bytes_received)
+
+    def test_file_is_grown_and_shrunk_to_the_new_size(self, mock_head):
+        self.write_local(DATA[:1234])
+        self.update()
+        self.assertEqual(DATA, self.read_local())
+        self.write_local(DATA + b'x' * 500)
+        updater, _ = self.update()
+        self.assertEqual(DATA, self.read_local())
+        self.assertEqual((), updater.plan.fetches)
+
+    def test_missing_file_is_downloaded_in_full(self, mock_head):
+        updater, response = self.update()
+        self.assertEqual(DATA, self.read_local())
+        self.assertEqual(len(DATA), response.timing.bytes_received)
+        self.assertEqual(7, len(response.timing.ranges))
+
+    def test_blocks_that_do_not_match_after_download_raise(self, mock_head):
+        self.write_local(b'\0' * len(DATA))
+        with self.assertRaises(RequestFailedException):
+            self.update(data=b'\1' * len(DATA))
+
+    def test_size_that_does_not_match_block_map_raises(self, mock_head):
+        mock_head.return_value = MagicMock(status_code=200, headers={'content-length': '10'})
+        with self.assertRaises(RequestFailedException):
+            self.update()
@@ -0,0 +1,186 @@
+import os
+import gzip
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest.mock import patch, MagicMock
+
+from chunkydl import DownloadConfig, ProgressTracker
+from chunkydl.download import _download
+from chunkydl.models.data_models import Response, Timing
+
+
+class TestDownloadCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.config = DownloadConfig(cache_dir=os.path.join(self.temp_dir, 'cache'), cache_link_mode='copy')
+        self.head = MagicMock(status_code=200, url='http://example.com/file.txt')
+        self.head.headers = {'etag': '"abc"', 'content-length': '4'}
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    @staticmethod
+    def write_output(url, output_path, config, **kwargs):
+        with open(output_path, 'wb') as file:
+            file.write(b'data')
+        return Response(url, {}, 200, timedelta(), output_path, Timing(bytes_received=4))
+
+    @patch('chunkydl.download.download_actual')
+    @patch('requests.head')
+    def test_second_download_is_served_from_cache(self, mock_head, mock_download):
+        mock_head.return_value = self.head
+        mock_download.side_effect = self.write_output
+        first = os.path.join(self.temp_dir, 'first.txt')
+        second = os.path.join(self.temp_dir, 'second.txt')
+
+        _download('http://example.com/file.txt', first, self.config)
+        _download('http://example.com/file.txt', second, self.config)
+
+        mock_download.assert_called_once()
+        with open(second, 'rb') as file:
+            self.assertEqual(b'data', file.read())
+
+    @patch('chunkydl.download.download_actual')
+    @patch('requests.head')
+    def test_changed_validator_downloads_again(self, mock_head, mock_download):
+        mock_head.return_value = self.head
+        mock_download.side_effect = self.write_output
+        _download('http://example.com/file.txt', os.path.join(self.temp_dir, 'first.txt'), self.config)
+        self.head.headers = {'etag': '"def"', 'content-length': '4'}
+        _download('http://example.com/file.txt', os.path.join(self.temp_dir, 'second.txt'), self.config)
+
+        self.assertEqual(2, mock_download.call_count)
+
+    @patch('chunkydl.download.download_actual')
+    @patch('requests.head')
+    def test_incomplete_files_are_not_cached(self, mock_head, mock_download):
+        self.head.headers = {'etag': '"abc"', 'content-length': '10'}
+        mock_head.return_value = self.head
+        mock_download.side_effect = self.write_output
+        _download('http://example.com/file.txt', os.path.join(self.temp_dir, 'first.txt'), self.config)
+
+        self.assertEqual(0, self.config.cache.size)
+
+
+class TestDownloadProgress(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = ProgressTracker()
+        self.tracker.start = lambda: None
+        self.head = MagicMock(status_code=200, url='http://example.com/file.txt')
+        self.head.headers = {'content-length': '4'}
+
+    @patch('chunkydl.download.download_actual')
+    @patch('requests.head')
+    def test_download_progress_is_tracked_until_finished(self, mock_head, mock_download):
+        mock_head.return_value = self.head
+        mock_download.return_value = Response('url', {}, 200, timedelta(), 'path', Timing())
+        _download('http://example.com/file.txt', '/path/file.txt', DownloadConfig(progress=self.tracker))
+
+        counter = mock_download.call_args.kwargs['progress']
+        self.assertEqual(4, counter.total)
+        self.assertTrue(counter.finished)
+        self.assertFalse(counter.failed)
+
+    @patch('chunkydl.download.download_actual', side_effect=OSError)
+    @patch('requests.head')
+    def test_failed_download_is_marked_as_failed(self, mock_head, mock_download):
+        mock_head.return_value = self.head
+        with self.assertRaises(OSError):
+            _download('http://example.com/file.txt', '/path/file.txt', DownloadConfig(progress=self.tracker))
+
+        self.assertEqual(1, self.tracker.report().failed)
+
+
+class TestMultipartDownload(unittest.TestCase):
+
+    @patch('chunkydl.download.MultiPartDownloader')
+    @patch('requests.head')
+    def test_content_encoding_is_passed_to_the_multipart_downloader(self, mock_head, mock_multipart):
+        mock_head.return_value = MagicMock(status_code=200, url='http://example.com/dump')
+        mock_head.return_value.headers = {'content-length': '400', 'content-encoding': 'gzip', 'accept-ranges': 'bytes'}
+        mock_multipart.return_value.timing = Timing()
+        with patch('chunkydl.download.os.path.getsize', return_value=1000):
+            _download('http://example.com/dump', '/path/dump', DownloadConfig(size_threshold=100, decompress=True))
+        self.assertEqual('gzip', mock_multipart.call_args.kwargs['content_encoding'])
+
+    @patch('chunkydl.download.download_actual')
+    @patch('chunkydl.download.MultiPartDownloader')
+    @patch('requests.head')
+    def test_files_from_servers_without_range_support_are_downloaded_in_one_part(self, mock_head, mock_multipart,
+                                                                                 mock_download):
+        mock_head.return_value = MagicMock(status_code=200, url='http://example.com/file')
+        mock_download.return_value = Response('http://example.com/file', {}, 200, timedelta(), '/path/file', Timing())
+        for headers in ({'content-length': '400'}, {'content-length': '400', 'accept-ranges': 'none'}):
+            with self.subTest(headers=headers):
+                mock_head.return_value.headers = headers
+                _download('http://example.com/file', '/path/file', DownloadConfig(size_threshold=100))
+                mock_multipart.assert_not_called()
+                self.assertEqual('/path/file', mock_download.call_args.kwargs['output_path'])
+
+
+class GzipHandler(BaseHTTPRequestHandler):
+
+    """
+    Serves DATA with a gzip Content-Encoding, honoring single Range requests over the encoded body.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    DATA = b'chunkydl content encoding ' * 20000
+    BODY = gzip.compress(DATA, mtime=0)
+
+    def do_HEAD(self):
+        self.send_body_headers(200, len(self.BODY))
+        self.end_headers()
+
+    def do_GET(self):
+        start, end = 0, len(self.BODY) - 1
+        range_header = self.headers.get('Range')
+        if range_header:
+            first, _, last = range_header.partition('=')[2].partition('-')
+            start, end = int(first), min(int(last), end)
+        self.send_body_headers(206 if range_header else 200, end - start + 1)
+        if range_header:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(self.BODY)}')
+        self.end_headers()
+        self.wfile.write(self.BODY[start:end + 1])
+
+    def send_body_headers(self, status, length):
+        self.send_response(status)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Accept-Ranges', 'bytes')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestContentEncoding(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), GzipHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/dump'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_single_and_multipart_downloads_save_the_same_decoded_file(self):
+        encoded_size = len(GzipHandler.BODY)
+        for multipart in (False, True):
+            for decompress in (False, True):
+                with self.subTest(multipart=multipart, decompress=decompress):
+                    size_threshold = encoded_size // 4 if multipart else encoded_size
+                    config = DownloadConfig(size_threshold=size_threshold, decompress=decompress)
+                    output = os.path.join(self.temp_dir, f'{multipart}-{decompress}')
+                    _download(self.url, output, config)
+                    with open(output, 'rb') as file:
+                        self.assertEqual(GzipHandler.DATA, file.read())
@@ -0,0 +1,166 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from chunkydl.models.download_cache import DownloadCache, link_file
+
+
+class CacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_file(self, name, content=b'content'):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb') as file:
+            file.write(content)
+        return path
+
+
+class TestMakeKey(unittest.TestCase):
+
+    def test_no_key_is_made_without_validators(self):
+        self.assertIsNone(DownloadCache.make_key('http://example.com/file', {'content-length': '10'}))
+
+    def test_key_changes_when_validators_change(self):
+        url = 'http://example.com/file'
+        key_one = DownloadCache.make_key(url, {'etag': '"one"'})
+        key_two = DownloadCache.make_key(url, {'etag': '"two"'})
+        self.assertIsNotNone(key_one)
+        self.assertNotEqual(key_one, key_two)
+        self.assertEqual(key_one, DownloadCache.make_key(url, {'etag': '"one"'}))
+
+    def test_key_changes_with_url(self):
+        headers = {'last-modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        self.assertNotEqual(
+            DownloadCache.make_key('http://example.com/one', headers),
+            DownloadCache.make_key('http://example.com/two', headers)
+        )
+
+
+class TestStoreAndMaterialize(CacheTestCase):
+
+    def test_stored_file_is_materialized_at_output_path(self):
+        cache = DownloadCache(self.cache_dir, link_mode='copy')
+        source = self.make_file('source.txt', b'cached content')
+        cache.store('key', source)
+
+        output = os.path.join(self.temp_dir, 'output.txt')
+        self.assertTrue(cache.materialize('key', output))
+        with open(output, 'rb') as file:
+            self.assertEqual(b'cached content', file.read())
+
+    def test_output_written_in_place_after_store_leaves_cached_file_unchanged(self):
+        for link_mode in ('auto', 'hardlink'):
+            with self.subTest(link_mode=link_mode):
+                cache = DownloadCache(os.path.join(self.cache_dir, link_mode), link_mode=link_mode)
+                source = self.make_file(f'{link_mode}.txt', b'AAAAAAAA')
+                cache.store('key', source)
+                with open(source, 'r+b') as file:
+                    file.write(b'ZZZZ')
+
+                output = os.path.join(self.temp_dir, f'{link_mode}-output.txt')
+                self.assertTrue(cache.materialize('key', output))
+                with open(output, 'rb') as file:
+                    self.assertEqual(b'AAAAAAAA', file.read())
+
+    def test_materialize_returns_false_for_missing_key(self):
+        cache = DownloadCache(self.cache_dir)
+        output = os.path.join(self.temp_dir, 'output.txt')
+        self.assertFalse(cache.materialize('missing', output))
+        self.assertFalse(os.path.exists(output))
+
+    def test_digest_mode_stores_identical_files_once(self):
+        cache = DownloadCache(self.cache_dir, digest=True, link_mode='copy')
+        cache.store('key_one', self.make_file('one.txt', b'same'))
+        cache.store('key_two', self.make_file('two.txt', b'same'))
+
+        self.assertEqual(1, len(os.listdir(cache.objects_path)))
+        self.assertEqual(cache.get('key_one'), cache.get('key_two'))
+
+    def test_files_larger_than_cache_are_not_stored(self):
+        cache = DownloadCache(self.cache_dir, max_size=4, link_mode='copy')
+        self.assertIsNone(cache.store('key', self.make_file('big.txt', b'too large')))
+        self.assertIsNone(cache.get('key'))
+
+
+class TestEvict(CacheTestCase):
+
+    def test_least_recently_used_files_are_evicted(self):
+        cache = DownloadCache(self.cache_dir, max_size=10, link_mode='copy')
+        cache.store('old', self.make_file('old.txt', b'12345'))
+        cache.store('used', self.make_file('used.txt', b'12345'))
+        past = time.time() - 100
+        os.utime(os.path.join(cache.objects_path, 'old'), (past, past))
+        os.utime(os.path.join(cache.objects_path, 'used'), (past, past))
+        cache.get('used')
+
+        cache.store('new', self.make_file('new.txt', b'12345'))
+
+        self.assertIsNone(cache.get('old'))
+        self.assertIsNotNone(cache.get('used'))
+        self.assertIsNotNone(cache.get('new'))
+        self.assertLessEqual(cache.size, 10)
+
+    def test_eviction_is_skipped_while_another_process_holds_the_lock(self):
+        cache = DownloadCache(self.cache_dir, max_size=4, link_mode='copy')
+        with open(os.path.join(cache.objects_path, 'entry'), 'wb') as file:
+            file.write(b'12345678')
+        open(cache.lock_path, 'w').close()
+
+        cache.evict()
+        self.assertTrue(os.path.exists(os.path.join(cache.objects_path, 'entry')))
+
+    def test_stale_lock_is_removed(self):
+        cache = DownloadCache(self.cache_dir, max_size=4, link_mode='copy', lock_timeout=1)
+        with open(os.path.join(cache.objects_path, 'entry'), 'wb') as file:
+            file.write(b'12345678')
+        open(cache.lock_path, 'w').close()
+        past = time.time() - 100
+        os.utime(cache.lock_path, (past, past))
+
+        cache.evict()
+        self.assertFalse(os.path.exists(os.path.join(cache.objects_path, 'entry')))
+        self.assertFalse(os.path.exists(cache.lock_path))
+
+
+class TestLinkFile(CacheTestCase):
+
+    def test_copy_mode_creates_independent_copy(self):
+        source = self.make_file('source.txt', b'data')
+        dest = os.path.join(self.temp_dir, 'dest.txt')
+        self.assertEqual('copy', link_file(source, dest, 'copy'))
+        self.assertFalse(os.path.samefile(source, dest))
+
+    def test_hardlink_mode_links_files(self):
+        source = self.make_file('source.txt', b'data')
+        dest = os.path.join(self.temp_dir, 'dest.txt')
+        self.assertEqual('hardlink', link_file(source, dest, 'hardlink'))
+        self.assertTrue(os.path.samefile(source, dest))
+
+    def test_existing_destination_is_replaced(self):
+        source = self.make_file('source.txt', b'new')
+        dest = self.make_file('dest.txt', b'old')
+        link_file(source, dest, 'copy')
+        with open(dest, 'rb') as file:
+            self.assertEqual(b'new', file.read())
+
+    @patch('chunkydl.models.download_cache._reflink', side_effect=OSError)
+    @patch('os.link')
+    def test_auto_mode_falls_back_to_copy_without_hard_linking(self, mock_link, mock_reflink):
+        source = self.make_file('source.txt', b'data')
+        dest = os.path.join(self.temp_dir, 'dest.txt')
+        self.assertEqual('copy', link_file(source, dest, 'auto'))
+        mock_link.assert_not_called()
+        self.assertFalse(os.path.samefile(source, dest))
+
+    def test_unknown_mode_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            link_file('source', 'dest', 'symlink')
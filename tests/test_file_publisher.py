@@ -0,0 +1,158 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+from unittest.mock import patch, MagicMock
+
+from benchmarks.server import BenchmarkServer, ServerOptions
+from chunkydl import DownloadConfig, MetricsRegistry
+from chunkydl.download import _download
+from chunkydl.models.data_models import Response, Timing
+from chunkydl.models.file_publisher import FilePublisher, FileSyncer
+from chunkydl.utils import share_download
+
+
+class PublisherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, name, data=b'data'):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+
+class TestFilePublisher(PublisherTestCase):
+
+    def test_temp_path_is_hidden_in_the_same_directory(self):
+        path = os.path.join(self.temp_dir, 'file.txt')
+        temp_path = FilePublisher().temp_path(path)
+        self.assertEqual(self.temp_dir, os.path.dirname(temp_path))
+        self.assertTrue(os.path.basename(temp_path).startswith('.file.txt.'))
+        self.assertEqual(path, FilePublisher(atomic=False, durability='file').temp_path(path))
+
+    def test_unknown_durability_raises(self):
+        with self.assertRaises(ValueError):
+            FilePublisher(durability='sometimes')
+
+    def test_publish_renames_temp_file(self):
+        publisher = FilePublisher()
+        path = os.path.join(self.temp_dir, 'file.txt')
+        temp_path = self.write(os.path.basename(publisher.temp_path(path)))
+        publisher.publish(temp_path, path)
+        self.assertFalse(os.path.exists(temp_path))
+        with open(path, 'rb') as file:
+            self.assertEqual(b'data', file.read())
+
+    @patch('chunkydl.models.file_publisher.os.fsync')
+    def test_file_durability_syncs_file_and_directory(self, mock_fsync):
+        metrics = MetricsRegistry()
+        publisher = FilePublisher(durability='file', metrics=metrics)
+        publisher.publish(self.write('.temp'), os.path.join(self.temp_dir, 'file.txt'))
+        self.assertEqual(2 if os.name != 'nt' else 1, mock_fsync.call_count)
+        snapshot = metrics.snapshot()
+        self.assertEqual(1, snapshot['counters']['files_synced'][None])
+        self.assertEqual(1, snapshot['histograms']['sync_seconds']['count'])
+
+    def test_discard_removes_temp_file(self):
+        publisher = FilePublisher()
+        temp_path = self.write('.temp')
+        publisher.discard(temp_path, os.path.join(self.temp_dir, 'file.txt'))
+        self.assertFalse(os.path.exists(temp_path))
+
+
+class TestFileSyncer(PublisherTestCase):
+
+    @patch('chunkydl.models.file_publisher.os.fsync')
+    def test_files_are_synced_in_batches(self, mock_fsync):
+        metrics = MetricsRegistry()
+        syncer = FileSyncer(batch_files=3, batch_seconds=60, metrics=metrics)
+        for index in range(3):
+            syncer.add(self.write(f'file{index}'))
+        syncer.flush()
+        snapshot = metrics.snapshot()
+        self.assertEqual(3, snapshot['counters']['files_synced'][None])
+        self.assertEqual(1, snapshot['counters']['sync_batches'][None])
+        # three files and their shared directory
+        self.assertEqual(4 if os.name != 'nt' else 3, mock_fsync.call_count)
+
+    @patch('chunkydl.models.file_publisher.os.fsync')
+    def test_partial_batch_is_synced_after_batch_seconds(self, mock_fsync):
+        metrics = MetricsRegistry()
+        syncer = FileSyncer(batch_files=100, batch_seconds=0.02, metrics=metrics)
+        syncer.add(self.write('file'))
+        for _ in range(100):
+            if metrics.snapshot()['counters'].get('files_synced'):
+                break
+            syncer._thread.join(0.01)
+        self.assertEqual(1, metrics.snapshot()['counters']['files_synced'][None])
+
+    def test_flush_without_files_returns(self):
+        FileSyncer().flush()
+
+    @patch('chunkydl.models.file_publisher.os.fsync')
+    def test_flush_syncs_partial_batch(self, mock_fsync):
+        syncer = FileSyncer(batch_files=100, batch_seconds=60)
+        syncer.add(self.write('file'))
+        syncer.flush()
+        self.assertTrue(mock_fsync.called)
+
+
+class TestAtomicDownload(PublisherTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.head = MagicMock(status_code=200, url='http://example.com/file.txt')
+        self.head.headers = {'content-length': '4'}
+        self.output = os.path.join(self.temp_dir, 'file.txt')
+
+    def write_output(self, url, output_path, config, **kwargs):
+        self.assertNotEqual(self.output, output_path)
+        self.assertFalse(os.path.exists(self.output))
+        with open(output_path, 'wb') as file:
+            file.write(b'data')
+        return Response(url, {}, 200, timedelta(), output_path, Timing(bytes_received=4))
+
+    @patch('chunkydl.download.download_actual')
+    @patch('requests.head')
+    def test_file_is_published_once_complete(self, mock_head, mock_download):
+        mock_head.return_value = self.head
+        mock_download.side_effect = self.write_output
+        response = _download('http://example.com/file.txt', self.output, DownloadConfig(atomic_publish=True))
+        self.assertEqual(self.output, response.output_path)
+        self.assertEqual(['file.txt'], os.listdir(self.temp_dir))
+
+    @patch('chunkydl.download.download_actual')
+    @patch('requests.head')
+    def test_failed_download_leaves_no_file(self, mock_head, mock_download):
+        mock_head.return_value = self.head
+
+        def fail(url, output_path, config, **kwargs):
+            self.write_output(url, output_path, config)
+            raise OSError('connection lost')
+        mock_download.side_effect = fail
+        with self.assertRaises(OSError):
+            _download('http://example.com/file.txt', self.output, DownloadConfig(atomic_publish=True))
+        self.assertEqual([], os.listdir(self.temp_dir))
+
+    def test_failed_multipart_download_leaves_no_file(self):
+        with BenchmarkServer(ServerOptions(fail_rate=1.0)) as server:
+            url = server.file_url('3mb', 'file.bin')
+            config = DownloadConfig(atomic_publish=True, size_threshold='1mb', retries=0)
+            with self.assertRaises(Exception):
+                _download(url, os.path.join(self.temp_dir, 'file.bin'), config)
+        self.assertEqual([], os.listdir(self.temp_dir))
+
+    def test_shared_download_is_published(self):
+        source = self.write('source.txt')
+        publisher = FilePublisher()
+        response = Response('url', {}, 200, timedelta(), source)
+        shared = share_download(response, os.path.join(self.temp_dir, 'copy.txt'), 'copy', publisher)
+        self.assertEqual(os.path.join(self.temp_dir, 'copy.txt'), shared.output_path)
+        self.assertEqual({'source.txt', 'copy.txt'}, set(os.listdir(self.temp_dir)))
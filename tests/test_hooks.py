@@ -0,0 +1,151 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+from unittest.mock import patch, mock_open, MagicMock
+
+from chunkydl import DownloadConfig, DownloadHooks, SpanRecorder, RequestFailedException
+from chunkydl.core import download_actual
+from chunkydl.download import _download
+from chunkydl.models.data_models import Response, Timing
+from chunkydl.models.multi_part_downloader import MultiPartDownloader
+from chunkydl.models.queue_downloader import QueueDownloader
+
+
+class TestSample(unittest.TestCase):
+
+    def test_all_urls_are_sampled_by_default(self):
+        self.assertTrue(DownloadHooks().sample('http://example.com/file'))
+
+    def test_no_urls_are_sampled_with_zero_rate(self):
+        hooks = DownloadHooks(sample_rate=0)
+        self.assertFalse(any(hooks.sample(f'http://example.com/{index}') for index in range(100)))
+
+    def test_sampling_is_consistent_for_each_url(self):
+        hooks = DownloadHooks(sample_rate=0.5)
+        urls = [f'http://example.com/{index}' for index in range(200)]
+        first = [hooks.sample(url) for url in urls]
+        self.assertEqual(first, [hooks.sample(url) for url in urls])
+        self.assertTrue(40 < sum(first) < 160)
+
+
+class TestDownloadActualHooks(unittest.TestCase):
+
+    @patch('requests.Session.get')
+    @patch('builtins.open', new_callable=mock_open)
+    def test_request_chunks_and_writes_are_reported(self, mock_file, mock_get):
+        url = 'http://example.com/file'
+        recorder = SpanRecorder()
+        mock_response = MagicMock(status_code=200, url=url)
+        mock_response.iter_content.return_value = iter([b'12345', b'678'])
+        mock_get.return_value = mock_response
+
+        download_actual(url, 'output.txt', config=DownloadConfig(hooks=recorder), hooks=recorder)
+
+        events = [span.event for span in recorder.spans]
+        self.assertEqual('connect', events[0])
+        self.assertEqual(200, recorder.spans[0].attributes['status_code'])
+        self.assertEqual(2, events.count('disk_write'))
+        self.assertEqual(
+            [5, 3, 0], [span.attributes['bytes'] for span in recorder.spans if span.event == 'chunk_batch']
+        )
+
+    @patch('requests.Session.get')
+    @patch('builtins.open', new_callable=mock_open)
+    def test_hooks_are_not_called_when_not_supplied(self, mock_file, mock_get):
+        recorder = SpanRecorder()
+        mock_response = MagicMock(status_code=200)
+        mock_response.iter_content.return_value = [b'12345']
+        mock_get.return_value = mock_response
+
+        download_actual('http://example.com/file', 'output.txt', config=DownloadConfig(hooks=recorder))
+
+        self.assertEqual([], recorder.spans)
+
+
+class TestDownloadHooks(unittest.TestCase):
+
+    def setUp(self):
+        self.head = MagicMock(status_code=200)
+        self.head.headers = {'content-length': '4'}
+
+    @patch('chunkydl.download.download_actual')
+    @patch('requests.head')
+    def test_download_and_head_are_reported(self, mock_head, mock_download):
+        mock_head.return_value = self.head
+        mock_download.return_value = Response('url', {}, 200, timedelta(), 'path', Timing())
+        recorder = SpanRecorder()
+
+        _download('http://example.com/file.txt', '/path/file.txt', DownloadConfig(hooks=recorder))
+
+        self.assertEqual(['head', 'download'], [span.event for span in recorder.spans])
+        self.assertIs(recorder, mock_download.call_args.kwargs['hooks'])
+
+    @patch('chunkydl.download.download_actual')
+    @patch('requests.head')
+    def test_unsampled_downloads_are_not_reported(self, mock_head, mock_download):
+        mock_head.return_value = self.head
+        mock_download.return_value = Response('url', {}, 200, timedelta(), 'path', Timing())
+        recorder = SpanRecorder(sample_rate=0)
+
+        _download('http://example.com/file.txt', '/path/file.txt', DownloadConfig(hooks=recorder))
+
+        self.assertEqual([], recorder.spans)
+        self.assertIsNone(mock_download.call_args.kwargs['hooks'])
+
+    @patch('requests.head')
+    def test_failed_download_is_reported_with_error(self, mock_head):
+        mock_head.return_value = MagicMock(status_code=404, reason='Not Found')
+        recorder = SpanRecorder()
+
+        with self.assertRaises(RequestFailedException):
+            _download('http://example.com/file.txt', '/path/file.txt', DownloadConfig(hooks=recorder))
+
+        self.assertEqual('download', recorder.spans[-1].event)
+        self.assertIsInstance(recorder.spans[-1].error, RequestFailedException)
+
+    @patch('chunkydl.models.queue_downloader._download')
+    def test_dispatch_is_reported(self, mock_download):
+        mock_download.return_value = Response('url', {}, 200, timedelta(), 'path', Timing())
+        recorder = SpanRecorder()
+        config = DownloadConfig(hooks=recorder)
+        downloader = QueueDownloader(config=config)
+        downloader.executor.shutdown()
+
+        downloader.download_group(('url', 'path', config), queued_at=None)
+
+        self.assertEqual('dispatch', recorder.spans[0].event)
+        self.assertEqual(0.0, recorder.spans[0].attributes['queue_wait'])
+
+
+class TestMultiPartHooks(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    @staticmethod
+    def write_part(url, output_path, config, **kwargs):
+        with open(output_path, 'wb') as file:
+            file.write(b'data')
+        return Response(url, {}, 206, timedelta(), output_path, Timing(bytes_received=4))
+
+    @patch('chunkydl.models.multi_part_downloader.download_actual')
+    def test_ranges_and_join_are_reported(self, mock_download):
+        mock_download.side_effect = self.write_part
+        recorder = SpanRecorder()
+        config = DownloadConfig(size_threshold=4, hooks=recorder)
+        downloader = MultiPartDownloader('http://example.com/file', os.path.join(self.temp_dir, 'file'), 8, config,
+                                         hooks=recorder)
+
+        downloader.run()
+
+        ranges = sorted((span.attributes['start'], span.attributes['end']) for span in recorder.spans
+                        if span.event == 'range')
+        self.assertEqual([(0, 3), (4, 7)], ranges)
+        self.assertEqual('join', recorder.spans[-1].event)
+        self.assertEqual(2, recorder.spans[-1].attributes['parts'])
+        self.assertIsNone(recorder.spans[-1].error)
@@ -0,0 +1,103 @@
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+from threading import Thread
+from unittest.mock import MagicMock, patch
+from datetime import timedelta
+
+from chunkydl import DownloadConfig, MemoryBudget
+from chunkydl.core import download_actual
+from chunkydl.models.memory_budget import MIN_BUFFER_SIZE, reserve_buffers
+from chunkydl.models.multi_part_downloader import MultiPartDownloader
+
+
+class TestMemoryBudget(unittest.TestCase):
+
+    def test_reservations_are_counted(self):
+        budget = MemoryBudget(1000)
+        self.assertEqual(400, budget.acquire(400))
+        self.assertEqual(600, budget.acquire(600))
+        self.assertEqual({'limit': 1000, 'used': 1000, 'peak': 1000, 'waiting': 0}, budget.usage())
+        budget.release(1000)
+        self.assertEqual(0, budget.used)
+        self.assertEqual(1000, budget.peak)
+
+    def test_reservation_shrinks_to_what_is_free(self):
+        budget = MemoryBudget(1000)
+        budget.acquire(700)
+        self.assertEqual(300, budget.acquire(500, minimum=100))
+
+    def test_reservation_larger_than_limit_is_reduced(self):
+        budget = MemoryBudget(1000)
+        with budget.reserve(5000) as granted:
+            self.assertEqual(1000, granted)
+
+    def test_reservation_waits_for_minimum(self):
+        budget = MemoryBudget(1000)
+        budget.acquire(950)
+        granted = []
+        thread = Thread(target=lambda: granted.append(budget.acquire(500, minimum=100)))
+        thread.start()
+        thread.join(0.05)
+        self.assertEqual([], granted)
+        self.assertEqual(1, budget.waiting)
+        budget.release(950)
+        thread.join(1)
+        self.assertEqual([500], granted)
+
+    def test_reserve_buffers_without_budget_gives_requested_size(self):
+        with reserve_buffers(None, 1000, 3) as size:
+            self.assertEqual(1000, size)
+
+    def test_reserve_buffers_shrinks_buffers(self):
+        budget = MemoryBudget(MIN_BUFFER_SIZE * 6)
+        with reserve_buffers(budget, MIN_BUFFER_SIZE * 4, 3) as size:
+            self.assertEqual(MIN_BUFFER_SIZE * 2, size)
+            self.assertEqual(MIN_BUFFER_SIZE * 6, budget.used)
+        self.assertEqual(0, budget.used)
+
+    def test_config_accepts_size_or_budget(self):
+        self.assertEqual(2 * 1024 * 1024, DownloadConfig(memory_limit='2mb').memory_budget.limit)
+        budget = MemoryBudget(100)
+        self.assertIs(budget, DownloadConfig(memory_limit=budget).memory_budget)
+        self.assertIsNone(DownloadConfig().memory_budget)
+
+
+class TestBudgetedDownloads(unittest.TestCase):
+
+    def test_chunk_size_shrinks_to_budget(self):
+        config = DownloadConfig(memory_limit=MIN_BUFFER_SIZE * 2, chunk_size='1mb')
+        mock_response = MagicMock(status_code=200, headers={})
+        mock_response.iter_content.return_value = [b'data']
+        mock_response.elapsed = timedelta(seconds=0)
+        with patch('requests.Session.get', return_value=mock_response), patch('builtins.open', MagicMock()):
+            download_actual('http://example.com/file', 'output', config=config)
+        mock_response.iter_content.assert_called_once_with(chunk_size=MIN_BUFFER_SIZE * 2)
+        self.assertEqual(0, config.memory_budget.used)
+
+    def test_decompression_buffers_fit_in_budget(self):
+        config = DownloadConfig(memory_limit=MIN_BUFFER_SIZE * 3, chunk_size='1mb')
+        mock_response = MagicMock(status_code=200, headers={})
+        mock_response.iter_content.return_value = [gzip.compress(b'data')]
+        mock_response.elapsed = timedelta(seconds=0)
+        with patch('requests.Session.get', return_value=mock_response), patch('builtins.open', MagicMock()):
+            download_actual('http://example.com/file.gz', 'output', config=config, decompress=True)
+        mock_response.iter_content.assert_called_once_with(chunk_size=MIN_BUFFER_SIZE)
+
+    def test_join_copies_parts_in_budgeted_buffers(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config = DownloadConfig(memory_limit=MIN_BUFFER_SIZE, chunk_size='1mb', size_threshold=300000)
+            output = os.path.join(temp_dir, 'file')
+            downloader = MultiPartDownloader('http://example.com/file', output, 600000, config)
+            downloader.part_count = 2
+            for part in range(2):
+                with open(downloader.get_output_path(part), 'wb') as part_file:
+                    part_file.write(bytes([part]) * 300000)
+            with patch('chunkydl.models.multi_part_downloader.shutil.copyfileobj',
+                       wraps=shutil.copyfileobj) as mock_copy:
+                downloader.join_file()
+            self.assertEqual(MIN_BUFFER_SIZE, mock_copy.call_args.args[2])
+            with open(output, 'rb') as file:
+                self.assertEqual(bytes(300000) + b'\x01' * 300000, file.read())
@@ -0,0 +1,153 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from concurrent.futures import Future
+from unittest.mock import patch
+
+import chunkydl
+from benchmarks.server import BenchmarkServer, content
+from chunkydl import DownloadConfig
+from chunkydl.download import _resolve_head
+from chunkydl.exceptions import RequestFailedException
+from chunkydl.models.data_models import HeadResult
+from chunkydl.models.metadata_stage import MetadataStage
+
+
+def fake_head(url, config, hooks=None):
+    size = int(url.rsplit('/', 1)[-1])
+    return HeadResult(type('FakeResponse', (), {'headers': {'content-length': str(size)}})(), 0.0)
+
+
+class TestMetadataStage(unittest.TestCase):
+
+    def setUp(self):
+        self.config = DownloadConfig()
+        self.dispatched = []
+        self.futures = []
+        patcher = patch('chunkydl.models.metadata_stage._resolve_head', side_effect=fake_head)
+        self.mock_head = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def dispatch(self, dl_group, queued_at, head, error):
+        self.dispatched.append((dl_group[0], head, error))
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def finish_all(self):
+        while len([future for future in self.futures if not future.done()]):
+            for future in list(self.futures):
+                if not future.done():
+                    future.set_result(None)
+
+    def wait_resolved(self, stage):
+        while stage._resolving:
+            time.sleep(0.01)
+
+    def run_stage(self, sizes, order):
+        stage = MetadataStage(self.dispatch, threads=4, slots=1, order=order)
+        # the first download holds the only slot until every other one has been resolved
+        stage.submit(('http://example.com/0', 'path', self.config))
+        self.wait_resolved(stage)
+        for size in sizes:
+            stage.submit((f'http://example.com/{size}', 'path', self.config))
+        self.wait_resolved(stage)
+        self.finish_all()
+        stage.shutdown()
+        return [int(url.rsplit('/', 1)[-1]) for url, _, _ in self.dispatched[1:]]
+
+    def test_downloads_are_dispatched_in_queue_order(self):
+        self.assertEqual([3, 1, 4, 2], self.run_stage([3, 1, 4, 2], 'queue'))
+
+    def test_smallest_downloads_are_dispatched_first(self):
+        self.assertEqual([1, 2, 3, 4], self.run_stage([3, 1, 4, 2], 'smallest'))
+
+    def test_largest_downloads_are_dispatched_first(self):
+        self.assertEqual([4, 3, 2, 1], self.run_stage([3, 1, 4, 2], 'largest'))
+
+    def test_dispatched_downloads_carry_their_head_response(self):
+        self.run_stage([5], 'queue')
+        self.assertEqual(5, self.dispatched[1][1].size)
+        self.assertIsNone(self.dispatched[1][2])
+
+    def test_failed_head_requests_are_dispatched_first_with_the_error(self):
+        error = RequestFailedException('http://example.com/2', 404, 'Not Found')
+
+        def head(url, config, hooks=None):
+            if url.endswith('/2'):
+                raise error
+            return fake_head(url, config)
+
+        self.mock_head.side_effect = head
+        self.assertEqual([2, 3, 1], self.run_stage([3, 1, 2], 'largest'))
+        self.assertIsNone(self.dispatched[1][1])
+        self.assertIs(error, self.dispatched[1][2])
+
+    def test_running_downloads_are_limited_to_the_slots(self):
+        stage = MetadataStage(self.dispatch, threads=4, slots=2)
+        for size in range(5):
+            stage.submit((f'http://example.com/{size}', 'path', self.config))
+        self.wait_resolved(stage)
+        self.assertEqual(2, len(self.dispatched))
+        self.futures[0].set_result(None)
+        self.assertEqual(3, len(self.dispatched))
+        self.finish_all()
+        stage.shutdown()
+        self.assertEqual(5, len(self.dispatched))
+
+    def test_submit_waits_while_the_lookahead_is_full(self):
+        stage = MetadataStage(self.dispatch, threads=2, slots=1, lookahead=2)
+        for size in range(3):
+            stage.submit((f'http://example.com/{size}', 'path', self.config))
+        thread = threading.Thread(target=stage.submit, args=(('http://example.com/3', 'path', self.config),))
+        thread.start()
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+        self.futures[0].set_result(None)
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.wait_resolved(stage)
+        self.finish_all()
+        stage.shutdown()
+        self.assertEqual(4, len(self.dispatched))
+
+    def test_unknown_order_raises(self):
+        with self.assertRaises(ValueError):
+            MetadataStage(self.dispatch, threads=1, slots=1, order='random')
+
+
+class TestMetadataStageDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BenchmarkServer().start()
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def test_download_threads_only_move_bytes(self):
+        head_threads = []
+
+        def record_head(url, config, hooks=None):
+            head_threads.append(threading.current_thread().name)
+            return _resolve_head(url, config, hooks)
+
+        urls = [self.server.file_url(1024 * (index + 1), f'file-{index}.bin') for index in range(12)]
+        with patch('chunkydl.models.metadata_stage._resolve_head', side_effect=record_head), \
+                patch('chunkydl.download._resolve_head', side_effect=record_head):
+            responses = chunkydl.download_list(urls, self.temp_dir, metadata_threads=8, metadata_order='largest')
+        self.assertEqual(12, len(responses))
+        self.assertEqual(12, len(head_threads))
+        self.assertTrue(all(name.startswith('chunkydl-metadata') for name in head_threads))
+        for index in range(12):
+            with open(os.path.join(self.temp_dir, f'file-{index}.bin'), 'rb') as file:
+                self.assertEqual(content(0, 1024 * (index + 1) - 1), file.read())
+
+    def test_failed_head_requests_fail_their_downloads(self):
+        urls = [self.server.file_url(1024, 'file.bin'), f'{self.server.url}/missing/other.bin']
+        responses = chunkydl.download_list(urls, self.temp_dir, metadata_threads=2)
+        self.assertEqual([urls[0]], [response.url for response in responses])
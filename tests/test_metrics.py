@@ -0,0 +1,164 @@
+import os
+import tempfile
+import unittest
+import urllib.request
+from datetime import timedelta
+from threading import Thread
+from unittest.mock import patch
+
+from chunkydl import DownloadConfig, MetricsRegistry, MetricsServer
+from chunkydl.download import _download
+from chunkydl.models.data_models import Response, Timing
+from chunkydl.models.multi_part_downloader import MultiPartDownloader
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_counters_are_merged_across_threads(self):
+        registry = MetricsRegistry()
+
+        def record():
+            for _ in range(100):
+                registry.increment('retries', 'example.com')
+                registry.add_bytes(10)
+
+        threads = [Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        snapshot = registry.snapshot()
+        self.assertEqual(400, snapshot['counters']['retries']['example.com'])
+        self.assertEqual(4000, snapshot['bytes_received'])
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry(buckets=(0.1, 1))
+        registry.observe('head_seconds', 0.05)
+        registry.observe('head_seconds', 0.5)
+        registry.observe('head_seconds', 5)
+
+        histogram = registry.snapshot()['histograms']['head_seconds']
+        self.assertEqual([(0.1, 1), (1, 2), ('+Inf', 3)], histogram['buckets'])
+        self.assertEqual(3, histogram['count'])
+        self.assertAlmostEqual(5.55, histogram['sum'])
+
+    def test_in_flight_counts_are_derived_from_counters(self):
+        registry = MetricsRegistry()
+        registry.increment('downloads_started', 'a.com')
+        registry.increment('downloads_started', 'b.com')
+        registry.increment('downloads_completed', 'a.com')
+        registry.increment('ranges_started', value=3)
+        registry.increment('ranges_finished')
+
+        snapshot = registry.snapshot()
+        self.assertEqual(1, snapshot['in_flight_downloads'])
+        self.assertEqual(2, snapshot['in_flight_ranges'])
+
+    def test_gauges_are_read_when_metrics_are_read(self):
+        registry = MetricsRegistry()
+        depth = [3]
+        registry.register_gauge('queue_depth', lambda: depth[0])
+        self.assertEqual(3, registry.snapshot()['gauges']['queue_depth'])
+        depth[0] = 7
+        self.assertEqual(7, registry.snapshot()['gauges']['queue_depth'])
+        registry.unregister_gauge('queue_depth')
+        self.assertNotIn('queue_depth', registry.snapshot()['gauges'])
+
+    def test_totals_of_another_registry_are_merged_as_a_shard(self):
+        remote = MetricsRegistry()
+        remote.increment('retries', 'example.com', 2)
+        remote.observe('head_seconds', 0.2)
+        remote.add_bytes(50)
+        registry = MetricsRegistry()
+        registry.increment('retries', 'example.com')
+        registry.add_shard(remote.totals())
+
+        snapshot = registry.snapshot()
+        self.assertEqual(3, snapshot['counters']['retries']['example.com'])
+        self.assertEqual(1, snapshot['histograms']['head_seconds']['count'])
+        self.assertEqual(50, snapshot['bytes_received'])
+
+    def test_shards_of_exited_threads_are_retired(self):
+        registry = MetricsRegistry()
+        registry.add_bytes(1)
+        threads = [Thread(target=registry.add_bytes, args=(10,)) for _ in range(50)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        self.assertEqual(1, len(registry._shards))
+        self.assertEqual(501, registry.snapshot()['bytes_received'])
+
+    def test_render_produces_prometheus_text(self):
+        registry = MetricsRegistry(buckets=(1,))
+        registry.increment('downloads_failed', 'example.com')
+        registry.observe('ttfb_seconds', 0.5)
+
+        text = registry.render()
+        self.assertIn('# TYPE chunkydl_downloads_failed_total counter', text)
+        self.assertIn('chunkydl_downloads_failed_total{host="example.com"} 1', text)
+        self.assertIn('chunkydl_ttfb_seconds_bucket{le="+Inf"} 1', text)
+        self.assertIn('chunkydl_ttfb_seconds_count 1', text)
+        self.assertTrue(text.endswith('\n'))
+
+
+class TestMetricsServer(unittest.TestCase):
+
+    def test_metrics_are_served_over_http(self):
+        registry = MetricsRegistry()
+        registry.add_bytes(42)
+        server = MetricsServer(registry, port=0)
+        server.start()
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics', timeout=5) as response:
+                body = response.read().decode('utf-8')
+        finally:
+            server.stop()
+        self.assertIn('chunkydl_bytes_received_total 42', body)
+
+
+class TestDownloadMetrics(unittest.TestCase):
+
+    @staticmethod
+    def write_range(url, output_path, config, **kwargs):
+        start, end = (int(value) for value in config.headers['range'].split('=')[1].split('-'))
+        length = end - start + 1
+        with open(output_path, 'wb') as file:
+            file.write(b'x' * length)
+        config.metrics.add_bytes(length)
+        return Response(url, {}, 206, timedelta(), output_path, Timing(bytes_received=length))
+
+    def test_shards_stay_bounded_over_many_multipart_downloads(self):
+        registry = MetricsRegistry()
+        config = DownloadConfig(metrics=registry, size_threshold=1024, multipart_threads=4)
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                patch('chunkydl.models.multi_part_downloader.download_actual', side_effect=self.write_range):
+            for index in range(20):
+                output = os.path.join(temp_dir, f'file-{index}.bin')
+                MultiPartDownloader(f'http://example.com/file-{index}.bin', output, 4096, config).run()
+        self.assertLessEqual(len(registry._shards), 1)
+        snapshot = registry.snapshot()
+        self.assertEqual(80, snapshot['counters']['ranges_finished'][None])
+        self.assertEqual(20 * 4096, snapshot['bytes_received'])
+
+    @patch('chunkydl.download._download_file')
+    def test_completed_download_is_recorded(self, mock_download):
+        mock_download.return_value = Response('url', {}, 200, None, 'path', Timing(head=0.1, ttfb=0.2, retries=2))
+        registry = MetricsRegistry()
+        _download('http://example.com/file', 'path', DownloadConfig(metrics=registry))
+
+        snapshot = registry.snapshot()
+        self.assertEqual(1, snapshot['counters']['downloads_completed']['example.com'])
+        self.assertEqual(2, snapshot['counters']['retries']['example.com'])
+        self.assertEqual(1, snapshot['histograms']['head_seconds']['count'])
+        self.assertEqual(0, snapshot['in_flight_downloads'])
+
+    @patch('chunkydl.download._download_file', side_effect=OSError)
+    def test_failed_download_is_recorded(self, mock_download):
+        registry = MetricsRegistry()
+        with self.assertRaises(OSError):
+            _download('http://example.com/file', 'path', DownloadConfig(metrics=registry))
+
+        snapshot = registry.snapshot()
+        self.assertEqual(1, snapshot['counters']['downloads_failed']['example.com'])
+        self.assertEqual(0, snapshot['in_flight_downloads'])
@@ -0,0 +1,47 @@
+import unittest
+
+from chunkydl.models.mirror_pool import MirrorPool, strip_etag
+
+
+class TestMirrorPool(unittest.TestCase):
+
+    def test_each_mirror_is_tried_before_any_is_reused(self):
+        pool = MirrorPool(['a', 'b', 'c'])
+        self.assertEqual({'a', 'b', 'c'}, {pool.choose().url for _ in range(3)})
+
+    def test_faster_mirror_is_preferred(self):
+        pool = MirrorPool(['slow', 'fast'])
+        slow, fast = pool.choose(), pool.choose()
+        pool.record(slow, 100, 1.0)
+        pool.record(fast, 1000, 1.0)
+        self.assertEqual('fast', pool.choose().url)
+
+    def test_ranges_are_shared_by_rate_and_ranges_in_flight(self):
+        pool = MirrorPool(['slow', 'fast'])
+        slow, fast = pool.choose(), pool.choose()
+        pool.record(slow, 100, 1.0)
+        pool.record(fast, 300, 1.0)
+        chosen = [pool.choose().url for _ in range(4)]
+        self.assertEqual(3, chosen.count('fast'))
+        self.assertEqual(1, chosen.count('slow'))
+
+    def test_failed_mirror_is_dropped(self):
+        pool = MirrorPool(['a', 'b'])
+        mirror = pool.choose()
+        self.assertTrue(pool.fail(mirror, 'error'))
+        self.assertEqual(['b'], [mirror.url for mirror in pool.available])
+        self.assertEqual('b', pool.choose().url)
+
+    def test_last_mirror_is_not_dropped(self):
+        pool = MirrorPool(['a'])
+        mirror = pool.choose()
+        self.assertFalse(pool.fail(mirror, 'error'))
+        self.assertEqual(['a'], [mirror.url for mirror in pool.available])
+
+    def test_duplicate_urls_are_ignored(self):
+        self.assertEqual(['a', 'b'], [mirror.url for mirror in MirrorPool(['a', 'b', 'a']).mirrors])
+
+    def test_weak_etag_prefix_is_stripped(self):
+        self.assertEqual('"abc"', strip_etag('W/"abc"'))
+        self.assertEqual('"abc"', strip_etag('"abc"'))
+        self.assertIsNone(strip_etag(None))
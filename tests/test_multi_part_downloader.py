@@ -1,10 +1,15 @@
+import gzip
 import logging
 import os
+import tempfile
 import unittest
+from datetime import timedelta
 from unittest.mock import patch, Mock, mock_open
 
 from chunkydl.models.multi_part_downloader import MultiPartDownloader
-from chunkydl import DownloadConfig
+from chunkydl.models.data_models import Response, Timing
+from chunkydl import DownloadConfig, RequestFailedException
+from chunkydl.exceptions import InconsistentMirrorException
 
 
 class TestRun(unittest.TestCase):
@@ -83,6 +88,142 @@ class TestRun(unittest.TestCase):
         mock_join_file.assert_called_once()
 
 
+    def test_supplied_ranges_are_downloaded(self):
+        config = Mock()
+        config.size_threshold = 100
+        config.multipart_threads = 4
+        downloader = MultiPartDownloader('http://example.com/file', '/path/to/file', file_size=450, config=config,
+                                         ranges=[(0, 99), (300, 349)])
+        downloader.executor = Mock()
+        downloader.get_output_path = Mock()
+        downloader.join_file = Mock()
+
+        downloader.run()
+
+        self.assertEqual(downloader.part_count, 2)
+        submitted = [call.kwargs for call in downloader.executor.submit.call_args_list]
+        self.assertEqual([(0, 99), (300, 349)], [(kwargs['start'], kwargs['end']) for kwargs in submitted])
+
+
+    @patch('chunkydl.models.multi_part_downloader.MultiPartDownloader.remove_temp_path')
+    def test_failed_part_fails_the_download_without_joining(self, mock_remove_path):
+        downloader = MultiPartDownloader('http://example.com/file', '/path/to/file', file_size=300,
+                                         config=DownloadConfig(size_threshold=100, clean_up_on_fail=True))
+        downloader.get_output_path = Mock()
+        downloader.download_part = Mock(side_effect=[None, RequestFailedException('url', 503, 'Unavailable'), None])
+        downloader.join_file = Mock()
+
+        with self.assertRaises(RequestFailedException):
+            downloader.run()
+
+        self.assertEqual(1, downloader.failed_parts)
+        downloader.join_file.assert_not_called()
+        mock_remove_path.assert_called_once()
+
+
+class TestDownloadPart(unittest.TestCase):
+
+    @patch('chunkydl.models.multi_part_downloader.download_actual')
+    def test_part_is_requested_with_range_header(self, mock_download):
+        mock_download.return_value = Response('url', {}, 206, timedelta(), 'path', Timing(bytes_received=100))
+        config = DownloadConfig()
+        downloader = MultiPartDownloader('http://example.com/file', '/path/to/file', file_size=450, config=config)
+
+        downloader.download_part(start=100, end=199, output_path='/path/to/part')
+
+        used_config = mock_download.call_args.kwargs['config']
+        self.assertEqual('bytes=100-199', used_config.headers['range'])
+        self.assertNotIn('range', config.headers)
+        self.assertFalse(mock_download.call_args.kwargs['raw'])
+
+    @patch('chunkydl.models.multi_part_downloader.download_actual')
+    def test_parts_of_an_encoded_file_are_saved_undecoded(self, mock_download):
+        mock_download.return_value = Response('url', {}, 206, timedelta(), 'path', Timing(bytes_received=100))
+        downloader = MultiPartDownloader('http://example.com/file', '/path/to/file', file_size=450,
+                                         config=DownloadConfig(), content_encoding='gzip')
+
+        downloader.download_part(start=100, end=199, output_path='/path/to/part')
+
+        self.assertTrue(mock_download.call_args.kwargs['raw'])
+
+    @patch('chunkydl.models.multi_part_downloader.download_actual')
+    def test_part_timings_are_combined(self, mock_download):
+        mock_download.side_effect = [
+            Response('url', {}, 206, timedelta(), 'path', Timing(ttfb=0.5, disk_write=1.0, bytes_received=100)),
+            Response('url', {}, 206, timedelta(), 'path', Timing(ttfb=0.2, disk_write=2.0, bytes_received=50,
+                                                                 retries=1)),
+        ]
+        downloader = MultiPartDownloader('http://example.com/file', '/path/to/file', file_size=150,
+                                         config=DownloadConfig())
+
+        downloader.download_part(start=0, end=99, output_path='/path/to/part-0')
+        downloader.download_part(start=100, end=199, output_path='/path/to/part-1')
+        timing = downloader.timing
+
+        self.assertEqual(150, timing.bytes_received)
+        self.assertEqual(0.2, timing.ttfb)
+        self.assertEqual(3.0, timing.disk_write)
+        self.assertEqual(1, timing.retries)
+        self.assertEqual([(0, 99), (100, 149)], [(r.start, r.end) for r in timing.ranges])
+
+
+class TestMirrors(unittest.TestCase):
+
+    @staticmethod
+    def mirror_response(url, **kwargs):
+        return Response(url, {}, 206, timedelta(), 'path', Timing(bytes_received=100, transfer=1.0))
+
+    @patch('chunkydl.models.multi_part_downloader.download_actual')
+    def test_failed_mirror_is_dropped_and_range_requested_again(self, mock_download):
+        mock_download.side_effect = [RequestFailedException('http://a/file', 503, 'Unavailable'),
+                                     self.mirror_response('http://b/file')]
+        downloader = MultiPartDownloader('http://a/file', '/path/to/file', file_size=200, config=DownloadConfig(),
+                                         mirrors=['http://b/file'])
+
+        downloader.download_part(start=0, end=99, output_path='/path/to/part-0')
+
+        self.assertEqual(['http://b/file'], [mirror.url for mirror in downloader.mirror_pool.available])
+        self.assertEqual('http://b/file', downloader.range_timings[0].mirror)
+
+    @patch('chunkydl.models.multi_part_downloader.download_actual')
+    def test_failure_of_last_mirror_is_raised(self, mock_download):
+        mock_download.side_effect = RequestFailedException('http://a/file', 503, 'Unavailable')
+        downloader = MultiPartDownloader('http://a/file', '/path/to/file', file_size=200, config=DownloadConfig())
+
+        with self.assertRaises(RequestFailedException):
+            downloader.download_part(start=0, end=99, output_path='/path/to/part-0')
+
+    def test_range_from_mirror_with_different_size_is_rejected(self):
+        downloader = MultiPartDownloader('http://a/file', '/path/to/file', file_size=200, config=DownloadConfig())
+        response = Mock(status_code=206, url='http://b/file', headers={'content-range': 'bytes 0-99/300'})
+
+        with self.assertRaises(InconsistentMirrorException):
+            downloader.verify_range(response, 0, 99)
+
+    def test_range_from_mirror_with_different_etag_is_rejected(self):
+        downloader = MultiPartDownloader('http://a/file', '/path/to/file', file_size=200, config=DownloadConfig(),
+                                         etag='"abc"')
+        response = Mock(status_code=206, url='http://b/file', headers={'etag': '"xyz"'})
+
+        with self.assertRaises(InconsistentMirrorException):
+            downloader.verify_range(response, 0, 99)
+
+    def test_whole_file_response_to_range_request_is_rejected(self):
+        downloader = MultiPartDownloader('http://a/file', '/path/to/file', file_size=200, config=DownloadConfig())
+        response = Mock(status_code=200, url='http://b/file', headers={})
+
+        with self.assertRaises(InconsistentMirrorException):
+            downloader.verify_range(response, 100, 199)
+
+    def test_matching_range_is_accepted(self):
+        downloader = MultiPartDownloader('http://a/file', '/path/to/file', file_size=200, config=DownloadConfig(),
+                                         etag='"abc"')
+        response = Mock(status_code=206, url='http://b/file',
+                        headers={'etag': 'W/"abc"', 'content-range': 'bytes 100-199/200'})
+
+        downloader.verify_range(response, 100, 199)
+
+
 class TestJoinFile(unittest.TestCase):
 
     @classmethod
@@ -110,7 +251,8 @@ class TestJoinFile(unittest.TestCase):
         downloader = MultiPartDownloader(
             url='http://example.com/file.mp4', output_path='/path/to/directory', file_size=400, config=config
         )
-        downloader.join_file()
+        with self.assertRaises(FileNotFoundError):
+            downloader.join_file()
         mock_remove_path.assert_called_once()
 
     @patch('builtins.open', new_callable=mock_open)
@@ -124,9 +266,33 @@ class TestJoinFile(unittest.TestCase):
         downloader = MultiPartDownloader(
             url='http://example.com/file.mp4', output_path='/path/to/directory', file_size=400, config=config
         )
-        downloader.join_file()
+        with self.assertRaises(FileNotFoundError):
+            downloader.join_file()
         mock_remove_path.assert_not_called()
 
+    def join_encoded(self, body, content_encoding='gzip'):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output = os.path.join(temp_dir, 'dump')
+            downloader = MultiPartDownloader('http://example.com/dump', output, len(body),
+                                             DownloadConfig(decompress=True), content_encoding=content_encoding)
+            downloader.part_count = 2
+            middle = len(body) // 2
+            for part, data in enumerate((body[:middle], body[middle:])):
+                with open(downloader.get_output_path(part), 'wb') as part_file:
+                    part_file.write(data)
+            downloader.join_file()
+            with open(output, 'rb') as file:
+                return file.read()
+
+    def test_content_encoding_is_decoded_on_join(self):
+        data = b'chunkydl multipart ' * 10000
+        self.assertEqual(data, self.join_encoded(gzip.compress(data)))
+
+    def test_decompression_error_fails_the_join(self):
+        with self.assertRaises(Exception):
+            self.join_encoded(b'not compressed ' * 10000)
+
+
 class TestGetOutputPath(unittest.TestCase):
 
     @patch('chunkydl.models.multi_part_downloader.ThreadPoolExecutor')
@@ -0,0 +1,190 @@
+import os
+import time
+import tempfile
+import unittest
+from datetime import timedelta
+from threading import Thread
+from unittest.mock import patch
+
+from chunkydl import DownloadConfig, DLGroup, RequestFailedException
+from chunkydl.models.data_models import Response, Timing
+from chunkydl.models.persistent_queue import PersistentQueue
+from chunkydl.models.queue_downloader import QueueDownloader
+
+
+class PersistentQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'queue.db')
+        self.config = DownloadConfig()
+        self.queues = []
+
+    def tearDown(self):
+        for queue in self.queues:
+            if not queue._closed.is_set():
+                queue.close()
+        self.temp_dir.cleanup()
+
+    def open_queue(self, **kwargs):
+        kwargs.setdefault('poll_interval', 0.01)
+        queue = PersistentQueue(self.path, self.config, **kwargs)
+        self.queues.append(queue)
+        return queue
+
+
+class TestPersistentQueue(PersistentQueueTestCase):
+
+    def test_items_are_returned_in_order_with_the_queue_config(self):
+        queue = self.open_queue()
+        queue.put_many([('url1', 'path1', DownloadConfig()), DLGroup('url2', 'path2', DownloadConfig(), ('mirror',))])
+        _, first = queue.get()
+        _, second = queue.get()
+        self.assertEqual(DLGroup('url1', 'path1', self.config), first)
+        self.assertEqual(DLGroup('url2', 'path2', self.config, ('mirror',)), second)
+
+    def test_items_survive_reopening(self):
+        queue = self.open_queue()
+        queue.put(('url', 'path', self.config))
+        queue.close()
+        reopened = self.open_queue()
+        self.assertEqual(1, reopened.qsize())
+        self.assertEqual('url', reopened.get()[1].url)
+
+    def test_leased_items_are_not_taken_by_other_consumers(self):
+        first = self.open_queue()
+        second = self.open_queue()
+        first.put_many([('url1', 'path1', self.config), ('url2', 'path2', self.config), None])
+        second.put(None)
+        self.assertEqual('url1', first.get()[1].url)
+        self.assertEqual('url2', second.get()[1].url)
+        self.assertIsNone(second.get()[1])
+
+    def test_done_removes_item(self):
+        queue = self.open_queue()
+        queue.put(('url', 'path', self.config))
+        _, item = queue.get()
+        queue.done(item)
+        self.assertEqual(0, queue.qsize())
+
+    def test_failed_items_are_retried_until_max_attempts(self):
+        queue = self.open_queue(max_attempts=2)
+        queue.put_many([('url', 'path', self.config), None])
+        for _ in range(2):
+            _, item = queue.get()
+            self.assertEqual('url', item.url)
+            queue.done(item, failed=True)
+        self.assertIsNone(queue.get()[1])
+        self.assertEqual(0, queue.qsize())
+        self.assertEqual([DLGroup('url', 'path', self.config)], queue.failed())
+
+    def test_expired_leases_are_taken_by_other_consumers(self):
+        crashed = self.open_queue(lease_timeout=0.05)
+        crashed.put(('url', 'path', self.config))
+        crashed.get()
+        crashed._closed.set()  # stops renewing its leases, as a crashed process would
+        crashed._renewer.join()
+        other = self.open_queue()
+        other.put(None)
+        self.assertIsNone(other.get()[1])
+        time.sleep(0.06)
+        self.assertEqual('url', other.get()[1].url)
+
+    def test_done_leaves_leases_taken_over_by_other_consumers(self):
+        stalled = self.open_queue(lease_timeout=0.05)
+        stalled.put(('url', 'path', self.config))
+        _, stalled_item = stalled.get()
+        stalled._closed.set()  # stops renewing its leases, as a stalled process would
+        stalled._renewer.join()
+        time.sleep(0.06)
+        other = self.open_queue()
+        _, item = other.get()
+        stalled.done(stalled_item)
+        self.assertEqual(1, other.qsize())
+        other.done(item)
+        self.assertEqual(0, other.qsize())
+
+    def test_failed_done_leaves_leases_taken_over_by_other_consumers(self):
+        stalled = self.open_queue(lease_timeout=0.05)
+        stalled.put(('url', 'path', self.config))
+        _, stalled_item = stalled.get()
+        stalled._closed.set()
+        stalled._renewer.join()
+        time.sleep(0.06)
+        other = self.open_queue()
+        other.get()
+        stalled.done(stalled_item, failed=True)
+        third = self.open_queue()
+        third.put(None)
+        self.assertIsNone(third.get()[1])
+
+    def test_leases_are_renewed(self):
+        queue = self.open_queue(lease_timeout=0.06)
+        other = self.open_queue()
+        queue.put(('url', 'path', self.config))
+        queue.get()
+        other.put(None)
+        time.sleep(0.15)
+        self.assertIsNone(other.get()[1])
+
+    def test_close_returns_unfinished_items(self):
+        queue = self.open_queue()
+        queue.put(('url', 'path', self.config))
+        queue.get()
+        queue.close()
+        other = self.open_queue()
+        other.put(None)
+        self.assertEqual('url', other.get()[1].url)
+
+    def test_get_waits_while_max_leases_are_held(self):
+        queue = self.open_queue(max_leases=1)
+        queue.put_many([('url1', 'path1', self.config), ('url2', 'path2', self.config)])
+        _, item = queue.get()
+        results = []
+        thread = Thread(target=lambda: results.append(queue.get()[1]))
+        thread.start()
+        thread.join(0.05)
+        self.assertEqual([], results)
+        queue.done(item)
+        thread.join(1)
+        self.assertEqual('url2', results[0].url)
+
+    def test_interrupt_wakes_waiting_get(self):
+        queue = self.open_queue()
+        results = []
+        thread = Thread(target=lambda: results.append(queue.get()[1]))
+        thread.start()
+        queue.interrupt()
+        thread.join(1)
+        self.assertEqual([None], results)
+
+
+class TestQueueDownloaderPersistentQueue(PersistentQueueTestCase):
+
+    @patch('chunkydl.models.queue_downloader._download')
+    def test_pending_downloads_survive_restart(self, mock_download):
+        mock_download.side_effect = lambda url, path, config, mirrors, head: Response(
+            url, {}, 200, timedelta(), path, Timing()
+        )
+        self.config = DownloadConfig(queue_path=self.path)
+        first = QueueDownloader(self.config)
+        first.add_multiple([('url1', 'path1', self.config), ('url2', 'path2', self.config)])
+        first.persistent_queue.close()
+
+        second = QueueDownloader(self.config)
+        second.add(None)
+        second.run()
+
+        self.assertEqual({'url1', 'url2'}, {response.url for response in second.results})
+        reopened = self.open_queue()
+        self.assertEqual(0, reopened.qsize())
+
+    @patch('chunkydl.models.queue_downloader._download', side_effect=RequestFailedException('url', 404, 'Not Found'))
+    def test_failed_downloads_are_marked_failed(self, mock_download):
+        self.config = DownloadConfig(queue_path=self.path, queue_max_attempts=1)
+        downloader = QueueDownloader(self.config)
+        downloader.add(('url', 'path', self.config))
+        downloader.add(None)
+        downloader.run()
+        reopened = self.open_queue()
+        self.assertEqual(['url'], [item.url for item in reopened.failed()])
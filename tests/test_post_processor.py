@@ -0,0 +1,179 @@
+import os
+import gzip
+import json
+import hashlib
+import tarfile
+import tempfile
+import unittest
+from datetime import timedelta
+from functools import partial
+from threading import Event, Thread
+from unittest.mock import patch
+
+from chunkydl import DownloadConfig
+from chunkydl.models.data_models import Response, Timing
+from chunkydl.models.post_processor import (PostProcessor, StageOutput, decompress_file, hash_file, run_stages,
+                                            stage_name, validate_file)
+from chunkydl.models.queue_downloader import QueueDownloader
+
+
+def file_size(path):
+    return os.path.getsize(path)
+
+
+def fail(path):
+    raise ValueError(f'{path} rejected')
+
+
+def rename(path, suffix):
+    new_path = path + suffix
+    os.rename(path, new_path)
+    return StageOutput(new_path, 'renamed')
+
+
+class TempDirTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.dir = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+
+class TestStages(TempDirTestCase):
+
+    def test_hash_file(self):
+        path = self.write('file', b'abc' * 1000)
+        self.assertEqual(hashlib.sha256(b'abc' * 1000).hexdigest(), hash_file(path))
+        self.assertEqual(hashlib.md5(b'abc' * 1000).hexdigest(), hash_file(path, 'md5', block_size=7))
+
+    def test_decompress_file_returns_new_path(self):
+        path = self.write('file.txt.gz', gzip.compress(b'hello' * 100))
+        output = decompress_file(path)
+        self.assertEqual(StageOutput(os.path.join(self.dir, 'file.txt'), os.path.join(self.dir, 'file.txt')), output)
+        with open(output.path, 'rb') as file:
+            self.assertEqual(b'hello' * 100, file.read())
+        self.assertTrue(os.path.exists(path))
+
+    def test_decompress_file_leaves_uncompressed_files(self):
+        path = self.write('file.txt', b'hello')
+        self.assertEqual(path, decompress_file(path))
+
+    def test_validate_file(self):
+        self.assertEqual('gzip', validate_file(self.write('file.gz', gzip.compress(b'data'))))
+        self.assertEqual('json', validate_file(self.write('file.json', json.dumps({'a': 1}).encode())))
+        self.assertEqual('file', validate_file(self.write('file.bin', b'data')))
+
+    def test_validate_file_reads_tar_members(self):
+        path = os.path.join(self.dir, 'archive.tar.gz')
+        member = self.write('member', b'x' * 1000)
+        with tarfile.open(path, 'w:gz') as archive:
+            archive.add(member, 'member')
+        self.assertEqual('tar', validate_file(path))
+
+    def test_validate_file_rejects_truncated_files(self):
+        with self.assertRaises(ValueError):
+            validate_file(self.write('file.gz', gzip.compress(b'data' * 1000)[:-10]))
+        with self.assertRaises(ValueError):
+            validate_file(self.write('file.json', b'{"a": '))
+
+    def test_stage_names(self):
+        self.assertEqual('sha256', stage_name('sha256'))
+        self.assertEqual('file_size', stage_name(file_size))
+        self.assertEqual('rename', stage_name(partial(rename, suffix='.x')))
+
+
+class TestRunStages(TempDirTestCase):
+
+    def test_later_stages_receive_new_path(self):
+        path = self.write('file', b'abc')
+        values, new_path, error, _ = run_stages(
+            [('rename', partial(rename, suffix='.x')), ('file_size', file_size)], path
+        )
+        self.assertEqual({'rename': 'renamed', 'file_size': 3}, values)
+        self.assertEqual(path + '.x', new_path)
+        self.assertIsNone(error)
+
+    def test_failed_stage_keeps_earlier_values(self):
+        path = self.write('file', b'abc')
+        values, _, error, _ = run_stages([('file_size', file_size), ('fail', fail), ('size', file_size)], path)
+        self.assertEqual({'file_size': 3}, values)
+        self.assertIsInstance(error, ValueError)
+
+
+class TestPostProcessor(TempDirTestCase):
+
+    def make_response(self, path):
+        return Response('url', {}, 200, timedelta(), path, Timing())
+
+    def test_unknown_stage_raises(self):
+        with self.assertRaises(ValueError):
+            PostProcessor(['unknown'])
+
+    def test_stages_run_in_worker_processes(self):
+        paths = [self.write(f'file{i}', bytes(i)) for i in range(6)]
+        results = []
+        processor = PostProcessor(['sha256', file_size], max_workers=2, max_pending=2)
+        for path in paths:
+            processor.submit(self.make_response(path), results.append)
+        processor.shutdown()
+        self.assertEqual(6, len(results))
+        for response in results:
+            self.assertTrue(response.post.ok)
+            self.assertEqual(response.output_path, response.post.path)
+            self.assertEqual(os.path.getsize(response.output_path), response.post.values['file_size'])
+            self.assertEqual(hash_file(response.output_path), response.post.values['sha256'])
+
+    def test_errors_are_reported_in_result(self):
+        results = []
+        processor = PostProcessor([fail], max_workers=1)
+        processor.submit(self.make_response(self.write('file', b'')), results.append)
+        processor.shutdown()
+        self.assertFalse(results[0].post.ok)
+        self.assertIsInstance(results[0].post.error, ValueError)
+
+    def test_unpicklable_stage_is_reported_in_result(self):
+        results = []
+        processor = PostProcessor([lambda path: path], max_workers=1)
+        processor.submit(self.make_response(self.write('file', b'')), results.append)
+        processor.shutdown()
+        self.assertFalse(results[0].post.ok)
+
+    def test_submit_waits_for_pending_files(self):
+        processor = PostProcessor([file_size], max_workers=1, max_pending=1)
+        processor._slots.acquire()
+        submitted = Event()
+        with patch.object(processor, '_executor'):
+            thread = Thread(target=lambda: (processor.submit(self.make_response('path'), list), submitted.set()))
+            thread.start()
+            self.assertFalse(submitted.wait(0.05))
+            processor._slots.release()
+            self.assertTrue(submitted.wait(1))
+            thread.join()
+
+
+class TestQueueDownloaderPostProcessing(TempDirTestCase):
+
+    def test_downloads_are_post_processed(self):
+        path = self.write('file.txt.gz', gzip.compress(b'hello'))
+        config = DownloadConfig(post_process=['decompress', 'sha256'], post_process_workers=1)
+        with patch('chunkydl.models.queue_downloader._download') as mock_download:
+            mock_download.return_value = Response('url', {}, 200, timedelta(), path, Timing())
+            downloader = QueueDownloader(config=config)
+            downloader.add(('url', path, config))
+            downloader.add(None)
+            downloader.run()
+        response = downloader.results[0]
+        self.assertEqual(path, response.output_path)
+        self.assertEqual(os.path.join(self.dir, 'file.txt'), response.post.path)
+        self.assertEqual(hashlib.sha256(b'hello').hexdigest(), response.post.values['sha256'])
+
+    def test_post_processor_is_only_made_when_configured(self):
+        self.assertIsNone(QueueDownloader(DownloadConfig()).post_processor)
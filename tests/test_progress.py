@@ -0,0 +1,106 @@
+import time
+import unittest
+from unittest.mock import patch
+
+from chunkydl import ProgressTracker
+
+
+class TestProgressTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = ProgressTracker(interval=60)
+        self.tracker.start = lambda: None  # reports are built manually in these tests
+
+    def test_no_report_is_built_when_nothing_is_tracked(self):
+        self.assertIsNone(self.tracker.report())
+
+    def test_file_progress_is_reported(self):
+        counter = self.tracker.start_file('http://example.com/file', '/path/file', 100)
+        counter.done += 40
+
+        report = self.tracker.report()
+        self.assertEqual(1, report.active)
+        self.assertEqual(40, report.done)
+        self.assertEqual(100, report.total)
+        self.assertEqual(40, report.files[0].done)
+        self.assertFalse(report.files[0].finished)
+
+    def test_range_progress_is_included_in_file_progress(self):
+        counter = self.tracker.start_file('http://example.com/file', '/path/file', 200)
+        first = counter.start_range(0, 99)
+        second = counter.start_range(100, 199)
+        first.done += 100
+        second.done += 25
+
+        file = self.tracker.report().files[0]
+        self.assertEqual(125, file.done)
+        self.assertEqual([(0, 99, 100, 100), (100, 199, 25, 100)], [tuple(r) for r in file.ranges])
+
+    def test_finished_files_are_reported_once_then_counted_in_the_aggregate(self):
+        done = self.tracker.start_file('http://example.com/one', '/path/one', 10)
+        failed = self.tracker.start_file('http://example.com/two', '/path/two', 10)
+        active = self.tracker.start_file('http://example.com/three', '/path/three', 10)
+        done.done = 10
+        done.finish()
+        failed.finish(failed=True)
+        active.done = 5
+
+        report = self.tracker.report()
+        self.assertEqual(3, len(report.files))
+        self.assertEqual(1, report.completed)
+        self.assertEqual(1, report.failed)
+
+        report = self.tracker.report()
+        self.assertEqual(['http://example.com/three'], [file.url for file in report.files])
+        self.assertEqual(15, report.done)
+        self.assertEqual(30, report.total)
+        self.assertEqual(1, report.active)
+
+    @patch('chunkydl.models.progress.time.monotonic')
+    def test_rate_and_eta_are_calculated(self, mock_clock):
+        mock_clock.return_value = 100.0
+        counter = self.tracker.start_file('http://example.com/file', '/path/file', 1000)
+        mock_clock.return_value = 102.0
+        counter.done = 200
+
+        report = self.tracker.report()
+        self.assertEqual(100.0, report.files[0].rate)
+        self.assertEqual(8.0, report.files[0].eta)
+        self.assertEqual(100.0, report.rate)
+        self.assertEqual(8.0, report.eta)
+
+    @patch('chunkydl.models.progress.time.monotonic')
+    def test_idle_time_grows_while_no_bytes_are_received(self, mock_clock):
+        mock_clock.return_value = 100.0
+        counter = self.tracker.start_file('http://example.com/file', '/path/file', 1000)
+        mock_clock.return_value = 101.0
+        counter.done = 10
+        self.assertEqual(0.0, self.tracker.report().files[0].idle)
+        mock_clock.return_value = 106.0
+        self.assertEqual(5.0, self.tracker.report().files[0].idle)
+
+    def test_subscribers_receive_emitted_reports(self):
+        reports = []
+        self.tracker.subscribe(reports.append)
+        self.tracker.start_file('http://example.com/file', '/path/file', 100)
+        self.tracker.emit()
+        self.assertEqual(1, len(reports))
+        self.tracker.unsubscribe(reports.append)
+        self.tracker.emit()
+        self.assertEqual(1, len(reports))
+
+
+class TestProgressThread(unittest.TestCase):
+
+    def test_reports_are_emitted_from_tracker_thread(self):
+        tracker = ProgressTracker(interval=0.01)
+        reports = []
+        tracker.subscribe(reports.append)
+        counter = tracker.start_file('http://example.com/file', '/path/file', 100)
+        counter.done = 100
+        counter.finish()
+        deadline = time.monotonic() + 5
+        while not reports and time.monotonic() < deadline:
+            time.sleep(0.01)
+        tracker.stop()
+        self.assertTrue(reports[0].files[0].finished)
@@ -1,8 +1,11 @@
+import logging
 import unittest
-from unittest.mock import Mock
+from datetime import timedelta
+from unittest.mock import Mock, patch, ANY
 import time
 
-from chunkydl import DownloadConfig
+from chunkydl import DownloadConfig, DLGroup, RequestFailedException
+from chunkydl.models.data_models import Response, Timing
 from chunkydl.models.queue_downloader import QueueDownloader
 
 
@@ -28,7 +31,9 @@ class TestRun(unittest.TestCase):
         downloader.add(('url', 'path', config))
         downloader.add(None)
         downloader.run()
-        mock_executor.submit.assert_called_once_with(downloader.download_group, dl_group=('url', 'path', config))
+        mock_executor.submit.assert_called_once_with(
+            downloader.download_group, dl_group=('url', 'path', config), queued_at=ANY, head=None, head_error=None
+        )
         mock_executor.shutdown.assert_called_with(wait=True)
 
     def test_calling_downloaders_stop_method_stops_download_without_none_being_added_to_queue(self):
@@ -43,3 +48,113 @@ class TestRun(unittest.TestCase):
         time.sleep(0.002)  # Allow downloader thread enough time to close the loop
         mock_executor.shutdown.assert_called_with(wait=True)
         self.assertFalse(downloader.continue_run)
+
+
+class TestCoalesce(unittest.TestCase):
+
+    def test_duplicate_urls_are_submitted_once(self):
+        config = DownloadConfig()
+        mock_executor = Mock()
+        downloader = QueueDownloader(config=config)
+        downloader.executor = mock_executor
+        downloader.add(('url', 'path', config))
+        downloader.add(('url', 'path2', config))
+        downloader.add(('url2', 'path3', config))
+        downloader.add(None)
+        downloader.run()
+        self.assertEqual(2, mock_executor.submit.call_count)
+
+    def test_duplicate_urls_are_submitted_separately_when_coalesce_is_disabled(self):
+        config = DownloadConfig(coalesce=False)
+        mock_executor = Mock()
+        downloader = QueueDownloader(config=config)
+        downloader.executor = mock_executor
+        downloader.add(('url', 'path', config))
+        downloader.add(('url', 'path2', config))
+        downloader.add(None)
+        downloader.run()
+        self.assertEqual(2, mock_executor.submit.call_count)
+
+    def test_urls_with_different_headers_are_not_coalesced(self):
+        config = DownloadConfig()
+        other_config = DownloadConfig(additional_headers={'If-None-Match': '"abc"'})
+        downloader = QueueDownloader(config=config)
+        self.assertFalse(downloader.join_flight(('url', 'path', config)))
+        self.assertFalse(downloader.join_flight(('url', 'path2', other_config)))
+        self.assertTrue(downloader.join_flight(('url', 'path3', config)))
+
+    def test_urls_with_different_configs_are_not_coalesced(self):
+        config = DownloadConfig()
+        decompress_config = DownloadConfig(decompress=True)
+        downloader = QueueDownloader(config=config)
+        self.assertFalse(downloader.join_flight(('url', 'path', config)))
+        self.assertFalse(downloader.join_flight(('url', 'path2', decompress_config)))
+        self.assertFalse(downloader.join_flight(('url', 'path3', DownloadConfig())))
+        self.assertTrue(downloader.join_flight(('url', 'path4', decompress_config)))
+
+    def test_extractions_are_only_coalesced_to_the_same_destination(self):
+        config = DownloadConfig(extract=True)
+        downloader = QueueDownloader(config=config)
+        self.assertFalse(downloader.join_flight(('url', '/destination', config)))
+        self.assertFalse(downloader.join_flight(('url', '/other', config)))
+        self.assertTrue(downloader.join_flight(('url', '/destination', config)))
+
+    @patch('chunkydl.models.queue_downloader.share_download')
+    @patch('chunkydl.models.queue_downloader._download')
+    def test_waiting_duplicates_receive_their_own_response(self, mock_download, mock_share):
+        config = DownloadConfig()
+        response = Response('url', {}, 200, timedelta(), '/path/file')
+        mock_download.return_value = response
+        mock_share.side_effect = lambda r, path, mode, publisher: r._replace(output_path=path)
+        downloader = QueueDownloader(config=config)
+        downloader.join_flight(('url', '/path/file', config))
+        downloader.join_flight(('url', '/other/file', config))
+
+        result = downloader.download_group(('url', '/path/file', config))
+
+        self.assertEqual(response, result)
+        mock_share.assert_called_once_with(response, '/other/file', 'clone', None)
+        self.assertEqual(['/other/file'], [r.output_path for r in downloader.results])
+        self.assertEqual({}, downloader._flights)
+
+    @patch('chunkydl.models.queue_downloader.share_download')
+    @patch('chunkydl.models.queue_downloader._download', side_effect=RequestFailedException('url', 404, 'Not Found'))
+    def test_failed_download_releases_duplicates(self, mock_download, mock_share):
+        logging.disable(logging.CRITICAL)
+        config = DownloadConfig()
+        downloader = QueueDownloader(config=config)
+        downloader.join_flight(('url', '/path/file', config))
+        downloader.join_flight(('url', '/other/file', config))
+
+        with self.assertRaises(RequestFailedException):
+            downloader.download_group(('url', '/path/file', config))
+        logging.disable(logging.NOTSET)
+
+        mock_share.assert_not_called()
+        self.assertEqual([], downloader.results)
+        self.assertEqual({}, downloader._flights)
+
+
+class TestDownloadGroup(unittest.TestCase):
+
+    @patch('chunkydl.models.queue_downloader.time.perf_counter', return_value=12.5)
+    @patch('chunkydl.models.queue_downloader._download')
+    def test_queue_wait_is_recorded_in_response_timing(self, mock_download, mock_clock):
+        config = DownloadConfig()
+        mock_download.return_value = Response('url', {}, 200, timedelta(), 'path', Timing(head=0.25))
+        downloader = QueueDownloader(config=config)
+
+        response = downloader.download_group(('url', 'path', config), queued_at=10.0)
+
+        self.assertEqual(2.5, response.timing.queue_wait)
+        self.assertEqual(0.25, response.timing.head)
+
+    @patch('chunkydl.models.queue_downloader._download')
+    def test_mirrors_are_passed_to_download(self, mock_download):
+        config = DownloadConfig()
+        mock_download.return_value = Response('url', {}, 200, timedelta(), 'path', Timing())
+        downloader = QueueDownloader(config=config)
+
+        downloader.download_group(DLGroup('url', 'path', config, ('mirror',)))
+
+        mock_download.assert_called_once_with('url', 'path', config, mirrors=('mirror',), head=None)
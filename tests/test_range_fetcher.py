@@ -0,0 +1,135 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from benchmarks.server import BenchmarkServer, ServerOptions, content
+from chunkydl import DownloadConfig, MetricsRegistry
+from chunkydl.models.range_fetcher import RangeFetcher
+
+
+DATA = bytes(range(256)) * 64
+
+
+class FakeSession:
+
+    """
+    Serves a bytes object in place of a requests session, answering multi-range requests with a multipart/byteranges
+    body if multirange is set, and with the first range otherwise.
+    """
+
+    def __init__(self, data: bytes, multirange: bool = True):
+        self.data = data
+        self.multirange = multirange
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        specs = headers['range'].split('=')[1].split(',')
+        self.requests.append(specs)
+        ranges = []
+        for spec in specs:
+            start, end = (int(value) for value in spec.split('-'))
+            if start < len(self.data):
+                ranges.append((start, min(end, len(self.data) - 1)))
+        if not ranges:
+            return MagicMock(status_code=416, reason='Range Not Satisfiable', headers={})
+        if len(ranges) == 1 or not self.multirange:
+            start, end = ranges[0]
+            return MagicMock(status_code=206, content=self.data[start:end + 1],
+                             headers={'content-range': f'bytes {start}-{end}/{len(self.data)}'})
+        body = b''
+        for start, end in ranges:
+            body += (f'--b\r\nContent-Range: bytes {start}-{end}/{len(self.data)}\r\n\r\n'.encode()
+                     + self.data[start:end + 1] + b'\r\n')
+        return MagicMock(status_code=206, content=body + b'--b--\r\n',
+                         headers={'content-type': 'multipart/byteranges; boundary=b'})
+
+    def close(self):
+        pass
+
+
+RANGES = [(9000, 9099), (10, 19), (0, 4), (5000, 5009), (16380, 16500)]
+
+
+class TestRangeFetcher(unittest.TestCase):
+
+    def fetcher(self, session, **kwargs):
+        with patch('chunkydl.models.range_fetcher.get_request_session', return_value=session):
+            return RangeFetcher('http://example.com/file', DownloadConfig(), **kwargs)
+
+    def expected(self, ranges):
+        return [DATA[start:end + 1] for start, end in ranges]
+
+    def test_merge_joins_ranges_within_the_gap(self):
+        self.assertEqual([(0, 19), (5000, 5009)], RangeFetcher.merge([(10, 19), (5000, 5009), (0, 4)], gap=5))
+        self.assertEqual([(0, 4), (10, 19)], RangeFetcher.merge([(10, 19), (0, 4)], gap=4))
+        self.assertEqual([(0, 30)], RangeFetcher.merge([(0, 30), (5, 10)]))
+
+    def test_missing_returns_uncovered_parts(self):
+        pieces = [(10, b'x' * 10), (40, b'x' * 5)]
+        self.assertEqual([(0, 9), (20, 39), (45, 50)], RangeFetcher._missing(pieces, [(0, 50)]))
+        self.assertEqual([], RangeFetcher._missing(pieces, [(12, 15)]))
+
+    def test_ranges_are_fetched_in_one_multirange_request(self):
+        session = FakeSession(DATA)
+        fetcher = self.fetcher(session, gap=16)
+        self.assertEqual(self.expected(RANGES), fetcher.read(RANGES))
+        self.assertEqual(1, len(session.requests))
+        self.assertEqual(['0-19', '5000-5009', '9000-9099', '16380-16500'], session.requests[0])
+        self.assertTrue(fetcher.multirange)
+
+    def test_ranges_are_batched_by_max_ranges(self):
+        session = FakeSession(DATA)
+        fetcher = self.fetcher(session, gap=0, max_ranges=2)
+        self.assertEqual(self.expected(RANGES), fetcher.read(RANGES))
+        self.assertEqual(3, len(session.requests))
+
+    def test_servers_without_multirange_are_sent_single_ranges(self):
+        session = FakeSession(DATA, multirange=False)
+        fetcher = self.fetcher(session, gap=16)
+        self.assertEqual(self.expected(RANGES), fetcher.read(RANGES))
+        self.assertFalse(fetcher.multirange)
+        self.assertEqual(4, len(session.requests))
+
+    def test_requests_made_from_every_thread_are_counted(self):
+        session = FakeSession(DATA, multirange=False)
+        fetcher = self.fetcher(session, gap=0)
+        ranges = [(start, start + 9) for start in range(0, len(DATA), 20)]
+        self.assertEqual(self.expected(ranges), fetcher.read(ranges))
+        self.assertEqual(len(ranges), len(session.requests))
+        self.assertEqual(len(session.requests), fetcher.requests)
+
+    def test_ranges_past_the_end_are_shortened(self):
+        fetcher = self.fetcher(FakeSession(DATA, multirange=False), gap=0)
+        ranges = [(len(DATA) - 5, len(DATA) + 5), (len(DATA) + 10, len(DATA) + 20)]
+        self.assertEqual([DATA[-5:], b''], fetcher.read(ranges))
+
+    def test_invalid_range_raises(self):
+        with self.assertRaises(ValueError):
+            self.fetcher(FakeSession(DATA)).read([(10, 5)])
+
+    def test_write_places_ranges_at_their_offsets(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'sparse')
+            self.fetcher(FakeSession(DATA), gap=0).write(RANGES, path)
+            with open(path, 'rb') as file:
+                written = file.read()
+        self.assertEqual(len(DATA), len(written))
+        for start, end in RANGES:
+            self.assertEqual(DATA[start:end + 1], written[start:end + 1])
+        self.assertEqual(b'\x00' * 10, written[100:110])
+
+
+class TestRangeFetcherWithoutRanges(unittest.TestCase):
+
+    def test_ranges_are_read_from_one_request_for_the_whole_file(self):
+        size = 8 * 1024 * 1024
+        ranges = [(index * 1024 * 1024 + 100, index * 1024 * 1024 + 109) for index in range(8)]
+        config = DownloadConfig(metrics=MetricsRegistry())
+        with BenchmarkServer(ServerOptions(ranges=False)) as server:
+            fetcher = RangeFetcher(server.file_url(size), config)
+            self.assertEqual([content(start, end) for start, end in ranges], fetcher.read(ranges))
+            fetcher.close()
+            self.assertEqual(2, server.requests)
+        self.assertFalse(fetcher.ranges_supported)
+        self.assertLessEqual(config.metrics.snapshot()['bytes_received'], size)
@@ -0,0 +1,140 @@
+import io
+import zipfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from benchmarks.server import BenchmarkServer, ServerOptions, content
+from chunkydl import DownloadConfig, RequestFailedException
+from chunkydl.models.remote_file import RemoteFile
+
+
+class FakeSession:
+
+    """
+    Serves a bytes object in place of a requests session, recording the ranges that are requested.
+    """
+
+    def __init__(self, data: bytes, etag: str = '"v1"', head_length: bool = True):
+        self.data = data
+        self.etag = etag
+        self.head_length = head_length
+        self.ranges = []
+
+    def head(self, url, **kwargs):
+        headers = {'etag': self.etag}
+        if self.head_length:
+            headers['content-length'] = str(len(self.data))
+        return MagicMock(status_code=200, headers=headers)
+
+    def get(self, url, headers=None, **kwargs):
+        start, end = (int(value) for value in headers['range'].split('=')[1].split('-'))
+        self.ranges.append((start, end))
+        if headers.get('If-Range', self.etag) != self.etag:
+            return MagicMock(status_code=200, headers={'etag': self.etag}, content=self.data)
+        content = self.data[start:end + 1]
+        return MagicMock(status_code=206, content=content, headers={
+            'etag': self.etag, 'content-range': f'bytes {start}-{start + len(content) - 1}/{len(self.data)}',
+        })
+
+    def close(self):
+        pass
+
+
+DATA = bytes(range(256)) * 64
+
+
+class TestRemoteFile(unittest.TestCase):
+
+    def open(self, session, **kwargs):
+        with patch('chunkydl.models.remote_file.get_request_session', return_value=session):
+            return RemoteFile('http://example.com/file', DownloadConfig(), **kwargs)
+
+    def test_reads_match_the_remote_file(self):
+        remote = self.open(FakeSession(DATA), block_size=100)
+        remote.seek(1000)
+        self.assertEqual(DATA[1000:1550], remote.read(550))
+        self.assertEqual(1550, remote.tell())
+        remote.seek(-10, io.SEEK_END)
+        self.assertEqual(DATA[-10:], remote.read())
+        self.assertEqual(b'', remote.read(10))
+
+    def test_only_the_blocks_read_are_fetched(self):
+        session = FakeSession(DATA)
+        remote = self.open(session, block_size=1024)
+        remote.seek(-22, io.SEEK_END)
+        remote.read()
+        self.assertEqual([(len(DATA) - 1024, len(DATA) - 1)], session.ranges)
+
+    def test_cached_blocks_are_not_fetched_again(self):
+        session = FakeSession(DATA)
+        remote = self.open(session, block_size=1024)
+        remote.read(100)
+        remote.seek(50)
+        remote.read(100)
+        self.assertEqual(1, len(session.ranges))
+
+    def test_adjacent_missing_blocks_are_fetched_in_one_request(self):
+        session = FakeSession(DATA)
+        remote = self.open(session, block_size=100, readahead=0)
+        remote.seek(250)
+        remote.read(10)
+        remote.seek(0)
+        remote.read(500)
+        self.assertEqual([(200, 299), (0, 199), (300, 499)], session.ranges)
+
+    def test_sequential_reads_read_ahead(self):
+        session = FakeSession(DATA)
+        remote = self.open(session, block_size=100, readahead=8)
+        for _ in range(20):
+            remote.read(100)
+        self.assertEqual(DATA[2000:2100], remote.read(100))
+        self.assertLess(len(session.ranges), 10)
+
+    def test_cache_is_limited_to_cache_size(self):
+        remote = self.open(FakeSession(DATA), block_size=100, cache_size=500)
+        remote.read()
+        self.assertLessEqual(len(remote._blocks), 5)
+
+    def test_size_is_read_from_range_when_head_has_no_length(self):
+        remote = self.open(FakeSession(DATA, head_length=False))
+        self.assertEqual(len(DATA), remote.size)
+
+    def test_changed_file_raises(self):
+        session = FakeSession(DATA)
+        remote = self.open(session, block_size=100)
+        session.etag = '"v2"'
+        with self.assertRaises(RequestFailedException):
+            remote.read(10)
+
+    def test_file_can_be_read_by_zipfile(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('first.txt', 'first')
+            archive.writestr('second.txt', b'x' * 100000)
+        session = FakeSession(buffer.getvalue())
+        with self.open(session, block_size=1024) as remote:
+            with zipfile.ZipFile(remote) as archive:
+                self.assertEqual(['first.txt', 'second.txt'], archive.namelist())
+                self.assertEqual(b'first', archive.read('first.txt'))
+        self.assertLess(sum(end - start + 1 for start, end in session.ranges), len(buffer.getvalue()))
+
+    def test_closed_file_can_not_be_read(self):
+        remote = self.open(FakeSession(DATA))
+        remote.close()
+        with self.assertRaises(ValueError):
+            remote.read(1)
+
+
+class TestRemoteFileWithoutRanges(unittest.TestCase):
+
+    def test_file_is_downloaded_once_and_read_locally(self):
+        size = 8 * 1024 * 1024
+        offsets = [7 * 1024 * 1024, 100, 3 * 1024 * 1024, 5 * 1024 * 1024, 1024 * 1024]
+        with BenchmarkServer(ServerOptions(ranges=False)) as server:
+            with RemoteFile(server.file_url(size), block_size=1024) as remote:
+                for offset in offsets:
+                    remote.seek(offset)
+                    self.assertEqual(content(offset, offset + 9), remote.read(10))
+                self.assertFalse(remote.ranges_supported)
+                self.assertEqual(size, remote.bytes_fetched)
+            self.assertEqual(1, server.requests)
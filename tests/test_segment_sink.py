@@ -0,0 +1,138 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+from unittest.mock import patch, MagicMock
+
+from chunkydl import DownloadConfig
+from chunkydl.download import _download
+from chunkydl.models.data_models import Response, Timing
+from chunkydl.models.segment_sink import SegmentSink
+
+
+class SegmentSinkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'segments')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def store(self, sink, url, data):
+        with sink.store(url) as item:
+            item.write(data)
+        return item.entry
+
+
+class TestSegmentSink(SegmentSinkTestCase):
+
+    def test_objects_are_appended_and_read_back(self):
+        sink = SegmentSink(self.path)
+        first = self.store(sink, 'url1', b'first')
+        second = self.store(sink, 'url2', b'second')
+        self.assertEqual(first.path, second.path)
+        self.assertEqual((0, 5), (first.offset, first.length))
+        self.assertEqual((5, 6), (second.offset, second.length))
+        self.assertEqual(b'first', sink.read('url1'))
+        self.assertEqual(b'second', sink.read('url2'))
+        with self.assertRaises(KeyError):
+            sink.read('missing')
+
+    def test_failed_object_is_removed_and_not_indexed(self):
+        sink = SegmentSink(self.path)
+        self.store(sink, 'url1', b'first')
+        with self.assertRaises(OSError):
+            with sink.store('url2') as item:
+                item.write(b'partial')
+                raise OSError('connection lost')
+        entry = self.store(sink, 'url3', b'third')
+        self.assertIsNone(sink.lookup('url2'))
+        self.assertEqual(5, entry.offset)
+        sink.close()
+        self.assertEqual(10, os.path.getsize(entry.path))
+
+    def test_concurrent_objects_are_written_to_separate_segments(self):
+        sink = SegmentSink(self.path)
+        with sink.store('url1') as first, sink.store('url2') as second:
+            first.write(b'first')
+            second.write(b'second')
+        self.assertNotEqual(first.entry.path, second.entry.path)
+        self.assertEqual(b'first', sink.read('url1'))
+        self.assertEqual(b'second', sink.read('url2'))
+
+    def test_segments_roll_once_full(self):
+        sink = SegmentSink(self.path, segment_size=8)
+        entries = [self.store(sink, f'url{index}', b'12345') for index in range(4)]
+        self.assertEqual(2, len({entry.path for entry in entries}))
+        self.assertEqual([0, 5, 0, 5], [entry.offset for entry in entries])
+
+    def test_index_is_committed_in_batches(self):
+        sink = SegmentSink(self.path, index_batch=2)
+        self.store(sink, 'url1', b'first')
+        other = SegmentSink(self.path)
+        self.assertIsNone(other.lookup('url1'))
+        self.store(sink, 'url2', b'second')
+        self.assertEqual(b'first', other.read('url1'))
+        self.store(sink, 'url3', b'third')
+        sink.flush()
+        self.assertEqual(['url1', 'url2', 'url3'], [url for url, _ in other.entries()])
+
+    def test_sink_is_picklable(self):
+        sink = SegmentSink(self.path, segment_size=100)
+        self.store(sink, 'url', b'data')
+        sink.flush()
+        copy = pickle.loads(pickle.dumps(sink))
+        self.assertEqual(100, copy.segment_size)
+        self.assertEqual(b'data', copy.read('url'))
+
+
+class TestSegmentDownload(SegmentSinkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.head = MagicMock(status_code=200, url='http://example.com/file.txt')
+        self.head.headers = {'content-length': '4'}
+
+    @staticmethod
+    def write_output(url, output_path, config, output_file=None, **kwargs):
+        output_file.write(b'data')
+        return Response(url, {}, 200, timedelta(), output_path, Timing(bytes_received=4))
+
+    def test_config_makes_sink(self):
+        self.assertIsNone(DownloadConfig().segment_sink)
+        config = DownloadConfig(segment_dir=self.path, segment_size='1mb')
+        self.assertEqual(1024 ** 2, config.segment_sink.segment_size)
+        self.assertIs(config.segment_sink, DownloadConfig(segment_dir=config.segment_sink).segment_sink)
+        with self.assertRaises(ValueError):
+            DownloadConfig(segment_dir=self.path, post_process=['sha256'])
+
+    @patch('chunkydl.download.download_actual')
+    @patch('requests.head')
+    def test_download_is_stored_in_segment(self, mock_head, mock_download):
+        mock_head.return_value = self.head
+        mock_download.side_effect = self.write_output
+        config = DownloadConfig(segment_dir=self.path)
+        output = os.path.join(self.temp_dir, 'file.txt')
+        response = _download('http://example.com/file.txt', output, config)
+        self.assertFalse(os.path.exists(output))
+        self.assertEqual(response.segment.path, response.output_path)
+        self.assertEqual(4, response.segment.length)
+        self.assertEqual(b'data', config.segment_sink.read('http://example.com/file.txt'))
+
+    @patch('chunkydl.download.download_actual')
+    @patch('requests.head')
+    def test_files_over_the_size_threshold_are_not_stored_in_segments(self, mock_head, mock_download):
+        self.head.headers['accept-ranges'] = 'bytes'
+        mock_head.return_value = self.head
+        config = DownloadConfig(segment_dir=self.path, size_threshold=2)
+        output = os.path.join(self.temp_dir, 'file.txt')
+        with patch('chunkydl.download.MultiPartDownloader') as mock_multipart:
+            mock_multipart.return_value.timing = Timing()
+            mock_multipart.return_value.run.side_effect = lambda: open(output, 'wb').write(b'data')
+            response = _download('http://example.com/file.txt', output, config)
+        self.assertIsNone(response.segment)
+        mock_download.assert_not_called()
+        self.assertIsNone(config.segment_sink.lookup('http://example.com/file.txt'))
@@ -0,0 +1,100 @@
+import os
+import pickle
+import unittest
+import multiprocessing
+from datetime import timedelta
+from unittest.mock import patch
+
+from chunkydl import DownloadConfig, DLGroup, MetricsRegistry
+from chunkydl.models.data_models import Response, Timing
+from chunkydl.models.sharded_downloader import ShardedDownloader
+from chunkydl.utils import get_host
+
+
+def fake_download(url, output_path, config, mirrors=(), head=None):
+    if config.metrics is not None:
+        config.metrics.increment('downloads_completed', get_host(url))
+        config.metrics.add_bytes(10)
+    headers = {'pid': os.getpid(), 'mirrors': mirrors}
+    if config.memory_budget is not None:
+        headers['memory_limit'] = config.memory_budget.limit
+    return Response(url, headers, 200, timedelta(), output_path, Timing())
+
+
+class TestShardedDownloader(unittest.TestCase):
+
+    def test_urls_are_sharded_by_key(self):
+        downloader = ShardedDownloader(DownloadConfig(), processes=4)
+        shards = {downloader.get_shard(f'http://host/{i}') for i in range(100)}
+        self.assertEqual({0, 1, 2, 3}, shards)
+        self.assertEqual(downloader.get_shard('http://host/a'), downloader.get_shard('http://host/a'))
+
+        by_host = ShardedDownloader(DownloadConfig(), processes=4, shard_key=get_host)
+        self.assertEqual(1, len({by_host.get_shard(f'http://host/{i}') for i in range(100)}))
+
+    def test_durable_queue_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ShardedDownloader(DownloadConfig(queue_path='queue.db'), processes=2)
+
+    @patch('chunkydl.models.queue_downloader._download', new=fake_download)
+    def test_results_are_collected_from_every_process(self):
+        config = DownloadConfig()
+        downloader = ShardedDownloader(config, processes=3, metrics_interval=0.05)
+        downloader.add_multiple([(f'http://host/{i}', f'path{i}', config) for i in range(30)])
+        downloader.add(DLGroup('http://host/mirrored', 'path', config, ('http://mirror/mirrored',)))
+        downloader.add(None)
+        downloader.run()
+
+        self.assertEqual(31, len(downloader.results))
+        self.assertEqual({f'http://host/{i}' for i in range(30)} | {'http://host/mirrored'},
+                         {response.url for response in downloader.results})
+        self.assertEqual(3, len({response.headers['pid'] for response in downloader.results}))
+        self.assertNotIn(os.getpid(), {response.headers['pid'] for response in downloader.results})
+        mirrored = next(response for response in downloader.results if response.url == 'http://host/mirrored')
+        self.assertEqual(('http://mirror/mirrored',), mirrored.headers['mirrors'])
+
+    @patch('chunkydl.models.queue_downloader._download', new=fake_download)
+    def test_metrics_of_every_process_are_merged(self):
+        metrics = MetricsRegistry()
+        config = DownloadConfig(metrics=metrics)
+        downloader = ShardedDownloader(config, processes=2, metrics_interval=0.05)
+        downloader.add_multiple([(f'http://host/{i}', f'path{i}', config) for i in range(10)])
+        downloader.add(None)
+        downloader.run()
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(10, snapshot['counters']['downloads_completed']['host'])
+        self.assertEqual(100, snapshot['bytes_received'])
+
+    @patch('chunkydl.models.queue_downloader._download', new=fake_download)
+    def test_memory_limit_is_divided_between_processes(self):
+        config = DownloadConfig(memory_limit=1000)
+        downloader = ShardedDownloader(config, processes=4, metrics_interval=0.05)
+        downloader.add_multiple([(f'http://host/{i}', f'path{i}', config) for i in range(20)])
+        downloader.add(None)
+        downloader.run()
+
+        self.assertEqual({250}, {response.headers['memory_limit'] for response in downloader.results})
+        self.assertEqual(1000, config.memory_budget.limit)
+
+    def test_memory_limit_smaller_than_the_processes_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ShardedDownloader(DownloadConfig(memory_limit=3), processes=4)
+
+    def test_worker_config_is_picklable(self):
+        config = DownloadConfig(memory_limit='64mb', atomic_publish=True, durability='batch', metrics=MetricsRegistry())
+        downloader = ShardedDownloader(config, processes=2)
+        worker_config = pickle.loads(pickle.dumps(downloader._workers[0]._args[1]))
+        self.assertEqual(32 * 1024 * 1024, worker_config.memory_budget.limit)
+        self.assertEqual(0, worker_config.memory_budget.used)
+        self.assertTrue(worker_config.publisher.atomic)
+        self.assertEqual(100, worker_config.publisher.syncer.batch_files)
+
+    def test_processes_start_with_the_spawn_method(self):
+        config = DownloadConfig(memory_limit='64mb', durability='batch', metrics=MetricsRegistry())
+        with patch('chunkydl.models.sharded_downloader.multiprocessing.get_context',
+                   return_value=multiprocessing.get_context('spawn')):
+            downloader = ShardedDownloader(config, processes=2, metrics_interval=0.05)
+        downloader.add(None)
+        downloader.run()
+        self.assertEqual([0, 0], [worker.exitcode for worker in downloader._workers])
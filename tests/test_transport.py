@@ -0,0 +1,164 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+
+import chunkydl
+from benchmarks.server import BenchmarkServer, ServerOptions, content
+from chunkydl import DownloadConfig
+from chunkydl.models.transport import RequestsTransport, Transport, Urllib3Transport, make_transport
+
+try:
+    import httpx  # noqa: F401
+    import h2  # noqa: F401
+    HTTPX_INSTALLED = True
+except ImportError:
+    HTTPX_INSTALLED = False
+
+
+SIZE = 300 * 1024
+
+
+class TransportConformance:
+
+    """
+    The behavior every transport must share, run against the local benchmark server for each backend.
+    """
+
+    transport = None
+
+    def setUp(self):
+        self.server = BenchmarkServer().start()
+        self.config = DownloadConfig(transport=self.transport, backoff_factor=0)
+        self.url = self.server.file_url(SIZE, 'file.bin')
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.config.transport.close()
+        self.server.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def read(self, response, decode_content=True):
+        try:
+            if decode_content:
+                return b''.join(response.iter_content(64 * 1024))
+            return b''.join(response.raw.stream(64 * 1024, decode_content=False))
+        finally:
+            response.close()
+
+    def test_config_holds_the_transport(self):
+        self.assertIsInstance(self.config.transport, Transport)
+        self.assertEqual(self.transport, self.config.transport.name)
+
+    def test_head(self):
+        response = self.config.transport.head(self.url, self.config)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(str(SIZE), response.headers['Content-Length'])
+        self.assertEqual(str(SIZE), response.headers.get('content-length'))
+        self.assertEqual(0, self.server.requests)
+
+    def test_streamed_get(self):
+        response = self.config.transport.get(self.url, self.config)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.url, response.url)
+        self.assertIsInstance(response.elapsed, timedelta)
+        self.assertEqual(content(0, SIZE - 1), self.read(response))
+
+    def test_raw_stream(self):
+        response = self.config.transport.get(self.url, self.config)
+        self.assertEqual(content(0, SIZE - 1), self.read(response, decode_content=False))
+
+    def test_unstreamed_get(self):
+        response = self.config.transport.get(self.url, self.config, stream=False)
+        self.assertEqual(content(0, SIZE - 1), response.content)
+        response.close()
+
+    def test_range_get(self):
+        response = self.config.transport.get(self.url, self.config, headers={'Range': 'bytes=100-199'})
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(f'bytes 100-199/{SIZE}', response.headers.get('content-range'))
+        self.assertEqual(content(100, 199), self.read(response))
+
+    def test_error_status_is_returned(self):
+        response = self.config.transport.get(f'{self.server.url}/missing', self.config)
+        self.assertEqual(404, response.status_code)
+        response.close()
+
+    def test_failed_requests_are_retried(self):
+        # every second request fails, so the request after the first is retried once
+        self.server.options = ServerOptions(fail_rate=0.5)
+        self.read(self.config.transport.get(self.url, self.config))
+        response = self.config.transport.get(self.url, self.config)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(content(0, SIZE - 1), self.read(response))
+        self.assertEqual(3, self.server.requests)
+        self.assertEqual(1, len(response.raw.retries.history))
+
+    def test_connections_are_released(self):
+        for _ in range(20):
+            response = self.config.transport.get(self.url, self.config, headers={'Range': 'bytes=0-9'})
+            self.assertEqual(content(0, 9), self.read(response))
+            # abandoning a body part way must not leave its connection in the pool
+            response = self.config.transport.get(self.url, self.config)
+            next(response.iter_content(1024))
+            response.close()
+        self.assertEqual(40, self.server.requests)
+
+    def test_download(self):
+        output = os.path.join(self.temp_dir, 'file.bin')
+        response = chunkydl.download(self.url, output, transport=self.transport)
+        self.assertEqual(200, response.status_code)
+        with open(output, 'rb') as file:
+            self.assertEqual(content(0, SIZE - 1), file.read())
+
+    def test_multipart_download(self):
+        output = os.path.join(self.temp_dir, 'file.bin')
+        chunkydl.download(self.url, output, transport=self.transport, size_threshold='100kb', chunk_size='64kb')
+        with open(output, 'rb') as file:
+            self.assertEqual(content(0, SIZE - 1), file.read())
+        self.assertGreater(self.server.requests, 1)
+
+    def test_transport_is_picklable(self):
+        self.config.transport.get(self.url, self.config).close()
+        copy = pickle.loads(pickle.dumps(self.config.transport))
+        self.assertEqual(content(0, 9), self.read(copy.get(self.url, self.config, headers={'Range': 'bytes=0-9'})))
+        copy.close()
+
+
+class TestRequestsTransport(TransportConformance, unittest.TestCase):
+
+    transport = 'requests'
+
+
+class TestUrllib3Transport(TransportConformance, unittest.TestCase):
+
+    transport = 'urllib3'
+
+
+@unittest.skipUnless(HTTPX_INSTALLED, 'httpx[http2] is not installed')
+class TestHttpxTransport(TransportConformance, unittest.TestCase):
+
+    transport = 'httpx'
+
+
+class TestMakeTransport(unittest.TestCase):
+
+    def test_transports_are_made_by_name(self):
+        self.assertIsInstance(make_transport('requests'), RequestsTransport)
+        self.assertIsInstance(make_transport('urllib3'), Urllib3Transport)
+        self.assertIsInstance(DownloadConfig().transport, RequestsTransport)
+
+    def test_transport_instances_are_used_as_given(self):
+        transport = Urllib3Transport(maxsize=4)
+        self.assertIs(transport, DownloadConfig(transport=transport).transport)
+
+    def test_unknown_transport_raises(self):
+        with self.assertRaises(ValueError):
+            DownloadConfig(transport='curl')
+
+    @unittest.skipIf(HTTPX_INSTALLED, 'httpx[http2] is installed')
+    def test_httpx_transport_requires_httpx(self):
+        with self.assertRaises(ImportError):
+            make_transport('httpx')
@@ -1,8 +1,13 @@
 import os
+import shutil
+import tempfile
 import unittest
+from datetime import timedelta
 from unittest.mock import patch
 
-from chunkydl.utils import get_output, get_name_from_url, convert_urls
+from chunkydl.utils import (get_output, get_name_from_url, convert_urls, share_download, parse_byteranges,
+                            parse_content_range)
+from chunkydl.models.data_models import Response
 from chunkydl import DownloadConfig, DLGroup
 
 
@@ -155,3 +160,60 @@ class TestConvertUrls(unittest.TestCase):
         urls = []
         groups = convert_urls(urls, '/downloads', DownloadConfig())
         self.assertEqual([], groups)
+
+
+class TestShareDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.temp_dir, 'source.txt')
+        with open(self.source, 'wb') as file:
+            file.write(b'data')
+        self.response = Response('http://example.com/file.txt', {}, 200, timedelta(), self.source)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_file_is_copied_to_output_path(self):
+        output = os.path.join(self.temp_dir, 'copy.txt')
+        result = share_download(self.response, output, 'copy')
+        self.assertEqual(output, result.output_path)
+        with open(output, 'rb') as file:
+            self.assertEqual(b'data', file.read())
+
+    def test_downloaded_name_is_used_for_directory_output_path(self):
+        output_dir = os.path.join(self.temp_dir, 'other')
+        os.mkdir(output_dir)
+        result = share_download(self.response, output_dir, 'copy')
+        self.assertEqual(os.path.join(output_dir, 'source.txt'), result.output_path)
+        self.assertTrue(os.path.exists(result.output_path))
+
+    def test_same_output_path_is_left_untouched(self):
+        result = share_download(self.response, self.source, 'copy')
+        self.assertEqual(self.source, result.output_path)
+        with open(self.source, 'rb') as file:
+            self.assertEqual(b'data', file.read())
+
+
+class TestParseByteranges(unittest.TestCase):
+
+    def test_parts_are_split_by_boundary(self):
+        body = (b'--sep\r\nContent-Type: text/plain\r\nContent-Range: bytes 0-2/10\r\n\r\nabc\r\n'
+                b'--sep\r\nContent-Range: bytes 7-9/10\r\n\r\nx\r\n\r\n--sep--\r\n')
+        self.assertEqual([(0, b'abc', 10), (7, b'x\r\n', 10)],
+                         parse_byteranges('multipart/byteranges; boundary=sep', body))
+
+    def test_missing_boundary_raises(self):
+        with self.assertRaises(ValueError):
+            parse_byteranges('multipart/byteranges', b'')
+
+    def test_wrong_content_range_raises(self):
+        body = b'--sep\r\nContent-Range: bytes 0-5/10\r\n\r\nabc\r\n--sep--\r\n'
+        with self.assertRaises(ValueError):
+            parse_byteranges('multipart/byteranges; boundary="sep"', body)
+
+    def test_content_range_is_parsed(self):
+        self.assertEqual((5, 9, 100), parse_content_range('bytes 5-9/100'))
+        self.assertEqual((5, 9, None), parse_content_range('bytes 5-9/*'))
+        self.assertIsNone(parse_content_range('bytes */100'))
+        self.assertIsNone(parse_content_range(None))